@@ -9,6 +9,7 @@ from models.schemas import (
 )
 from services.database_service import DatabaseService
 from services.rag_service import RAGService
+from services.embedding_cache_service import embedding_cache
 from app.api.auth import require_admin
 from import_articles import extract_tags_from_text, generate_tags_with_ollama, choose_category_by_keywords, generate_category_with_ollama
 from models.database import CarOption as CarOptionModel, CarOptionsGroup as CarOptionsGroupModel
@@ -22,18 +23,20 @@ async def get_articles(
     skip: int = Query(0, ge=0),
     limit: int = Query(1000, ge=1, le=5000),
     search: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы; skip игнорируется"),
     db: Session = Depends(get_db),
     _: object = Depends(require_admin)
 ):
     """Получает список статей с пагинацией и поиском"""
     db_service = DatabaseService(db)
-    articles, total = db_service.get_articles(skip=skip, limit=limit, search=search)
+    articles, total, next_cursor = db_service.get_articles_page(skip=skip, limit=limit, search=search, cursor=cursor)
     
     return ArticleListResponse(
         articles=articles,
         total=total,
         page=1,
-        size=limit
+        size=limit,
+        next_cursor=next_cursor
     )
 
 
@@ -147,6 +150,12 @@ async def reindex_articles(db: Session = Depends(get_db), _: object = Depends(re
     return result
 
 
+@router.get("/embedding-cache/stats")
+async def get_embedding_cache_stats(_: object = Depends(require_admin)):
+    """Статистика кэша эмбеддингов (попадания в память/таблицу, промахи, hit rate)"""
+    return embedding_cache.get_stats()
+
+
 @router.post("/articles/{article_id}/generate_meta")
 async def generate_article_meta(article_id: int, db: Session = Depends(get_db), _: object = Depends(require_admin)):
     """Генерирует теги и категорию для статьи в реальном времени и сохраняет"""
@@ -204,16 +213,15 @@ async def get_admin_cars(
     skip: int = Query(0, ge=0),
     limit: int = Query(1000, ge=1, le=5000),
     search: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы; skip игнорируется"),
     db: Session = Depends(get_db),
     _: object = Depends(require_admin)
 ):
     """Получает список новых автомобилей для админ-панели"""
     db_service = DatabaseService(db)
-    skip_val = skip
-    limit_val = limit
-    cars, total = db_service.get_cars(skip=skip_val, limit=limit_val, search=search)
+    cars, total, next_cursor = db_service.get_cars_page(skip=skip, limit=limit, cursor=cursor, search=search)
     
-    return CarListResponse(cars=cars, total=total, page=(skip // limit) + 1, size=limit)
+    return CarListResponse(cars=cars, total=total, page=(skip // limit) + 1, size=limit, next_cursor=next_cursor)
 
 
 @router.get("/cars/used", response_model=UsedCarListResponse)
@@ -221,16 +229,15 @@ async def get_admin_used_cars(
     skip: int = Query(0, ge=0),
     limit: int = Query(1000, ge=1, le=5000),
     search: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы; skip игнорируется"),
     db: Session = Depends(get_db),
     _: object = Depends(require_admin)
 ):
     """Получает список подержанных автомобилей для админ-панели"""
     db_service = DatabaseService(db)
-    skip_val = skip
-    limit_val = limit
-    used_cars, total = db_service.get_used_cars(skip=skip_val, limit=limit_val, search=search)
+    used_cars, total, next_cursor = db_service.get_used_cars_page(skip=skip, limit=limit, cursor=cursor, search=search)
     
-    return UsedCarListResponse(used_cars=used_cars, total=total, page=(skip // limit) + 1, size=limit)
+    return UsedCarListResponse(used_cars=used_cars, total=total, page=(skip // limit) + 1, size=limit, next_cursor=next_cursor)
 
 
 @router.get("/cars/options", response_model=List[CarOption])
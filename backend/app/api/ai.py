@@ -1067,6 +1067,23 @@ async def toggle_sql_agent(
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Ошибка изменения статуса: {str(e)}")
 
+def _merge_dialog_criteria(dialog_state, new_filters: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Объединяет новые фильтры с сохраненными критериями диалога одной операцией modify_criteria
+
+    Марка из сохраненных критериев, если в новых фильтрах ее нет, остается в критериях
+    и дописывается в new_filters.
+
+    Returns:
+        Сохраненные критерии
+    """
+    saved_criteria = dialog_state.modify_criteria(lambda criteria: {**criteria, **new_filters})
+    if saved_criteria.get("mark") and not new_filters.get("mark"):
+        new_filters["mark"] = saved_criteria["mark"]
+        print(f"✅ Сохраняю марку из существующих критериев: {saved_criteria['mark']}")
+    return saved_criteria
+
+
 @router.post("/sql-agent/query", response_model=SQLAgentResponse)
 async def query_sql_agent(
     request: SQLAgentQuestionRequest,
@@ -1181,6 +1198,9 @@ async def query_sql_agent(
         try:
             from models.database import ChatMessage
             from sqlalchemy import desc
+            from services.chat_write_behind_service import chat_write_behind
+            # Последний ход может еще ждать в очереди отложенной записи
+            await chat_write_behind.wait_persisted()
             last_message = db.query(ChatMessage).filter(
                 ChatMessage.user_id == user_id
             ).order_by(desc(ChatMessage.created_at)).first()
@@ -1329,15 +1349,7 @@ async def query_sql_agent(
             # Сохраняем критерии из запроса
             if current_filters:
                 # ВАЖНО: Объединяем с уже сохраненными критериями, чтобы не потерять марку
-                existing_criteria = dialog_state.get_criteria()
-                # Если марка была сохранена ранее, но не в новых фильтрах - сохраняем её
-                if existing_criteria.get("mark") and not current_filters.get("mark"):
-                    current_filters["mark"] = existing_criteria["mark"]
-                    print(f"✅ Сохраняю марку из существующих критериев: {existing_criteria['mark']}")
-                # Объединяем критерии
-                combined_for_save = {**existing_criteria, **current_filters}
-                dialog_state.update_criteria(combined_for_save)
-                saved_criteria = dialog_state.get_criteria()
+                saved_criteria = _merge_dialog_criteria(dialog_state, current_filters)
                 print(f"📋 Сохранены критерии из запроса: {saved_criteria}")
                 if saved_criteria.get("mark"):
                     print(f"✅ Марка сохранена: {saved_criteria['mark']}")
@@ -1457,15 +1469,7 @@ async def query_sql_agent(
                     # Обновляем сохраненные критерии только если есть новые фильтры
                     if new_filters:
                         # ВАЖНО: Объединяем с уже сохраненными критериями, чтобы не потерять марку
-                        current_criteria = dialog_state.get_criteria()
-                        # Если марка была сохранена ранее, но не в новых фильтрах - сохраняем её
-                        if current_criteria.get("mark") and not new_filters.get("mark"):
-                            new_filters["mark"] = current_criteria["mark"]
-                            print(f"✅ Сохраняю марку из существующих критериев: {current_criteria['mark']}")
-                        # Объединяем критерии
-                        combined_for_update = {**current_criteria, **new_filters}
-                        dialog_state.update_criteria(combined_for_update)
-                        updated_criteria = dialog_state.get_criteria()
+                        updated_criteria = _merge_dialog_criteria(dialog_state, new_filters)
                         print(f"✅ Критерии обновлены: {updated_criteria}")
                         if updated_criteria.get("mark"):
                             print(f"✅ Марка сохранена в обновленных критериях: {updated_criteria['mark']}")
@@ -1616,15 +1620,7 @@ async def query_sql_agent(
                     # Обновляем сохраненные критерии только если есть новые фильтры
                     # ВАЖНО: Объединяем с уже сохраненными критериями, а не перезаписываем
                     if new_filters:
-                        current_criteria = dialog_state.get_criteria()
-                        # Если марка была сохранена ранее, но не в новых фильтрах - сохраняем её
-                        if current_criteria.get("mark") and not new_filters.get("mark"):
-                            new_filters["mark"] = current_criteria["mark"]
-                            print(f"✅ Сохраняю марку из существующих критериев: {current_criteria['mark']}")
-                        # Объединяем критерии
-                        combined_criteria = {**current_criteria, **new_filters}
-                        dialog_state.update_criteria(combined_criteria)
-                        updated_criteria = dialog_state.get_criteria()
+                        updated_criteria = _merge_dialog_criteria(dialog_state, new_filters)
                         print(f"✅ Критерии обновлены из простого ответа: {updated_criteria}")
                         if updated_criteria.get("mark"):
                             print(f"✅ Марка сохранена в обновленных критериях: {updated_criteria['mark']}")
@@ -1636,14 +1632,7 @@ async def query_sql_agent(
                 if extracted_filters and not new_filters:
                     # Критерии были извлечены, но не были сохранены (например, в запросе с командой поиска)
                     # Объединяем извлеченные критерии с уже сохраненными
-                    current_criteria = dialog_state.get_criteria()
-                    # Если марка была сохранена ранее, но не в извлеченных фильтрах - сохраняем её
-                    if current_criteria.get("mark") and not extracted_filters.get("mark"):
-                        extracted_filters["mark"] = current_criteria["mark"]
-                        print(f"✅ Сохраняю марку из существующих критериев перед поиском: {current_criteria['mark']}")
-                    combined_before_search = {**current_criteria, **extracted_filters}
-                    dialog_state.update_criteria(combined_before_search)
-                    updated_criteria = dialog_state.get_criteria()
+                    updated_criteria = _merge_dialog_criteria(dialog_state, extracted_filters)
                     print(f"✅ Критерии сохранены перед началом поиска: {updated_criteria}")
                     if updated_criteria.get("mark"):
                         print(f"✅ Марка сохранена перед поиском: {updated_criteria['mark']}")
@@ -1651,7 +1640,6 @@ async def query_sql_agent(
                 # ВАЖНО: Также проверяем, есть ли интерпретированные критерии, которые не были сохранены
                 # Это нужно для случаев, когда интерпретированные критерии (например, год) не попали в new_filters
                 if descriptive_result.get("interpreted_criteria"):
-                    current_criteria = dialog_state.get_criteria()
                     interpreted = descriptive_result["interpreted_criteria"].copy()
                     # Нормализуем значения для совместимости с поиском
                     if interpreted.get("gear_box_type") == "automatic":
@@ -1659,22 +1647,17 @@ async def query_sql_agent(
                     elif interpreted.get("gear_box_type") == "manual":
                         interpreted["gear_box_type"] = "механика"
                     
-                    # ВАЖНО: Сохраняем марку из текущих критериев, если она есть
-                    if current_criteria.get("mark") and not interpreted.get("mark"):
-                        interpreted["mark"] = current_criteria["mark"]
-                        print(f"✅ Сохраняю марку из существующих критериев при добавлении интерпретированных: {current_criteria['mark']}")
-                    
                     # Проверяем, есть ли в интерпретированных критериях что-то, чего нет в сохраненных
-                    has_new_interpreted = any(
-                        k not in current_criteria or current_criteria[k] != interpreted[k]
-                        for k in interpreted.keys()
-                    )
+                    # (внутри modify_criteria: проверка и запись идут по одним и тем же критериям)
+                    new_interpreted: List[str] = []
+                    
+                    def merge_interpreted(criteria: Dict[str, Any]) -> Dict[str, Any]:
+                        new_interpreted[:] = [k for k, v in interpreted.items() if criteria.get(k) != v]
+                        return {**criteria, **interpreted}
                     
-                    if has_new_interpreted:
-                        # Объединяем интерпретированные критерии с уже сохраненными
-                        combined_with_interpreted = {**current_criteria, **interpreted}
-                        dialog_state.update_criteria(combined_with_interpreted)
-                        updated_criteria = dialog_state.get_criteria()
+                    updated_criteria = dialog_state.modify_criteria(merge_interpreted)
+                    if new_interpreted:
+                        # Интерпретированные критерии объединены с уже сохраненными (марка не теряется)
                         print(f"✅ Добавлены интерпретированные критерии к сохраненным: {updated_criteria}")
                         if updated_criteria.get("mark"):
                             print(f"✅ Марка сохранена в интерпретированных критериях: {updated_criteria['mark']}")
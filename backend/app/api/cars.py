@@ -1,17 +1,36 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, Query
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
-from models import get_db
+from models import get_db, get_async_db
 from models.schemas import (
     Car, UsedCar, CarListResponse, UsedCarListResponse,
     CarPicture, UsedCarPicture, CarOption, CarOptionsGroup
 )
-from services.database_service import DatabaseService
+from services.async_database_service import AsyncDatabaseService
+from services.image_cache_service import image_cache_service
 from app.api.auth import get_current_user
 
 router = APIRouter(prefix="/api/cars", tags=["cars"])
 
 
+def _with_thumbnails(pictures, schema, db: Session, background_tasks: BackgroundTasks):
+    """
+    Добавляет к фото адреса миниатюр из локального кэша
+
+    Фото, которых еще нет в кэше, загружаются в фоне после ответа:
+    следующий запрос уже получит миниатюры.
+    """
+    thumbnails = image_cache_service.get_thumbnails(db, (picture.url for picture in pictures))
+    missing = [picture.url for picture in pictures if picture.url and picture.url not in thumbnails]
+    if missing:
+        background_tasks.add_task(image_cache_service.cache_in_background, missing)
+    return [
+        schema.model_validate(picture).model_copy(update={"thumbnails": thumbnails.get(picture.url)})
+        for picture in pictures
+    ]
+
+
 @router.get("/", response_model=CarListResponse)
 async def get_cars(
     page: int = Query(1, ge=1),
@@ -24,8 +43,9 @@ async def get_cars(
     body_type: Optional[str] = None,
     min_year: Optional[int] = None,
     max_year: Optional[int] = None,
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы (next_cursor предыдущего ответа); page игнорируется"),
     use_intelligent_search: Optional[bool] = Query(False, description="Использовать интеллектуальный поиск через Elasticsearch"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     _: object = Depends(get_current_user)
 ):
     """Получает список новых автомобилей с фильтрацией"""
@@ -63,8 +83,8 @@ async def get_cars(
                     car_ids = [hit.get("_source", {}).get("id") for hit in hits[:size]]
                     
                     if car_ids:
-                        db_service = DatabaseService(db)
-                        cars = [db_service.get_car(cid) for cid in car_ids if db_service.get_car(cid)]
+                        db_service = AsyncDatabaseService(db)
+                        cars = await db_service.get_cars_by_ids([cid for cid in car_ids if cid])
                         total = search_result.get("total", len(cars))
                         
                         return CarListResponse(
@@ -77,11 +97,12 @@ async def get_cars(
             print(f"⚠️ Ошибка интеллектуального поиска в cars.py: {e}, используем обычный поиск")
     
     # Обычный поиск через БД
-    db_service = DatabaseService(db)
+    db_service = AsyncDatabaseService(db)
     skip = (page - 1) * size
-    cars, total = db_service.get_cars(
+    cars, total, next_cursor = await db_service.get_cars_page(
         skip=skip,
         limit=size,
+        cursor=cursor,
         search=search,
         mark=mark,
         model=model,
@@ -91,18 +112,18 @@ async def get_cars(
         min_year=min_year,
         max_year=max_year
     )
-    return CarListResponse(cars=cars, total=total, page=page, size=size)
+    return CarListResponse(cars=cars, total=total, page=page, size=size, next_cursor=next_cursor)
 
 
 @router.get("/{car_id}", response_model=Car)
 async def get_car(
     car_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     _: object = Depends(get_current_user)
 ):
     """Получает информацию о новом автомобиле"""
-    db_service = DatabaseService(db)
-    car = db_service.get_car(car_id)
+    db_service = AsyncDatabaseService(db)
+    car = await db_service.get_car(car_id)
     if not car:
         from fastapi import HTTPException
         raise HTTPException(status_code=404, detail="Автомобиль не найден")
@@ -112,13 +133,14 @@ async def get_car(
 @router.get("/{car_id}/pictures", response_model=List[CarPicture])
 async def get_car_pictures(
     car_id: int,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     _: object = Depends(get_current_user)
 ):
     """Получает фотографии нового автомобиля"""
-    from models.database import CarPicture
-    pictures = db.query(CarPicture).filter(CarPicture.car_id == car_id).order_by(CarPicture.seqno).all()
-    return pictures
+    from models.database import CarPicture as CarPictureModel
+    pictures = db.query(CarPictureModel).filter(CarPictureModel.car_id == car_id).order_by(CarPictureModel.seqno).all()
+    return _with_thumbnails(pictures, CarPicture, db, background_tasks)
 
 
 @router.get("/{car_id}/options", response_model=List[CarOption])
@@ -161,15 +183,17 @@ async def get_used_cars(
     body_type: Optional[str] = None,
     min_mileage: Optional[int] = None,
     max_mileage: Optional[int] = None,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы (next_cursor предыдущего ответа); page игнорируется"),
+    db: AsyncSession = Depends(get_async_db),
     _: object = Depends(get_current_user)
 ):
     """Получает список подержанных автомобилей с фильтрацией"""
-    db_service = DatabaseService(db)
+    db_service = AsyncDatabaseService(db)
     skip = (page - 1) * size
-    used_cars, total = db_service.get_used_cars(
+    used_cars, total, next_cursor = await db_service.get_used_cars_page(
         skip=skip,
         limit=size,
+        cursor=cursor,
         search=search,
         mark=mark,
         model=model,
@@ -179,18 +203,18 @@ async def get_used_cars(
         min_mileage=min_mileage,
         max_mileage=max_mileage
     )
-    return UsedCarListResponse(used_cars=used_cars, total=total, page=page, size=size)
+    return UsedCarListResponse(used_cars=used_cars, total=total, page=page, size=size, next_cursor=next_cursor)
 
 
 @router.get("/used/{used_car_id}", response_model=UsedCar)
 async def get_used_car(
     used_car_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     _: object = Depends(get_current_user)
 ):
     """Получает информацию о подержанном автомобиле"""
-    db_service = DatabaseService(db)
-    used_car = db_service.get_used_car(used_car_id)
+    db_service = AsyncDatabaseService(db)
+    used_car = await db_service.get_used_car(used_car_id)
     if not used_car:
         from fastapi import HTTPException
         raise HTTPException(status_code=404, detail="Подержанный автомобиль не найден")
@@ -200,15 +224,16 @@ async def get_used_car(
 @router.get("/used/{used_car_id}/pictures", response_model=List[UsedCarPicture])
 async def get_used_car_pictures(
     used_car_id: int,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     _: object = Depends(get_current_user)
 ):
     """Получает фотографии подержанного автомобиля"""
-    from models.database import UsedCarPicture
-    pictures = db.query(UsedCarPicture).filter(
-        UsedCarPicture.used_car_id == used_car_id
-    ).order_by(UsedCarPicture.seqno).all()
-    return pictures
+    from models.database import UsedCarPicture as UsedCarPictureModel
+    pictures = db.query(UsedCarPictureModel).filter(
+        UsedCarPictureModel.used_car_id == used_car_id
+    ).order_by(UsedCarPictureModel.seqno).all()
+    return _with_thumbnails(pictures, UsedCarPicture, db, background_tasks)
 
 
 
@@ -1,85 +1,113 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from models import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import get_db, get_async_db
 from models.schemas import (
     ChatMessageRequest, ChatMessageResponse, FeedbackRequest,
     ChatCreate, Chat, ChatListResponse, ChatUpdate
 )
+from services.car_hydration_service import CarHydrator, ref_from_source
 from services.database_service import DatabaseService
+from services.async_database_service import AsyncDatabaseService
 from services.rag_service import RAGService
-import redis
+from services.chat_write_behind_service import chat_write_behind
+import asyncio
 import json
+import time
 from typing import Dict, Any, List, Optional
-from app.core.config import settings
+from app.core.redis_client import async_redis_client
 
 router = APIRouter(prefix="/api/chat", tags=["chat"])
 
-# Безопасный fallback для Redis (in-memory), если сервер Redis недоступен
-class _MemoryRedis:
-    def __init__(self):
-        self._kv: dict[str, str] = {}
-        self._lists: dict[str, list[str]] = {}
-
-    def get(self, key: str):
-        return self._kv.get(key)
-
-    def set(self, key: str, value: str):
-        self._kv[key] = str(value)
-        return True
-
-    def rpush(self, key: str, value: str):
-        self._lists.setdefault(key, []).append(value)
-        return True
-
-    def lrange(self, key: str, start: int, end: int):
-        lst = self._lists.get(key, [])
-        # Redis lrange end inclusive; -1 means end of list
-        if end == -1:
-            end = len(lst) - 1
-        return lst[start:end+1]
-
-
-def _init_redis_client():
-    try:
-        client = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=settings.redis_db, decode_responses=True)
-        # Ленивая проверка соединения
-        client.ping()
-        return client
-    except Exception:
-        return _MemoryRedis()
-
-
-redis_client = _init_redis_client()
-
-
 def _session_key(user_id: str, session_id: int) -> str:
     return f"chat:history:{user_id}:{session_id}"
 
 
-def _current_session_id(user_id: str) -> int:
-    cur = redis_client.get(f"chat:current:{user_id}")
+async def _current_session_id(user_id: str) -> int:
+    cur = await async_redis_client.get(f"chat:current:{user_id}")
     if cur is None:
         # инициализируем первую сессию
-        redis_client.set(f"chat:current:{user_id}", 1)
-        redis_client.rpush(f"chat:sessions:{user_id}", 1)
+        pipe = async_redis_client.pipeline(transaction=True)
+        pipe.set(f"chat:current:{user_id}", 1)
+        pipe.rpush(f"chat:sessions:{user_id}", 1)
+        await pipe.execute()
         return 1
     return int(cur)
 
 
-def _start_new_session(user_id: str) -> int:
-    cur = _current_session_id(user_id)
+async def _start_new_session(user_id: str) -> int:
+    cur = await _current_session_id(user_id)
     new_id = cur + 1
-    redis_client.set(f"chat:current:{user_id}", new_id)
-    redis_client.rpush(f"chat:sessions:{user_id}", new_id)
+    pipe = async_redis_client.pipeline(transaction=True)
+    pipe.set(f"chat:current:{user_id}", new_id)
+    pipe.rpush(f"chat:sessions:{user_id}", new_id)
+    await pipe.execute()
     return new_id
 
 
-def _get_chat_history(user_id: str, limit: int = 5) -> List[Dict[str, Any]]:
+def _history_entry(message: str, response: str) -> str:
+    return json.dumps({
+        "q": message,
+        "a": response,
+        "ts": time.time()
+    })
+
+
+async def _append_history(user_id: str, message: str, response: str):
+    """Добавляет обмен репликами в историю текущей сессии"""
+    sid = await _current_session_id(user_id)
+    await async_redis_client.rpush(_session_key(user_id, sid), _history_entry(message, response))
+
+
+async def _record_turn(
+    async_db_service: AsyncDatabaseService,
+    user_id: str,
+    chat_id: int,
+    message: str,
+    response: str,
+    related_article_ids: List[int],
+    sources_data: Optional[Dict[str, Any]]
+) -> int:
+    """
+    Сохраняет ход диалога: сообщение в БД, updated_at чата и историю в Redis
+
+    При отложенной записи ход подтверждается одной транзакцией Redis (история и
+    очередь записи в БД), иначе сообщение сохраняется в БД сразу.
+
+    Returns:
+        ID сообщения
+    """
+    if chat_write_behind.enabled():
+        message_id = await chat_write_behind.reserve_message_id()
+        ops = chat_write_behind.turn_ops(
+            message_id, chat_id, user_id, message, response, related_article_ids, sources_data
+        )
+        sid = await _current_session_id(user_id)
+        if await chat_write_behind.enqueue(ops, _session_key(user_id, sid), _history_entry(message, response)):
+            return message_id
+        # Redis пропал: записываем в БД сразу (операции идемпотентны, повтор из очереди безопасен)
+        await chat_write_behind.write_now(ops)
+        await _append_history(user_id, message, response)
+        return message_id
+
+    chat_message = await async_db_service.save_chat_message(
+        user_id=user_id,
+        message=message,
+        response=response,
+        related_article_ids=related_article_ids,
+        chat_id=chat_id,
+        sources_data=sources_data
+    )
+    await _append_history(user_id, message, response)
+    return chat_message.id
+
+
+async def _get_chat_history(user_id: str, limit: int = 5) -> List[Dict[str, Any]]:
     """Получает историю диалога из Redis (до limit последних сообщений)"""
     try:
-        sid = _current_session_id(user_id)
+        sid = await _current_session_id(user_id)
         history_key = _session_key(user_id, sid)
-        items = redis_client.lrange(history_key, -limit, -1)  # Последние N сообщений
+        items = await async_redis_client.lrange(history_key, -limit, -1)  # Последние N сообщений
         history = []
         for item in items:
             try:
@@ -91,50 +119,44 @@ def _get_chat_history(user_id: str, limit: int = 5) -> List[Dict[str, Any]]:
         return []
 
 
+async def _get_assistant_result(user_id: str, session_id: Optional[int], message: str) -> Optional[Dict[str, Any]]:
+    """Уточняющие вопросы, проактивные предложения и финансовые расчеты от CarDealerAssistantService"""
+    try:
+        from services.car_dealer_assistant_service import CarDealerAssistantService
+        # Используем chat_id как session_id для ассистента
+        assistant = CarDealerAssistantService(
+            user_id=user_id,
+            session_id=session_id
+        )
+        return await assistant.process_query(message)
+    except Exception as e:
+        print(f"⚠️ Ошибка получения данных от CarDealerAssistantService: {e}")
+        return None
+
+
 @router.post("/message", response_model=ChatMessageResponse)
 async def send_message(
     request: ChatMessageRequest,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    async_db: AsyncSession = Depends(get_async_db)
 ):
     """
     Отправляет сообщение в чат и получает ответ от AI
     """
+    assistant_task: Optional[asyncio.Task] = None
     try:
         db_service = DatabaseService(db)
+        async_db_service = AsyncDatabaseService(async_db)
         
-        # Определяем или создаем чат для правильного пользователя
-        chat_id = request.chat_id
-        if chat_id:
-            # Проверяем, что chat_id принадлежит правильному пользователю
-            chat = db_service.get_chat(chat_id, request.user_id)
-            if not chat:
-                # Если chat_id не принадлежит пользователю, создаем новый чат
-                print(f"⚠️ Предупреждение: chat_id {chat_id} не принадлежит пользователю {request.user_id}, создаем новый чат")
-                chat = db_service.create_chat(user_id=request.user_id, title=None)
-                chat_id = chat.id
-        else:
-            # Создаем новый чат для пользователя
-            chat = db_service.create_chat(user_id=request.user_id, title=None)
-            chat_id = chat.id
-        
-        # Обновляем updated_at чата (убеждаемся, что чат принадлежит пользователю)
-        from models.database import Chat
-        from datetime import datetime
-        chat = db_service.get_chat(chat_id, request.user_id)
-        if chat:
-            chat.updated_at = datetime.utcnow()
-            db.commit()
+        # Определяем или создаем чат для правильного пользователя и обновляем его updated_at
+        # (при отложенной записи updated_at обновляет очередь вместе с сообщением)
+        if chat_write_behind.enabled():
+            chat_id = await async_db_service.get_or_create_chat(request.chat_id, request.user_id)
         else:
-            # Если чат не найден, создаем новый
-            print(f"⚠️ Предупреждение: чат {chat_id} не найден для пользователя {request.user_id}, создаем новый")
-            chat = db_service.create_chat(user_id=request.user_id, title=None)
-            chat_id = chat.id
+            chat_id = await async_db_service.touch_or_create_chat(request.chat_id, request.user_id)
         
         # Если пришел готовый ответ от SQL-агента, сохраняем его напрямую
         if request.sql_agent_response:
-            import json
-            import time
-            
             # Убеждаемся, что sources_data имеет правильную структуру
             sql_sources_data = request.sources_data or {}
             if not isinstance(sql_sources_data, dict):
@@ -153,28 +175,24 @@ async def send_message(
             sql_related_used_cars = []
             
             if sql_sources_data.get("cars"):
+                # Словари загружаем одним запросом на тип; наличие mileage означает used_car
+                sql_refs = [
+                    ("used_car" if car_data.get("mileage") is not None else "car", car_data.get("id"))
+                    for car_data in sql_sources_data["cars"]
+                    if isinstance(car_data, dict) and car_data.get("id")
+                ]
+                sql_related_cars, sql_related_used_cars = CarHydrator(db).hydrate(sql_refs)
                 for car_data in sql_sources_data["cars"]:
-                    if isinstance(car_data, dict):
-                        car_id = car_data.get("id")
-                        if car_id:
-                            # Проверяем, есть ли поле mileage - если есть, это used_car
-                            if car_data.get("mileage") is not None:
-                                used_car = db_service.get_used_car(car_id)
-                                if used_car:
-                                    sql_related_used_cars.append(used_car)
-                            else:
-                                car = db_service.get_car(car_id)
-                                if car:
-                                    sql_related_cars.append(car)
-                    elif hasattr(car_data, 'id'):
+                    if not isinstance(car_data, dict) and hasattr(car_data, 'id'):
                         # Уже объект Car или UsedCar
                         if hasattr(car_data, 'mileage') and car_data.mileage is not None:
                             sql_related_used_cars.append(car_data)
                         else:
                             sql_related_cars.append(car_data)
             
-            # Сохраняем сообщение в БД
-            chat_message = db_service.save_chat_message(
+            # Сохраняем сообщение в БД и историю в Redis
+            message_id = await _record_turn(
+                async_db_service,
                 user_id=request.user_id,
                 message=request.message,
                 response=request.sql_agent_response,
@@ -183,15 +201,6 @@ async def send_message(
                 sources_data=sql_sources_data if sql_sources_data else None
             )
             
-            # Сохраняем историю в Redis
-            sid = _current_session_id(request.user_id)
-            history_key = _session_key(request.user_id, sid)
-            redis_client.rpush(history_key, json.dumps({
-                "q": request.message,
-                "a": request.sql_agent_response,
-                "ts": time.time()
-            }))
-            
             return ChatMessageResponse(
                 response=request.sql_agent_response,
                 related_articles=[],
@@ -199,7 +208,7 @@ async def send_message(
                 related_cars=sql_related_cars,  # Передаем все найденные автомобили со всеми полями
                 related_used_cars=sql_related_used_cars,  # Передаем все найденные автомобили со всеми полями
                 model_info={},
-                message_id=chat_message.id,
+                message_id=message_id,
                 chat_id=chat_id
             )
         
@@ -272,8 +281,13 @@ async def send_message(
                     "sources": []
                 }
         
+        # Запускаем ассистента параллельно с основной генерацией ответа (независимые LLM/ES вызовы)
+        assistant_task = asyncio.create_task(
+            _get_assistant_result(request.user_id, request.chat_id or chat_id, request.message)
+        )
+        
         # Получаем историю диалога (до 5 последних сообщений)
-        history = _get_chat_history(request.user_id, limit=5)
+        history = await _get_chat_history(request.user_id, limit=5)
         
         # ВАЖНО: Загружаем автомобили из sources_data ДО вызова generate_response,
         # чтобы они попали в контекст для AI
@@ -284,43 +298,14 @@ async def send_message(
             cars_data = request.sources_data.get("cars", [])
             print(f"🔍 Получено автомобилей из sources_data: {len(cars_data)}")
             if cars_data:
+                # Тип берем из type или по наличию mileage; если в своей таблице автомобиль
+                # не найден, ищем в другой. Все ID загружаются одним запросом на тип.
+                preloaded_cars_from_sources, preloaded_used_cars_from_sources = CarHydrator(db).hydrate(
+                    [ref_from_source(car_data) for car_data in cars_data if isinstance(car_data, dict)],
+                    fallback=True
+                )
                 for car_data in cars_data:
-                    if isinstance(car_data, dict):
-                        car_id = car_data.get("id")
-                        if car_id:
-                            # Определяем тип автомобиля: проверяем type, mileage или другие признаки
-                            car_type = car_data.get("type")
-                            has_mileage = car_data.get("mileage") is not None
-                            
-                            # Если явно указан тип
-                            if car_type == "used_car" or has_mileage:
-                                used_car = db_service.get_used_car(car_id)
-                                if used_car:
-                                    preloaded_used_cars_from_sources.append(used_car)
-                                else:
-                                    # Если не нашли в used_cars, пробуем в cars
-                                    car = db_service.get_car(car_id)
-                                    if car:
-                                        preloaded_cars_from_sources.append(car)
-                            elif car_type == "car":
-                                car = db_service.get_car(car_id)
-                                if car:
-                                    preloaded_cars_from_sources.append(car)
-                                else:
-                                    # Если не нашли в cars, пробуем в used_cars
-                                    used_car = db_service.get_used_car(car_id)
-                                    if used_car:
-                                        preloaded_used_cars_from_sources.append(used_car)
-                            else:
-                                # Пробуем оба варианта, если тип не указан
-                                car = db_service.get_car(car_id)
-                                if car:
-                                    preloaded_cars_from_sources.append(car)
-                                else:
-                                    used_car = db_service.get_used_car(car_id)
-                                    if used_car:
-                                        preloaded_used_cars_from_sources.append(used_car)
-                    elif hasattr(car_data, 'id'):
+                    if not isinstance(car_data, dict) and hasattr(car_data, 'id'):
                         # Уже объект Car или UsedCar
                         if hasattr(car_data, 'mileage') and car_data.mileage is not None:
                             preloaded_used_cars_from_sources.append(car_data)
@@ -363,41 +348,12 @@ async def send_message(
                     # Ограничиваем до 5 лучших результатов для загрузки полных данных
                     top_hits = hits[:5]
                     
-                    for hit in top_hits:
-                        source = hit.get("_source", {})
-                        car_id = source.get("id")
-                        if car_id:
-                            # Определяем тип по наличию mileage или по полю type
-                            car_type = source.get("type")
-                            has_mileage = source.get("mileage") is not None
-                            
-                            if car_type == 'used_car' or has_mileage:
-                                used_car = db_service.get_used_car(car_id)
-                                if used_car:
-                                    # Обновляем объект из БД, чтобы получить все поля
-                                    try:
-                                        db.refresh(used_car)
-                                    except:
-                                        pass
-                                    if used_car not in preloaded_used_cars_from_sources:
-                                        preloaded_used_cars_from_sources.append(used_car)
-                            else:
-                                car = db_service.get_car(car_id)
-                                if car:
-                                    # Обновляем объект из БД, чтобы получить все поля и опции
-                                    try:
-                                        db.refresh(car)
-                                        # Загружаем опции, если они еще не загружены
-                                        if hasattr(car, 'options') and car.options is None:
-                                            # Принудительно загружаем опции
-                                            _ = car.options
-                                        if hasattr(car, 'options_groups') and car.options_groups is None:
-                                            # Принудительно загружаем группы опций
-                                            _ = car.options_groups
-                                    except:
-                                        pass
-                                    if car not in preloaded_cars_from_sources:
-                                        preloaded_cars_from_sources.append(car)
+                    # Одним запросом на тип, с фотографиями и опциями (selectinload)
+                    hit_cars, hit_used_cars = CarHydrator(db).hydrate_hits(top_hits)
+                    known_car_ids = {car.id for car in preloaded_cars_from_sources}
+                    known_used_car_ids = {car.id for car in preloaded_used_cars_from_sources}
+                    preloaded_cars_from_sources.extend(car for car in hit_cars if car.id not in known_car_ids)
+                    preloaded_used_cars_from_sources.extend(car for car in hit_used_cars if car.id not in known_used_car_ids)
                     
                     # Сохраняем критерии поиска в состояние диалога
                     dialog_state = DialogStateService(request.user_id)
@@ -436,7 +392,7 @@ async def send_message(
         # Обрабатываем запрос через единый агент или fallback
         if use_unified_agent and agent:
             # Используем единый агент
-            sid = _current_session_id(request.user_id)
+            sid = await _current_session_id(request.user_id)
             agent_result = await agent.process_message(
                 user_input=request.message,
                 user_id=request.user_id,
@@ -500,33 +456,16 @@ async def send_message(
                 )
         
         # Получаем уточняющие вопросы и проактивные предложения через CarDealerAssistantService
+        # (задача запущена до генерации ответа и выполнялась параллельно с ней)
         clarifying_questions = []
         proactive_suggestions = []
         finance_calculation = None
         
-        try:
-            from services.car_dealer_assistant_service import CarDealerAssistantService
-            # Используем chat_id как session_id для ассистента
-            session_id = None
-            if request.chat_id:
-                session_id = request.chat_id
-            elif chat_id:
-                session_id = chat_id
-            
-            assistant = CarDealerAssistantService(
-                user_id=request.user_id,
-                session_id=session_id
-            )
-            
-            # Получаем дополнительные данные от ассистента
-            assistant_result = await assistant.process_query(request.message)
-            
-            if assistant_result:
-                clarifying_questions = assistant_result.get("clarifying_questions", [])
-                proactive_suggestions = assistant_result.get("proactive_suggestions", [])
-                finance_calculation = assistant_result.get("finance_calculation")
-        except Exception as e:
-            print(f"⚠️ Ошибка получения данных от CarDealerAssistantService: {e}")
+        assistant_result = await assistant_task
+        if assistant_result:
+            clarifying_questions = assistant_result.get("clarifying_questions", [])
+            proactive_suggestions = assistant_result.get("proactive_suggestions", [])
+            finance_calculation = assistant_result.get("finance_calculation")
         
         # Объединяем sources_data из запроса с articles и documents из результата RAG
         combined_sources_data = request.sources_data or {}
@@ -580,23 +519,12 @@ async def send_message(
             response_text = "Извините, не удалось сформировать ответ. Попробуйте переформулировать запрос."
             result["response"] = response_text
         
-        # Убеждаемся, что chat_id существует и принадлежит правильному пользователю
-        if not chat_id:
-            # Создаем новый чат для пользователя
-            chat = db_service.create_chat(user_id=request.user_id, title=None)
-            chat_id = chat.id
-        else:
-            # Проверяем, что chat_id принадлежит правильному пользователю
-            chat_check = db_service.get_chat(chat_id, request.user_id)
-            if not chat_check:
-                # Если chat_id не принадлежит пользователю, создаем новый
-                print(f"⚠️ Предупреждение: chat_id {chat_id} не принадлежит пользователю {request.user_id}, создаем новый чат")
-                chat = db_service.create_chat(user_id=request.user_id, title=None)
-                chat_id = chat.id
-        
         # Сохраняем сообщение в БД с объединенными sources_data
         # Убеждаемся, что все данные относятся к правильному пользователю
-        chat_message = db_service.save_chat_message(
+        # chat_id уже проверен: получен из touch_or_create_chat или проверен после агента
+        # История в Redis (по сессиям) сохраняется вместе с сообщением
+        message_id = await _record_turn(
+            async_db_service,
             user_id=request.user_id,  # Всегда используем user_id из запроса
             message=request.message,
             response=response_text,
@@ -605,15 +533,6 @@ async def send_message(
             sources_data=combined_sources_data if combined_sources_data else None
         )
         
-        # Сохраняем историю в Redis (по сессиям) для правильного пользователя
-        sid = _current_session_id(request.user_id)
-        history_key = _session_key(request.user_id, sid)
-        redis_client.rpush(history_key, json.dumps({
-            "q": request.message,
-            "a": response_text,
-            "ts": __import__("time").time()
-        }))
-        
         # Убеждаемся, что все поля присутствуют в ответе
         # Проверяем, что response не пустой
         if not response_text or not response_text.strip():
@@ -633,7 +552,7 @@ async def send_message(
             related_cars=all_related_cars,  # Используем объединенный список со всеми полями
             related_used_cars=all_related_used_cars,  # Используем объединенный список со всеми полями
             model_info=result.get("model_info", {}),
-            message_id=chat_message.id,
+            message_id=message_id,
             chat_id=chat_id  # Всегда присутствует и принадлежит правильному пользователю
         )
         
@@ -663,13 +582,7 @@ async def send_message(
                 sources_data=request.sources_data
             )
             # Сохраняем историю в Redis
-            sid = _current_session_id(request.user_id)
-            history_key = _session_key(request.user_id, sid)
-            redis_client.rpush(history_key, json.dumps({
-                "q": request.message,
-                "a": fallback_text,
-                "ts": __import__("time").time()
-            }))
+            await _append_history(request.user_id, request.message, fallback_text)
             return ChatMessageResponse(
                 response=fallback_text,
                 related_articles=[],
@@ -716,6 +629,10 @@ async def send_message(
                         "error": str(fallback_error)
                     }
                 )
+    finally:
+        # Ответ не дошел до ожидания ассистента (ошибка или отмена запроса): не оставляем задачу висеть
+        if assistant_task is not None and not assistant_task.done():
+            assistant_task.cancel()
 
 
 @router.post("/feedback")
@@ -728,6 +645,15 @@ async def submit_feedback(
     """
     try:
         db_service = DatabaseService(db)
+        if chat_write_behind.enabled():
+            # Сообщение может еще ждать в очереди записи; оценка встает в очередь после него
+            if not (await chat_write_behind.is_pending(request.message_id)
+                    or db_service.chat_message_exists(request.message_id)):
+                raise HTTPException(status_code=404, detail="Сообщение не найдено")
+            op = chat_write_behind.feedback_op(request.message_id, request.feedback, request.comment)
+            if await chat_write_behind.enqueue([op]):
+                return {"message": "Обратная связь сохранена"}
+
         success = db_service.update_feedback(
             message_id=request.message_id,
             feedback=request.feedback,
@@ -739,6 +665,8 @@ async def submit_feedback(
         
         return {"message": "Обратная связь сохранена"}
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при сохранении обратной связи: {str(e)}")
 
@@ -746,16 +674,19 @@ async def submit_feedback(
 @router.get("/history")
 async def get_history(user_id: str, session_id: int | None = None):
     """Возвращает историю сообщений текущей или указанной сессии, а также список всех сессий"""
-    sid = session_id or _current_session_id(user_id)
-    items = redis_client.lrange(_session_key(user_id, sid), 0, -1)
-    sessions = [int(x) for x in redis_client.lrange(f"chat:sessions:{user_id}", 0, -1)]
+    sid = session_id or await _current_session_id(user_id)
+    pipe = async_redis_client.pipeline(transaction=False)
+    pipe.lrange(_session_key(user_id, sid), 0, -1)
+    pipe.lrange(f"chat:sessions:{user_id}", 0, -1)
+    items, session_ids = await pipe.execute()
+    sessions = [int(x) for x in session_ids]
     return {"history": [json.loads(i) for i in items], "current_session": sid, "sessions": sessions}
 
 
 @router.post("/new_chat")
 async def new_chat(user_id: str):
     """Начинает НОВЫЙ чат и сохраняет старые. Возвращает session_id."""
-    sid = _start_new_session(user_id)
+    sid = await _start_new_session(user_id)
     return {"ok": True, "session_id": sid}
 
 
@@ -794,6 +725,12 @@ async def get_chat_messages(
     db: Session = Depends(get_db)
 ):
     """Получает сообщения конкретного чата"""
+    # Сообщения последних ходов могут еще ждать в очереди записи
+    try:
+        if not await chat_write_behind.wait_persisted():
+            print("⚠️ Очередь сообщений чата не записана за отведенное время, последние сообщения могут отсутствовать")
+    except Exception as e:
+        print(f"⚠️ Не удалось дождаться записи очереди сообщений чата: {e}")
     db_service = DatabaseService(db)
     messages = db_service.get_chat_messages(chat_id=chat_id, user_id=user_id, skip=skip, limit=limit)
     
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import List
 
@@ -42,6 +43,22 @@ async def create_document_chunks(
     }
 
 
+@router.post("/rechunk")
+async def rechunk_documents(
+    document_ids: List[int],
+    db: Session = Depends(get_db),
+    _: object = Depends(require_admin)
+):
+    """Пересоздает чанки нескольких документов (эмбеддинги неизменившихся чанков переиспользуются)"""
+    doc_service = DocumentService(db)
+    results = await run_in_threadpool(doc_service.rechunk_documents, document_ids)
+    
+    return {
+        "message": f"Пересоздано чанков для {len(results)} документов",
+        "chunks_count": results
+    }
+
+
 @router.get("/search")
 async def search_chunks(
     query: str,
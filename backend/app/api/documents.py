@@ -1,40 +1,75 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import List, Optional, Tuple
+from urllib.parse import quote
 from models import get_db
 from models.schemas import (
     Document, DocumentCreate, DocumentUpdate, DocumentListResponse, 
     DocumentUploadResponse, Category, Tag
 )
 from services.document_service import DocumentService
+from services.document_job_service import DocumentJobService
 from services.database_service import DatabaseService
+from services.blob_storage_service import BlobTooLargeError, document_blob_storage
 from app.api.auth import require_admin
 import uuid
 import os
 
 router = APIRouter(prefix="/api/documents", tags=["documents"])
 
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024  # 50MB
+
 
 @router.get("/", response_model=DocumentListResponse)
 async def get_documents(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     search: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы; skip игнорируется"),
     db: Session = Depends(get_db),
     _: object = Depends(require_admin)
 ):
     """Получает список документов с пагинацией и поиском"""
     doc_service = DocumentService(db)
-    documents, total = doc_service.get_documents(skip=skip, limit=limit, search=search)
+    documents, total, next_cursor = doc_service.get_documents_page(skip=skip, limit=limit, search=search, cursor=cursor)
     
     return DocumentListResponse(
         documents=documents,
         total=total,
         page=1,
-        size=limit
+        size=limit,
+        next_cursor=next_cursor
     )
 
 
+@router.get("/jobs")
+async def get_processing_jobs(
+    status: Optional[str] = Query(None, description="queued, running, completed, failed"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    _: object = Depends(require_admin)
+):
+    """Получает список задач фоновой обработки документов"""
+    job_service = DocumentJobService(db)
+    jobs = job_service.list_jobs(status=status, limit=limit)
+    return {"jobs": [DocumentJobService.job_to_dict(job) for job in jobs]}
+
+
+@router.get("/jobs/{job_id}")
+async def get_processing_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    _: object = Depends(require_admin)
+):
+    """Получает статус и прогресс задачи обработки"""
+    job = DocumentJobService(db).get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return DocumentJobService.job_to_dict(job)
+
+
 @router.get("/{document_id}", response_model=Document)
 async def get_document(
     document_id: int, 
@@ -73,10 +108,24 @@ async def upload_document(
             detail=f"Неподдерживаемый тип файла. Разрешены: {', '.join(allowed_types)}"
         )
     
-    # Проверяем размер файла (максимум 50MB)
-    file_content = await file.read()
-    if len(file_content) > 50 * 1024 * 1024:  # 50MB
-        raise HTTPException(status_code=400, detail="Файл слишком большой. Максимум 50MB")
+    # Сохраняем файл в контентно-адресуемое хранилище потоком (без чтения целиком в память);
+    # запись прерывается, как только размер превысит 50MB
+    try:
+        content_hash, file_size = await run_in_threadpool(
+            document_blob_storage.put_stream, file.file, MAX_UPLOAD_SIZE
+        )
+    except BlobTooLargeError:
+        raise HTTPException(status_code=413, detail="Файл слишком большой. Максимум 50MB")
+    doc_service = DocumentService(db)
+    
+    # Идентичный файл уже загружен - не создаем дубликат и не обрабатываем повторно
+    existing_document = doc_service.get_document_by_hash(content_hash)
+    if existing_document:
+        return DocumentUploadResponse(
+            document_id=existing_document.id,
+            message=f"Идентичный документ уже загружен: {existing_document.original_filename}",
+            processing_status=existing_document.processing_status or "pending"
+        )
     
     try:
         # Парсим JSON параметры
@@ -99,29 +148,15 @@ async def upload_document(
         )
         
         # Создаем документ
-        doc_service = DocumentService(db)
-        document = doc_service.create_document(document_data, file_content)
+        document = doc_service.create_document(document_data, content_hash=content_hash, file_size=file_size)
         
-        # Запускаем обработку в фоне (можно сделать асинхронно)
-        try:
-            success = doc_service.process_document(document.id)
-            if not success:
-                return DocumentUploadResponse(
-                    document_id=document.id,
-                    message="Документ загружен, но обработка завершилась с ошибкой",
-                    processing_status="failed"
-                )
-        except Exception as e:
-            return DocumentUploadResponse(
-                document_id=document.id,
-                message=f"Документ загружен, но обработка завершилась с ошибкой: {str(e)}",
-                processing_status="failed"
-            )
+        # Ставим обработку в фоновую очередь (извлечение текста, метаданные, эмбеддинги)
+        job = DocumentJobService(db).enqueue(document.id)
         
         return DocumentUploadResponse(
             document_id=document.id,
-            message="Документ успешно загружен и обработан",
-            processing_status="completed"
+            message=f"Документ загружен и поставлен в очередь на обработку (задача {job.id})",
+            processing_status="queued"
         )
         
     except Exception as e:
@@ -174,17 +209,31 @@ async def process_document(
     if not document:
         raise HTTPException(status_code=404, detail="Документ не найден")
     
-    success = doc_service.process_document(document_id)
+    job = DocumentJobService(db).enqueue(document_id)
     
-    if success:
-        return {"message": "Обработка документа запущена"}
-    else:
-        raise HTTPException(status_code=500, detail="Ошибка при обработке документа")
+    return {
+        "message": "Обработка документа запущена",
+        **DocumentJobService.job_to_dict(job)
+    }
+
+
+@router.get("/{document_id}/job")
+async def get_document_job(
+    document_id: int,
+    db: Session = Depends(get_db),
+    _: object = Depends(require_admin)
+):
+    """Получает последнюю задачу обработки документа"""
+    job = DocumentJobService(db).get_latest_job(document_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача обработки для документа не найдена")
+    return DocumentJobService.job_to_dict(job)
 
 
 @router.get("/{document_id}/download")
 async def download_document(
     document_id: int,
+    range_header: Optional[str] = Header(None, alias="Range"),
     db: Session = Depends(get_db),
     _: object = Depends(require_admin)
 ):
@@ -195,20 +244,67 @@ async def download_document(
     if not document:
         raise HTTPException(status_code=404, detail="Документ не найден")
     
-    if not document.file_content:
-        raise HTTPException(status_code=404, detail="Файл не найден")
+    headers = {
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(document.original_filename)}",
+        "Accept-Ranges": "bytes"
+    }
+    
+    if not document.content_hash or not document_blob_storage.exists(document.content_hash):
+        # Документы, загруженные до переноса файлов в BlobStorage
+        content = doc_service.get_document_content(document)
+        if not content:
+            raise HTTPException(status_code=404, detail="Файл не найден")
+        headers.pop("Accept-Ranges")
+        return Response(content=content, media_type="application/octet-stream", headers=headers)
+    
+    file_size = document_blob_storage.size(document.content_hash)
+    headers["ETag"] = f'"{document.content_hash}"'
+    byte_range = _parse_range_header(range_header, file_size)
     
-    from fastapi.responses import Response
+    if byte_range is None:
+        headers["Content-Length"] = str(file_size)
+        return StreamingResponse(
+            document_blob_storage.iter_range(document.content_hash),
+            media_type="application/octet-stream",
+            headers=headers
+        )
     
-    return Response(
-        content=document.file_content,
+    start, end = byte_range
+    if start >= file_size or start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Запрошенный диапазон недоступен",
+            headers={"Content-Range": f"bytes */{file_size}"}
+        )
+    
+    headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        document_blob_storage.iter_range(document.content_hash, start, end),
+        status_code=206,
         media_type="application/octet-stream",
-        headers={
-            "Content-Disposition": f"attachment; filename={document.original_filename}"
-        }
+        headers=headers
     )
 
 
+def _parse_range_header(range_header: Optional[str], file_size: int) -> Optional[Tuple[int, int]]:
+    """Разбирает заголовок Range (поддерживается один диапазон bytes=start-end)"""
+    if not range_header or not range_header.startswith("bytes="):
+        return None
+    spec = range_header[len("bytes="):].split(",")[0].strip()
+    start_str, _, end_str = spec.partition("-")
+    try:
+        if not start_str:
+            # bytes=-N: последние N байт
+            length = int(end_str)
+            return max(file_size - length, 0), file_size - 1
+        start = int(start_str)
+        end = int(end_str) if end_str else file_size - 1
+        return start, min(end, file_size - 1)
+    except ValueError:
+        return None
+
+
 @router.get("/{document_id}/text")
 async def get_document_text(
     document_id: int,
@@ -239,19 +335,21 @@ async def batch_process_documents(
     db: Session = Depends(get_db),
     _: object = Depends(require_admin)
 ):
-    """Обрабатывает несколько документов"""
-    doc_service = DocumentService(db)
+    """Ставит несколько документов в очередь на обработку"""
+    job_service = DocumentJobService(db)
     results = []
     
     for doc_id in document_ids:
         try:
-            success = doc_service.process_document(doc_id)
+            job = job_service.enqueue(doc_id)
             results.append({
                 "document_id": doc_id,
-                "success": success,
-                "message": "Обработан успешно" if success else "Ошибка обработки"
+                "success": True,
+                "job_id": job.id,
+                "message": "Поставлен в очередь"
             })
         except Exception as e:
+            db.rollback()
             results.append({
                 "document_id": doc_id,
                 "success": False,
@@ -259,7 +357,7 @@ async def batch_process_documents(
             })
     
     return {
-        "message": f"Обработано {len(document_ids)} документов",
+        "message": f"Поставлено в очередь {sum(1 for r in results if r['success'])} из {len(document_ids)} документов",
         "results": results
     }
 
@@ -0,0 +1,62 @@
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Header, Query
+from fastapi.responses import FileResponse, Response
+from typing import Optional
+import re
+
+from services.image_cache_service import image_cache_service, THUMBNAIL_SIZES, THUMBNAIL_MEDIA_TYPE
+from app.api.auth import require_admin
+
+router = APIRouter(prefix="/api/images", tags=["images"])
+
+CONTENT_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+# Адрес миниатюры содержит хеш содержимого и никогда не меняется
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Сравнение If-None-Match с ETag (слабое, как требует RFC 9110 для GET)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+
+@router.get("/{content_hash}/{size}")
+async def get_image(
+    content_hash: str,
+    size: str,
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match")
+):
+    """
+    Отдает миниатюру фото из локального кэша
+
+    Без авторизации: адрес используется в <img src>, а хеш содержимого известен
+    только тем, кто получил его из API фотографий.
+    """
+    if not CONTENT_HASH_RE.match(content_hash) or size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=404, detail="Фото не найдено")
+
+    etag = f'"{content_hash}-{size}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    path = image_cache_service.thumbnail_path(content_hash, size)
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="Фото не найдено")
+    return FileResponse(path, media_type=THUMBNAIL_MEDIA_TYPE, headers=headers)
+
+
+@router.post("/prefetch")
+async def prefetch_images(
+    background_tasks: BackgroundTasks,
+    limit: int = Query(1000, ge=1, le=100000),
+    _: object = Depends(require_admin)
+):
+    """Запускает фоновую загрузку в кэш фото каталога, которых там еще нет"""
+    if not image_cache_service.is_available():
+        raise HTTPException(status_code=503, detail="Pillow не установлен. Установите: pip install Pillow")
+    background_tasks.add_task(image_cache_service.prefetch, limit)
+    return {"message": "Загрузка фото в кэш запущена", "limit": limit}
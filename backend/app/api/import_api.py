@@ -1,19 +1,25 @@
 """
 API для импорта автомобилей из JSON/XML файлов
 """
+import asyncio
 import logging
+import xml.etree.ElementTree as ET
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
 from sqlalchemy.orm import Session
 from models import get_db
 from models.schemas import (
     ImportAnalysisResponse, ImportSaveRequest, ImportSaveResponse,
-    ImportListResponse, MigrateRequest, MigrateResponse, ImportCar, ImportUsedCar
+    ImportListResponse, MigrateRequest, MigrateResponse, ImportCar, ImportUsedCar,
+    ImportMappingProfileInfo
 )
 from pydantic import BaseModel
 from services.import_service import ImportService
+from services.catalog_migration_service import CatalogMigrationService
+from services.field_mapping_service import MappingProfileService
+from services.facet_service import facet_store
+from services.pagination_service import CursorError, cached_count, paginate
 from models.database import ImportCar as ImportCarModel, ImportUsedCar as ImportUsedCarModel
 from typing import List, Optional
-from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
@@ -39,12 +45,15 @@ async def upload_file(
         else:
             raise HTTPException(status_code=400, detail="Неподдерживаемый формат файла. Используйте JSON или XML")
         
-        # Читаем содержимое файла
-        content = await file.read()
-        
-        # Анализируем файл
+        # Анализируем файл потоково, не читая его в память целиком
         import_service = ImportService(db)
-        analysis = import_service.analyze_file(content, file_type)
+        await file.seek(0)
+        try:
+            analysis = import_service.analyze_stream(file.file, file_type)
+        except ET.ParseError:
+            # Поврежденный XML - разбор целиком с очисткой содержимого
+            await file.seek(0)
+            analysis = import_service.analyze_file(await file.read(), file_type)
         
         return ImportAnalysisResponse(**analysis)
         
@@ -59,10 +68,17 @@ async def save_import(
     file_type: str = None,
     car_type: str = "new",
     field_mapping: str = None,  # JSON строка
+    fields_fingerprint: Optional[str] = None,
+    profile_name: Optional[str] = None,
+    save_profile: bool = True,
     db: Session = Depends(get_db)
 ):
     """
     Сохраняет импортированные данные в таблицы импорта
+    
+    Использованное сопоставление подтверждается и сохраняется в профиль фида
+    (fields_fingerprint из ответа /upload; без него - по полям field_mapping):
+    следующие загрузки того же фида получат его в auto_mapping.
     """
     try:
         import json
@@ -84,17 +100,39 @@ async def save_import(
         else:
             field_mapping_dict = {}
         
-        # Читаем содержимое файла
-        content = await file.read()
-        
-        # Сохраняем импорт
+        # Сохраняем импорт потоково: записи читаются из файла и вставляются пачками
         import_service = ImportService(db)
-        result = import_service.save_import(
-            content,
-            file_type,
-            field_mapping_dict,
-            car_type
-        )
+        await file.seek(0)
+        try:
+            result = import_service.save_import_stream(
+                file.file,
+                file_type,
+                field_mapping_dict,
+                car_type
+            )
+        except ET.ParseError:
+            # Поврежденный XML (ничего еще не сохранено) - разбор целиком с очисткой содержимого
+            await file.seek(0)
+            result = import_service.save_import(
+                await file.read(),
+                file_type,
+                field_mapping_dict,
+                car_type
+            )
+        
+        if save_profile and field_mapping_dict and result.get("success"):
+            try:
+                profile = MappingProfileService(db).save(
+                    field_mapping_dict,
+                    fingerprint=fields_fingerprint,
+                    name=profile_name,
+                    file_type=file_type,
+                    car_type=car_type
+                )
+                result["mapping_profile_id"] = profile.id
+            except Exception as e:
+                db.rollback()
+                logger.warning(f"Не удалось сохранить профиль сопоставления: {e}")
         
         return ImportSaveResponse(**result)
         
@@ -103,27 +141,53 @@ async def save_import(
         raise HTTPException(status_code=500, detail=f"Ошибка при сохранении импорта: {str(e)}")
 
 
+@router.get("/mapping-profiles", response_model=List[ImportMappingProfileInfo])
+async def list_mapping_profiles(db: Session = Depends(get_db)):
+    """
+    Сохраненные профили сопоставления полей фидов
+    """
+    return MappingProfileService(db).list_profiles()
+
+
+@router.delete("/mapping-profiles/{profile_id}")
+async def delete_mapping_profile(profile_id: int, db: Session = Depends(get_db)):
+    """
+    Удаляет профиль сопоставления: следующая загрузка фида сопоставится заново
+    """
+    if not MappingProfileService(db).delete(profile_id):
+        raise HTTPException(status_code=404, detail="Профиль сопоставления не найден")
+    return {"success": True}
+
+
 @router.get("/list", response_model=ImportListResponse)
 async def get_import_list(
     skip: int = 0,
     limit: int = 100,
     car_type: Optional[str] = None,
+    cursor: Optional[str] = None,
+    used_cursor: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """
     Получает список импортированных автомобилей
+    
+    cursor / used_cursor - курсоры следующих страниц из next_cursor / next_used_cursor
+    предыдущего ответа (skip для соответствующего списка игнорируется)
     """
     try:
+        next_cursor = next_used_cursor = None
         if car_type == "new" or car_type is None:
-            cars = db.query(ImportCarModel).offset(skip).limit(limit).all()
-            total = db.query(ImportCarModel).count()
+            query = db.query(ImportCarModel)
+            cars, next_cursor = paginate(query, None, ImportCarModel.id, limit, skip=skip, cursor=cursor, descending=False)
+            total = cached_count(query, ImportCarModel.__tablename__)
         else:
             cars = []
             total = 0
                 
         if car_type == "used" or car_type is None:
-            used_cars = db.query(ImportUsedCarModel).offset(skip).limit(limit).all()
-            total_used = db.query(ImportUsedCarModel).count()
+            query = db.query(ImportUsedCarModel)
+            used_cars, next_used_cursor = paginate(query, None, ImportUsedCarModel.id, limit, skip=skip, cursor=used_cursor, descending=False)
+            total_used = cached_count(query, ImportUsedCarModel.__tablename__)
         else:
             used_cars = []
             total_used = 0
@@ -147,9 +211,13 @@ async def get_import_list(
             total=total,
             total_used=total_used,
             skip=skip,
-            limit=limit
+            limit=limit,
+            next_cursor=next_cursor,
+            next_used_cursor=next_used_cursor
         )
         
+    except CursorError:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при получении списка импорта: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка при получении списка: {str(e)}")
@@ -162,143 +230,25 @@ async def migrate_data(
 ):
     """
     Мигрирует данные из импортных таблиц в основные таблицы
+    
+    Режимы (mode): replace - заменить каталог импортом, append - добавить,
+    upsert - обновить совпавшие по VIN (только измененные) и добавить остальные.
+    Без mode используется replace при delete_old и append иначе. Перенос идет
+    одной транзакцией: до ее завершения каталог остается прежним. Перенос и
+    пересчет фасетов выполняются в потоке, не блокируя event loop.
     """
     try:
-        from models.database import (
-            Car, UsedCar, CarPicture, UsedCarPicture,
-            CarOption, CarOptionsGroup
-        )
-        from services.elasticsearch_agent_service import ElasticSearchAgentService
+        car_type = request.car_type or None
+        mode = request.mode or ("replace" if request.delete_old else "append")
+        try:
+            stats = await asyncio.to_thread(CatalogMigrationService(db).migrate, car_type=car_type, mode=mode)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        migrated_cars = 0
-        migrated_used_cars = 0
-        migrated_pictures = 0
-        migrated_options = 0
-        deleted_old_cars = 0
-        deleted_old_used_cars = 0
+        new_stats = stats.get("new", {})
+        used_stats = stats.get("used", {})
         errors = []
         
-        # Удаляем старые данные, если нужно
-        if request.delete_old:
-            if request.car_type == "new" or request.car_type is None:
-                # Удаляем старые фотографии и опции
-                db.query(CarPicture).delete()
-                db.query(CarOption).delete()
-                db.query(CarOptionsGroup).delete()
-                deleted_old_cars = db.query(Car).delete()
-                db.commit()
-            
-            if request.car_type == "used" or request.car_type is None:
-                deleted_old_used_cars = db.query(UsedCarPicture).delete()
-                db.query(UsedCar).delete()
-                db.commit()
-        
-        # Мигрируем новые автомобили
-        if request.car_type == "new" or request.car_type is None:
-            import_cars = db.query(ImportCarModel).filter(
-                ImportCarModel.import_status == "imported"
-            ).all()
-            
-            for import_car in import_cars:
-                try:
-                    # Создаем новый Car из ImportCar
-                    car_data = {}
-                    for column in ImportCarModel.__table__.columns:
-                        if column.name not in ['id', 'import_status', 'import_source', 
-                                              'import_error', 'imported_at', 'migrated_at',
-                                              'created_at', 'updated_at']:
-                            value = getattr(import_car, column.name, None)
-                            if value is not None:
-                                car_data[column.name] = value
-                    
-                    car = Car(**car_data)
-                    db.add(car)
-                    db.flush()
-                    migrated_cars += 1
-                    
-                    # Мигрируем фотографии
-                    import_pictures = import_car.pictures
-                    for import_pic in import_pictures:
-                        pic = CarPicture(
-                            car_id=car.id,
-                            url=import_pic.url,
-                            type=import_pic.type,
-                            seqno=import_pic.seqno
-                        )
-                        db.add(pic)
-                        migrated_pictures += 1
-                    
-                    # Мигрируем опции
-                    import_options = import_car.options
-                    for import_option in import_options:
-                        option = CarOption(
-                            car_id=car.id,
-                            code=import_option.code,
-                            description=import_option.description,
-                            options_group_id=None  # Можно добавить логику для групп
-                        )
-                        db.add(option)
-                        migrated_options += 1
-                    
-                    # Обновляем статус импорта
-                    import_car.import_status = "migrated"
-                    import_car.migrated_at = datetime.now()
-                    
-                except Exception as e:
-                    error_msg = f"Ошибка при миграции автомобиля {import_car.id}: {str(e)}"
-                    logger.error(error_msg)
-                    errors.append(error_msg)
-                    import_car.import_status = "error"
-                    import_car.import_error = error_msg
-        
-        # Мигрируем подержанные автомобили
-        if request.car_type == "used" or request.car_type is None:
-            import_used_cars = db.query(ImportUsedCarModel).filter(
-                ImportUsedCarModel.import_status == "imported"
-            ).all()
-            
-            for import_used_car in import_used_cars:
-                try:
-                    # Создаем новый UsedCar из ImportUsedCar
-                    used_car_data = {}
-                    for column in ImportUsedCarModel.__table__.columns:
-                        if column.name not in ['id', 'import_status', 'import_source',
-                                              'import_error', 'imported_at', 'migrated_at',
-                                              'created_at', 'updated_at']:
-                            value = getattr(import_used_car, column.name, None)
-                            if value is not None:
-                                used_car_data[column.name] = value
-                    
-                    used_car = UsedCar(**used_car_data)
-                    db.add(used_car)
-                    db.flush()
-                    migrated_used_cars += 1
-                    
-                    # Мигрируем фотографии
-                    import_pictures = import_used_car.pictures
-                    for import_pic in import_pictures:
-                        pic = UsedCarPicture(
-                            used_car_id=used_car.id,
-                            url=import_pic.url,
-                            type=import_pic.type,
-                            seqno=import_pic.seqno
-                        )
-                        db.add(pic)
-                        migrated_pictures += 1
-                    
-                    # Обновляем статус импорта
-                    import_used_car.import_status = "migrated"
-                    import_used_car.migrated_at = datetime.now()
-                    
-                except Exception as e:
-                    error_msg = f"Ошибка при миграции подержанного автомобиля {import_used_car.id}: {str(e)}"
-                    logger.error(error_msg)
-                    errors.append(error_msg)
-                    import_used_car.import_status = "error"
-                    import_used_car.import_error = error_msg
-        
-        db.commit()
-        
         # Обновляем эмбеддинги и индексы Elasticsearch
         try:
             from services.elasticsearch_agent_service import ElasticSearchAgentService
@@ -313,17 +263,29 @@ async def migrate_data(
         except Exception as e:
             logger.warning(f"Не удалось обновить Elasticsearch: {e}")
         
+        # Фасеты каталога пересчитываем сразу, не дожидаясь отложенного пересчета
+        try:
+            await asyncio.to_thread(facet_store.rebuild)
+        except Exception as e:
+            logger.warning(f"Не удалось пересчитать фасеты каталога: {e}")
+        
         return MigrateResponse(
             success=True,
-            migrated_cars=migrated_cars,
-            migrated_used_cars=migrated_used_cars,
-            migrated_pictures=migrated_pictures,
-            migrated_options=migrated_options,
-            deleted_old_cars=deleted_old_cars,
-            deleted_old_used_cars=deleted_old_used_cars,
+            migrated_cars=new_stats.get("inserted", 0) + new_stats.get("updated", 0),
+            migrated_used_cars=used_stats.get("inserted", 0) + used_stats.get("updated", 0),
+            migrated_pictures=new_stats.get("pictures", 0) + used_stats.get("pictures", 0),
+            migrated_options=new_stats.get("options", 0),
+            deleted_old_cars=new_stats.get("deleted_old", 0),
+            deleted_old_used_cars=used_stats.get("deleted_old", 0),
+            updated_cars=new_stats.get("updated", 0),
+            updated_used_cars=used_stats.get("updated", 0),
+            unchanged_cars=new_stats.get("unchanged", 0),
+            unchanged_used_cars=used_stats.get("unchanged", 0),
             errors=errors
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при миграции данных: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка при миграции: {str(e)}")
@@ -1,7 +1,7 @@
 """
 API endpoints для парсера автомобилей с aaa-motors.ru
 """
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
 from sqlalchemy.orm import Session
 from typing import Dict, Any, Optional, Union
 from models import get_db
@@ -13,8 +13,9 @@ from models.schemas import (
 )
 from services.parser_service import AAAMotorsParser
 from services.ai_parser_service import AIParser
-from sqlalchemy import func
-from models.database import ParsedCar as ParsedCarModel
+from services.facet_service import facet_store
+from services.pagination_service import cached_count, paginate
+from models.database import ParsedCar as ParsedCarModel, ParsedCarChange as ParsedCarChangeModel
 import logging
 
 logger = logging.getLogger(__name__)
@@ -133,6 +134,12 @@ async def start_parser(
             print(f"   - use_ai: {request.use_ai}")
             print(f"{'='*80}\n")
             
+            # Инкрементальная синхронизация: без очистки, объявления обновляются по месту
+            incremental = request.sync_mode == "incremental"
+            if incremental:
+                logger.info("🔁 Инкрементальная синхронизация: очистка данных не выполняется")
+                clear_before_value = False
+            
             # ПРИНУДИТЕЛЬНАЯ ОЧИСТКА ПЕРЕД ПАРСИНГОМ
             if clear_before_value:
                 logger.info("🗑️ Принудительная очистка данных перед парсингом...")
@@ -148,7 +155,8 @@ async def start_parser(
                 max_pages=request.max_pages,
                 max_cars=request.max_cars,
                 delay=request.delay,
-                clear_before=False  # Очистка уже выполнена выше, поэтому False
+                clear_before=False,  # Очистка уже выполнена выше, поэтому False
+                incremental=incremental
             )
             logger.info(f"✅ Парсинг завершен: {result}")
             print(f"\n{'='*80}")
@@ -164,6 +172,11 @@ async def start_parser(
         finally:
             # Закрываем сессию БД
             background_db.close()
+            # Пересчитываем фасеты объявлений (в т.ч. после частичного или прерванного парсинга)
+            try:
+                facet_store.rebuild(car_types=["parsed_car"])
+            except Exception as e:
+                logger.warning(f"Не удалось пересчитать фасеты каталога: {e}")
             # Удаляем парсер после завершения
             if parser_id in _active_parsers:
                 del _active_parsers[parser_id]
@@ -219,6 +232,8 @@ async def get_parser_status(user_id: str = "default"):
         nlp_extractions=status.get("nlp_extractions", 0),
         ollama_extractions=status.get("ollama_extractions", 0),
         structure_changes_detected=status.get("structure_changes_detected", 0),
+        template_extractions=status.get("template_extractions", 0),
+        unchanged_skipped=status.get("unchanged_skipped", 0),
         message=f"Обработано {status['total_parsed']} автомобилей, ошибок: {status['total_errors']}"
     )
 
@@ -230,6 +245,7 @@ async def get_parsed_cars(
     mark: Optional[str] = None,
     model: Optional[str] = None,
     city: Optional[str] = None,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """
@@ -239,6 +255,8 @@ async def get_parsed_cars(
     - mark: Марка автомобиля
     - model: Модель автомобиля
     - city: Город
+    
+    cursor - курсор следующей страницы из next_cursor предыдущего ответа (skip игнорируется)
     """
     query = db.query(ParsedCarModel)
     
@@ -253,17 +271,18 @@ async def get_parsed_cars(
     # Фильтр только активных
     query = query.filter(ParsedCarModel.is_active == True)
     
-    # Получаем общее количество
-    total = query.count()
+    # Общее количество (кэшируется до следующей записи в parsed_cars)
+    total = cached_count(query, ParsedCarModel.__tablename__, {"mark": mark, "model": model, "city": city, "is_active": True})
     
-    # Применяем пагинацию
-    cars = query.order_by(ParsedCarModel.parsed_at.desc()).offset(skip).limit(limit).all()
+    # Применяем пагинацию (по курсору - без OFFSET)
+    cars, next_cursor = paginate(query, ParsedCarModel.parsed_at, ParsedCarModel.id, limit, skip=skip, cursor=cursor)
     
     return ParsedCarListResponse(
         cars=[ParsedCar.model_validate(car) for car in cars],
         total=total,
         skip=skip,
-        limit=limit
+        limit=limit,
+        next_cursor=next_cursor
     )
 
 
@@ -293,32 +312,48 @@ async def delete_parsed_car(car_id: int, db: Session = Depends(get_db)):
     return {"message": "Автомобиль удален"}
 
 
+@router.get("/changes")
+async def get_parsed_car_changes(
+    after_id: int = Query(0, ge=0, description="Курсор: id последнего обработанного изменения"),
+    limit: int = Query(500, ge=1, le=5000),
+    db: Session = Depends(get_db)
+):
+    """
+    Журнал изменений объявлений инкрементальной синхронизации (created, updated, reactivated, deactivated)
+
+    Потребитель хранит next_after_id и запрашивает следующие изменения с ним.
+    """
+    changes = (
+        db.query(ParsedCarChangeModel)
+        .filter(ParsedCarChangeModel.id > after_id)
+        .order_by(ParsedCarChangeModel.id)
+        .limit(limit)
+        .all()
+    )
+    return {
+        "changes": [
+            {
+                "id": change.id,
+                "run_id": change.run_id,
+                "parsed_car_id": change.parsed_car_id,
+                "source_url": change.source_url,
+                "change_type": change.change_type,
+                "content_hash": change.content_hash,
+                "created_at": change.created_at,
+            }
+            for change in changes
+        ],
+        "next_after_id": changes[-1].id if changes else after_id,
+    }
+
+
 @router.get("/stats")
-async def get_parser_stats(db: Session = Depends(get_db)):
-    """Получает статистику по спарсенным автомобилям"""
-    total_cars = db.query(func.count(ParsedCarModel.id)).filter(
-        ParsedCarModel.is_active == True
-    ).scalar()
-    
-    total_by_mark = db.query(
-        ParsedCarModel.mark,
-        func.count(ParsedCarModel.id).label('count')
-    ).filter(
-        ParsedCarModel.is_active == True,
-        ParsedCarModel.mark.isnot(None)
-    ).group_by(ParsedCarModel.mark).all()
-    
-    total_by_city = db.query(
-        ParsedCarModel.city,
-        func.count(ParsedCarModel.id).label('count')
-    ).filter(
-        ParsedCarModel.is_active == True,
-        ParsedCarModel.city.isnot(None)
-    ).group_by(ParsedCarModel.city).all()
+async def get_parser_stats():
+    """Получает статистику по спарсенным автомобилям (из снимка фасетов)"""
+    facets = facet_store.get("parsed_car")
     
     return {
-        "total_cars": total_cars or 0,
-        "by_mark": [{"mark": mark, "count": count} for mark, count in total_by_mark],
-        "by_city": [{"city": city, "count": count} for city, count in total_by_city]
+        "total_cars": facets.get("count", 0),
+        "by_mark": [{"mark": mark, "count": count} for mark, count in (facets.get("brands") or {}).items()],
+        "by_city": [{"city": city, "count": count} for city, count in (facets.get("cities") or {}).items()]
     }
-
@@ -1,12 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from typing import Optional
 from models import get_db
 from models.schemas import VoiceSettingsResponse, VoiceSettingsRequest, VoiceTranscribeResponse
+from services.transcription_service import (
+    transcription_service,
+    TranscriptionQueueFullError,
+    TranscriptionUnavailableError,
+)
 import json
-import os
-import tempfile
 import logging
 from pathlib import Path
 
@@ -60,6 +63,9 @@ async def update_voice_settings(request: VoiceSettingsRequest):
     _save_voice_settings(settings_dict)
     return VoiceSettingsResponse(**settings_dict)
 
+def _audio_suffix(audio: UploadFile) -> str:
+    return audio.filename.split('.')[-1] if audio.filename and '.' in audio.filename else 'webm'
+
 @router.post("/transcribe", response_model=VoiceTranscribeResponse)
 async def transcribe_audio(
     audio: UploadFile = File(...),
@@ -75,54 +81,73 @@ async def transcribe_audio(
         language: Язык (ru, en и т.д.) или None для автоопределения
     """
     try:
-        # Импортируем whisper только при использовании
-        try:
-            import whisper
-        except ImportError:
-            raise HTTPException(
-                status_code=503,
-                detail="Whisper не установлен. Установите: pip install openai-whisper"
-            )
+        content = await audio.read()
         
-        # Сохраняем временный файл
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{audio.filename.split('.')[-1] if audio.filename else 'webm'}") as tmp_file:
-            content = await audio.read()
-            tmp_file.write(content)
-            tmp_file_path = tmp_file.name
+        logger.info(f"Транскрибация аудио (модель: {model}, язык: {language or 'авто'})")
+        result = await transcription_service.transcribe(
+            content,
+            model=model or "base",
+            language=language or None,
+            suffix=_audio_suffix(audio)
+        )
         
-        try:
-            # Загружаем модель Whisper
-            logger.info(f"Загрузка модели Whisper: {model}")
-            whisper_model = whisper.load_model(model)
-            
-            # Транскрибируем аудио
-            logger.info(f"Транскрибация аудио (язык: {language or 'авто'})")
-            result = whisper_model.transcribe(
-                tmp_file_path,
-                language=language if language else None,
-                task="transcribe"
-            )
-            
-            # Получаем результат
-            text = result.get("text", "").strip()
-            detected_language = result.get("language", language or "unknown")
-            
-            logger.info(f"Распознано: {text[:50]}... (язык: {detected_language})")
-            
-            return VoiceTranscribeResponse(
-                text=text,
-                language=detected_language,
-                confidence=result.get("no_speech_prob", 0)  # Используем вероятность отсутствия речи как индикатор
-            )
-            
-        finally:
-            # Удаляем временный файл
-            if os.path.exists(tmp_file_path):
-                os.unlink(tmp_file_path)
-                
+        logger.info(f"Распознано: {result['text'][:50]}... (язык: {result['language']})")
+        
+        return VoiceTranscribeResponse(**result)
+        
+    except TranscriptionUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except TranscriptionQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         logger.error(f"Ошибка транскрибации: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка распознавания речи: {str(e)}")
 
+@router.post("/transcribe/stream")
+async def transcribe_audio_stream(
+    audio: UploadFile = File(...),
+    model: Optional[str] = Form("base"),
+    language: Optional[str] = Form(None)
+):
+    """
+    Транскрибация длинного аудио с частичными результатами
+    
+    Возвращает NDJSON: по одной строке на каждое 30-секундное окно
+    (text, language, chunk, total_chunks, final, full_text).
+    """
+    content = await audio.read()
+    try:
+        stream = transcription_service.transcribe_stream(
+            content,
+            model=model or "base",
+            language=language or None,
+            suffix=_audio_suffix(audio)
+        )
+        # Получаем первый результат до начала ответа, чтобы ошибки допуска вернулись кодом
+        first = await stream.__anext__()
+    except TranscriptionUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except TranscriptionQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        logger.error(f"Ошибка транскрибации: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Ошибка распознавания речи: {str(e)}")
+    
+    async def generate():
+        try:
+            yield json.dumps(first, ensure_ascii=False) + "\n"
+            async for partial in stream:
+                yield json.dumps(partial, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.error(f"Ошибка потоковой транскрибации: {e}", exc_info=True)
+            yield json.dumps({"error": str(e), "final": True}, ensure_ascii=False) + "\n"
+        finally:
+            # Клиент мог отключиться: освобождаем место в очереди и отменяем оставшиеся окна сразу, а не при сборке мусора
+            await stream.aclose()
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
 
-
+@router.get("/transcribe/status")
+async def get_transcription_status():
+    """Состояние очереди транскрибации"""
+    return transcription_service.get_stats()
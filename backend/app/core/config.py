@@ -50,13 +50,127 @@ class Settings(BaseSettings):
     redis_host: str = "localhost"
     redis_port: int = 6379
     redis_db: int = 0
-    
+    redis_max_connections: int = 50  # Соединений в общем пуле процесса (отдельно sync и asyncio)
+    redis_socket_timeout: float = 1.0  # Таймаут подключения и команды, сек
+    redis_health_check_interval: int = 30  # Проверка простаивающего соединения перед использованием, сек
+    redis_reconnect_interval_seconds: float = 15.0  # Повторная проверка недоступного Redis (до нее - хранилище в памяти)
+
+    # Whisper (транскрибация голоса)
+    whisper_max_workers: int = 1  # Процессов в пуле транскрибации
+    whisper_max_pending: int = 8  # Максимум задач в работе и очереди
+    whisper_model_cache_size: int = 2  # Моделей в LRU-кэше каждого процесса
+
+    # Хранилище файлов документов (контентно-адресуемое, по SHA-256)
+    document_storage_dir: str = "storage/documents"
+    # Бэкенд извлечения текста из PDF: auto (PyMuPDF, если установлен, иначе PyPDF2), pymupdf, pypdf2
+    document_pdf_backend: str = "auto"
+
+    # Фоновая обработка документов
+    document_job_workers: int = 2  # Потоков-обработчиков очереди document_jobs
+    document_extract_concurrency: int = 2  # Параллельных извлечений текста
+    document_metadata_concurrency: int = 2  # Документов, одновременно генерирующих метаданные через LLM
+    document_metadata_workers: int = 4  # Параллельных LLM-запросов метаданных одного документа
+    document_embed_concurrency: int = 4  # Параллельных запросов эмбеддингов
+    document_job_max_attempts: int = 3
+
+    # Разбиение документов на чанки
+    document_chunk_max_tokens: int = 200  # Бюджет чанка (приблизительные токены: слова и знаки)
+    document_chunk_overlap_tokens: int = 30  # Перекрытие соседних чанков целыми предложениями
+    document_chunk_workers: int = 2  # Процессов для параллельного разбиения при пакетной переобработке
+    embedding_max_input_tokens: int = 1000  # Страховочный предел длины текста для эмбеддинга
+    embedding_cache_memory_entries: int = 10000  # Эмбеддингов в LRU-кэше процесса (перед таблицей embedding_cache)
+
+    # Локальные эмбеддинги (embedding_model = "local:<модель>" в ai_settings.json)
+    local_embedding_model: str = "BAAI/bge-m3"  # Мультиязычная модель с 1024 измерениями
+    local_embedding_backend: str = "torch"  # torch, onnx или openvino (sentence-transformers >= 3.2)
+    local_embedding_workers: int = 2  # Потоков инференса
+    local_embedding_batch_size: int = 32
+
+    # Векторный поиск автомобилей (car_embeddings, HNSW)
+    vector_search_ef_search: int = 100  # Кандидатов HNSW при поиске (больше - точнее при жестких фильтрах)
+    vector_index_on_startup: bool = True  # Инкрементальная индексация автомобилей при запуске
+
+    # Гибридный поиск (ES + pgvector + SQL, слияние RRF)
+    hybrid_search_rrf_k: int = 60
+    hybrid_search_source_limit: int = 20  # Результатов с каждого источника до слияния
+    hybrid_search_es_timeout: float = 0.8  # Бюджет источника, сек; опоздавший источник отбрасывается
+    hybrid_search_vector_timeout: float = 1.5  # Включает получение эмбеддинга запроса
+    hybrid_search_sql_timeout: float = 1.0
+    hybrid_search_hydrate_timeout: float = 1.0  # Бюджет загрузки карточек из каталога; затем - данные источников
+
+    # Списки с пагинацией
+    count_cache_ttl_seconds: int = 300  # Кэш total; запись через ORM сбрасывает его сразу
+    count_estimate_min_rows: int = 100000  # Для таблиц больше - оценка pg_class.reltuples вместо COUNT(*) без фильтров
+
+    # Фасеты каталога (inventory_facet_snapshots)
+    facet_snapshot_ttl_seconds: int = 60  # Как часто воркер перечитывает снимок (пересчеты других процессов)
+    facet_rebuild_delay_seconds: float = 10.0  # Пересчет после коммита в каталог; коммиты за это время схлопываются
+    facet_price_interval: int = 500000  # Шаг гистограммы цен, руб.
+
+    # Импорт автомобилей из файлов (потоковый разбор XML/JSON)
+    import_batch_size: int = 500  # Записей в одной пачке INSERT и одной транзакции
+    import_stream_chunk_bytes: int = 65536  # Размер блока чтения файла
+    import_max_reported_errors: int = 1000  # Сообщений об ошибках в ответе (остальные только считаются)
+
+    # Перенос каталога из SQLite cars.db в PostgreSQL
+    sqlite_migration_chunk_size: int = 2000  # Строк в одной пачке COPY и одной транзакции (с чекпоинтом)
+    sqlite_migration_workers: int = 3  # Параллельных таблиц (фото, группы опций, опции)
+
+    # Асинхронный обход сайта парсером
+    crawler_concurrency: int = 6  # Одновременных запросов (и соединений в пуле)
+    crawler_host_rate_per_second: float = 4.0  # Вежливость: не больше запросов в секунду к одному хосту
+    crawler_host_burst: int = 4  # Запросов подряд без ожидания (емкость token bucket)
+    crawler_max_retries: int = 3  # Повторы при таймаутах, 429 и 5xx
+    crawler_retry_backoff_seconds: float = 1.0  # База экспоненциальной задержки повтора (со случайным разбросом)
+    crawler_timeout_seconds: float = 20.0
+
+    # NLP-модели парсера (общий пул процесса: spaCy NER, тональность)
+    parser_nlp_batch_size: int = 32  # Текстов в пачке nlp.pipe и transformers
+    parser_nlp_cache_size: int = 2048  # Текстов в LRU-кэше извлеченных сущностей
+
+    # Шаблоны извлечения по отпечатку структуры страницы (page_layout_templates)
+    parser_template_min_samples: int = 2  # Страниц, подтвердивших селекторы, до применения шаблона
+    parser_template_max_misses: int = 3  # Промахов подряд, после которых шаблон переучивается
+    parser_template_max_count: int = 50  # Шаблонов на сайт (уникальные разметки дальше не изучаются)
+
+    # Инкрементальная синхронизация объявлений парсера (sync_mode="incremental")
+    parser_sync_batch_size: int = 50  # Объявлений в одной пачке записи
+
+    # Кэш фотографий автомобилей (оригиналы и миниатюры по SHA-256)
+    image_storage_dir: str = "storage/images"
+    image_fetch_concurrency: int = 8  # Одновременных загрузок фото
+    image_host_rate_per_second: float = 20.0  # Загрузок фото в секунду с одного хоста (CDN дилера)
+    image_thumbnail_workers: int = 2  # Процессов уменьшения фото
+    image_thumbnail_quality: int = 82  # Качество JPEG миниатюр
+    image_max_bytes: int = 15 * 1024 * 1024  # Фото больше не загружаются
+    image_max_attempts: int = 3  # Попыток загрузки недоступного фото
+    image_cache_batch_size: int = 100  # URL в пачке загрузки; результаты пачки фиксируются одной транзакцией
+
+    # Отложенная запись сообщений чата (очередь в Redis, перенос в PostgreSQL пачками)
+    chat_write_behind_enabled: bool = True  # Только для PostgreSQL и доступного Redis, иначе запись сразу
+    chat_persist_flush_interval_seconds: float = 0.5  # Как часто очередь переносится в БД
+    chat_persist_batch_size: int = 200  # Операций в одной транзакции БД
+    chat_message_id_block_size: int = 50  # ID сообщений, выделяемых из последовательности за один запрос
+    chat_persist_read_wait_seconds: float = 2.0  # Ожидание записи очереди перед чтением сообщений из БД
+
     @property
     def database_url(self) -> str:
         if self.database_url_env:
             return self.database_url_env
         return f"postgresql://{self.postgres_user}:{self.postgres_password}@{self.postgres_host}:{self.postgres_port}/{self.postgres_db}"
     
+    @property
+    def async_database_url(self) -> str:
+        """URL для асинхронного движка (asyncpg для Postgres, aiosqlite для SQLite)"""
+        url = self.database_url
+        if url.startswith("postgresql+psycopg2://"):
+            return url.replace("postgresql+psycopg2://", "postgresql+asyncpg://", 1)
+        if url.startswith("postgresql://"):
+            return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+        if url.startswith("sqlite://"):
+            return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+        return url
+    
     @property
     def chroma_url(self) -> str:
         return f"http://{self.chroma_host}:{self.chroma_port}"
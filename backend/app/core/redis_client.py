@@ -0,0 +1,512 @@
+"""
+Общее подключение к Redis для всего приложения
+
+Один пул соединений на процесс вместо отдельного клиента (и блокирующего ping)
+в каждом сервисе:
+- redis_client - синхронный клиент на общем ConnectionPool;
+- async_redis_client - клиент redis.asyncio для async-обработчиков (не блокирует event loop).
+
+Доступность Redis проверяется лениво при первой команде. Пока Redis недоступен,
+команды выполняет хранилище в памяти процесса (MemoryRedis: строки, списки, хеши,
+TTL, транзакции WATCH/MULTI/EXEC); раз в redis_reconnect_interval_seconds
+выполняется повторная проверка, и после восстановления команды снова уходят в Redis.
+Данные, записанные в память за время недоступности, в Redis не переносятся.
+"""
+import fnmatch
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import redis
+import redis.asyncio as aioredis
+from redis.exceptions import WatchError
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Ошибки соединения, после которых Redis считается недоступным
+CONNECTION_ERRORS = (redis.ConnectionError, redis.TimeoutError, OSError)
+
+
+class MemoryRedis:
+    """
+    Хранилище в памяти процесса с командами redis-py (fallback, когда Redis недоступен)
+
+    Поддерживает строки, списки и хеши с TTL, а также pipeline() с семантикой
+    WATCH/MULTI/EXEC: транзакция выполняется под блокировкой и отменяется
+    (WatchError), если отслеживаемый ключ изменился после watch().
+    """
+    def __init__(self):
+        self._data: Dict[str, str] = {}
+        self._lists: Dict[str, List[str]] = {}
+        self._hashes: Dict[str, Dict[str, str]] = {}
+        self._expires: Dict[str, float] = {}
+        self._versions: Dict[str, int] = {}  # Счетчик изменений ключа для WATCH
+        self._lock = threading.RLock()
+
+    def _alive(self, key: str):
+        """Удаляет ключ, если истек его TTL"""
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._drop(key)
+
+    def _drop(self, key: str) -> bool:
+        existed = False
+        for storage in (self._data, self._lists, self._hashes):
+            if key in storage:
+                del storage[key]
+                existed = True
+        self._expires.pop(key, None)
+        if existed:
+            self._touch(key)
+        return existed
+
+    def _touch(self, key: str):
+        self._versions[key] = self._versions.get(key, 0) + 1
+
+    def ping(self) -> bool:
+        return True
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            self._alive(key)
+            return self._data.get(key)
+
+    def set(self, key: str, value: Any, ex: Optional[int] = None):
+        with self._lock:
+            self._drop(key)
+            self._data[key] = str(value)
+            if ex:
+                self._expires[key] = time.monotonic() + ex
+            self._touch(key)
+            return True
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        with self._lock:
+            self._alive(key)
+            value = int(self._data.get(key) or 0) + amount
+            self._data[key] = str(value)
+            self._touch(key)
+            return value
+
+    def delete(self, *keys: str):
+        with self._lock:
+            return sum(1 for key in keys if self._drop(key))
+
+    def exists(self, *keys: str) -> int:
+        with self._lock:
+            for key in keys:
+                self._alive(key)
+            return sum(1 for key in keys if key in self._data or key in self._lists or key in self._hashes)
+
+    def expire(self, key: str, seconds: int) -> bool:
+        """Устанавливает TTL существующего ключа"""
+        with self._lock:
+            if not self.exists(key):
+                return False
+            self._expires[key] = time.monotonic() + seconds
+            return True
+
+    def ttl(self, key: str) -> int:
+        with self._lock:
+            if not self.exists(key):
+                return -2
+            expires_at = self._expires.get(key)
+            return -1 if expires_at is None else max(0, int(round(expires_at - time.monotonic())))
+
+    def rpush(self, key: str, *values: Any):
+        """Добавляет элементы в конец списка"""
+        with self._lock:
+            self._alive(key)
+            lst = self._lists.setdefault(key, [])
+            lst.extend(str(value) for value in values)
+            self._touch(key)
+            return len(lst)
+
+    def lrange(self, key: str, start: int, end: int) -> List[str]:
+        """Получает элементы списка (индексы как в Redis: включительно, отрицательные - с конца)"""
+        with self._lock:
+            self._alive(key)
+            lst = self._lists.get(key, [])
+            size = len(lst)
+            if start < 0:
+                start = max(size + start, 0)
+            if end < 0:
+                end = size + end
+            return lst[start:end + 1] if end >= start else []
+
+    def lset(self, key: str, index: int, value: Any):
+        """Заменяет элемент списка по индексу"""
+        with self._lock:
+            self._alive(key)
+            if key not in self._lists:
+                raise redis.ResponseError("no such key")
+            self._lists[key][index] = str(value)
+            self._touch(key)
+            return True
+
+    def llen(self, key: str) -> int:
+        """Возвращает длину списка"""
+        with self._lock:
+            self._alive(key)
+            return len(self._lists.get(key, []))
+
+    def ltrim(self, key: str, start: int, end: int):
+        """Обрезает список"""
+        with self._lock:
+            self._alive(key)
+            if key not in self._lists:
+                return True
+            self._lists[key] = self.lrange(key, start, end)
+            if not self._lists[key]:
+                self._drop(key)
+            else:
+                self._touch(key)
+            return True
+
+    def hset(self, key: str, field: Optional[str] = None, value: Any = None,
+             mapping: Optional[Dict[str, Any]] = None) -> int:
+        """Устанавливает поля хеша; возвращает число новых полей"""
+        with self._lock:
+            self._alive(key)
+            items = dict(mapping or {})
+            if field is not None:
+                items[field] = value
+            fields = self._hashes.setdefault(key, {})
+            added = sum(1 for name in items if name not in fields)
+            fields.update({name: str(item) for name, item in items.items()})
+            self._touch(key)
+            return added
+
+    def hget(self, key: str, field: str) -> Optional[str]:
+        with self._lock:
+            self._alive(key)
+            return self._hashes.get(key, {}).get(field)
+
+    def hgetall(self, key: str) -> Dict[str, str]:
+        with self._lock:
+            self._alive(key)
+            return dict(self._hashes.get(key, {}))
+
+    def hdel(self, key: str, *fields: str) -> int:
+        with self._lock:
+            self._alive(key)
+            hash_fields = self._hashes.get(key)
+            if not hash_fields:
+                return 0
+            removed = sum(1 for name in fields if hash_fields.pop(name, None) is not None)
+            if not hash_fields:
+                # Как в Redis: пустой хеш удаляется
+                self._drop(key)
+            elif removed:
+                self._touch(key)
+            return removed
+
+    def keys(self, pattern: str = "*") -> List[str]:
+        """Возвращает ключи, соответствующие паттерну"""
+        with self._lock:
+            for key in list(self._expires):
+                self._alive(key)
+            all_keys = list(self._data.keys()) + list(self._lists.keys()) + list(self._hashes.keys())
+            return [k for k in all_keys if fnmatch.fnmatch(k, pattern)]
+
+    def pipeline(self, transaction: bool = True) -> "MemoryPipeline":
+        return MemoryPipeline(self)
+
+
+class MemoryPipeline:
+    """Pipeline поверх MemoryRedis с поведением redis-py (watch, multi, execute)"""
+    def __init__(self, storage: MemoryRedis):
+        self._storage = storage
+        self._watched: Dict[str, int] = {}
+        self._commands: List[tuple] = []
+        self._buffered = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.reset()
+
+    def __getattr__(self, name: str):
+        method = getattr(self._storage, name)
+        if not self._buffered:
+            # После watch() и до multi() команды выполняются сразу
+            return method
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def watch(self, *keys: str):
+        with self._storage._lock:
+            self._watched.update({key: self._storage._versions.get(key, 0) for key in keys})
+        self._buffered = False
+
+    def multi(self):
+        self._buffered = True
+
+    def execute(self) -> List[Any]:
+        try:
+            with self._storage._lock:
+                if any(self._storage._versions.get(key, 0) != version for key, version in self._watched.items()):
+                    raise WatchError("Watched variable changed.")
+                return [method(*args, **kwargs) for method, args, kwargs in self._commands]
+        finally:
+            self.reset()
+
+    def reset(self):
+        self._watched = {}
+        self._commands = []
+        self._buffered = True
+
+
+class AsyncMemoryRedis:
+    """Асинхронный интерфейс (как redis.asyncio) к тому же MemoryRedis"""
+    def __init__(self, storage: MemoryRedis):
+        self._storage = storage
+
+    def __getattr__(self, name: str):
+        method = getattr(self._storage, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+    def pipeline(self, transaction: bool = True) -> "AsyncMemoryPipeline":
+        return AsyncMemoryPipeline(self._storage.pipeline(transaction))
+
+
+class AsyncMemoryPipeline:
+    """Pipeline redis.asyncio поверх MemoryPipeline: команды в очередь, await execute()"""
+    def __init__(self, pipeline: MemoryPipeline):
+        self._pipeline = pipeline
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._pipeline.reset()
+
+    def __getattr__(self, name: str):
+        if self._pipeline._buffered:
+            queue = getattr(self._pipeline, name)
+
+            def buffered(*args, **kwargs):
+                queue(*args, **kwargs)
+                return self
+            return buffered
+        method = getattr(self._pipeline, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+    async def watch(self, *keys: str):
+        self._pipeline.watch(*keys)
+
+    def multi(self):
+        self._pipeline.multi()
+
+    async def execute(self) -> List[Any]:
+        return self._pipeline.execute()
+
+    async def reset(self):
+        self._pipeline.reset()
+
+
+class RedisManager:
+    """Общие пулы соединений с Redis, состояние доступности и переключение на память"""
+
+    def __init__(self):
+        pool_kwargs = dict(
+            host=settings.redis_host,
+            port=settings.redis_port,
+            db=settings.redis_db,
+            decode_responses=True,
+            max_connections=settings.redis_max_connections,
+            socket_connect_timeout=settings.redis_socket_timeout,
+            socket_timeout=settings.redis_socket_timeout,
+            health_check_interval=settings.redis_health_check_interval,
+        )
+        self._sync_client = redis.Redis(connection_pool=redis.ConnectionPool(**pool_kwargs))
+        # Пул redis.asyncio привязан к event loop, поэтому создается при первом async-вызове
+        self._pool_kwargs = pool_kwargs
+        self._async_client: Optional[aioredis.Redis] = None
+        self.memory = MemoryRedis()
+        self.async_memory = AsyncMemoryRedis(self.memory)
+        self._available: Optional[bool] = None  # None - еще не проверялся
+        self._next_check = 0.0
+        self._last_error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _due(self) -> bool:
+        return self._available is None or (not self._available and time.monotonic() >= self._next_check)
+
+    def _set_state(self, available: bool, error: Optional[str] = None):
+        with self._lock:
+            previous = self._available
+            self._available = available
+            self._last_error = error
+            if not available:
+                self._next_check = time.monotonic() + settings.redis_reconnect_interval_seconds
+        if available and previous is not True:
+            logger.info(f"✅ Redis доступен: {settings.redis_host}:{settings.redis_port}")
+        elif not available and previous is not False:
+            logger.warning(f"⚠️ Redis недоступен ({error}), данные хранятся в памяти процесса")
+
+    def mark_down(self, error: Exception):
+        """Команда завершилась ошибкой соединения: до повторной проверки работаем с памятью"""
+        self._set_state(False, f"{type(error).__name__}: {error}")
+
+    def check(self) -> bool:
+        """Синхронная проверка доступности (ping через общий пул)"""
+        try:
+            self._sync_client.ping()
+            self._set_state(True)
+        except Exception as e:
+            self.mark_down(e)
+        return bool(self._available)
+
+    async def check_async(self) -> bool:
+        """Проверка доступности без блокировки event loop"""
+        try:
+            await self._get_async_client().ping()
+            self._set_state(True)
+        except Exception as e:
+            self.mark_down(e)
+        return bool(self._available)
+
+    def _get_async_client(self) -> aioredis.Redis:
+        if self._async_client is None:
+            self._async_client = aioredis.Redis(connection_pool=aioredis.ConnectionPool(**self._pool_kwargs))
+        return self._async_client
+
+    def sync_backend(self):
+        if self._due():
+            self.check()
+        return self._sync_client if self._available else self.memory
+
+    async def async_backend(self):
+        if self._due():
+            await self.check_async()
+        return self._get_async_client() if self._available else self.async_memory
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "backend": "redis" if self._available else "memory",
+            "available": self._available,
+            "host": f"{settings.redis_host}:{settings.redis_port}",
+            "last_error": self._last_error,
+        }
+
+    async def close(self):
+        """Закрывает пулы соединений (остановка приложения)"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        self._sync_client.connection_pool.disconnect()
+
+
+class SyncRedisClient:
+    """Синхронный клиент: команды выполняются в Redis из общего пула или в памяти"""
+
+    def __init__(self, manager: RedisManager):
+        self._manager = manager
+
+    def __getattr__(self, name: str):
+        backend = self._manager.sync_backend()
+        attr = getattr(backend, name)
+        if backend is self._manager.memory or not callable(attr) or name == "pipeline":
+            return attr
+
+        def call(*args, **kwargs):
+            try:
+                return attr(*args, **kwargs)
+            except CONNECTION_ERRORS as e:
+                # Redis пропал между проверками: команда выполняется в памяти
+                self._manager.mark_down(e)
+                return getattr(self._manager.memory, name)(*args, **kwargs)
+        return call
+
+
+class AsyncRedisClient:
+    """Асинхронный клиент (redis.asyncio) с тем же переключением на память"""
+
+    def __init__(self, manager: RedisManager):
+        self._manager = manager
+
+    def pipeline(self, transaction: bool = True) -> "AsyncClientPipeline":
+        return AsyncClientPipeline(self._manager, transaction)
+
+    def __getattr__(self, name: str):
+        async def call(*args, **kwargs):
+            backend = await self._manager.async_backend()
+            if backend is self._manager.async_memory:
+                return await getattr(backend, name)(*args, **kwargs)
+            try:
+                return await getattr(backend, name)(*args, **kwargs)
+            except CONNECTION_ERRORS as e:
+                self._manager.mark_down(e)
+                return await getattr(self._manager.async_memory, name)(*args, **kwargs)
+        return call
+
+
+class AsyncClientPipeline:
+    """
+    Pipeline async_redis_client: команды копятся до execute()
+
+    Бэкенд выбирается в execute() с той же проверкой доступности, что и для отдельных
+    команд. Если Redis пропал во время выполнения, он помечается недоступным, а
+    накопленные команды повторяются в pipeline памяти.
+    """
+
+    def __init__(self, manager: RedisManager, transaction: bool = True):
+        self._manager = manager
+        self._transaction = transaction
+        self._commands: List[tuple] = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.reset()
+
+    def __len__(self) -> int:
+        return len(self._commands)
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self) -> List[Any]:
+        commands, self._commands = self._commands, []
+        backend = await self._manager.async_backend()
+        if backend is not self._manager.async_memory:
+            try:
+                return await self._replay(backend, commands)
+            except CONNECTION_ERRORS as e:
+                self._manager.mark_down(e)
+        return await self._replay(self._manager.async_memory, commands)
+
+    async def _replay(self, backend, commands: List[tuple]) -> List[Any]:
+        pipe = backend.pipeline(self._transaction)
+        for name, args, kwargs in commands:
+            getattr(pipe, name)(*args, **kwargs)
+        return await pipe.execute()
+
+    async def reset(self):
+        self._commands = []
+
+
+redis_manager = RedisManager()
+redis_client = SyncRedisClient(redis_manager)
+async_redis_client = AsyncRedisClient(redis_manager)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Скрипт для индексации автомобилей (cars, used_cars) в векторную таблицу car_embeddings
+
+Индексация батчевая и возобновляемая: при повторном запуске пересчитываются только
+новые и изменившиеся автомобили (или все - после смены модели эмбеддингов).
+"""
+import asyncio
+import sys
+from pathlib import Path
+from typing import Dict
+
+# Добавляем путь к модулям
+sys.path.append(str(Path(__file__).parent))
+
+from services.vector_search_service import VectorSearchService
+
+
+async def index_cars_to_vector_db(batch_size: int = 100, db_session=None) -> Dict[str, int]:
+    """
+    Индексирует автомобили, не блокируя event loop
+
+    db_session оставлен для совместимости: индексация идет в фоне дольше запроса,
+    поэтому использует собственные сессии.
+    """
+    service = VectorSearchService()
+    return await asyncio.to_thread(service.index_cars, batch_size)
+
+
+if __name__ == "__main__":
+    print("=== Индексация автомобилей в векторную БД ===")
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    try:
+        asyncio.run(index_cars_to_vector_db(batch_size=batch_size))
+    except Exception as e:
+        print(f"❌ Ошибка индексации: {e}")
+        sys.exit(1)
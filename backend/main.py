@@ -1,12 +1,14 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app.api import chat, admin, auth, documents, chunks, ai, cars
 from app.api import search_es
 from app.api import import_api, parser_api, voice_api, domain_api
-from app.api import model_management
+from app.api import model_management, images
 from app.core.config import settings
 from models import Base, engine
 from models import database  # Импортируем модели для создания таблиц
+from services.pagination_service import CursorError
 import logging
 import time
 import asyncio
@@ -64,6 +66,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.exception_handler(CursorError)
+async def cursor_error_handler(request: Request, exc: CursorError):
+    """Некорректный курсор пагинации - ошибка клиента, а не сервера"""
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+
 # Подключение роутеров
 app.include_router(chat.router)
 app.include_router(admin.router)
@@ -73,6 +82,7 @@ app.include_router(chunks.router)
 app.include_router(ai.router, prefix="/api/ai", tags=["ai"])
 app.include_router(import_api.router, prefix="/api/import", tags=["import"])
 app.include_router(cars.router)
+app.include_router(images.router)
 app.include_router(search_es.router)
 app.include_router(parser_api.router, prefix="/api")
 app.include_router(voice_api.router, prefix="/api")
@@ -82,91 +92,34 @@ app.include_router(model_management.router)
 
 async def check_and_index_vector_db():
     """
-    Проверяет наличие документов в векторной БД и запускает индексацию при необходимости
+    Проверяет векторный индекс автомобилей (car_embeddings) и запускает индексацию в фоне
+
+    Индексация инкрементальная: пересчитываются только новые и изменившиеся автомобили.
     """
     try:
         from services.vector_search_service import VectorSearchService
-        from models import get_db
-        from sqlalchemy import text
-        
-        logger.info("🔍 Проверяю наличие документов в векторной БД...")
-        
-        # Проверяем подключение к БД
-        db = next(get_db())
+
+        logger.info("🔍 Проверяю векторный индекс автомобилей...")
         try:
-            # Проверяем, есть ли документы в векторной БД
-            # PGVector из langchain_postgres использует 'langchain_pg_embedding'
-            # PGVector из langchain_community использует 'langchain_pg_embedding_{collection_name}'
-            collection_name = "cars_collection"
-            
-            # Определяем имя таблицы в зависимости от версии PGVector
-            try:
-                from langchain_postgres import PGVector
-                USE_NEW_PGVECTOR_CHECK = True
-            except ImportError:
-                try:
-                    from langchain_community.vectorstores import PGVector
-                    USE_NEW_PGVECTOR_CHECK = False
-                except ImportError:
-                    USE_NEW_PGVECTOR_CHECK = None
-            
-            if USE_NEW_PGVECTOR_CHECK:
-                # Новая версия использует 'langchain_pg_embedding'
-                table_name = "langchain_pg_embedding"
-            else:
-                # Старая версия использует 'langchain_pg_embedding_{collection_name}'
-                table_name = f"langchain_pg_embedding_{collection_name}"
-            
-            # Используем begin() для автоматического управления транзакцией
-            with engine.begin() as connection:
-                # Проверяем, что расширение pgvector установлено
-                try:
-                    connection.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
-                    logger.info("✅ Расширение pgvector установлено/проверено")
-                except Exception as ext_error:
-                    logger.warning(f"⚠️ Расширение pgvector не установлено в PostgreSQL: {ext_error}")
-                    logger.warning("   Для работы векторного поиска необходимо установить pgvector:")
-                    logger.warning("   1. Используйте образ PostgreSQL с pgvector (например, ankane/pgvector)")
-                    logger.warning("   2. Или установите pgvector вручную в PostgreSQL")
-                    # Векторный поиск будет недоступен, но приложение продолжит работу
-                    return
-                
-                # Проверяем наличие таблицы
-                try:
-                    result = connection.execute(text(f"""
-                        SELECT COUNT(*) as count 
-                        FROM information_schema.tables 
-                        WHERE table_name = '{table_name}'
-                    """))
-                    table_exists = result.scalar() > 0
-                except Exception as table_check_error:
-                    logger.warning(f"⚠️ Ошибка проверки таблицы: {table_check_error}")
-                    return
-                
-                if table_exists:
-                    # Проверяем количество документов
-                    result = connection.execute(text(f"SELECT COUNT(*) FROM {table_name}"))
-                    doc_count = result.scalar()
-                    logger.info(f"📊 Найдено {doc_count} документов в векторной БД (pgvector)")
-                    
-                    # Если документов мало или нет - запускаем индексацию
-                    if doc_count < 10:
-                        logger.info("⚠️ Документов в векторной БД мало, запускаю индексацию...")
-                        await run_vector_indexing(db)
-                    else:
-                        logger.info("✅ Векторная БД уже проиндексирована")
-                else:
-                    logger.info("⚠️ Таблица векторной БД не найдена, запускаю индексацию...")
-                    await run_vector_indexing(db)
-        finally:
-            db.close()
-            
+            await asyncio.to_thread(VectorSearchService.ensure_schema)
+            logger.info("✅ Расширение pgvector и таблица car_embeddings проверены")
+        except Exception as ext_error:
+            logger.warning(f"⚠️ Расширение pgvector не установлено в PostgreSQL: {ext_error}")
+            logger.warning("   Для работы векторного поиска необходимо установить pgvector:")
+            logger.warning("   1. Используйте образ PostgreSQL с pgvector (например, ankane/pgvector)")
+            logger.warning("   2. Или установите pgvector вручную в PostgreSQL")
+            # Векторный поиск будет недоступен, но приложение продолжит работу
+            return
+
+        doc_count = await asyncio.to_thread(VectorSearchService().count_indexed)
+        logger.info(f"📊 Найдено {doc_count} автомобилей в векторном индексе (pgvector)")
+        await run_vector_indexing()
     except Exception as e:
         logger.warning(f"⚠️ Ошибка при проверке/индексации векторной БД: {e}")
         logger.warning("   Векторный поиск может быть недоступен, но приложение продолжит работу")
 
 
-async def run_vector_indexing(db):
+async def run_vector_indexing():
     """
     Запускает индексацию автомобилей в векторную БД в фоновом режиме
     """
@@ -175,7 +128,7 @@ async def run_vector_indexing(db):
         
         logger.info("🚀 Запускаю индексацию автомобилей в векторную БД...")
         # Запускаем индексацию в фоне (не блокируем запуск приложения)
-        asyncio.create_task(index_cars_to_vector_db(batch_size=100, db_session=db))
+        asyncio.create_task(index_cars_to_vector_db(batch_size=100))
         logger.info("✅ Индексация запущена в фоновом режиме")
     except Exception as e:
         logger.error(f"❌ Ошибка запуска индексации: {e}")
@@ -188,25 +141,45 @@ async def startup_event():
     """
     logger.info("🚀 Запуск приложения...")
     
-    # Индексация векторной БД уже выполнена в docker-entrypoint.sh
-    # Здесь только проверяем статус (не блокируем запуск)
-    try:
-        from sqlalchemy import text
-        with engine.begin() as connection:
-            result = connection.execute(text("""
-                SELECT COUNT(*) as count 
-                FROM information_schema.tables 
-                WHERE table_name = 'langchain_pg_embedding_cars_collection'
-            """))
-            table_exists = result.scalar() > 0
-            if table_exists:
-                result = connection.execute(text("SELECT COUNT(*) FROM langchain_pg_embedding_cars_collection"))
-                doc_count = result.scalar()
-                logger.info(f"📊 Векторная БД: {doc_count} документов")
-            else:
-                logger.info("📊 Векторная БД: не проиндексирована (будет доступна после индексации)")
-    except Exception as e:
-        logger.warning(f"⚠️ Не удалось проверить статус векторной БД: {e}")
+    # Проверка Redis (без блокировки event loop); при недоступности - хранилище в памяти
+    from app.core.redis_client import redis_manager
+    await redis_manager.check_async()
+    
+    # Обработчики фоновой очереди документов
+    from services.document_job_service import document_job_worker
+    document_job_worker.start()
+    
+    # Перенос очереди сообщений чата из Redis в БД
+    from services.chat_write_behind_service import chat_write_behind
+    chat_write_behind.start()
+    
+    # Снимок фасетов каталога читается в потоке (при пустой таблице - пересчет в фоне)
+    from services.facet_service import facet_store
+    asyncio.create_task(asyncio.to_thread(facet_store.get))
+    
+    # Векторный индекс автомобилей: проверка и инкрементальная индексация в фоне
+    if settings.vector_index_on_startup:
+        asyncio.create_task(check_and_index_vector_db())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    События при остановке приложения
+    """
+    from services.transcription_service import transcription_service
+    from services.document_job_service import document_job_worker
+    from services.image_cache_service import image_cache_service
+    from services.chat_write_behind_service import chat_write_behind
+    from services.text_chunker_service import shutdown_chunk_pool
+    from app.core.redis_client import redis_manager
+    transcription_service.shutdown()
+    image_cache_service.shutdown()
+    shutdown_chunk_pool()
+    # Остаток очереди сообщений записывается до закрытия пулов Redis
+    await chat_write_behind.stop()
+    await redis_manager.close()
+    document_job_worker.stop()
 
 
 @app.get("/")
@@ -220,7 +193,8 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    from app.core.redis_client import redis_manager
+    return {"status": "healthy", "redis": redis_manager.status()}
 
 
 if __name__ == "__main__":
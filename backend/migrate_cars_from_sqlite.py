@@ -2,7 +2,6 @@
 """
 Скрипт для миграции данных из SQLite cars.db в PostgreSQL и ChromaDB
 """
-import sqlite3
 import sys
 from pathlib import Path
 from typing import Optional
@@ -47,12 +46,10 @@ Base = declarative_base()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=migration_engine)
 
 # Импортируем модели после создания engine
-from models.database import (
-    Car, UsedCar, CarPicture, UsedCarPicture, 
-    CarOptionsGroup, CarOption
-)
+from models.database import Car, UsedCar
 # Переопределяем Base для использования в создании таблиц
 Base = Car.metadata  # Используем metadata из моделей
+from services.sqlite_migration_service import SqliteCatalogMigrator
 import chromadb
 from chromadb.config import Settings as ChromaSettings
 
@@ -74,32 +71,13 @@ def find_cars_db():
     print("⚠️ Файл cars.db не найден ни в одном из возможных мест")
     return None
 
-def convert_value(value, target_type, max_length=None):
-    """Конвертирует значение в нужный тип"""
-    if value is None:
-        return None
+def migrate_cars(reset: bool = False):
+    """
+    Мигрирует данные из SQLite в PostgreSQL и ChromaDB
     
-    if target_type == "float":
-        try:
-            return str(float(value)) if value else None
-        except (ValueError, TypeError):
-            return None
-    elif target_type == "int":
-        try:
-            return int(value) if value else None
-        except (ValueError, TypeError):
-            return None
-    elif target_type == "str":
-        result = str(value) if value else None
-        if result and max_length and len(result) > max_length:
-            # Обрезаем с предупреждением
-            return result[:max_length]
-        return result
-    
-    return value
-
-def migrate_cars():
-    """Мигрирует данные из SQLite в PostgreSQL и ChromaDB"""
+    Args:
+        reset: Начать перенос заново, игнорируя чекпоинты прерванного запуска
+    """
     
     # Находим файл базы данных
     sqlite_path = find_cars_db()
@@ -109,11 +87,6 @@ def migrate_cars():
     
     print(f"Найден файл базы данных: {sqlite_path}")
     
-    # Подключаемся к SQLite
-    sqlite_conn = sqlite3.connect(sqlite_path)
-    sqlite_conn.row_factory = sqlite3.Row
-    sqlite_cursor = sqlite_conn.cursor()
-    
     # Создаем таблицы в PostgreSQL
     print("\n📋 Создание таблиц в PostgreSQL...")
     from models.database import Base as ModelsBase
@@ -124,230 +97,21 @@ def migrate_cars():
     db = SessionLocal()
     
     try:
-        # 1. Миграция новых автомобилей (car)
-        print("\n🚗 Миграция новых автомобилей...")
-        sqlite_cursor.execute("SELECT * FROM car")
-        cars_data = sqlite_cursor.fetchall()
-        
-        imported_cars = 0
-        for car_row in cars_data:
-            try:
-                car = Car(
-                    id=car_row['id'],
-                    title=convert_value(car_row['title'], "str"),
-                    doc_num=convert_value(car_row['doc_num'], "str"),
-                    stock_qty=convert_value(car_row['stock_qty'], "int"),
-                    mark=convert_value(car_row['mark'], "str"),
-                    model=convert_value(car_row['model'], "str"),
-                    code_compl=convert_value(car_row['code_compl'], "str"),
-                    vin=convert_value(car_row['vin'], "str"),
-                    color=convert_value(car_row['color'], "str"),
-                    price=convert_value(car_row['price'], "float"),
-                    city=convert_value(car_row['city'], "str"),
-                    manufacture_year=convert_value(car_row['manufacture_year'], "int"),
-                    fuel_type=convert_value(car_row['fuel_type'], "str"),
-                    power=convert_value(car_row['power'], "float"),
-                    body_type=convert_value(car_row['body_type'], "str"),
-                    gear_box_type=convert_value(car_row['gear_box_type'], "str"),
-                    driving_gear_type=convert_value(car_row['driving_gear_type'], "str"),
-                    engine_vol=convert_value(car_row['engine_vol'], "int"),
-                    dealer_center=convert_value(car_row['dealer_center'], "str"),
-                    interior_color=convert_value(car_row['interior_color'], "str"),
-                    engine=convert_value(car_row['engine'], "str"),
-                    door_qty=convert_value(car_row['door_qty'], "str"),
-                    pts_colour=convert_value(car_row['pts_colour'], "str"),
-                    model_year=convert_value(car_row['model_year'], "str"),
-                    fuel_consumption=convert_value(car_row['fuel_consumption'], "str"),
-                    max_torque=convert_value(car_row['max_torque'], "str"),
-                    acceleration=convert_value(car_row['acceleration'], "str"),
-                    max_speed=convert_value(car_row['max_speed'], "str"),
-                    eco_class=convert_value(car_row['eco_class'], "str"),
-                    dimensions=convert_value(car_row['dimensions'], "str"),
-                    weight=convert_value(car_row['weight'], "str"),
-                    cargo_volume=convert_value(car_row['cargo_volume'], "str"),
-                    compl_level=convert_value(car_row['compl_level'], "str"),
-                    interior_code=convert_value(car_row['interior_code'], "str"),
-                    color_code=convert_value(car_row['color_code'], "str"),
-                    car_order_int_status=convert_value(car_row['car_order_int_status'], "str"),
-                    sale_price=convert_value(car_row['sale_price'], "float"),
-                    max_additional_discount=convert_value(car_row['max_additional_discount'], "float"),
-                    max_discount_trade_in=convert_value(car_row['max_discount_trade_in'], "float"),
-                    max_discount_credit=convert_value(car_row['max_discount_credit'], "float"),
-                    max_discount_casko=convert_value(car_row['max_discount_casko'], "float"),
-                    max_discount_extra_gear=convert_value(car_row['max_discount_extra_gear'], "float"),
-                    max_discount_life_insurance=convert_value(car_row['max_discount_life_insurance'], "float"),
-                )
-                db.merge(car)  # Используем merge для обновления существующих записей
-                imported_cars += 1
-                if imported_cars % 50 == 0:
-                    print(f"  Импортировано {imported_cars}/{len(cars_data)} новых автомобилей...")
-            except Exception as e:
-                print(f"  ❌ Ошибка при импорте автомобиля ID {car_row['id']}: {e}")
-                continue
-        
-        print(f"✅ Импортировано новых автомобилей: {imported_cars}/{len(cars_data)}")
-        
-        # 2. Миграция подержанных автомобилей (used_car)
-        print("\n🚙 Миграция подержанных автомобилей...")
-        sqlite_cursor.execute("SELECT * FROM used_car")
-        used_cars_data = sqlite_cursor.fetchall()
-        
-        imported_used_cars = 0
-        for used_car_row in used_cars_data:
-            try:
-                used_car = UsedCar(
-                    id=used_car_row['id'],
-                    title=convert_value(used_car_row['title'], "str", max_length=100),
-                    doc_num=convert_value(used_car_row['doc_num'], "str"),
-                    mark=convert_value(used_car_row['mark'], "str", max_length=100),
-                    model=convert_value(used_car_row['model'], "str", max_length=100),
-                    vin=convert_value(used_car_row['vin'], "str"),
-                    color=convert_value(used_car_row['color'], "str"),
-                    price=convert_value(used_car_row['price'], "float"),
-                    city=convert_value(used_car_row['city'], "str", max_length=100),
-                    manufacture_year=convert_value(used_car_row['manufacture_year'], "int"),
-                    mileage=convert_value(used_car_row['mileage'], "int"),
-                    body_type=convert_value(used_car_row['body_type'], "str"),
-                    gear_box_type=convert_value(used_car_row['gear_box_type'], "str"),
-                    driving_gear_type=convert_value(used_car_row['driving_gear_type'], "str"),
-                    engine_vol=convert_value(used_car_row['engine_vol'], "int"),
-                    power=convert_value(used_car_row['power'], "float"),
-                    fuel_type=convert_value(used_car_row['fuel_type'], "str"),
-                    dealer_center=convert_value(used_car_row['dealer_center'], "str", max_length=100),
-                    date_begin=convert_value(used_car_row['date_begin'], "str"),
-                    date_end=convert_value(used_car_row['date_end'], "str"),
-                    ad_status=convert_value(used_car_row['ad_status'], "str", max_length=100),
-                    allow_email=convert_value(used_car_row['allow_email'], "str"),
-                    company_name=convert_value(used_car_row['company_name'], "str"),
-                    manager_name=convert_value(used_car_row['manager_name'], "str"),
-                    contact_phone=convert_value(used_car_row['contact_phone'], "str"),
-                    category=convert_value(used_car_row['category'], "str", max_length=100),
-                    region=convert_value(used_car_row['region'], "str", max_length=100),
-                    car_type=convert_value(used_car_row['car_type'], "str"),
-                    accident=convert_value(used_car_row['accident'], "str", max_length=100),
-                    certification_number=convert_value(used_car_row['certification_number'], "str", max_length=100),
-                    allow_avtokod_report_link=convert_value(used_car_row['allow_avtokod_report_link'], "str"),
-                    doors=convert_value(used_car_row['doors'], "str"),
-                    wheel_type=convert_value(used_car_row['wheel_type'], "str"),
-                    owners=convert_value(used_car_row['owners'], "int"),
-                    street=convert_value(used_car_row['street'], "str"),
-                    sticker=convert_value(used_car_row['sticker'], "str"),
-                    generation_id=convert_value(used_car_row['generation_id'], "str", max_length=100),
-                    modification_id=convert_value(used_car_row['modification_id'], "str", max_length=100),
-                    aaa_max_additional_discount=convert_value(used_car_row['aaa_max_additional_discount'], "str", max_length=100),
-                    aaa_max_discount_trade_in=convert_value(used_car_row['aaa_max_discount_trade_in'], "str", max_length=100),
-                    aaa_max_discount_credit=convert_value(used_car_row['aaa_max_discount_credit'], "str", max_length=100),
-                    aaa_max_discount_casko=convert_value(used_car_row['aaa_max_discount_casko'], "str", max_length=100),
-                    aaa_max_discount_extra_gear=convert_value(used_car_row['aaa_max_discount_extra_gear'], "str", max_length=100),
-                    aaa_max_discount_life_insurance=convert_value(used_car_row['aaa_max_discount_life_insurance'], "str", max_length=100),
-                )
-                db.merge(used_car)
-                imported_used_cars += 1
-                if imported_used_cars % 50 == 0:
-                    print(f"  Импортировано {imported_used_cars}/{len(used_cars_data)} подержанных автомобилей...")
-            except Exception as e:
-                print(f"  ❌ Ошибка при импорте подержанного автомобиля ID {used_car_row['id']}: {e}")
-                continue
-        
-        print(f"✅ Импортировано подержанных автомобилей: {imported_used_cars}/{len(used_cars_data)}")
-        
-        # 3. Миграция фотографий новых автомобилей
-        print("\n📸 Миграция фотографий новых автомобилей...")
-        sqlite_cursor.execute("SELECT * FROM picture")
-        pictures_data = sqlite_cursor.fetchall()
-        
-        imported_pictures = 0
-        for pic_row in pictures_data:
-            try:
-                picture = CarPicture(
-                    id=pic_row['id'],
-                    car_id=pic_row['car_id'],
-                    url=convert_value(pic_row['url'], "str"),
-                    type=convert_value(pic_row['type'], "str"),
-                    seqno=convert_value(pic_row['seqno'], "int"),
-                )
-                db.merge(picture)
-                imported_pictures += 1
-            except Exception as e:
-                print(f"  ❌ Ошибка при импорте фото ID {pic_row['id']}: {e}")
-                continue
-        
-        print(f"✅ Импортировано фотографий новых авто: {imported_pictures}/{len(pictures_data)}")
-        
-        # 4. Миграция фотографий подержанных автомобилей
-        print("\n📸 Миграция фотографий подержанных автомобилей...")
-        sqlite_cursor.execute("SELECT * FROM used_car_picture")
-        used_pictures_data = sqlite_cursor.fetchall()
-        
-        imported_used_pictures = 0
-        for used_pic_row in used_pictures_data:
-            try:
-                used_picture = UsedCarPicture(
-                    id=used_pic_row['id'],
-                    used_car_id=used_pic_row['used_car_id'],
-                    url=convert_value(used_pic_row['url'], "str"),
-                    type=convert_value(used_pic_row['type'], "str"),
-                    seqno=convert_value(used_pic_row['seqno'], "int"),
-                )
-                db.merge(used_picture)
-                imported_used_pictures += 1
-            except Exception as e:
-                print(f"  ❌ Ошибка при импорте фото подержанного авто ID {used_pic_row['id']}: {e}")
-                continue
-        
-        print(f"✅ Импортировано фотографий подержанных авто: {imported_used_pictures}/{len(used_pictures_data)}")
-        
-        # 5. Миграция групп опций
-        print("\n⚙️ Миграция групп опций...")
-        sqlite_cursor.execute("SELECT * FROM options_group")
-        options_groups_data = sqlite_cursor.fetchall()
-        
-        imported_groups = 0
-        for group_row in options_groups_data:
-            try:
-                options_group = CarOptionsGroup(
-                    id=group_row['id'],
-                    car_id=group_row['car_id'],
-                    code=convert_value(group_row['code'], "str"),
-                    name=convert_value(group_row['name'], "str"),
-                )
-                db.merge(options_group)
-                imported_groups += 1
-            except Exception as e:
-                print(f"  ❌ Ошибка при импорте группы опций ID {group_row['id']}: {e}")
-                continue
-        
-        print(f"✅ Импортировано групп опций: {imported_groups}/{len(options_groups_data)}")
-        
-        # 6. Миграция опций
-        print("\n⚙️ Миграция опций...")
-        sqlite_cursor.execute("SELECT * FROM option")
-        options_data = sqlite_cursor.fetchall()
-        
-        imported_options = 0
-        for option_row in options_data:
-            try:
-                option = CarOption(
-                    id=option_row['id'],
-                    car_id=option_row['car_id'],
-                    code=convert_value(option_row['code'], "str"),
-                    description=convert_value(option_row['description'], "str"),
-                    options_group_id=convert_value(option_row['options_group_id'], "int"),
-                )
-                db.merge(option)
-                imported_options += 1
-                if imported_options % 200 == 0:
-                    print(f"  Импортировано {imported_options}/{len(options_data)} опций...")
-            except Exception as e:
-                print(f"  ❌ Ошибка при импорте опции ID {option_row['id']}: {e}")
-                continue
-        
-        print(f"✅ Импортировано опций: {imported_options}/{len(options_data)}")
-        
-        # Коммитим все изменения
-        print("\n💾 Сохранение данных в PostgreSQL...")
-        db.commit()
-        print("✅ Данные сохранены в PostgreSQL")
+        # 1-6. Автомобили, фотографии, группы опций и опции: пачками через COPY,
+        # независимые таблицы параллельно; прерванный перенос продолжается с чекпоинта
+        migration = SqliteCatalogMigrator(sqlite_path, migration_engine).run(reset=reset)
+        if not migration["success"]:
+            print("\n❌ Миграция не завершена, повторный запуск продолжит с места остановки")
+            return False
+        stats = migration["tables"]
+        print(f"✅ Данные сохранены в PostgreSQL за {migration['duration_seconds']} сек")
+        
+        # Фасеты каталога (марки, модели, гистограммы) для промптов и фильтров
+        try:
+            from services.facet_service import facet_store
+            facet_store.rebuild(db)
+        except Exception as e:
+            print(f"⚠️ Не удалось пересчитать фасеты каталога: {e}")
         
         # 7. Индексация в ChromaDB
         print("\n🔍 Индексация автомобилей в ChromaDB...")
@@ -459,12 +223,15 @@ def migrate_cars():
         print("🎉 МИГРАЦИЯ ЗАВЕРШЕНА УСПЕШНО!")
         print("=" * 80)
         print(f"📊 Статистика:")
-        print(f"  - Новых автомобилей: {imported_cars}")
-        print(f"  - Подержанных автомобилей: {imported_used_cars}")
-        print(f"  - Фотографий новых авто: {imported_pictures}")
-        print(f"  - Фотографий подержанных авто: {imported_used_pictures}")
-        print(f"  - Групп опций: {imported_groups}")
-        print(f"  - Опций: {imported_options}")
+        print(f"  - Новых автомобилей: {stats['car']['rows']}")
+        print(f"  - Подержанных автомобилей: {stats['used_car']['rows']}")
+        print(f"  - Фотографий новых авто: {stats['picture']['rows']}")
+        print(f"  - Фотографий подержанных авто: {stats['used_car_picture']['rows']}")
+        print(f"  - Групп опций: {stats['options_group']['rows']}")
+        print(f"  - Опций: {stats['option']['rows']}")
+        failed_rows = sum(table.get("failed", 0) for table in stats.values())
+        if failed_rows:
+            print(f"  - Пропущено строк с ошибками: {failed_rows}")
         print(f"  - Проиндексировано в ChromaDB: {indexed_count} новых + {indexed_used_count} подержанных")
         
         return True
@@ -477,9 +244,8 @@ def migrate_cars():
         return False
     finally:
         db.close()
-        sqlite_conn.close()
 
 if __name__ == "__main__":
-    migrate_cars()
+    migrate_cars(reset="--reset" in sys.argv)
 
 
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Скрипт для переноса файлов документов из колонки documents.file_content
+в контентно-адресуемое хранилище (BlobStorage)
+
+Переносит документы по одному, поэтому не держит все файлы в памяти.
+Можно запускать повторно: уже перенесенные документы пропускаются.
+"""
+import sys
+from pathlib import Path
+
+# Добавляем путь к модулям
+sys.path.append(str(Path(__file__).parent))
+
+from sqlalchemy import text
+from models import SessionLocal, engine
+from services.blob_storage_service import document_blob_storage
+
+
+def migrate_document_blobs() -> bool:
+    """Переносит file_content в BlobStorage и очищает колонку"""
+    db = SessionLocal()
+    moved = 0
+    deduplicated = 0
+    
+    try:
+        ids = [row[0] for row in db.execute(text(
+            "SELECT id FROM documents WHERE file_content IS NOT NULL ORDER BY id"
+        )).fetchall()]
+        print(f"📄 Документов с файлом в БД: {len(ids)}")
+        
+        seen_hashes = set()
+        for document_id in ids:
+            content = db.execute(
+                text("SELECT file_content FROM documents WHERE id = :id"),
+                {"id": document_id}
+            ).scalar()
+            if not content:
+                continue
+            
+            content_hash = document_blob_storage.put_bytes(bytes(content))
+            if content_hash in seen_hashes:
+                deduplicated += 1
+            seen_hashes.add(content_hash)
+            
+            db.execute(
+                text("UPDATE documents SET content_hash = :hash, file_content = NULL WHERE id = :id"),
+                {"hash": content_hash, "id": document_id}
+            )
+            db.commit()
+            moved += 1
+            print(f"  ✅ Документ {document_id} -> {content_hash[:12]}...")
+        
+        print(f"✅ Перенесено файлов: {moved} (из них дубликатов: {deduplicated})")
+        if moved and engine.dialect.name == "postgresql":
+            print("💡 Чтобы вернуть место на диске, выполните: VACUUM FULL documents;")
+        return True
+        
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Ошибка переноса файлов: {e}")
+        return False
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    print("=== Перенос файлов документов в BlobStorage ===")
+    if not migrate_document_blobs():
+        sys.exit(1)
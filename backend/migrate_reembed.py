@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Скрипт для пересчета эмбеддингов после смены провайдера (ai_settings.json -> embedding_model)
+
+Пересчитывает чанки документов, память пользователей и векторы автомобилей, у которых embedding_model
+отличается от текущей модели. Работает батчами и коммитит после каждого батча,
+поэтому прерванный запуск можно просто повторить - он продолжит с оставшихся записей.
+"""
+import sys
+from pathlib import Path
+
+# Добавляем путь к модулям
+sys.path.append(str(Path(__file__).parent))
+
+from sqlalchemy import or_
+from models import SessionLocal
+from models.database import Document, DocumentChunk, UserMemory
+from services.document_service import DocumentService
+from services.embedding_provider_service import current_embedding_model, embed_texts
+from services.vector_search_service import VectorSearchService
+
+BATCH_SIZE = 64
+
+
+def _stale(column, model_name: str):
+    return or_(column.is_(None), column != model_name)
+
+
+def reembed_document_chunks(model_name: str) -> int:
+    db = SessionLocal()
+    updated = 0
+    try:
+        doc_service = DocumentService(db)
+        document_ids = [row[0] for row in db.query(DocumentChunk.document_id).filter(
+            _stale(DocumentChunk.embedding_model, model_name)
+        ).distinct().order_by(DocumentChunk.document_id).all()]
+        print(f"📄 Документов с устаревшими эмбеддингами чанков: {len(document_ids)}")
+
+        for document_id in document_ids:
+            document = db.query(Document).filter(Document.id == document_id).first()
+            context = doc_service._build_chunk_context(document)
+            last_id = 0
+            while True:
+                chunks = db.query(DocumentChunk).filter(
+                    DocumentChunk.document_id == document_id,
+                    DocumentChunk.id > last_id,
+                    _stale(DocumentChunk.embedding_model, model_name)
+                ).order_by(DocumentChunk.id).limit(BATCH_SIZE).all()
+                if not chunks:
+                    break
+                last_id = chunks[-1].id
+
+                inputs = [doc_service._build_embedding_context(chunk.text, context) for chunk in chunks]
+                vectors = embed_texts(inputs)
+                if not any(vectors):
+                    raise Exception(f"модель не вернула эмбеддинги для документа {document_id}")
+                for chunk, vector in zip(chunks, vectors):
+                    # Неудавшиеся остаются устаревшими и будут пересчитаны при следующем запуске
+                    if vector:
+                        chunk.embedding = str(vector)
+                        chunk.embedding_model = model_name
+                        updated += 1
+                db.commit()
+            print(f"  ✅ Документ {document_id}")
+        return updated
+    finally:
+        db.close()
+
+
+def reembed_user_memories(model_name: str) -> int:
+    db = SessionLocal()
+    updated = 0
+    last_id = 0
+    try:
+        while True:
+            memories = db.query(UserMemory).filter(
+                UserMemory.id > last_id,
+                _stale(UserMemory.embedding_model, model_name)
+            ).order_by(UserMemory.id).limit(BATCH_SIZE).all()
+            if not memories:
+                break
+            last_id = memories[-1].id
+
+            vectors = embed_texts([memory.memory_text for memory in memories])
+            if not any(vectors):
+                raise Exception("модель не вернула эмбеддинги для памяти пользователей")
+            for memory, vector in zip(memories, vectors):
+                if vector:
+                    memory.embedding = vector
+                    memory.embedding_model = model_name
+                    updated += 1
+            db.commit()
+            print(f"  🔄 Память пользователей: {updated}")
+        return updated
+    finally:
+        db.close()
+
+
+def migrate_reembed() -> bool:
+    model_name = current_embedding_model()
+    print(f"🧠 Текущая модель эмбеддингов: {model_name}")
+    try:
+        chunks = reembed_document_chunks(model_name)
+        memories = reembed_user_memories(model_name)
+        cars = VectorSearchService().index_cars(batch_size=BATCH_SIZE)["indexed"]
+        print(f"✅ Пересчитано эмбеддингов: чанков {chunks}, записей памяти {memories}, автомобилей {cars}")
+        return True
+    except Exception as e:
+        print(f"❌ Ошибка пересчета эмбеддингов: {e}")
+        return False
+
+
+if __name__ == "__main__":
+    print("=== Пересчет эмбеддингов под текущую модель ===")
+    if not migrate_reembed():
+        sys.exit(1)
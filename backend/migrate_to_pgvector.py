@@ -3,7 +3,6 @@
 Скрипт для миграции данных из SQLite cars.db в новый PostgreSQL (postgres-pgvector на порту 5433)
 Использует прямое подключение, обходя config.py
 """
-import sqlite3
 import sys
 import os
 from pathlib import Path
@@ -43,28 +42,13 @@ def find_cars_db():
     
     return None
 
-def convert_value(value, target_type):
-    """Конвертирует значение в нужный тип"""
-    if value is None:
-        return None
+def migrate_cars(reset: bool = False):
+    """
+    Мигрирует данные из SQLite в PostgreSQL
     
-    if target_type == "float":
-        try:
-            return str(float(value)) if value else None
-        except (ValueError, TypeError):
-            return None
-    elif target_type == "int":
-        try:
-            return int(value) if value else None
-        except (ValueError, TypeError):
-            return None
-    elif target_type == "str":
-        return str(value) if value else None
-    
-    return value
-
-def migrate_cars():
-    """Мигрирует данные из SQLite в PostgreSQL"""
+    Args:
+        reset: Начать перенос заново, игнорируя чекпоинты прерванного запуска
+    """
     
     # Находим файл базы данных
     sqlite_path = find_cars_db()
@@ -91,11 +75,6 @@ def migrate_cars():
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
     db = SessionLocal()
     
-    # Подключаемся к SQLite
-    sqlite_conn = sqlite3.connect(sqlite_path)
-    sqlite_conn.row_factory = sqlite3.Row
-    sqlite_cursor = sqlite_conn.cursor()
-    
     try:
         # Создаем таблицы в PostgreSQL используя SQLAlchemy модели
         print("\n📋 Создание таблиц в PostgreSQL...")
@@ -103,45 +82,21 @@ def migrate_cars():
         Base.metadata.create_all(bind=engine)
         print("✅ Таблицы созданы")
         
-        # Импортируем модели
-        from models.database import (
-            Car, UsedCar, CarPicture, UsedCarPicture, 
-            CarOptionsGroup, CarOption
-        )
+        # Новые автомобили: пачками через COPY с чекпоинтами (прерванный перенос продолжается)
+        from services.sqlite_migration_service import SqliteCatalogMigrator
+        migration = SqliteCatalogMigrator(sqlite_path, engine).run(tables=["car"], reset=reset)
+        if not migration["success"]:
+            print("\n❌ Миграция не завершена, повторный запуск продолжит с места остановки")
+            return False
+        imported_cars = migration["tables"]["car"]["rows"]
+        print(f"\n💾 Данные сохранены в PostgreSQL за {migration['duration_seconds']} сек")
         
-        # 1. Миграция новых автомобилей (car)
-        print("\n🚗 Миграция новых автомобилей...")
-        sqlite_cursor.execute("SELECT * FROM car")
-        cars_data = sqlite_cursor.fetchall()
-        
-        imported_cars = 0
-        for car_row in cars_data:
-            try:
-                car = Car(
-                    id=car_row['id'],
-                    title=convert_value(car_row['title'], "str"),
-                    doc_num=convert_value(car_row['doc_num'], "str"),
-                    stock_qty=convert_value(car_row['stock_qty'], "int"),
-                    mark=convert_value(car_row['mark'], "str"),
-                    model=convert_value(car_row['model'], "str"),
-                    code_compl=convert_value(car_row['code_compl'], "str"),
-                    vin=convert_value(car_row['vin'], "str"),
-                    # ... остальные поля аналогично
-                )
-                db.add(car)
-                imported_cars += 1
-                
-                if imported_cars % 50 == 0:
-                    print(f"  Импортировано {imported_cars}/{len(cars_data)} новых автомобилей...")
-            except Exception as e:
-                print(f"  ⚠️ Ошибка при импорте автомобиля ID {car_row.get('id')}: {e}")
-                continue
-        
-        print(f"✅ Импортировано новых автомобилей: {imported_cars}/{len(cars_data)}")
-        
-        # Сохраняем все изменения
-        db.commit()
-        print("\n💾 Данные сохранены в PostgreSQL")
+        # Фасеты каталога (марки, модели, гистограммы) для промптов и фильтров
+        try:
+            from services.facet_service import facet_store
+            facet_store.rebuild(db)
+        except Exception as e:
+            print(f"⚠️ Не удалось пересчитать фасеты каталога: {e}")
         
         print("\n" + "=" * 80)
         print("🎉 МИГРАЦИЯ ЗАВЕРШЕНА УСПЕШНО!")
@@ -159,10 +114,9 @@ def migrate_cars():
         return False
     finally:
         db.close()
-        sqlite_conn.close()
 
 if __name__ == "__main__":
-    migrate_cars()
+    migrate_cars(reset="--reset" in sys.argv)
 
 
 
@@ -0,0 +1,11 @@
+-- Миграция: Вынос файлов документов в контентно-адресуемое хранилище
+-- Дата: 2026-10-18
+-- После применения перенесите существующие файлы: python migrate_document_blobs.py
+
+-- SHA-256 содержимого файла (ключ в BlobStorage)
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);
+
+CREATE INDEX IF NOT EXISTS ix_documents_content_hash ON documents(content_hash);
+
+COMMENT ON COLUMN documents.content_hash IS 'SHA-256 файла; сам файл хранится в document_storage_dir';
+COMMENT ON COLUMN documents.file_content IS 'Устарело: файлы переносятся в BlobStorage скриптом migrate_document_blobs.py';
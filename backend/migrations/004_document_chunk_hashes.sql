@@ -0,0 +1,11 @@
+-- Миграция: Хеши и размеры чанков документов
+-- Дата: 2026-10-18
+-- content_hash позволяет не пересчитывать эмбеддинги неизменившихся чанков при переобработке
+
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS token_count INTEGER;
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);
+
+CREATE INDEX IF NOT EXISTS ix_document_chunks_content_hash ON document_chunks(content_hash);
+
+COMMENT ON COLUMN document_chunks.token_count IS 'Приблизительное число токенов чанка (слова и знаки препинания)';
+COMMENT ON COLUMN document_chunks.content_hash IS 'SHA-256 текста, отправляемого в эмбеддинг (чанк + контекст документа)';
@@ -0,0 +1,14 @@
+-- Миграция: Модель, которой посчитан эмбеддинг
+-- Дата: 2026-10-18
+-- Нужна для переключения провайдера эмбеддингов (ai_settings.json -> embedding_model):
+-- migrate_reembed.py пересчитывает только записи, посчитанные другой моделью
+
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS embedding_model VARCHAR(100);
+ALTER TABLE user_memories ADD COLUMN IF NOT EXISTS embedding_model VARCHAR(100);
+
+-- Все существующие эмбеддинги посчитаны Mistral
+UPDATE document_chunks SET embedding_model = 'mistral-embed' WHERE embedding IS NOT NULL AND embedding_model IS NULL;
+UPDATE user_memories SET embedding_model = 'mistral-embed' WHERE embedding IS NOT NULL AND embedding_model IS NULL;
+
+COMMENT ON COLUMN document_chunks.embedding_model IS 'Провайдер/модель эмбеддинга (mistral-embed, local:BAAI/bge-m3, ...)';
+COMMENT ON COLUMN user_memories.embedding_model IS 'Провайдер/модель эмбеддинга (mistral-embed, local:BAAI/bge-m3, ...)';
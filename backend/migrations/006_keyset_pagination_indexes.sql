@@ -0,0 +1,12 @@
+-- Миграция: Индексы для курсорной (keyset) пагинации списков
+-- Дата: 2026-10-18
+-- Списки каталога сортируются по (created_at, id) / (parsed_at, id); курсор сравнивает пару значений,
+-- поэтому ключ сортировки не должен быть NULL
+
+UPDATE cars SET created_at = now() WHERE created_at IS NULL;
+UPDATE used_cars SET created_at = now() WHERE created_at IS NULL;
+UPDATE parsed_cars SET parsed_at = now() WHERE parsed_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS ix_cars_created_at_id ON cars(created_at, id);
+CREATE INDEX IF NOT EXISTS ix_used_cars_created_at_id ON used_cars(created_at, id);
+CREATE INDEX IF NOT EXISTS ix_parsed_cars_active_parsed_at_id ON parsed_cars(is_active, parsed_at, id);
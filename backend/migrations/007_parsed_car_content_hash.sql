@@ -0,0 +1,5 @@
+-- Миграция: Хеш содержимого объявлений парсера для инкрементальной синхронизации
+-- Дата: 2026-10-18
+-- Таблица parsed_car_changes создается через Base.metadata.create_all
+
+ALTER TABLE parsed_cars ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);
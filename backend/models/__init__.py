@@ -1,6 +1,7 @@
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from app.core.config import settings
 import logging
 
@@ -18,6 +19,24 @@ engine = create_engine(
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Асинхронный движок для горячих путей в async-обработчиках (не блокирует event loop)
+try:
+    async_engine_kwargs = {"pool_pre_ping": True, "pool_recycle": 300, "echo": False}
+    if not settings.async_database_url.startswith("sqlite"):
+        async_engine_kwargs.update(pool_size=20, max_overflow=20)
+    async_engine = create_async_engine(settings.async_database_url, **async_engine_kwargs)
+    AsyncSessionLocal = async_sessionmaker(
+        bind=async_engine,
+        class_=AsyncSession,
+        autoflush=False,
+        expire_on_commit=False
+    )
+except Exception as e:
+    # Драйвер (asyncpg/aiosqlite) не установлен - работаем только через синхронный движок
+    logger.warning(f"Асинхронный движок БД недоступен: {e}")
+    async_engine = None
+    AsyncSessionLocal = None
+
 Base = declarative_base()
 
 def get_db():
@@ -26,3 +45,9 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    if AsyncSessionLocal is None:
+        raise RuntimeError("Асинхронный движок БД недоступен: установите asyncpg")
+    async with AsyncSessionLocal() as session:
+        yield session
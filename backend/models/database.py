@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Table, Boolean, LargeBinary, Float
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Table, Boolean, LargeBinary, Float, Index, UniqueConstraint
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.sql import func
 from models import Base
 
@@ -138,7 +138,10 @@ class Document(Base):
     original_filename = Column(String(255), nullable=False)
     file_type = Column(String(10), nullable=False)  # pdf, doc, docx, txt
     file_size = Column(Integer, nullable=False)
-    file_content = Column(LargeBinary, nullable=True)  # Бинарные данные файла
+    content_hash = Column(String(64), nullable=True, index=True)  # SHA-256 файла в BlobStorage
+    # Бинарные данные файла (устаревшее хранение в строке; новые файлы лежат в BlobStorage).
+    # deferred: не загружается при обычных запросах к Document
+    file_content = deferred(Column(LargeBinary, nullable=True))
     
     # Обработанный контент
     title = Column(String(1024), nullable=True, index=True)
@@ -174,7 +177,10 @@ class DocumentChunk(Base):
     document_id = Column(Integer, ForeignKey("documents.id"), nullable=False, index=True)
     chunk_index = Column(Integer, nullable=False)  # Порядковый номер чанка
     text = Column(Text, nullable=False)  # Текст чанка
+    token_count = Column(Integer, nullable=True)  # Приблизительное число токенов
+    content_hash = Column(String(64), nullable=True, index=True)  # SHA-256 текста эмбеддинга (чанк + контекст)
     embedding = Column(Text, nullable=True)  # JSON с эмбеддингом
+    embedding_model = Column(String(100), nullable=True)  # Провайдер/модель, посчитавшая эмбеддинг
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Связь с документом
@@ -185,6 +191,40 @@ class DocumentChunk(Base):
 Document.chunks = relationship("DocumentChunk", back_populates="document", cascade="all, delete-orphan")
 
 
+class DocumentJob(Base):
+    """Фоновая задача обработки документа (очередь в Postgres)"""
+    __tablename__ = "document_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False, index=True)
+    status = Column(String(20), nullable=False, default="queued", index=True)  # queued, running, completed, failed
+    stage = Column(String(20), nullable=False, default="extract")  # extract, metadata, chunks, done
+    progress = Column(Float, nullable=False, default=0.0)  # 0.0 - 1.0
+    chunks_total = Column(Integer, nullable=True)
+    chunks_done = Column(Integer, nullable=False, default=0)  # Для продолжения с последнего сохраненного чанка
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    error_message = Column(Text, nullable=True)
+    worker_id = Column(String(100), nullable=True)
+    run_after = Column(DateTime(timezone=True), server_default=func.now(), index=True)  # Для отложенных повторов
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+
+class EmbeddingCacheEntry(Base):
+    """Постоянный кэш эмбеддингов по (модель, SHA-256 нормализованного текста)"""
+    __tablename__ = "embedding_cache"
+
+    model = Column(String(100), primary_key=True)
+    text_hash = Column(String(64), primary_key=True)
+    dimensions = Column(Integer, nullable=False)
+    embedding = Column(Text, nullable=False)  # JSON со списком чисел
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
 # ============================================================================
 # МОДЕЛИ ДЛЯ АВТОМОБИЛЕЙ
 # ============================================================================
@@ -243,6 +283,9 @@ class Car(Base):
     pictures = relationship("CarPicture", back_populates="car", cascade="all, delete-orphan")
     options = relationship("CarOption", back_populates="car", cascade="all, delete-orphan")
     options_groups = relationship("CarOptionsGroup", back_populates="car", cascade="all, delete-orphan")
+    
+    # Курсорная пагинация каталога: ORDER BY created_at DESC, id DESC
+    __table_args__ = (Index("ix_cars_created_at_id", "created_at", "id"),)
 
 
 class UsedCar(Base):
@@ -301,6 +344,9 @@ class UsedCar(Base):
     
     # Связи
     pictures = relationship("UsedCarPicture", back_populates="used_car", cascade="all, delete-orphan")
+    
+    # Курсорная пагинация каталога: ORDER BY created_at DESC, id DESC
+    __table_args__ = (Index("ix_used_cars_created_at_id", "created_at", "id"),)
 
 
 class CarPicture(Base):
@@ -393,9 +439,13 @@ class ParsedCar(Base):
     parsed_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     is_active = Column(Boolean, default=True)  # Флаг активности объявления
+    content_hash = Column(String(64), nullable=True)  # SHA-256 содержимого (инкрементальная синхронизация)
     
     # Связи
     pictures = relationship("ParsedCarPicture", back_populates="parsed_car", cascade="all, delete-orphan")
+    
+    # Курсорная пагинация активных объявлений: ORDER BY parsed_at DESC, id DESC
+    __table_args__ = (Index("ix_parsed_cars_active_parsed_at_id", "is_active", "parsed_at", "id"),)
 
 
 # ============================================================================
@@ -588,6 +638,28 @@ class ImportCarOption(Base):
     options_group = relationship("ImportCarOptionsGroup", back_populates="options")
 
 
+class ImportMappingProfile(Base):
+    """
+    Сохраненное сопоставление полей фида с полями таблиц импорта
+
+    Ключ - отпечаток набора полей файла: повторные загрузки того же фида
+    получают подтвержденный маппинг без нечеткого сопоставления.
+    """
+    __tablename__ = "import_mapping_profiles"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(255), nullable=False)
+    fingerprint = Column(String(64), nullable=False, unique=True, index=True)  # SHA-256 отсортированных полей
+    file_type = Column(String(10), nullable=True)  # xml, json
+    car_type = Column(String(10), nullable=True)  # new, used
+    field_count = Column(Integer, nullable=False, default=0)
+    field_mapping = Column(Text, nullable=False)  # JSON: {source_field: target_field | null}
+    use_count = Column(Integer, nullable=False, default=0)
+    last_used_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+
 class ParsedCarPicture(Base):
     """Модель для фотографий парсенных автомобилей"""
     __tablename__ = "parsed_car_pictures"
@@ -603,6 +675,200 @@ class ParsedCarPicture(Base):
     parsed_car = relationship("ParsedCar", back_populates="pictures")
 
 
+class ParsedCarChange(Base):
+    """
+    Журнал изменений объявлений при инкрементальной синхронизации парсера
+
+    Потребители (индексатор поиска, кэши) читают записи по возрастанию id.
+    """
+    __tablename__ = "parsed_car_changes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(String(36), nullable=False, index=True)
+    parsed_car_id = Column(Integer, nullable=False, index=True)  # Без внешнего ключа: журнал переживает удаление
+    source_url = Column(String(1024), nullable=False)
+    change_type = Column(String(20), nullable=False)  # created, updated, reactivated, deactivated
+    content_hash = Column(String(64), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class CrawlFrontierEntry(Base):
+    """
+    Очередь URL обхода сайта парсером (services/crawl_engine_service.py)
+
+    Хранится в БД: прерванный обход продолжается с оставшихся pending URL.
+    ETag/Last-Modified страниц автомобилей сохраняются между обходами для
+    условных запросов - неизменившиеся страницы не загружаются и не разбираются.
+    """
+    __tablename__ = "crawl_frontier"
+
+    id = Column(Integer, primary_key=True, index=True)
+    crawl_key = Column(String(255), nullable=False, index=True)  # base_url парсера
+    url = Column(String(1024), nullable=False)
+    kind = Column(String(20), nullable=False)  # catalog, car, run (отметка незавершенного обхода)
+    status = Column(String(20), nullable=False, default="pending")  # pending, done, failed, idle
+    attempts = Column(Integer, nullable=False, default=0)
+    etag = Column(String(255), nullable=True)
+    last_modified = Column(String(64), nullable=True)
+    http_status = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+    discovered_at = Column(DateTime(timezone=True), server_default=func.now())
+    fetched_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("crawl_key", "url", name="uq_crawl_frontier_key_url"),
+        Index("ix_crawl_frontier_key_status_kind", "crawl_key", "status", "kind", "id"),
+    )
+
+
+class PageLayoutTemplate(Base):
+    """
+    Шаблон извлечения для структуры страницы (services/page_template_service.py)
+
+    Страницы с одинаковым отпечатком DOM разбираются выученными CSS-селекторами
+    вместо эвристик, NLP и Ollama.
+    """
+    __tablename__ = "page_layout_templates"
+
+    id = Column(Integer, primary_key=True, index=True)
+    site = Column(String(255), nullable=False)  # base_url парсера
+    fingerprint = Column(String(64), nullable=False)
+    rules = Column(Text, nullable=False)  # JSON: {поле: {"selector": ..., "normalizer": ...}}
+    samples = Column(Integer, nullable=False, default=0)  # Страниц, на которых правила подтверждены
+    hits = Column(Integer, nullable=False, default=0)
+    misses = Column(Integer, nullable=False, default=0)
+    is_ready = Column(Boolean, nullable=False, default=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("site", "fingerprint", name="uq_page_layout_templates_site_fingerprint"),
+    )
+
+
+# ============================================================================
+# ВЕКТОРНЫЙ ИНДЕКС АВТОМОБИЛЕЙ
+# ============================================================================
+
+class CarEmbedding(Base):
+    """
+    Эмбеддинг автомобиля (cars / used_cars) для семантического поиска
+    
+    Поля фильтров продублированы из каталога (строки в нижнем регистре, цена числом),
+    чтобы структурные фильтры применялись в том же запросе, что и поиск по HNSW.
+    """
+    __tablename__ = "car_embeddings"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    car_type = Column(String(20), nullable=False)  # 'car' или 'used_car'
+    car_id = Column(Integer, nullable=False)
+    
+    if PGVECTOR_AVAILABLE and Vector:
+        embedding = Column(Vector(1024), nullable=True)
+    else:
+        embedding = Column(Text, nullable=True)  # Fallback если pgvector не доступен
+    
+    embedding_model = Column(String(100), nullable=True)
+    content_hash = Column(String(64), nullable=True)  # SHA-256 текста, по которому посчитан эмбеддинг
+    document = Column(Text, nullable=True)  # Текст, по которому посчитан эмбеддинг
+    
+    # Фильтры
+    mark = Column(String(100), nullable=True, index=True)
+    model = Column(String(100), nullable=True)
+    city = Column(String(100), nullable=True, index=True)
+    body_type = Column(String(50), nullable=True)
+    fuel_type = Column(String(50), nullable=True)
+    gear_box_type = Column(String(50), nullable=True)
+    price = Column(Float, nullable=True, index=True)
+    manufacture_year = Column(Integer, nullable=True)
+    mileage = Column(Integer, nullable=True)
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    
+    if PGVECTOR_AVAILABLE and Vector:
+        __table_args__ = (
+            UniqueConstraint("car_type", "car_id", name="uq_car_embeddings_car"),
+            Index(
+                "ix_car_embeddings_embedding_hnsw",
+                "embedding",
+                postgresql_using="hnsw",
+                postgresql_with={"m": 16, "ef_construction": 64},
+                postgresql_ops={"embedding": "vector_cosine_ops"},
+            ),
+        )
+    else:
+        __table_args__ = (UniqueConstraint("car_type", "car_id", name="uq_car_embeddings_car"),)
+
+
+# ============================================================================
+# ФАСЕТЫ КАТАЛОГА
+# ============================================================================
+
+class InventoryFacetSnapshot(Base):
+    """
+    Материализованные фасеты каталога по типу автомобиля (car, used_car, parsed_car)
+    
+    Пересчитываются после импорта, миграций и парсинга (services/facet_service.py),
+    читаются всеми потребителями фасетов вместо DISTINCT/COUNT на каждый запрос.
+    """
+    __tablename__ = "inventory_facet_snapshots"
+    
+    car_type = Column(String(20), primary_key=True)
+    car_count = Column(Integer, nullable=False, default=0)
+    facets = Column(Text, nullable=False)  # JSON: марки, модели, города, кузова, гистограммы цен и годов
+    built_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+# ============================================================================
+# КЭШ ФОТОГРАФИЙ АВТОМОБИЛЕЙ
+# ============================================================================
+
+class CarImage(Base):
+    """
+    Загруженная фотография автомобиля по внешнему URL (services/image_cache_service.py)
+
+    Файлы хранятся по SHA-256 содержимого: одинаковые фото с разных URL
+    загружаются на диск и уменьшаются один раз.
+    """
+    __tablename__ = "car_images"
+
+    id = Column(Integer, primary_key=True, index=True)
+    source_url = Column(String(1024), nullable=False, unique=True)
+    content_hash = Column(String(64), nullable=True, index=True)
+    content_type = Column(String(100), nullable=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    size_bytes = Column(Integer, nullable=True)
+    status = Column(String(20), nullable=False, default="ready")  # ready, failed
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+
+# ============================================================================
+# МИГРАЦИЯ КАТАЛОГА ИЗ SQLITE
+# ============================================================================
+
+class CatalogMigrationCheckpoint(Base):
+    """
+    Прогресс переноса таблицы cars.db в PostgreSQL (services/sqlite_migration_service.py)
+
+    Обновляется в одной транзакции с каждой пачкой строк: прерванная миграция
+    того же файла продолжается с last_id. После успешного завершения удаляется.
+    """
+    __tablename__ = "catalog_migration_checkpoints"
+
+    source_key = Column(String(64), primary_key=True)  # SHA-256 пути, размера и mtime файла SQLite
+    table_name = Column(String(50), primary_key=True)  # Таблица SQLite
+    last_id = Column(Integer, nullable=False, default=0)
+    rows_done = Column(Integer, nullable=False, default=0)
+    rows_failed = Column(Integer, nullable=False, default=0)
+    completed = Column(Boolean, nullable=False, default=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
 # ============================================================================
 # МОДЕЛЬ ДЛЯ ДОЛГОВРЕМЕННОЙ ПАМЯТИ ПОЛЬЗОВАТЕЛЯ
 # ============================================================================
@@ -622,6 +888,8 @@ class UserMemory(Base):
     else:
         embedding = Column(Text, nullable=True)  # Fallback если pgvector не доступен
     
+    embedding_model = Column(String(100), nullable=True)  # Провайдер/модель, посчитавшая эмбеддинг
+    
     # Структурированные данные в JSON
     memory_metadata = Column(Text, nullable=True)  # JSON строка с метаданными (переименовано из metadata, т.к. зарезервировано)
     
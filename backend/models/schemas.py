@@ -197,6 +197,7 @@ class ArticleListResponse(BaseModel):
     total: int
     page: int
     size: int
+    next_cursor: Optional[str] = None  # Курсор следующей страницы (None - страница последняя)
 
 
 class ArticleImportRequest(BaseModel):
@@ -251,6 +252,7 @@ class DocumentListResponse(BaseModel):
     total: int
     page: int
     size: int
+    next_cursor: Optional[str] = None  # Курсор следующей страницы (None - страница последняя)
 
 
 class DocumentUploadResponse(BaseModel):
@@ -315,6 +317,8 @@ class DocumentChunkUpdate(BaseModel):
 class DocumentChunk(DocumentChunkBase):
     id: int
     document_id: int
+    token_count: Optional[int] = None
+    content_hash: Optional[str] = None
     created_at: datetime
 
     class Config:
@@ -444,6 +448,7 @@ class CarListResponse(BaseModel):
     total: int
     page: int
     size: int
+    next_cursor: Optional[str] = None  # Курсор следующей страницы (None - страница последняя)
 
 
 class UsedCarListResponse(BaseModel):
@@ -451,6 +456,7 @@ class UsedCarListResponse(BaseModel):
     total: int
     page: int
     size: int
+    next_cursor: Optional[str] = None  # Курсор следующей страницы (None - страница последняя)
 
 
 # Схемы для AI Model Orchestrator
@@ -607,6 +613,7 @@ class CarPicture(BaseModel):
     type: Optional[str] = None
     seqno: Optional[int] = None
     created_at: datetime
+    thumbnails: Optional[Dict[str, str]] = None  # Миниатюры из локального кэша: {размер: адрес}
     
     class Config:
         from_attributes = True
@@ -619,6 +626,7 @@ class UsedCarPicture(BaseModel):
     type: Optional[str] = None
     seqno: Optional[int] = None
     created_at: datetime
+    thumbnails: Optional[Dict[str, str]] = None  # Миниатюры из локального кэша: {размер: адрес}
     
     class Config:
         from_attributes = True
@@ -785,6 +793,7 @@ class ParsedCarListResponse(BaseModel):
     total: int
     skip: int = 0
     limit: int = 100
+    next_cursor: Optional[str] = None  # Курсор следующей страницы (None - страница последняя)
 
 
 # ============================================================================
@@ -972,6 +981,20 @@ class FieldMapping(BaseModel):
     target_field: Optional[str] = None  # Поле в таблице (None = не импортировать)
 
 
+class ImportMappingProfileInfo(BaseModel):
+    """Профиль сопоставления полей фида"""
+    id: int
+    name: str
+    file_type: Optional[str] = None
+    car_type: Optional[str] = None
+    field_count: int = 0
+    use_count: int = 0
+    last_used_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+
 class ImportAnalysisResponse(BaseModel):
     """Ответ с анализом файла и автоматическим сопоставлением полей"""
     file_type: str
@@ -980,6 +1003,8 @@ class ImportAnalysisResponse(BaseModel):
     available_fields: List[str]  # Все доступные поля в файле
     auto_mapping: Dict[str, Optional[str]]  # Автоматическое сопоставление: {source_field: target_field}
     suggestions: Dict[str, List[str]]  # Предложения для каждого поля: {source_field: [possible_targets]}
+    fields_fingerprint: Optional[str] = None  # Отпечаток набора полей (ключ профиля сопоставления)
+    mapping_profile: Optional[ImportMappingProfileInfo] = None  # Профиль, из которого взят auto_mapping
 
 
 class ImportSaveRequest(BaseModel):
@@ -997,6 +1022,7 @@ class ImportSaveResponse(BaseModel):
     imported_options: int
     imported_used_cars: int = 0  # Для обратной совместимости
     errors: List[str] = []
+    mapping_profile_id: Optional[int] = None  # Профиль, в который сохранено сопоставление
 
 
 class ImportListResponse(BaseModel):
@@ -1007,12 +1033,15 @@ class ImportListResponse(BaseModel):
     total_used: int
     skip: int = 0
     limit: int = 100
+    next_cursor: Optional[str] = None  # Курсор следующей страницы новых автомобилей
+    next_used_cursor: Optional[str] = None  # Курсор следующей страницы подержанных автомобилей
 
 
 class MigrateRequest(BaseModel):
     """Запрос на миграцию данных"""
     car_type: Optional[str] = None  # "new", "used" или None (все)
     delete_old: bool = True  # Удалять старые данные перед миграцией
+    mode: Optional[str] = None  # replace, append или upsert (по VIN); None - по delete_old
 
 
 class MigrateResponse(BaseModel):
@@ -1024,6 +1053,10 @@ class MigrateResponse(BaseModel):
     migrated_options: int
     deleted_old_cars: int
     deleted_old_used_cars: int
+    updated_cars: int = 0  # Режим upsert: обновлено совпавших по VIN
+    updated_used_cars: int = 0
+    unchanged_cars: int = 0  # Режим upsert: совпали по VIN без изменений
+    unchanged_used_cars: int = 0
     errors: List[str] = []
 
 
@@ -1036,6 +1069,7 @@ class ParserStartRequest(BaseModel):
     use_ollama: bool = True  # Использовать Ollama для извлечения данных
     ollama_model: Optional[str] = None  # Модель Ollama (по умолчанию из настроек)
     clear_before: bool = True  # Очистить все данные перед парсингом
+    sync_mode: str = "reload"  # reload - очистка и загрузка заново; incremental - обновление по месту (clear_before игнорируется)
 
 
 class ParserStatusResponse(BaseModel):
@@ -1047,6 +1081,8 @@ class ParserStatusResponse(BaseModel):
     nlp_extractions: Optional[int] = None  # Количество NLP извлечений
     ollama_extractions: Optional[int] = None  # Количество Ollama извлечений
     structure_changes_detected: Optional[int] = None  # Обнаруженные изменения структуры
+    template_extractions: Optional[int] = None  # Страниц, разобранных по шаблону разметки (без NLP/Ollama)
+    unchanged_skipped: Optional[int] = None  # Страниц без изменений (ответ 304 на условный запрос)
 
 
 # ========== СХЕМЫ ДЛЯ РАСПОЗНАВАНИЯ РЕЧИ ==========
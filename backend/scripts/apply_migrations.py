@@ -67,7 +67,12 @@ def main():
     # Список миграций в порядке применения
     migrations = [
         "001_create_user_memories.sql",
-        "002_fix_chat_message_chat_id.sql"
+        "002_fix_chat_message_chat_id.sql",
+        "003_document_blob_storage.sql",
+        "004_document_chunk_hashes.sql",
+        "005_embedding_model_columns.sql",
+        "006_keyset_pagination_indexes.sql",
+        "007_parsed_car_content_hash.sql"
     ]
     
     success_count = 0
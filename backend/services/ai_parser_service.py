@@ -3,7 +3,6 @@
 """
 import re
 import json
-import time
 import httpx
 from typing import Dict, List, Optional, Any, Tuple
 from urllib.parse import urljoin
@@ -12,25 +11,14 @@ from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from models.database import ParsedCar, ParsedCarPicture
 from app.core.config import settings
+from services.crawl_engine_service import CrawlFrontier, ParserCrawlRunner
+from services.parsed_car_sync_service import ParsedCarSync
+from services.nlp_model_pool_service import nlp_model_pool
+from services.page_template_service import CITY_NAME_STEMS, PageTemplateStore
 import logging
 
 logger = logging.getLogger(__name__)
 
-# NLP импорты
-try:
-    import spacy
-    SPACY_AVAILABLE = True
-except ImportError:
-    spacy = None
-    SPACY_AVAILABLE = False
-
-try:
-    from transformers import pipeline
-    TRANSFORMERS_AVAILABLE = True
-except ImportError:
-    TRANSFORMERS_AVAILABLE = False
-
-
 class AIParser:
     """ИИ-агент для интеллектуального парсинга с NLP, ML и Ollama компонентами"""
     
@@ -45,20 +33,20 @@ class AIParser:
             "current_page": 0,
             "nlp_extractions": 0,
             "structure_changes_detected": 0,
-            "ollama_extractions": 0
+            "ollama_extractions": 0,
+            "template_extractions": 0,
+            "unchanged_skipped": 0
         }
         self.is_running = False
+        self.sync: Optional[ParsedCarSync] = None  # Инкрементальная синхронизация текущего запуска
         
         # Настройки Ollama
         self.use_ollama = use_ollama
         self.ollama_model = ollama_model or getattr(settings, 'ollama_model', 'llama3:8b')
         self.ollama_working_url = None
         
-        # Инициализация NLP компонентов
-        self.nlp_model = self._load_nlp_model()
-        # Анализ тональности загружается лениво (только при использовании)
-        self.sentiment_analyzer = None
-        self._sentiment_analyzer_loading = False
+        # NLP модели (spaCy, тональность) берутся из общего пула процесса
+        # и загружаются при первом использовании
         
         # Проверка доступности Ollama
         if self.use_ollama:
@@ -67,107 +55,18 @@ class AIParser:
         # Кэш для структуры страниц (для обнаружения изменений)
         self.page_structure_cache = {}
         
-    def _load_nlp_model(self):
-        """Загружает NLP модель для извлечения сущностей"""
-        if not SPACY_AVAILABLE:
-            logger.warning("spaCy не установлен. NLP функции будут ограничены.")
-            return None
-        
-        model_names = ['ru_core_news_md', 'ru_core_news_sm', 'xx_ent_wiki_sm']
-        for model_name in model_names:
-            try:
-                nlp = spacy.load(model_name)
-                logger.info(f"✅ Загружена NLP модель: {model_name}")
-                return nlp
-            except OSError:
-                continue
+        # Шаблоны извлечения по отпечатку разметки (page_layout_templates)
+        self.page_templates = PageTemplateStore(self.db, self.base_url)
         
-        logger.warning("Не удалось загрузить NLP модель. Используется базовое извлечение.")
-        return None
+    @property
+    def nlp_model(self):
+        """spaCy-пайплайн (только NER) из общего пула или None"""
+        return nlp_model_pool.get_nlp()
     
-    def _load_sentiment_analyzer(self):
-        """
-        Ленивая загрузка модели для анализа тональности (опционально)
-        Анализ тональности не критичен для парсинга - парсер работает и без него
-        Загружается только при первом использовании
-        """
-        # Если уже загружен - возвращаем
-        if self.sentiment_analyzer is not None:
-            return self.sentiment_analyzer
-        
-        # Если идет загрузка - возвращаем None (чтобы не блокировать)
-        if self._sentiment_analyzer_loading:
-            return None
-        
-        if not TRANSFORMERS_AVAILABLE:
-            return None
-        
-        # Устанавливаем флаг загрузки
-        self._sentiment_analyzer_loading = True
-        
-        try:
-            # Устанавливаем переменные окружения для увеличения таймаута
-            import os
-            os.environ['HF_HUB_DOWNLOAD_TIMEOUT'] = '60'  # 1 минута (быстрее)
-            os.environ['HF_HUB_CACHE'] = os.path.expanduser('~/.cache/huggingface')
-            
-            from transformers import pipeline
-            import threading
-            
-            # Загружаем в отдельном потоке с таймаутом, чтобы не блокировать
-            def load_analyzer():
-                try:
-                    logger.debug("Загрузка модели анализа тональности (в фоне)...")
-                    # Используем правильный способ загрузки DistilBERT
-                    from transformers import AutoTokenizer, AutoModelForSequenceClassification
-                    import torch
-                    
-                    model_name = "distilbert/distilbert-base-uncased-finetuned-sst-2-english"
-                    
-                    # Загружаем токенизатор и модель напрямую (без pipeline для избежания конфликтов)
-                    tokenizer = AutoTokenizer.from_pretrained(model_name)
-                    model = AutoModelForSequenceClassification.from_pretrained(model_name)
-                    
-                    # Создаем pipeline после загрузки модели
-                    analyzer = pipeline(
-                        "text-classification",
-                        model=model,
-                        tokenizer=tokenizer,
-                        device=-1  # -1 для CPU
-                    )
-                    
-                    self.sentiment_analyzer = analyzer
-                    logger.debug("✅ Загружен анализатор тональности DistilBERT (в фоне)")
-                except Exception as e:
-                    logger.debug(f"Не удалось загрузить анализатор тональности: {e}")
-                    # Пробуем упрощенный способ через pipeline напрямую
-                    try:
-                        from transformers import pipeline
-                        analyzer = pipeline(
-                            "text-classification",
-                            model="distilbert/distilbert-base-uncased-finetuned-sst-2-english",
-                            device=-1
-                        )
-                        self.sentiment_analyzer = analyzer
-                        logger.debug("✅ Загружен анализатор тональности через pipeline")
-                    except Exception as e2:
-                        logger.debug(f"Не удалось загрузить через pipeline: {e2}")
-                        # Не критично - парсер работает без него
-                        self.sentiment_analyzer = None
-                finally:
-                    self._sentiment_analyzer_loading = False
-            
-            # Запускаем загрузку в фоне
-            thread = threading.Thread(target=load_analyzer, daemon=True)
-            thread.start()
-            
-            # Не ждем завершения - возвращаем None пока идет загрузка
-            return None
-            
-        except Exception as e:
-            logger.debug(f"Ошибка инициализации анализатора тональности: {e}")
-            self._sentiment_analyzer_loading = False
-            return None
+    @property
+    def sentiment_analyzer(self):
+        """Анализатор тональности из общего пула (None, пока загружается в фоне)"""
+        return nlp_model_pool.get_sentiment_analyzer()
     
     def _check_ollama_availability(self):
         """Проверяет доступность Ollama и находит рабочий URL"""
@@ -347,16 +246,11 @@ class AIParser:
             "other": []
         }
         
-        if not self.nlp_model or not text:
+        if not text or self.nlp_model is None:
             return entities
         
         try:
-            doc = self.nlp_model(text)
-            
-            for ent in doc.ents:
-                label = ent.label_.upper()
-                text_clean = ent.text.strip()
-                
+            for label, text_clean in nlp_model_pool.extract_entities([text])[0]:
                 if label in ('DATE', 'TIME'):
                     entities["dates"].append(text_clean)
                 elif label in ('ORG', 'ORGANIZATION'):
@@ -399,26 +293,10 @@ class AIParser:
         if not text:
             return None
         
-        # Пытаемся загрузить анализатор лениво (если еще не загружен)
-        if self.sentiment_analyzer is None and not self._sentiment_analyzer_loading:
-            self._load_sentiment_analyzer()
-        
-        # Если ML модель доступна - используем её
-        if self.sentiment_analyzer:
-            try:
-                # Ограничиваем длину текста для анализа
-                text_short = text[:512]  # Максимум 512 символов
-                result = self.sentiment_analyzer(text_short)
-                
-                # Форматируем результат
-                if isinstance(result, list) and len(result) > 0:
-                    return {
-                        "label": result[0].get("label", "N/A"),
-                        "score": result[0].get("score", 0.0),
-                        "method": "ml"
-                    }
-            except Exception as e:
-                logger.debug(f"Ошибка ML анализа тональности: {e}")
+        # ML модель из общего пула (первый вызов запускает загрузку в фоне)
+        result = nlp_model_pool.analyze_sentiment([text])[0]
+        if result:
+            return {**result, "method": "ml"}
         
         # Простой эвристический анализ (если ML модель недоступна)
         try:
@@ -552,12 +430,8 @@ class AIParser:
         
         return None
     
-    def _intelligent_extract_car_data(self, soup: BeautifulSoup, url: str) -> Dict[str, Any]:
-        """
-        Интеллектуальное извлечение данных об автомобиле со СТРАНИЦЫ АВТОМОБИЛЯ
-        ВАЖНО: Этот метод предназначен для парсинга отдельной страницы автомобиля,
-        а не карточки в каталоге. Селекторы оптимизированы для полной страницы.
-        """
+    def _empty_car_data(self, url: str) -> Dict[str, Any]:
+        """Пустая структура данных автомобиля"""
         # Определяем тип автомобиля по URL (new/used)
         car_type = "new" if "/sale/new/" in url else "used" if "/sale/used/" in url else "unknown"
         
@@ -583,6 +457,127 @@ class AIParser:
             "ollama_extracted": {},
             "car_type": car_type  # Сохраняем тип автомобиля
         }
+        return car_data
+    
+    def _extract_tech_characteristics(self, soup: BeautifulSoup, car_data: Dict[str, Any]):
+        """Характеристики из блоков card__tech и комплектация из card__com-wrap (aaa-motors.ru)"""
+        # Специфичный поиск для aaa-motors.ru
+        # ПРИОРИТЕТ 1: card__tech (страница автомобиля) - структура <div><span>Название</span><span>Значение</span></div>
+        # Поддерживаем как для новых, так и для подержанных автомобилей
+        card_tech = soup.find('div', class_=re.compile(r'card__tech|js-card-tech', re.I))
+        if card_tech:
+            logger.debug("🔍 Найдена структура card__tech, парсинг характеристик...")
+            # Ищем все дочерние div элементы
+            tech_items = card_tech.find_all('div', recursive=False)
+            logger.debug(f"   Найдено элементов характеристик: {len(tech_items)}")
+            
+            for tech_item in tech_items:
+                # Ищем два span элемента: первый - название, второй - значение
+                spans = tech_item.find_all('span', recursive=False)
+                if len(spans) >= 2:
+                    key = spans[0].get_text(strip=True)
+                    value = spans[1].get_text(strip=True)
+                    key_lower = key.lower()
+                    
+                    logger.debug(f"   📋 Извлечено: {key} = {value}")
+                    
+                    # Обрабатываем критичные характеристики
+                    self._parse_characteristic(key, value, car_data)
+                    
+                    # Сохраняем дополнительные характеристики в JSON
+                    if not car_data.get("characteristics"):
+                        car_data["characteristics"] = {}
+                    
+                    # Сохраняем все характеристики, включая нестандартные
+                    # Исключаем стандартные поля, которые уже обработаны
+                    standard_fields = ['год выпуска', 'год', 'объем двигателя', 'объем', 
+                                      'тип двигателя', 'мощность двигателя', 'мощность',
+                                      'пробег', 'привод', 'кпп', 'цвет', 'руль', 'тип кузова',
+                                      'кузов', 'макс скорость', 'вес']
+                    
+                    if key_lower not in standard_fields:
+                        # Это дополнительные характеристики (макс скорость, вес и т.д.)
+                        car_data["characteristics"][key] = value
+                    elif key_lower in ['макс скорость', 'вес']:
+                        # Сохраняем макс скорость и вес в characteristics
+                        car_data["characteristics"][key] = value
+        
+        # ПРИОРИТЕТ 2: Парсинг комплектации (card__com-wrap)
+        card_com = soup.find('div', class_=re.compile(r'card__com-wrap|js-card-com', re.I))
+        if card_com:
+            logger.debug("🔍 Найдена структура комплектации (card__com-wrap), парсинг опций...")
+            
+            # Ищем все элементы списка опций
+            com_items = card_com.find_all('div', class_=re.compile(r'card__com-item|com-item', re.I))
+            all_options = []
+            
+            for com_item in com_items:
+                # Ищем ul списки внутри
+                ul_lists = com_item.find_all('ul')
+                for ul in ul_lists:
+                    # Ищем все li элементы
+                    li_items = ul.find_all('li')
+                    for li in li_items:
+                        option_text = li.get_text(strip=True)
+                        if option_text and len(option_text) > 3:  # Минимальная длина опции
+                            all_options.append(option_text)
+            
+            if all_options:
+                # Сохраняем комплектацию в characteristics
+                if not car_data.get("characteristics"):
+                    car_data["characteristics"] = {}
+                
+                car_data["characteristics"]["equipment"] = all_options
+                car_data["characteristics"]["equipment_count"] = len(all_options)
+                logger.info(f"   ✅ Извлечено опций комплектации: {len(all_options)}")
+                logger.debug(f"   📋 Первые 5 опций: {all_options[:5]}")
+    
+    def _extract_pictures(self, soup: BeautifulSoup, car_data: Dict[str, Any]):
+        """Фотографии автомобиля (data-src для lozad, затем src)"""
+        # Специфичный поиск для aaa-motors.ru (использует data-src и lozad)
+        img_selectors = [
+            # Основной селектор для aaa-motors.ru (lozad lazy loading)
+            soup.find_all('img', class_=re.compile(r'lozad|item-row__img', re.I)),
+            soup.find_all('img', {'data-src': True}),
+            soup.find_all('img', class_=re.compile(r'car|photo|image|gallery|auto', re.I)),
+            soup.find_all('img', src=re.compile(r'car|auto|photo|image|media\.cm\.expert', re.I)),
+            soup.find_all('img', alt=re.compile(r'car|auto|машин|автомобил', re.I)),
+        ]
+        
+        all_images = set()
+        for selector_list in img_selectors:
+            for img in selector_list:
+                # Приоритет: data-src (для lazy loading), затем src
+                src = img.get('data-src') or img.get('src') or img.get('data-lazy-src') or img.get('data-original')
+                if src:
+                    # Убираем параметры загрузки, если есть
+                    if '?' in src:
+                        src = src.split('?')[0]
+                    if src.startswith('//'):
+                        src = 'https:' + src
+                    elif src.startswith('/'):
+                        src = urljoin(self.base_url, src)
+                    elif not src.startswith('http'):
+                        src = urljoin(self.base_url, src)
+                    # Фильтруем placeholder изображения
+                    if 'placeholder' not in src.lower() and 'no-image' not in src.lower():
+                        all_images.add(src)
+        
+        sorted_images = sorted(list(all_images))
+        for idx, img_url in enumerate(sorted_images[:20]):
+            car_data["pictures"].append({
+                "image_url": img_url,
+                "seqno": idx
+            })
+    
+    def _intelligent_extract_car_data(self, soup: BeautifulSoup, url: str) -> Dict[str, Any]:
+        """
+        Интеллектуальное извлечение данных об автомобиле со СТРАНИЦЫ АВТОМОБИЛЯ
+        ВАЖНО: Этот метод предназначен для парсинга отдельной страницы автомобиля,
+        а не карточки в каталоге. Селекторы оптимизированы для полной страницы.
+        """
+        car_data = self._empty_car_data(url)
+        car_type = car_data["car_type"]
         
         logger.info(f"   🚗 Тип автомобиля: {'Новый' if car_type == 'new' else 'Подержанный' if car_type == 'used' else 'Неизвестно'}")
         
@@ -673,9 +668,6 @@ class AIParser:
             
             title_text_clean = " ".join(unique_words)
             
-            # Используем NLP для извлечения марки и модели
-            title_entities = self._extract_entities_nlp(title_text_clean)
-            
             # Пытаемся найти марку и модель в заголовке
             # Формат обычно: "Daewoo Matiz" или "BMW X5" или "Москвич МОСКВИЧ 3"
             title_parts = [p for p in title_text_clean.split() if len(p) > 1]  # Убираем одиночные символы
@@ -838,6 +830,9 @@ class AIParser:
         if price_text:
             price_candidates.append(price_text)
         
+        # Сущности всех кандидатов - одной пачкой (дальше _extract_price берет их из кэша пула)
+        nlp_model_pool.extract_entities(price_candidates)
+        
         # Выбираем лучшую цену (самую большую числовую)
         best_price = None
         best_price_value = 0
@@ -893,7 +888,7 @@ class AIParser:
                     for part in city_parts:
                         if len(part) > 3 and not part[0].isdigit():
                             # Проверяем, не является ли это названием города
-                            if any(word in part.lower() for word in ['москв', 'ростов', 'спб', 'питер', 'казан', 'нижн', 'новосиб', 'екатерин']):
+                            if any(word in part.lower() for word in CITY_NAME_STEMS):
                                 car_data["city"] = part
                                 break
                     if not car_data["city"] and city_text:
@@ -938,77 +933,8 @@ class AIParser:
                     car_data["manufacture_year"] = year
                     break
         
-        # Адаптивный парсинг характеристик
-        # Специфичный поиск для aaa-motors.ru
-        # ПРИОРИТЕТ 1: card__tech (страница автомобиля) - структура <div><span>Название</span><span>Значение</span></div>
-        # Поддерживаем как для новых, так и для подержанных автомобилей
-        card_tech = soup.find('div', class_=re.compile(r'card__tech|js-card-tech', re.I))
-        if card_tech:
-            logger.debug("🔍 Найдена структура card__tech, парсинг характеристик...")
-            # Ищем все дочерние div элементы
-            tech_items = card_tech.find_all('div', recursive=False)
-            logger.debug(f"   Найдено элементов характеристик: {len(tech_items)}")
-            
-            for tech_item in tech_items:
-                # Ищем два span элемента: первый - название, второй - значение
-                spans = tech_item.find_all('span', recursive=False)
-                if len(spans) >= 2:
-                    key = spans[0].get_text(strip=True)
-                    value = spans[1].get_text(strip=True)
-                    key_lower = key.lower()
-                    
-                    logger.debug(f"   📋 Извлечено: {key} = {value}")
-                    
-                    # Обрабатываем критичные характеристики
-                    self._parse_characteristic(key, value, car_data)
-                    
-                    # Сохраняем дополнительные характеристики в JSON
-                    if not car_data.get("characteristics"):
-                        car_data["characteristics"] = {}
-                    
-                    # Сохраняем все характеристики, включая нестандартные
-                    # Исключаем стандартные поля, которые уже обработаны
-                    standard_fields = ['год выпуска', 'год', 'объем двигателя', 'объем', 
-                                      'тип двигателя', 'мощность двигателя', 'мощность',
-                                      'пробег', 'привод', 'кпп', 'цвет', 'руль', 'тип кузова',
-                                      'кузов', 'макс скорость', 'вес']
-                    
-                    if key_lower not in standard_fields:
-                        # Это дополнительные характеристики (макс скорость, вес и т.д.)
-                        car_data["characteristics"][key] = value
-                    elif key_lower in ['макс скорость', 'вес']:
-                        # Сохраняем макс скорость и вес в characteristics
-                        car_data["characteristics"][key] = value
-        
-        # ПРИОРИТЕТ 2: Парсинг комплектации (card__com-wrap)
-        card_com = soup.find('div', class_=re.compile(r'card__com-wrap|js-card-com', re.I))
-        if card_com:
-            logger.debug("🔍 Найдена структура комплектации (card__com-wrap), парсинг опций...")
-            
-            # Ищем все элементы списка опций
-            com_items = card_com.find_all('div', class_=re.compile(r'card__com-item|com-item', re.I))
-            all_options = []
-            
-            for com_item in com_items:
-                # Ищем ul списки внутри
-                ul_lists = com_item.find_all('ul')
-                for ul in ul_lists:
-                    # Ищем все li элементы
-                    li_items = ul.find_all('li')
-                    for li in li_items:
-                        option_text = li.get_text(strip=True)
-                        if option_text and len(option_text) > 3:  # Минимальная длина опции
-                            all_options.append(option_text)
-            
-            if all_options:
-                # Сохраняем комплектацию в characteristics
-                if not car_data.get("characteristics"):
-                    car_data["characteristics"] = {}
-                
-                car_data["characteristics"]["equipment"] = all_options
-                car_data["characteristics"]["equipment_count"] = len(all_options)
-                logger.info(f"   ✅ Извлечено опций комплектации: {len(all_options)}")
-                logger.debug(f"   📋 Первые 5 опций: {all_options[:5]}")
+        # Адаптивный парсинг характеристик (card__tech, комплектация)
+        self._extract_tech_characteristics(soup, car_data)
         
         # ПРИОРИТЕТ 3: Другие контейнеры с характеристиками
         spec_containers = [
@@ -1144,41 +1070,7 @@ class AIParser:
                                     car_data["color"] = text
         
         # Интеллектуальное извлечение фотографий
-        # Специфичный поиск для aaa-motors.ru (использует data-src и lozad)
-        img_selectors = [
-            # Основной селектор для aaa-motors.ru (lozad lazy loading)
-            soup.find_all('img', class_=re.compile(r'lozad|item-row__img', re.I)),
-            soup.find_all('img', {'data-src': True}),
-            soup.find_all('img', class_=re.compile(r'car|photo|image|gallery|auto', re.I)),
-            soup.find_all('img', src=re.compile(r'car|auto|photo|image|media\.cm\.expert', re.I)),
-            soup.find_all('img', alt=re.compile(r'car|auto|машин|автомобил', re.I)),
-        ]
-        
-        all_images = set()
-        for selector_list in img_selectors:
-            for img in selector_list:
-                # Приоритет: data-src (для lazy loading), затем src
-                src = img.get('data-src') or img.get('src') or img.get('data-lazy-src') or img.get('data-original')
-                if src:
-                    # Убираем параметры загрузки, если есть
-                    if '?' in src:
-                        src = src.split('?')[0]
-                    if src.startswith('//'):
-                        src = 'https:' + src
-                    elif src.startswith('/'):
-                        src = urljoin(self.base_url, src)
-                    elif not src.startswith('http'):
-                        src = urljoin(self.base_url, src)
-                    # Фильтруем placeholder изображения
-                    if 'placeholder' not in src.lower() and 'no-image' not in src.lower():
-                        all_images.add(src)
-        
-        sorted_images = sorted(list(all_images))
-        for idx, img_url in enumerate(sorted_images[:20]):
-            car_data["pictures"].append({
-                "image_url": img_url,
-                "seqno": idx
-            })
+        self._extract_pictures(soup, car_data)
         
         return car_data
     
@@ -1432,7 +1324,7 @@ class AIParser:
             city_parts = address_text.split()
             for part in city_parts:
                 if len(part) > 3 and not part[0].isdigit():
-                    if any(word in part.lower() for word in ['москв', 'ростов', 'спб', 'питер', 'казан', 'нижн', 'новосиб', 'екатерин']):
+                    if any(word in part.lower() for word in CITY_NAME_STEMS):
                         car_data["city"] = re.sub(r'[,;]\s*$', '', part).strip()
                         break
             if not car_data["city"] and address_text:
@@ -1565,8 +1457,24 @@ class AIParser:
                 return None
             
             response.raise_for_status()
-            
-            soup = BeautifulSoup(response.content, 'html.parser')
+        except httpx.HTTPStatusError as e:
+            logger.error(f"HTTP ошибка парсинга страницы {url}: {e}")
+            self.stats["total_errors"] += 1
+            return None
+        except httpx.TimeoutException:
+            logger.warning(f"Таймаут при загрузке страницы: {url}")
+            self.stats["total_errors"] += 1
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка загрузки страницы {url}: {e}")
+            self.stats["total_errors"] += 1
+            return None
+        return self._parse_car_html(url, response.content)
+    
+    def _parse_car_html(self, url: str, content: bytes) -> Optional[Dict[str, Any]]:
+        """Извлекает данные автомобиля из загруженной страницы с использованием ИИ"""
+        try:
+            soup = BeautifulSoup(content, 'html.parser')
             
             # Проверяем, что это действительно страница автомобиля, а не каталог
             # Страница автомобиля обычно содержит h1 с названием и специфичные элементы
@@ -1583,9 +1491,21 @@ class AIParser:
             # Обнаружение изменений структуры
             self._detect_structure_changes(url, soup)
             
-            # Интеллектуальное извлечение данных со страницы автомобиля
-            logger.info(f"🔍 Извлечение данных со страницы автомобиля: {url}")
-            car_data = self._intelligent_extract_car_data(soup, url)
+            # Известная разметка разбирается выученными селекторами (без эвристик, NLP и Ollama)
+            fingerprint = self.page_templates.fingerprint(soup)
+            baseline = self._empty_car_data(url)
+            self._extract_tech_characteristics(soup, baseline)
+            self._extract_pictures(soup, baseline)
+            car_data = self.page_templates.apply(fingerprint, soup, baseline)
+            
+            if car_data:
+                self.stats["template_extractions"] += 1
+                logger.info(f"⚡ Данные извлечены по шаблону разметки {fingerprint[:8]}: {url}")
+            else:
+                # Интеллектуальное извлечение данных со страницы автомобиля
+                logger.info(f"🔍 Извлечение данных со страницы автомобиля: {url}")
+                car_data = self._intelligent_extract_car_data(soup, url)
+                self.page_templates.observe(fingerprint, soup, car_data, baseline)
             
             # Логируем результат извлечения (всегда)
             logger.info(f"📊 Результат извлечения: марка={car_data.get('mark') or 'НЕ НАЙДЕНО'}, "
@@ -1621,24 +1541,13 @@ class AIParser:
             logger.info(f"✅ Данные извлечены (даже если неполные): марка={car_data.get('mark')}, модель={car_data.get('model')}")
             return car_data
             
-        except httpx.HTTPStatusError as e:
-            if e.response.status_code == 404:
-                logger.warning(f"Страница не найдена (404): {url}")
-            else:
-                logger.error(f"HTTP ошибка парсинга страницы {url}: {e}")
-            self.stats["total_errors"] += 1
-            return None
-        except httpx.TimeoutException:
-            logger.warning(f"Таймаут при загрузке страницы: {url}")
-            self.stats["total_errors"] += 1
-            return None
         except Exception as e:
             logger.error(f"Ошибка парсинга страницы {url}: {e}")
             self.stats["total_errors"] += 1
             return None
     
     def _find_car_links(self, page_url: str) -> List[str]:
-        """Находит все ссылки на автомобили на странице каталога"""
+        """Загружает страницу каталога и находит все ссылки на автомобили"""
         try:
             session = self._create_session()
             response = session.get(page_url, timeout=10.0)
@@ -1649,8 +1558,15 @@ class AIParser:
                 return []
             
             response.raise_for_status()
-            
-            soup = BeautifulSoup(response.content, 'html.parser')
+        except Exception as e:
+            logger.error(f"Ошибка загрузки страницы {page_url}: {e}")
+            return []
+        return self._extract_car_links(page_url, response.content)
+    
+    def _extract_car_links(self, page_url: str, content: bytes) -> List[str]:
+        """Находит все ссылки на автомобили в загруженной странице каталога"""
+        try:
+            soup = BeautifulSoup(content, 'html.parser')
             car_links = []
             
             # Специфичный поиск для aaa-motors.ru
@@ -1959,6 +1875,9 @@ class AIParser:
             print(f"Найдено автомобилей: {cars_count}")
             print(f"Найдено фотографий: {pictures_count}")
             
+            # Очередь обхода и валидаторы (ETag/Last-Modified) без данных не нужны
+            CrawlFrontier(self.db, self.base_url).reset()
+            
             if cars_count == 0 and pictures_count == 0:
                 logger.info("✅ Данных для удаления нет, база уже пуста")
                 print(f"✅ Данных для удаления нет")
@@ -2021,15 +1940,122 @@ class AIParser:
             print(f"\n❌ ОШИБКА ПРИ ОЧИСТКЕ ДАННЫХ: {e}\n")
             raise
     
-    def parse(self, max_pages: Optional[int] = None, max_cars: Optional[int] = None, delay: float = 1.0, clear_before: bool = True) -> Dict[str, Any]:
+    def _process_car_page(self, url: str, content: bytes, index: int, total: int) -> bool:
+        """
+        Разбирает загруженную страницу автомобиля и сохраняет его (вызывается обходчиком)
+        
+        Returns:
+            True, если автомобиль сохранен
+        """
+        logger.info(f"Парсинг автомобиля {index}/{total}: {url}")
+        
+        car_data = self._parse_car_html(url, content)
+        
+        # ВСЕГДА выводим данные для проверки, даже если они неполные
+        if car_data:
+            # Проверяем что хотя бы базовые данные извлечены
+            has_basic_data = any([
+                car_data.get('mark'),
+                car_data.get('model'),
+                car_data.get('price'),
+                car_data.get('manufacture_year')
+            ])
+            
+            if not has_basic_data:
+                logger.warning(f"⚠️ [{index}/{total}] Данные извлечены, но все поля пустые: {url}")
+                # Пытаемся извлечь хотя бы марку и модель из URL
+                url_parts = url.rstrip('/').split('/')
+                if len(url_parts) >= 5:
+                    if not car_data.get('mark'):
+                        car_data['mark'] = url_parts[-3].replace('-', ' ').title()
+                    if not car_data.get('model'):
+                        car_data['model'] = url_parts[-2].replace('-', ' ').title()
+                    logger.info(f"   ✅ Извлечены марка и модель из URL: {car_data.get('mark')} {car_data.get('model')}")
+            
+            # Выводим найденные данные для проверки (ВСЕГДА)
+            logger.info(f"📋 [{index}/{total}] Данные извлечены со страницы: {url}")
+            self._log_extracted_data(car_data, index)
+            
+            # ВСЕГДА пытаемся сохранить, даже если данных немного
+            logger.info(f"📦 ПЕРЕДАЧА ДАННЫХ В _save_car:")
+            logger.info(f"   mark={car_data.get('mark')}, model={car_data.get('model')}, price={car_data.get('price')}")
+            logger.info(f"   year={car_data.get('manufacture_year')}, city={car_data.get('city')}")
+            logger.info(f"   body_type={car_data.get('body_type')}, fuel_type={car_data.get('fuel_type')}, gear_box={car_data.get('gear_box_type')}")
+            
+            if self.sync is not None:
+                # Инкрементальный режим: запись пачками с проверкой хеша содержимого
+                self.sync.add(car_data)
+                self.stats["total_parsed"] += 1
+                return True
+            
+            saved = self._save_car(car_data)
+            if saved:
+                # Проверяем что данные действительно сохранились
+                saved_car = self.db.query(ParsedCar).filter(
+                    ParsedCar.source_url == car_data['source_url']
+                ).first()
+                
+                if saved_car:
+                    logger.info(f"   ✅ Данные сохранены: mark={saved_car.mark}, model={saved_car.model}, price={saved_car.price}")
+                    
+                    # КРИТИЧНО: Если данные не сохранились, принудительно обновляем
+                    needs_update = False
+                    if not saved_car.mark and car_data.get("mark"):
+                        saved_car.mark = car_data["mark"]
+                        needs_update = True
+                        logger.warning(f"   🔄 ПРИНУДИТЕЛЬНОЕ обновление mark: {car_data['mark']}")
+                    if not saved_car.model and car_data.get("model"):
+                        saved_car.model = car_data["model"]
+                        needs_update = True
+                        logger.warning(f"   🔄 ПРИНУДИТЕЛЬНОЕ обновление model: {car_data['model']}")
+                    if not saved_car.price and car_data.get("price"):
+                        saved_car.price = car_data["price"]
+                        needs_update = True
+                        logger.warning(f"   🔄 ПРИНУДИТЕЛЬНОЕ обновление price: {car_data['price']}")
+                    if not saved_car.manufacture_year and car_data.get("manufacture_year"):
+                        saved_car.manufacture_year = car_data["manufacture_year"]
+                        needs_update = True
+                        logger.warning(f"   🔄 ПРИНУДИТЕЛЬНОЕ обновление year: {car_data['manufacture_year']}")
+                    if not saved_car.body_type and car_data.get("body_type"):
+                        saved_car.body_type = car_data["body_type"]
+                        needs_update = True
+                    if not saved_car.fuel_type and car_data.get("fuel_type"):
+                        saved_car.fuel_type = car_data["fuel_type"]
+                        needs_update = True
+                    if not saved_car.gear_box_type and car_data.get("gear_box_type"):
+                        saved_car.gear_box_type = car_data["gear_box_type"]
+                        needs_update = True
+                    
+                    if needs_update:
+                        self.db.commit()
+                        self.db.refresh(saved_car)
+                        logger.info(f"   ✅ Принудительное обновление выполнено: mark={saved_car.mark}, model={saved_car.model}, price={saved_car.price}")
+                else:
+                    logger.warning(f"   ⚠️ Запись не найдена после сохранения")
+                return True
+            else:
+                logger.warning(f"   ⚠️ Не удалось сохранить данные для {url}")
+        else:
+            logger.warning(f"⚠️ [{index}/{total}] Не удалось извлечь данные: {url}")
+            print(f"⚠️ [{index}/{total}] Не удалось извлечь данные: {url}")
+            print(f"   Это может означать, что страница не загрузилась или структура изменилась\n")
+            self.stats["total_errors"] += 1
+        return False
+    
+    def parse(self, max_pages: Optional[int] = None, max_cars: Optional[int] = None, delay: float = 1.0, clear_before: bool = True, incremental: bool = False) -> Dict[str, Any]:
         """
         Запускает интеллектуальный парсинг автомобилей
         
         Args:
             max_pages: Максимальное количество страниц каталога
             max_cars: Максимальное количество автомобилей
-            delay: Задержка между запросами (секунды)
+            delay: Задержка между запросами одного потока обхода (секунды), ограничивает частоту запросов к сайту
             clear_before: Очистить все данные перед парсингом (по умолчанию True)
+            incremental: Инкрементальная синхронизация вместо очистки: неизменившиеся объявления
+                не перезаписываются, пропавшие помечаются неактивными (clear_before игнорируется)
+        
+        Страницы загружаются параллельно (ParserCrawlRunner); очередь обхода хранится в БД,
+        поэтому остановленный парсинг без clear_before продолжается с оставшихся страниц.
         """
         self.is_running = True
         self.stats = {
@@ -2038,9 +2064,15 @@ class AIParser:
             "current_page": 0,
             "nlp_extractions": 0,
             "structure_changes_detected": 0,
-            "ollama_extractions": 0  # Добавляем поле для Ollama
+            "ollama_extractions": 0,  # Добавляем поле для Ollama
+            "template_extractions": 0,  # Страниц, разобранных по шаблону разметки
+            "unchanged_skipped": 0  # Страниц без изменений (ответ 304)
         }
         
+        self.sync = ParsedCarSync(self.db, self.base_url) if incremental else None
+        if incremental:
+            clear_before = False
+        
         try:
             # КРИТИЧЕСКИ ВАЖНО: Очищаем все данные перед парсингом
             # По умолчанию clear_before=True, если явно не указано False
@@ -2080,141 +2112,41 @@ class AIParser:
                 logger.warning("⚠️ Очистка данных отключена (clear_before=False). Данные будут добавлены к существующим.")
                 print(f"⚠️ ВНИМАНИЕ: Очистка данных отключена. Новые данные будут добавлены к существующим.\n")
             
-            catalog_pages = self._find_catalog_pages()
-            if not catalog_pages:
-                logger.warning("Не найдено страниц каталога")
-                return {
-                    "status": "error",
-                    "message": "Не найдено страниц каталога",
-                    **self.stats
-                }
-            
-            if max_pages:
-                catalog_pages = catalog_pages[:max_pages]
+            runner = ParserCrawlRunner(self, delay=delay, headers=dict(self._create_session().headers))
             
-            all_car_links = []
-            
-            for page_url in catalog_pages:
-                if not self.is_running:
-                    break
-                    
-                self.stats["current_page"] += 1
-                logger.info(f"Парсинг страницы {self.stats['current_page']}: {page_url}")
-                
-                car_links = self._find_car_links(page_url)
-                all_car_links.extend(car_links)
+            # Прерванный обход продолжается с оставшихся URL, иначе - заново со страниц каталога
+            if runner.has_unfinished():
+                logger.info("🔄 Продолжение прерванного обхода")
+            else:
+                catalog_pages = self._find_catalog_pages()
+                if not catalog_pages:
+                    logger.warning("Не найдено страниц каталога")
+                    return {
+                        "status": "error",
+                        "message": "Не найдено страниц каталога",
+                        **self.stats
+                    }
                 
-                if delay > 0:
-                    time.sleep(delay)
-            
-            unique_car_links = list(set(all_car_links))
-            logger.info(f"Найдено {len(unique_car_links)} уникальных автомобилей")
+                if max_pages:
+                    catalog_pages = catalog_pages[:max_pages]
+                runner.start(catalog_pages)
             
-            if max_cars:
-                unique_car_links = unique_car_links[:max_cars]
+            runner.run(max_cars=max_cars)
             
-            for idx, car_url in enumerate(unique_car_links):
-                if not self.is_running:
-                    break
-                
-                if max_cars and self.stats["total_parsed"] >= max_cars:
-                    break
-                
-                logger.info(f"Парсинг автомобиля {idx + 1}/{len(unique_car_links)}: {car_url}")
-                
-                car_data = self._parse_car_page(car_url)
-                
-                # ВСЕГДА выводим данные для проверки, даже если они неполные
-                if car_data:
-                    # Проверяем что хотя бы базовые данные извлечены
-                    has_basic_data = any([
-                        car_data.get('mark'),
-                        car_data.get('model'),
-                        car_data.get('price'),
-                        car_data.get('manufacture_year')
-                    ])
-                    
-                    if not has_basic_data:
-                        logger.warning(f"⚠️ [{idx + 1}/{len(unique_car_links)}] Данные извлечены, но все поля пустые: {car_url}")
-                        # Пытаемся извлечь хотя бы марку и модель из URL
-                        url_parts = car_url.rstrip('/').split('/')
-                        if len(url_parts) >= 5:
-                            if not car_data.get('mark'):
-                                car_data['mark'] = url_parts[-3].replace('-', ' ').title()
-                            if not car_data.get('model'):
-                                car_data['model'] = url_parts[-2].replace('-', ' ').title()
-                            logger.info(f"   ✅ Извлечены марка и модель из URL: {car_data.get('mark')} {car_data.get('model')}")
-                    
-                    # Выводим найденные данные для проверки (ВСЕГДА)
-                    logger.info(f"📋 [{idx + 1}/{len(unique_car_links)}] Данные извлечены со страницы: {car_url}")
-                    self._log_extracted_data(car_data, idx + 1)
-                    
-                    # ВСЕГДА пытаемся сохранить, даже если данных немного
-                    logger.info(f"📦 ПЕРЕДАЧА ДАННЫХ В _save_car:")
-                    logger.info(f"   mark={car_data.get('mark')}, model={car_data.get('model')}, price={car_data.get('price')}")
-                    logger.info(f"   year={car_data.get('manufacture_year')}, city={car_data.get('city')}")
-                    logger.info(f"   body_type={car_data.get('body_type')}, fuel_type={car_data.get('fuel_type')}, gear_box={car_data.get('gear_box_type')}")
-                    
-                    saved = self._save_car(car_data)
-                    if saved:
-                        # Проверяем что данные действительно сохранились
-                        saved_car = self.db.query(ParsedCar).filter(
-                            ParsedCar.source_url == car_data['source_url']
-                        ).first()
-                        
-                        if saved_car:
-                            logger.info(f"   ✅ Данные сохранены: mark={saved_car.mark}, model={saved_car.model}, price={saved_car.price}")
-                            
-                            # КРИТИЧНО: Если данные не сохранились, принудительно обновляем
-                            needs_update = False
-                            if not saved_car.mark and car_data.get("mark"):
-                                saved_car.mark = car_data["mark"]
-                                needs_update = True
-                                logger.warning(f"   🔄 ПРИНУДИТЕЛЬНОЕ обновление mark: {car_data['mark']}")
-                            if not saved_car.model and car_data.get("model"):
-                                saved_car.model = car_data["model"]
-                                needs_update = True
-                                logger.warning(f"   🔄 ПРИНУДИТЕЛЬНОЕ обновление model: {car_data['model']}")
-                            if not saved_car.price and car_data.get("price"):
-                                saved_car.price = car_data["price"]
-                                needs_update = True
-                                logger.warning(f"   🔄 ПРИНУДИТЕЛЬНОЕ обновление price: {car_data['price']}")
-                            if not saved_car.manufacture_year and car_data.get("manufacture_year"):
-                                saved_car.manufacture_year = car_data["manufacture_year"]
-                                needs_update = True
-                                logger.warning(f"   🔄 ПРИНУДИТЕЛЬНОЕ обновление year: {car_data['manufacture_year']}")
-                            if not saved_car.body_type and car_data.get("body_type"):
-                                saved_car.body_type = car_data["body_type"]
-                                needs_update = True
-                            if not saved_car.fuel_type and car_data.get("fuel_type"):
-                                saved_car.fuel_type = car_data["fuel_type"]
-                                needs_update = True
-                            if not saved_car.gear_box_type and car_data.get("gear_box_type"):
-                                saved_car.gear_box_type = car_data["gear_box_type"]
-                                needs_update = True
-                            
-                            if needs_update:
-                                self.db.commit()
-                                self.db.refresh(saved_car)
-                                logger.info(f"   ✅ Принудительное обновление выполнено: mark={saved_car.mark}, model={saved_car.model}, price={saved_car.price}")
-                        else:
-                            logger.warning(f"   ⚠️ Запись не найдена после сохранения")
-                    else:
-                        logger.warning(f"   ⚠️ Не удалось сохранить данные для {car_url}")
-                else:
-                    logger.warning(f"⚠️ [{idx + 1}/{len(unique_car_links)}] Не удалось извлечь данные: {car_url}")
-                    print(f"⚠️ [{idx + 1}/{len(unique_car_links)}] Не удалось извлечь данные: {car_url}")
-                    print(f"   Это может означать, что страница не загрузилась или структура изменилась\n")
-                    self.stats["total_errors"] += 1
-                
-                if delay > 0 and idx < len(unique_car_links) - 1:
-                    time.sleep(delay)
+            if self.sync is not None:
+                # Пропавшие объявления снимаются только после полного обхода каталога
+                self.sync.flush()
+                if self.is_running and not max_pages and not max_cars and runner.catalog_complete():
+                    self.sync.deactivate_missing()
+                self.stats["sync"] = self.sync.summary()
+                logger.info(f"🔁 Инкрементальная синхронизация: {self.stats['sync']}")
             
             message = f"Парсинг завершен. Обработано {self.stats['total_parsed']} автомобилей. "
             message += f"NLP извлечений: {self.stats['nlp_extractions']}. "
             if self.use_ollama:
                 message += f"Ollama извлечений: {self.stats['ollama_extractions']}. "
-            message += f"Изменений структуры: {self.stats['structure_changes_detected']}"
+            message += f"Изменений структуры: {self.stats['structure_changes_detected']}. "
+            message += f"По шаблонам разметки: {self.stats['template_extractions']}"
             
             return {
                 "status": "completed",
@@ -2231,6 +2163,9 @@ class AIParser:
             }
         finally:
             self.is_running = False
+            if self.sync is not None:
+                self.sync.flush()
+            self.page_templates.flush()
             if self.session:
                 self.session.close()
                 self.session = None
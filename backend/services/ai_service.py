@@ -270,12 +270,32 @@ class AIService:
             if model_name.startswith("ollama:"):
                 model_name = model_name.replace("ollama:", "")
                 return await self._test_ollama_embedding_model(model_name)
+            elif model_name.startswith("local:"):
+                return await self._test_local_embedding_model(model_name)
             else:
                 # Тестируем внешний API
                 return await self._test_external_embedding_model(model_name)
         except Exception as e:
             raise Exception(f"Ошибка тестирования модели эмбеддингов: {str(e)}")
 
+    async def _test_local_embedding_model(self, model_name: str) -> Dict[str, Any]:
+        """Тестирование локальной модели эмбеддингов (sentence-transformers на CPU)"""
+        from services.embedding_provider_service import create_embedding_provider
+        
+        provider = create_embedding_provider(model_name)
+        try:
+            embedding = (await provider.aembed(["Тестовый текст для эмбеддинга"]))[0]
+        finally:
+            provider.close()
+        if not embedding:
+            raise Exception(f"Локальная модель {model_name} не вернула эмбеддинг")
+        return {
+            "status": "success",
+            "model": model_name,
+            "embedding_length": len(embedding),
+            "type": "local"
+        }
+
     async def _test_ollama_response_model(self, model_name: str) -> Dict[str, Any]:
         """Тестирование модели ответов Ollama"""
         working_url = await self._find_working_ollama_url()
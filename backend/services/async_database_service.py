@@ -0,0 +1,147 @@
+"""
+Асинхронные версии горячих запросов DatabaseService
+
+Используются в async-обработчиках (чат, каталог), чтобы обращения к Postgres
+не блокировали event loop и могли выполняться параллельно с ES и LLM.
+"""
+from sqlalchemy import select, func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Tuple, Dict, Any
+from models.database import Car, UsedCar, Chat, ChatMessage
+from services.database_service import car_filter_conditions
+from services.pagination_service import acached_count, apaginate
+import json
+
+
+class AsyncDatabaseService:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    # Автомобили
+    async def get_cars(self, skip: int = 0, limit: int = 100, **filters) -> Tuple[List[Car], int]:
+        """Получает список новых автомобилей с фильтрацией (те же фильтры, что в DatabaseService.get_cars)"""
+        cars, total, _ = await self._get_catalog_page(Car, skip, limit, None, filters)
+        return cars, total
+
+    async def get_used_cars(self, skip: int = 0, limit: int = 100, **filters) -> Tuple[List[UsedCar], int]:
+        """Получает список подержанных автомобилей с фильтрацией"""
+        cars, total, _ = await self._get_catalog_page(UsedCar, skip, limit, None, filters)
+        return cars, total
+
+    async def get_cars_page(self, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                            **filters) -> Tuple[List[Car], int, Optional[str]]:
+        """Страница новых автомобилей с курсором следующей страницы (см. DatabaseService.get_cars_page)"""
+        return await self._get_catalog_page(Car, skip, limit, cursor, filters)
+
+    async def get_used_cars_page(self, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                                 **filters) -> Tuple[List[UsedCar], int, Optional[str]]:
+        """Страница подержанных автомобилей с курсором следующей страницы"""
+        return await self._get_catalog_page(UsedCar, skip, limit, cursor, filters)
+
+    async def _get_catalog_page(self, model_cls, skip: int, limit: int, cursor: Optional[str],
+                                filters: Dict[str, Any]):
+        conditions = car_filter_conditions(model_cls, **filters)
+        total = await acached_count(self.db, model_cls, conditions, filters)
+        cars, next_cursor = await apaginate(
+            self.db, select(model_cls).where(*conditions),
+            model_cls.created_at, model_cls.id, limit, skip=skip, cursor=cursor
+        )
+        return cars, total, next_cursor
+
+    async def get_car(self, car_id: int) -> Optional[Car]:
+        return await self.db.get(Car, car_id)
+
+    async def get_used_car(self, used_car_id: int) -> Optional[UsedCar]:
+        return await self.db.get(UsedCar, used_car_id)
+
+    async def get_cars_by_ids(self, car_ids: List[int]) -> List[Car]:
+        """Загружает автомобили одним запросом, сохраняя порядок car_ids"""
+        if not car_ids:
+            return []
+        result = await self.db.execute(select(Car).where(Car.id.in_(car_ids)))
+        by_id = {car.id: car for car in result.scalars().all()}
+        return [by_id[cid] for cid in car_ids if cid in by_id]
+
+    # Чаты
+    async def get_chat(self, chat_id: int, user_id: str) -> Optional[Chat]:
+        result = await self.db.execute(
+            select(Chat).where(Chat.id == chat_id, Chat.user_id == user_id)
+        )
+        return result.scalars().first()
+
+    async def create_chat(self, user_id: str, title: Optional[str] = None) -> Chat:
+        chat = Chat(user_id=user_id, title=title)
+        self.db.add(chat)
+        await self.db.commit()
+        await self.db.refresh(chat)
+        return chat
+
+    async def touch_or_create_chat(self, chat_id: Optional[int], user_id: str) -> int:
+        """
+        Обновляет updated_at чата пользователя или создает новый чат
+
+        Заменяет связку get_chat + commit + create_chat одним UPDATE ... RETURNING.
+
+        Returns:
+            ID существующего или созданного чата
+        """
+        if chat_id:
+            result = await self.db.execute(
+                update(Chat)
+                .where(Chat.id == chat_id, Chat.user_id == user_id)
+                .values(updated_at=func.now())
+                .returning(Chat.id)
+            )
+            touched_id = result.scalar()
+            if touched_id is not None:
+                await self.db.commit()
+                return touched_id
+            print(f"⚠️ Предупреждение: chat_id {chat_id} не принадлежит пользователю {user_id}, создаем новый чат")
+
+        chat = await self.create_chat(user_id=user_id, title=None)
+        return chat.id
+
+    async def get_or_create_chat(self, chat_id: Optional[int], user_id: str) -> int:
+        """
+        Проверяет, что чат принадлежит пользователю, или создает новый
+
+        В отличие от touch_or_create_chat только читает существующий чат:
+        updated_at обновляет очередь отложенной записи.
+        """
+        if chat_id:
+            result = await self.db.execute(
+                select(Chat.id).where(Chat.id == chat_id, Chat.user_id == user_id)
+            )
+            found_id = result.scalar()
+            if found_id is not None:
+                return found_id
+            print(f"⚠️ Предупреждение: chat_id {chat_id} не принадлежит пользователю {user_id}, создаем новый чат")
+
+        chat = await self.create_chat(user_id=user_id, title=None)
+        return chat.id
+
+    # Чат сообщения
+    async def save_chat_message(self, user_id: str, message: str, response: str, related_article_ids: List[int],
+                                chat_id: Optional[int] = None, sources_data: Optional[Dict] = None) -> ChatMessage:
+        chat_message = ChatMessage(
+            chat_id=chat_id,
+            user_id=user_id,
+            message=message,
+            response=response,
+            related_article_ids=json.dumps(related_article_ids),
+            sources_data=json.dumps(sources_data) if sources_data else None
+        )
+        self.db.add(chat_message)
+        await self.db.commit()
+        await self.db.refresh(chat_message)
+        return chat_message
+
+    async def get_recent_messages(self, user_id: str, limit: int = 10) -> List[ChatMessage]:
+        """Последние сообщения пользователя (новые первыми)"""
+        result = await self.db.execute(
+            select(ChatMessage)
+            .where(ChatMessage.user_id == user_id)
+            .order_by(ChatMessage.created_at.desc())
+            .limit(limit)
+        )
+        return list(result.scalars().all())
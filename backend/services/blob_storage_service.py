@@ -0,0 +1,125 @@
+"""
+Контентно-адресуемое хранилище файлов на локальной файловой системе
+
+Файл сохраняется по SHA-256 своего содержимого: storage/ab/cd/abcd...,
+поэтому одинаковые загрузки хранятся один раз, а в БД остается только хеш.
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional, Tuple, Union
+
+from app.core.config import settings
+
+READ_CHUNK_SIZE = 1024 * 1024  # 1 МБ
+
+
+class BlobTooLargeError(ValueError):
+    """Поток больше допустимого размера"""
+
+
+class BlobStorage:
+    """Хранилище бинарных данных, адресуемых SHA-256"""
+
+    def __init__(self, root: Union[str, Path]):
+        self.root = Path(root)
+
+    def path_for(self, content_hash: str) -> Path:
+        """Путь к файлу по хешу (двухуровневое разбиение каталогов)"""
+        return self.root / content_hash[:2] / content_hash[2:4] / content_hash
+
+    def exists(self, content_hash: str) -> bool:
+        return bool(content_hash) and self.path_for(content_hash).is_file()
+
+    def size(self, content_hash: str) -> int:
+        return self.path_for(content_hash).stat().st_size
+
+    def put_bytes(self, data: bytes) -> str:
+        """Сохраняет байты и возвращает их SHA-256"""
+        content_hash = hashlib.sha256(data).hexdigest()
+        if not self.exists(content_hash):
+            self._write_atomic(content_hash, lambda f: f.write(data))
+        return content_hash
+
+    def put_stream(self, stream: BinaryIO, max_bytes: Optional[int] = None) -> Tuple[str, int]:
+        """
+        Сохраняет поток, считая хеш по мере записи (без загрузки файла в память)
+
+        Args:
+            max_bytes: Предел размера; при превышении запись прерывается (None - без предела)
+
+        Returns:
+            (sha256, размер в байтах)
+
+        Raises:
+            BlobTooLargeError: Поток больше max_bytes (временный файл удален)
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                while True:
+                    chunk = stream.read(READ_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if max_bytes is not None and size > max_bytes:
+                        raise BlobTooLargeError(f"Файл больше {max_bytes} байт")
+                    hasher.update(chunk)
+                    tmp_file.write(chunk)
+            content_hash = hasher.hexdigest()
+            if self.exists(content_hash):
+                os.unlink(tmp_path)
+            else:
+                target = self.path_for(content_hash)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_path, target)
+            return content_hash, size
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def read_bytes(self, content_hash: str) -> bytes:
+        return self.path_for(content_hash).read_bytes()
+
+    def iter_range(self, content_hash: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Читает файл кусками в диапазоне [start, end] включительно"""
+        path = self.path_for(content_hash)
+        if end is None:
+            end = path.stat().st_size - 1
+        remaining = end - start + 1
+        with open(path, "rb") as f:
+            f.seek(start)
+            while remaining > 0:
+                chunk = f.read(min(READ_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def delete(self, content_hash: str) -> bool:
+        path = self.path_for(content_hash)
+        if path.is_file():
+            path.unlink()
+            return True
+        return False
+
+    def _write_atomic(self, content_hash: str, writer):
+        target = self.path_for(content_hash)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=target.parent, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                writer(tmp_file)
+            os.replace(tmp_path, target)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+
+document_blob_storage = BlobStorage(settings.document_storage_dir)
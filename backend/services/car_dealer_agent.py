@@ -623,6 +623,9 @@ class CarDealerAgent:
         related_cars = []
         related_used_cars = []
         
+        # Ссылки на автомобили, которые нужно загрузить из БД (одним запросом на тип)
+        refs_to_load = []
+        
         for result in final_state.get("search_results", []):
             # UnifiedSearchService возвращает словари с ключом "data"
             if isinstance(result, dict):
@@ -637,18 +640,8 @@ class CarDealerAgent:
                     else:
                         related_cars.append(data)
                 # Если data - это словарь или есть car_id, загружаем из БД
-                elif car_id and self.db_session:
-                    from services.database_service import DatabaseService
-                    db_service = DatabaseService(self.db_session)
-                    
-                    if car_type == "used_car":
-                        used_car = db_service.get_used_car(car_id)
-                        if used_car:
-                            related_used_cars.append(used_car)
-                    else:
-                        car = db_service.get_car(car_id)
-                        if car:
-                            related_cars.append(car)
+                elif car_id:
+                    refs_to_load.append(("used_car" if car_type == "used_car" else "car", car_id))
             # Если result - это уже объект Car/UsedCar
             elif hasattr(result, 'id'):
                 if hasattr(result, 'mileage') and result.mileage is not None:
@@ -656,6 +649,12 @@ class CarDealerAgent:
                 else:
                     related_cars.append(result)
         
+        if refs_to_load and self.db_session:
+            from services.car_hydration_service import CarHydrator
+            loaded_cars, loaded_used_cars = CarHydrator(self.db_session).hydrate(refs_to_load)
+            related_cars.extend(loaded_cars)
+            related_used_cars.extend(loaded_used_cars)
+        
         # Убеждаемся, что response не пустой
         response_text = final_state.get("response", "")
         if not response_text or not response_text.strip():
@@ -16,6 +16,7 @@ from services.fuzzy_query_interpreter import FuzzyQueryInterpreter
 from services.recommendation_service import RecommendationService
 from services.finance_calculator_service import FinanceCalculatorService
 from services.elasticsearch_service import ElasticsearchService
+from services.facet_service import facet_store
 from services.ai_model_orchestrator_service import AIModelOrchestratorService, TaskType
 
 
@@ -239,33 +240,16 @@ class CarDealerAssistantService:
             return {}
     
     def _get_available_brands(self) -> List[str]:
-        """Получает список доступных марок"""
+        """Получает список доступных марок (самые представленные в каталоге)"""
         try:
-            # Простой поиск для получения марок
-            result = self.es_service.search_cars(limit=100)
-            brands = set()
-            
-            for hit in result.get("hits", []):
-                brand = hit.get("_source", {}).get("mark")
-                if brand:
-                    brands.add(brand)
-            
-            return list(brands)[:20]  # Возвращаем до 20 марок
+            return facet_store.brands(limit=20)  # Возвращаем до 20 марок
         except Exception:
             return []
     
     def _get_available_categories(self) -> List[str]:
         """Получает список доступных категорий"""
         try:
-            result = self.es_service.search_cars(limit=100)
-            categories = set()
-            
-            for hit in result.get("hits", []):
-                category = hit.get("_source", {}).get("body_type") or hit.get("_source", {}).get("category")
-                if category:
-                    categories.add(category)
-            
-            return list(categories)[:15]  # Возвращаем до 15 категорий
+            return facet_store.body_types(limit=15)  # Возвращаем до 15 категорий
         except Exception:
             return []
     
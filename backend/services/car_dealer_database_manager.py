@@ -5,6 +5,7 @@
 from typing import Dict, Any, List, Optional
 from services.elasticsearch_service import ElasticsearchService
 from services.database_service import DatabaseService
+from services.facet_service import facet_store
 from services.finance_calculator_service import FinanceCalculatorService
 
 
@@ -46,15 +47,7 @@ class CarDealerDatabaseManagerService:
     def get_available_brands(self) -> List[str]:
         """Получает список доступных марок"""
         try:
-            result = self.es_service.search_cars(limit=500)
-            brands = set()
-            
-            for hit in result.get("hits", []):
-                brand = hit.get("_source", {}).get("mark")
-                if brand:
-                    brands.add(brand)
-            
-            return sorted(list(brands))
+            return facet_store.brands(by_count=False)
         except Exception as e:
             print(f"⚠️ Ошибка получения марок: {e}")
             return []
@@ -62,15 +55,7 @@ class CarDealerDatabaseManagerService:
     def get_available_categories(self) -> List[str]:
         """Получает список доступных категорий кузова"""
         try:
-            result = self.es_service.search_cars(limit=500)
-            categories = set()
-            
-            for hit in result.get("hits", []):
-                category = hit.get("_source", {}).get("body_type") or hit.get("_source", {}).get("category")
-                if category:
-                    categories.add(category)
-            
-            return sorted(list(categories))
+            return facet_store.body_types(by_count=False)
         except Exception as e:
             print(f"⚠️ Ошибка получения категорий: {e}")
             return []
@@ -0,0 +1,187 @@
+"""
+Загрузка автомобилей для результатов поиска (Elasticsearch, pgvector, SQL)
+
+Вместо get_car/get_used_car на каждый hit все ID одного типа загружаются одним
+запросом IN, а фотографии и опции - через selectinload (еще по одному запросу на
+связь, а не на автомобиль). Если в _source хита есть все поля краткой карточки,
+карточка строится прямо из него, без обращения к Postgres.
+"""
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session, selectinload
+
+from models.database import Car, UsedCar
+
+# Поля краткой карточки автомобиля в результатах поиска
+SUMMARY_FIELDS = ("id", "type", "mark", "model", "price", "city", "manufacture_year")
+
+# (type, id); type = None - тип неизвестен, ищем в обеих таблицах
+CarRef = Tuple[Optional[str], int]
+
+
+def parse_price(value: Any) -> Optional[float]:
+    """Цена в каталоге хранится строкой ("1 500 000", "1500000.0")"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    cleaned = re.sub(r"[^\d.,]", "", str(value)).replace(",", ".")
+    try:
+        return float(cleaned) if cleaned else None
+    except ValueError:
+        return None
+
+
+def car_to_dict(car_obj: Any) -> Dict[str, Any]:
+    """Краткая карточка Car/UsedCar для результатов поиска"""
+    if not car_obj:
+        return {}
+    result = {
+        "id": car_obj.id,
+        "mark": car_obj.mark,
+        "model": car_obj.model,
+        "price": car_obj.price,
+        "city": car_obj.city,
+        "manufacture_year": car_obj.manufacture_year,
+    }
+    if hasattr(car_obj, "mileage"):
+        result["mileage"] = car_obj.mileage
+        result["type"] = "used_car"
+    else:
+        result["type"] = "car"
+    return result
+
+
+def car_summary_from_source(source: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Краткая карточка из _source хита Elasticsearch (None, если полей не хватает)"""
+    if not source or any(source.get(field) in (None, "") for field in SUMMARY_FIELDS):
+        return None
+    if source["type"] not in ("car", "used_car"):
+        return None
+    summary = {field: source[field] for field in SUMMARY_FIELDS}
+    if source["type"] == "used_car":
+        if source.get("mileage") is None:
+            return None
+        summary["mileage"] = source["mileage"]
+    return summary
+
+
+def ref_from_source(source: Dict[str, Any]) -> Optional[CarRef]:
+    """(type, id) из _source хита или словаря автомобиля; тип выводится по mileage"""
+    car_id = (source or {}).get("id")
+    if not car_id:
+        return None
+    car_type = source.get("type")
+    if car_type not in ("car", "used_car"):
+        car_type = "used_car" if source.get("mileage") is not None else None
+    return car_type, int(car_id)
+
+
+class CarHydrator:
+    """Пакетная загрузка Car/UsedCar по ссылкам (type, id)"""
+
+    def __init__(self, db: Session, with_relations: bool = True):
+        """
+        Args:
+            db: SQLAlchemy сессия
+            with_relations: Загружать ли фотографии и опции вместе с автомобилями
+        """
+        self.db = db
+        self.with_relations = with_relations
+
+    def _load_options(self, model_cls, with_relations: bool) -> list:
+        if not with_relations:
+            return []
+        if model_cls is Car:
+            return [selectinload(Car.pictures), selectinload(Car.options), selectinload(Car.options_groups)]
+        return [selectinload(UsedCar.pictures)]
+
+    def load_many(self, model_cls, ids: Iterable[int], with_relations: Optional[bool] = None) -> Dict[int, Any]:
+        """Загружает автомобили одного типа одним запросом IN: {id: объект}"""
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return {}
+        if with_relations is None:
+            with_relations = self.with_relations
+        cars = (
+            self.db.query(model_cls)
+            .options(*self._load_options(model_cls, with_relations))
+            .filter(model_cls.id.in_(ids))
+            .all()
+        )
+        return {car.id: car for car in cars}
+
+    def hydrate(self, refs: Iterable[CarRef], fallback: bool = False,
+                with_relations: Optional[bool] = None) -> Tuple[List[Car], List[UsedCar]]:
+        """
+        Загружает автомобили по ссылкам, сохраняя порядок и убирая дубликаты
+
+        Args:
+            refs: Ссылки (type, id); type = None - ищем сначала в cars, затем в used_cars
+            fallback: Искать автомобиль в другой таблице, если по указанному типу не найден
+            with_relations: Переопределяет with_relations конструктора
+
+        Returns:
+            (новые автомобили, подержанные автомобили)
+        """
+        refs = [ref for ref in dict.fromkeys(refs) if ref and ref[1]]
+        car_ids = [car_id for car_type, car_id in refs if car_type != "used_car" or fallback]
+        used_ids = [car_id for car_type, car_id in refs if car_type != "car" or fallback]
+        cars_by_id = self.load_many(Car, car_ids, with_relations)
+        used_by_id = self.load_many(UsedCar, used_ids, with_relations)
+
+        cars: List[Car] = []
+        used_cars: List[UsedCar] = []
+        seen = set()
+        for car_type, car_id in refs:
+            order = [("used_car", used_by_id), ("car", cars_by_id)] if car_type == "used_car" \
+                else [("car", cars_by_id), ("used_car", used_by_id)]
+            if car_type is not None and not fallback:
+                order = order[:1]
+            for found_type, by_id in order:
+                car = by_id.get(car_id)
+                if car is not None:
+                    if (found_type, car_id) not in seen:
+                        seen.add((found_type, car_id))
+                        (used_cars if found_type == "used_car" else cars).append(car)
+                    break
+        return cars, used_cars
+
+    def hydrate_hits(self, hits: Iterable[Dict[str, Any]], fallback: bool = False) -> Tuple[List[Car], List[UsedCar]]:
+        """Загружает автомобили для хитов Elasticsearch"""
+        return self.hydrate(
+            (ref_from_source(hit.get("_source") or {}) for hit in hits),
+            fallback=fallback
+        )
+
+    def summaries_from_hits(self, hits: Iterable[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Краткие карточки для хитов Elasticsearch (в порядке хитов)
+
+        Полные _source используются как есть; из Postgres одним запросом на тип
+        догружаются только хиты с неполным _source. None - автомобиля нет в каталоге.
+        """
+        hits = list(hits)
+        summaries: List[Optional[Dict[str, Any]]] = [
+            car_summary_from_source(hit.get("_source") or {}) for hit in hits
+        ]
+        missing = {
+            index: ref_from_source(hits[index].get("_source") or {})
+            for index, summary in enumerate(summaries) if summary is None
+        }
+        refs = [ref for ref in missing.values() if ref]
+        if refs:
+            cars, used_cars = self.hydrate(refs, with_relations=False)
+            loaded = {("car", car.id): car_to_dict(car) for car in cars}
+            loaded.update({("used_car", car.id): car_to_dict(car) for car in used_cars})
+            for index, ref in missing.items():
+                if not ref:
+                    continue
+                car_type, car_id = ref
+                if car_type is None:
+                    # Тип неизвестен: hydrate искал в обеих таблицах, сначала в cars
+                    summaries[index] = loaded.get(("car", car_id)) or loaded.get(("used_car", car_id))
+                else:
+                    summaries[index] = loaded.get((car_type, car_id))
+        return summaries
@@ -0,0 +1,365 @@
+"""
+Перенос автомобилей из таблиц импорта в каталог (cars, used_cars) set-based запросами
+
+Вместо создания ORM-объекта на каждый автомобиль перенос выполняется несколькими
+INSERT ... SELECT в одной транзакции:
+
+1. Во временную таблицу-карту (import_id -> new_id) отбираются записи импорта;
+   id каталога выделяются заранее (nextval последовательности в Postgres,
+   MAX(id) + ROW_NUMBER() в SQLite), поэтому фотографии и опции переносятся
+   тем же INSERT ... SELECT через JOIN с картой, без обхода по одной записи.
+2. Режимы:
+   replace - старые строки каталога удаляются и заменяются импортом;
+   append  - импорт добавляется к каталогу;
+   upsert  - сопоставление по VIN: совпавшие автомобили обновляются, только если
+             изменились поля, фотографии или опции; остальные добавляются.
+3. Все шаги выполняются в одной транзакции: до коммита читатели видят прежний
+   каталог, поэтому он не бывает пустым посреди миграции, а ошибка откатывает все.
+"""
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import (
+    Boolean, Column, Integer, MetaData, Table, and_, delete, exists, func, insert,
+    literal, not_, or_, select, update,
+)
+from sqlalchemy.orm import Session
+
+from models.database import (
+    Car, CarOption, CarOptionsGroup, CarPicture, ImportCar, ImportCarOption,
+    ImportCarPicture, ImportUsedCar, ImportUsedCarPicture, UsedCar, UsedCarPicture,
+)
+
+MIGRATION_MODES = ("replace", "append", "upsert")
+
+# Служебные колонки импорта и каталога, которые не переносятся
+_SKIP_COLUMNS = {
+    "id", "import_status", "import_source", "import_error", "imported_at", "migrated_at",
+    "created_at", "updated_at",
+}
+
+
+@dataclass(frozen=True)
+class _CatalogSpec:
+    """Соответствие таблиц импорта и каталога для одного типа автомобилей"""
+    car_type: str  # "new" или "used"
+    source: Table
+    target: Table
+    source_pictures: Table
+    target_pictures: Table
+    picture_fk: str  # Колонка ссылки на автомобиль в таблицах фотографий (одинакова в импорте и каталоге)
+    source_options: Optional[Table] = None
+    target_options: Optional[Table] = None
+    target_option_groups: Optional[Table] = None
+
+    @property
+    def columns(self) -> List[str]:
+        """Переносимые колонки: общие для импорта и каталога"""
+        return [
+            column.name for column in self.source.columns
+            if column.name not in _SKIP_COLUMNS and column.name in self.target.columns
+        ]
+
+
+_SPECS = {
+    "new": _CatalogSpec(
+        car_type="new",
+        source=ImportCar.__table__,
+        target=Car.__table__,
+        source_pictures=ImportCarPicture.__table__,
+        target_pictures=CarPicture.__table__,
+        picture_fk="car_id",
+        source_options=ImportCarOption.__table__,
+        target_options=CarOption.__table__,
+        target_option_groups=CarOptionsGroup.__table__,
+    ),
+    "used": _CatalogSpec(
+        car_type="used",
+        source=ImportUsedCar.__table__,
+        target=UsedCar.__table__,
+        source_pictures=ImportUsedCarPicture.__table__,
+        target_pictures=UsedCarPicture.__table__,
+        picture_fk="used_car_id",
+    ),
+}
+
+
+def _normalized_vin(column):
+    """VIN без пробелов в верхнем регистре (как в DatabaseService.get_car_by_vin)"""
+    return func.upper(func.replace(func.trim(column), " ", ""))
+
+
+class CatalogMigrationService:
+    """Set-based перенос импорта в каталог"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def migrate(self, car_type: Optional[str] = None, mode: str = "replace") -> Dict[str, Any]:
+        """
+        Переносит записи импорта со статусом imported в каталог одной транзакцией
+
+        Args:
+            car_type: "new", "used" или None (оба типа)
+            mode: replace, append или upsert (по VIN)
+
+        Returns:
+            Статистика по типам: {"new": {...}, "used": {...}}; у каждого типа
+            inserted, updated, unchanged, deleted_old, pictures, options
+        """
+        if mode not in MIGRATION_MODES:
+            raise ValueError(f"Неизвестный режим миграции: {mode}. Допустимо: {', '.join(MIGRATION_MODES)}")
+        car_types = [car_type] if car_type else list(_SPECS)
+        for name in car_types:
+            if name not in _SPECS:
+                raise ValueError(f"Неизвестный тип автомобиля: {name}")
+
+        started = time.perf_counter()
+        try:
+            result = {name: self._migrate_type(_SPECS[name], mode) for name in car_types}
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+        print(f"🚚 Миграция импорта ({mode}) за {time.perf_counter() - started:.1f}с: " + ", ".join(
+            f"{name}: +{stats['inserted']} ~{stats['updated']} ={stats['unchanged']} -{stats['deleted_old']}"
+            for name, stats in result.items()
+        ))
+        return result
+
+    # ------------------------------------------------------------------
+    # Один тип автомобилей
+    # ------------------------------------------------------------------
+
+    def _migrate_type(self, spec: _CatalogSpec, mode: str) -> Dict[str, int]:
+        stats = {"inserted": 0, "updated": 0, "unchanged": 0, "deleted_old": 0, "pictures": 0, "options": 0}
+        id_map = self._create_id_map(spec)
+        if mode == "upsert":
+            self._stage_upsert(spec, id_map)
+            stats["updated"] = self._update_changed(spec, id_map)
+            stats["unchanged"] = self._count(id_map, id_map.c.matched, not_(id_map.c.changed))
+        else:
+            self._stage_new_rows(spec, id_map, self._source_rows(spec))
+            if mode == "replace":
+                stats["deleted_old"] = self._delete_catalog(spec)
+
+        stats["inserted"] = self._insert_new_cars(spec, id_map)
+        stats["pictures"], stats["options"] = self._copy_children(spec, id_map)
+        self._mark_migrated(spec, id_map)
+        # При ошибке карта удаляется откатом транзакции
+        id_map.drop(bind=self.db.connection())
+        return stats
+
+    def _create_id_map(self, spec: _CatalogSpec) -> Table:
+        """
+        Временная таблица-карта: запись импорта -> id автомобиля в каталоге
+
+        matched - автомобиль уже есть в каталоге (upsert), иначе строка создается
+        с заранее выделенным new_id; changed - фотографии и опции перезаписываются.
+        """
+        id_map = Table(
+            f"migration_map_{spec.target.name}",
+            MetaData(),
+            Column("import_id", Integer, primary_key=True),
+            Column("new_id", Integer, nullable=False, index=True),
+            Column("matched", Boolean, nullable=False, default=False),
+            Column("changed", Boolean, nullable=False, default=True),
+            prefixes=["TEMPORARY"],
+        )
+        connection = self.db.connection()
+        id_map.drop(bind=connection, checkfirst=True)
+        id_map.create(bind=connection)
+        return id_map
+
+    def _source_rows(self, spec: _CatalogSpec):
+        """Условие отбора записей импорта"""
+        return spec.source.c.import_status == "imported"
+
+    def _allocate_ids(self, spec: _CatalogSpec):
+        """Выражение нового id каталога для INSERT ... SELECT в карту"""
+        if self.db.get_bind().dialect.name == "postgresql":
+            return func.nextval(func.pg_get_serial_sequence(spec.target.name, "id"))
+        # SQLite: запись в БД сериализована, MAX(id) внутри транзакции стабилен
+        current_max = select(func.coalesce(func.max(spec.target.c.id), 0)).scalar_subquery()
+        return current_max + func.row_number().over(order_by=spec.source.c.id)
+
+    def _stage_new_rows(self, spec: _CatalogSpec, id_map: Table, condition):
+        """Добавляет в карту записи импорта, для которых создаются новые строки каталога"""
+        self.db.execute(
+            insert(id_map).from_select(
+                ["import_id", "new_id", "matched", "changed"],
+                select(spec.source.c.id, self._allocate_ids(spec), literal(False), literal(True))
+                .where(condition)
+                .order_by(spec.source.c.id)
+            )
+        )
+
+    def _stage_upsert(self, spec: _CatalogSpec, id_map: Table):
+        """
+        Карта для upsert по VIN
+
+        Из нескольких записей импорта с одним VIN берется последняя. Запись
+        сопоставляется с автомобилем каталога с тем же VIN (наименьший id).
+        """
+        source, target = spec.source, spec.target
+        source_vin = _normalized_vin(source.c.vin)
+        has_vin = and_(source.c.vin.isnot(None), func.trim(source.c.vin) != "")
+
+        latest_per_vin = (
+            select(func.max(source.c.id))
+            .where(self._source_rows(spec), has_vin)
+            .group_by(source_vin)
+        )
+        staged = and_(self._source_rows(spec), or_(not_(has_vin), source.c.id.in_(latest_per_vin)))
+
+        existing_id = (
+            select(func.min(target.c.id))
+            .where(_normalized_vin(target.c.vin) == source_vin)
+            .scalar_subquery()
+        )
+        # Совпавшие по VIN - id существующего автомобиля
+        self.db.execute(
+            insert(id_map).from_select(
+                ["import_id", "new_id", "matched", "changed"],
+                select(source.c.id, existing_id, literal(True), literal(False))
+                .where(staged, has_vin, existing_id.isnot(None))
+            )
+        )
+        # Остальные - новые строки каталога
+        self._stage_new_rows(spec, id_map, and_(staged, source.c.id.notin_(select(id_map.c.import_id))))
+        self._mark_changed(spec, id_map)
+
+    def _mark_changed(self, spec: _CatalogSpec, id_map: Table):
+        """Помечает совпавшие автомобили, у которых отличаются поля, фотографии или опции"""
+        source, target = spec.source, spec.target
+        fields_differ = exists().where(
+            source.c.id == id_map.c.import_id,
+            target.c.id == id_map.c.new_id,
+            or_(*[target.c[name].is_distinct_from(source.c[name]) for name in spec.columns]),
+        )
+        conditions = [fields_differ]
+
+        picture_columns = ("url", "type", "seqno")
+        conditions += self._children_differ(
+            spec.source_pictures, spec.target_pictures, spec.picture_fk, picture_columns, id_map
+        )
+        if spec.source_options is not None:
+            conditions += self._children_differ(
+                spec.source_options, spec.target_options, "car_id", ("code", "description"), id_map
+            )
+
+        self.db.execute(
+            update(id_map)
+            .where(id_map.c.matched, or_(*conditions))
+            .values(changed=True)
+        )
+
+    @staticmethod
+    def _children_differ(source_children: Table, target_children: Table, fk: str,
+                         columns: tuple, id_map: Table) -> list:
+        """Условия: у записи импорта есть строка, которой нет в каталоге, и наоборот"""
+        def same(a, b):
+            return and_(*[a.c[name].is_not_distinct_from(b.c[name]) for name in columns])
+
+        conditions = []
+        for outer, outer_key, inner, inner_key in (
+            (source_children.alias(), id_map.c.import_id, target_children.alias(), id_map.c.new_id),
+            (target_children.alias(), id_map.c.new_id, source_children.alias(), id_map.c.import_id),
+        ):
+            conditions.append(exists().where(
+                outer.c[fk] == outer_key,
+                ~exists().where(inner.c[fk] == inner_key, same(inner, outer)),
+            ))
+        return conditions
+
+    def _update_changed(self, spec: _CatalogSpec, id_map: Table) -> int:
+        """Обновляет поля изменившихся автомобилей и удаляет их фотографии/опции для перезаписи"""
+        source, target = spec.source, spec.target
+        changed_ids = select(id_map.c.new_id).where(id_map.c.matched, id_map.c.changed)
+
+        values = {name: source.c[name] for name in spec.columns}
+        if "updated_at" in target.c:
+            values["updated_at"] = func.now()
+        updated = self.db.execute(
+            update(target)
+            .where(target.c.id == id_map.c.new_id, id_map.c.import_id == source.c.id,
+                   id_map.c.matched, id_map.c.changed)
+            .values(values)
+        ).rowcount or 0
+
+        self.db.execute(delete(spec.target_pictures).where(spec.target_pictures.c[spec.picture_fk].in_(changed_ids)))
+        if spec.target_options is not None:
+            self.db.execute(delete(spec.target_options).where(spec.target_options.c.car_id.in_(changed_ids)))
+        return updated
+
+    def _delete_catalog(self, spec: _CatalogSpec) -> int:
+        """Удаляет текущий каталог типа (режим replace; видно другим только после коммита)"""
+        self.db.execute(delete(spec.target_pictures))
+        if spec.target_options is not None:
+            self.db.execute(delete(spec.target_options))
+            self.db.execute(delete(spec.target_option_groups))
+        return self.db.execute(delete(spec.target)).rowcount or 0
+
+    def _insert_new_cars(self, spec: _CatalogSpec, id_map: Table) -> int:
+        """INSERT ... SELECT новых автомобилей с заранее выделенными id"""
+        source = spec.source
+        columns = spec.columns
+        return self.db.execute(
+            insert(spec.target).from_select(
+                ["id", *columns],
+                select(id_map.c.new_id, *[source.c[name] for name in columns])
+                .select_from(source.join(id_map, id_map.c.import_id == source.c.id))
+                .where(not_(id_map.c.matched))
+                .order_by(id_map.c.new_id)
+            )
+        ).rowcount or 0
+
+    def _copy_children(self, spec: _CatalogSpec, id_map: Table):
+        """Фотографии и опции новых и обновленных автомобилей: один INSERT ... SELECT на таблицу"""
+        rewritten = id_map.c.changed  # Новые строки всегда changed, совпавшие - только измененные
+        source_pictures = spec.source_pictures
+        pictures = self.db.execute(
+            insert(spec.target_pictures).from_select(
+                [spec.picture_fk, "url", "type", "seqno"],
+                select(id_map.c.new_id, source_pictures.c.url, source_pictures.c.type, source_pictures.c.seqno)
+                .select_from(source_pictures.join(id_map, id_map.c.import_id == source_pictures.c[spec.picture_fk]))
+                .where(rewritten)
+                .order_by(source_pictures.c.id)
+            )
+        ).rowcount or 0
+
+        options = 0
+        if spec.source_options is not None:
+            source_options = spec.source_options
+            options = self.db.execute(
+                insert(spec.target_options).from_select(
+                    ["car_id", "code", "description"],
+                    select(id_map.c.new_id, source_options.c.code, source_options.c.description)
+                    .select_from(source_options.join(id_map, id_map.c.import_id == source_options.c.car_id))
+                    .where(rewritten)
+                    .order_by(source_options.c.id)
+                )
+            ).rowcount or 0
+        return pictures, options
+
+    def _mark_migrated(self, spec: _CatalogSpec, id_map: Table):
+        """Статус migrated для перенесенных записей и дубликатов VIN, вытесненных последней записью"""
+        source = spec.source
+        staged = select(id_map.c.import_id)
+        superseded = and_(
+            self._source_rows(spec),
+            source.c.vin.isnot(None),
+            _normalized_vin(source.c.vin).in_(
+                select(_normalized_vin(spec.target.c.vin)).where(spec.target.c.id.in_(select(id_map.c.new_id)))
+            ),
+        )
+        self.db.execute(
+            update(source)
+            .where(or_(source.c.id.in_(staged), superseded))
+            .values(import_status="migrated", migrated_at=func.now())
+        )
+
+    def _count(self, id_map: Table, *conditions) -> int:
+        return self.db.execute(select(func.count()).select_from(id_map).where(*conditions)).scalar() or 0
@@ -0,0 +1,392 @@
+"""
+Отложенная (write-behind) запись сообщений чата в Postgres
+
+Ход диалога подтверждается, как только он записан в Redis: реплика истории
+(chat:history:*) и операции сохранения попадают в одну транзакцию MULTI/EXEC,
+а в Postgres их переносит фоновый обработчик пачками - одна транзакция БД на
+пачку вместо двух-трех коммитов на каждое сообщение.
+
+Очередь chat:persist:queue - список JSON-операций в порядке поступления:
+- message - вставка сообщения с заранее выделенным ID (ответ API сразу
+  содержит message_id, по которому можно отправить обратную связь);
+- touch - обновление updated_at чата;
+- feedback - оценка ответа.
+
+ID сообщений выделяются блоками из последовательности chat_messages.id
+(один запрос на chat_message_id_block_size сообщений). Операции идемпотентны
+(INSERT ... ON CONFLICT DO NOTHING, updated_at = greatest(...), feedback
+перезаписывается), поэтому пачка удаляется из очереди только после коммита:
+при падении процесса между коммитом и удалением пачка просто повторяется.
+Сохранность очереди при перезапуске обеспечивает персистентность Redis (AOF/RDB).
+Пачки обрабатывает один процесс за раз (блокировка chat:persist:lock).
+
+Если пачка не записывается из-за данных (слишком длинное значение, нарушение
+ограничения), операции применяются по одной, а не записавшиеся переносятся в
+chat:persist:dead с текстом ошибки - одна плохая операция не задерживает
+остальные. При недоступности БД пачка остается в очереди целиком.
+
+Счетчики chat:persist:enqueued и chat:persist:flushed (поставлено в очередь и
+обработано) позволяют читателям chat_messages дождаться записи всех ходов,
+подтвержденных до чтения (wait_persisted).
+
+Отложенная запись включается только для PostgreSQL и доступного Redis: без
+Redis (хранилище в памяти процесса) очередь не переживет перезапуск, и
+сообщения сохраняются в БД сразу, как раньше.
+"""
+import asyncio
+import json
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import bindparam, func, select, text, update
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.core.config import settings
+from app.core.redis_client import CONNECTION_ERRORS, redis_manager
+from models import async_engine
+from models.database import Chat, ChatMessage
+
+QUEUE_KEY = "chat:persist:queue"
+LOCK_KEY = "chat:persist:lock"
+DEAD_LETTER_KEY = "chat:persist:dead"
+ENQUEUED_KEY = "chat:persist:enqueued"
+FLUSHED_KEY = "chat:persist:flushed"
+PENDING_TTL_SECONDS = 86400  # Метка "сообщение еще в очереди" (для обратной связи до записи в БД)
+LOCK_TTL_SECONDS = 30  # Блокировка обработчика; пачки берутся, пока не прошла половина срока
+
+# Снятие блокировки только ее владельцем
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _pending_key(message_id: int) -> str:
+    return f"chat:persist:msg:{message_id}"
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _is_data_error(error: Exception) -> bool:
+    """Ошибка в данных операции (повтор не поможет), а не недоступность БД"""
+    if isinstance(error, (AttributeError, KeyError, TypeError, ValueError)):
+        return True
+    if isinstance(error, (sa_exc.OperationalError, sa_exc.InterfaceError)):
+        return False
+    if getattr(error, "connection_invalidated", False):
+        return False
+    return isinstance(error, sa_exc.StatementError)
+
+
+def _dead_letter(item: str, error: Any) -> str:
+    return json.dumps({"item": item, "error": str(error)[:500], "at": _now_iso()}, ensure_ascii=False)
+
+
+class ChatWriteBehindService:
+    """Очередь сохранения сообщений чата в Redis и фоновый перенос ее в Postgres"""
+
+    def __init__(self):
+        self.flush_interval = settings.chat_persist_flush_interval_seconds
+        self.batch_size = settings.chat_persist_batch_size
+        self.id_block_size = settings.chat_message_id_block_size
+        self._ids: deque = deque()
+        self._ids_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def enabled(self) -> bool:
+        """Отложенная запись возможна: PostgreSQL и Redis (не хранилище в памяти) доступны"""
+        return (
+            settings.chat_write_behind_enabled
+            and async_engine is not None
+            and async_engine.dialect.name == "postgresql"
+            and redis_manager.status()["backend"] == "redis"
+        )
+
+    async def reserve_message_id(self) -> int:
+        """Выделяет ID сообщения из последовательности chat_messages (блоками)"""
+        if self._ids_lock is None:
+            self._ids_lock = asyncio.Lock()
+        async with self._ids_lock:
+            if not self._ids:
+                async with async_engine.connect() as conn:
+                    result = await conn.execute(
+                        text(
+                            "SELECT nextval(pg_get_serial_sequence('chat_messages', 'id')) "
+                            "FROM generate_series(1, :count)"
+                        ),
+                        {"count": self.id_block_size}
+                    )
+                    self._ids.extend(result.scalars().all())
+            return self._ids.popleft()
+
+    @staticmethod
+    def turn_ops(message_id: int, chat_id: int, user_id: str, message: str, response: str,
+                 related_article_ids: List[int], sources_data: Optional[Dict]) -> List[Dict[str, Any]]:
+        """Операции сохранения одного хода: сообщение и обновление чата"""
+        created_at = _now_iso()
+        return [
+            {
+                "op": "message",
+                "id": message_id,
+                "chat_id": chat_id,
+                "user_id": user_id,
+                "message": message,
+                "response": response,
+                "related_article_ids": json.dumps(related_article_ids),
+                "sources_data": json.dumps(sources_data) if sources_data else None,
+                "created_at": created_at,
+            },
+            {"op": "touch", "chat_id": chat_id, "at": created_at},
+        ]
+
+    async def enqueue(self, ops: List[Dict[str, Any]], history_key: Optional[str] = None,
+                      history_entry: Optional[str] = None) -> bool:
+        """
+        Ставит операции в очередь одной транзакцией с записью реплики истории
+
+        Returns:
+            False, если Redis недоступен: операции нужно записать в БД сразу (write_now)
+        """
+        backend = await redis_manager.async_backend()
+        if backend is redis_manager.async_memory:
+            return False
+        try:
+            pipe = backend.pipeline(transaction=True)
+            if history_key:
+                pipe.rpush(history_key, history_entry)
+            pipe.rpush(QUEUE_KEY, *[json.dumps(op, ensure_ascii=False, default=str) for op in ops])
+            pipe.incrby(ENQUEUED_KEY, len(ops))
+            for op in ops:
+                if op["op"] == "message":
+                    pipe.set(_pending_key(op["id"]), 1, ex=PENDING_TTL_SECONDS)
+            await pipe.execute()
+            return True
+        except CONNECTION_ERRORS as e:
+            redis_manager.mark_down(e)
+            return False
+
+    async def is_pending(self, message_id: int) -> bool:
+        """Сообщение еще в очереди и не записано в БД"""
+        backend = await redis_manager.async_backend()
+        if backend is redis_manager.async_memory:
+            return False
+        try:
+            return bool(await backend.exists(_pending_key(message_id)))
+        except CONNECTION_ERRORS as e:
+            redis_manager.mark_down(e)
+            return False
+
+    @staticmethod
+    def feedback_op(message_id: int, feedback: int, comment: Optional[str]) -> Dict[str, Any]:
+        """Операция обратной связи; в очереди она идет после сообщения, поэтому порядок сохраняется"""
+        return {"op": "feedback", "id": message_id, "feedback": feedback, "comment": comment}
+
+    async def wait_persisted(self, timeout: Optional[float] = None) -> bool:
+        """
+        Дожидается записи в БД всех операций, поставленных в очередь до вызова
+
+        Вызывается перед чтением chat_messages, чтобы последние ходы не пропали
+        из выдачи. Очередь переносится сразу (если обработчик другого процесса
+        держит блокировку - ожидание его записи), но не дольше timeout.
+
+        Returns:
+            False, если за timeout записано не все
+        """
+        if not self.enabled():
+            return True
+        timeout = settings.chat_persist_read_wait_seconds if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        try:
+            backend = await redis_manager.async_backend()
+            if backend is redis_manager.async_memory:
+                return True
+            target = int(await backend.get(ENQUEUED_KEY) or 0)
+            while int(await backend.get(FLUSHED_KEY) or 0) < target:
+                if time.monotonic() >= deadline:
+                    return False
+                if not await self.flush():
+                    await asyncio.sleep(0.05)
+            return True
+        except CONNECTION_ERRORS as e:
+            redis_manager.mark_down(e)
+            return False
+
+    async def write_now(self, ops: List[Dict[str, Any]]):
+        """Записывает операции в БД сразу (Redis недоступен, очередь не используется)"""
+        await self._apply(ops)
+
+    async def _apply(self, ops: List[Dict[str, Any]]):
+        """Применяет пачку операций одной транзакцией (идемпотентно)"""
+        messages = [op for op in ops if op.get("op") == "message"]
+        touches: Dict[int, datetime] = {}
+        feedback: Dict[int, Dict[str, Any]] = {}
+        for op in ops:
+            if op.get("op") == "touch":
+                at = datetime.fromisoformat(op["at"])
+                touches[op["chat_id"]] = max(at, touches.get(op["chat_id"], at))
+            elif op.get("op") == "feedback":
+                # Более поздняя оценка того же сообщения заменяет раннюю
+                feedback[op["id"]] = {"message_id": op["id"], "feedback": op["feedback"], "comment": op.get("comment")}
+
+        async with async_engine.begin() as conn:
+            chat_ids = {op["chat_id"] for op in messages} | set(touches)
+            if chat_ids:
+                # Чат могли удалить, пока сообщение ждало в очереди
+                result = await conn.execute(select(Chat.id).where(Chat.id.in_(chat_ids)))
+                existing = set(result.scalars().all())
+                messages = [op for op in messages if op["chat_id"] in existing]
+                touches = {chat_id: at for chat_id, at in touches.items() if chat_id in existing}
+
+            if messages:
+                await conn.execute(
+                    pg_insert(ChatMessage).on_conflict_do_nothing(index_elements=["id"]),
+                    [
+                        {
+                            "id": op["id"],
+                            "chat_id": op["chat_id"],
+                            "user_id": op["user_id"],
+                            "message": op["message"],
+                            "response": op["response"],
+                            "related_article_ids": op["related_article_ids"],
+                            "sources_data": op["sources_data"],
+                            "created_at": datetime.fromisoformat(op["created_at"]),
+                        }
+                        for op in messages
+                    ]
+                )
+            if touches:
+                await conn.execute(
+                    update(Chat)
+                    .where(Chat.id == bindparam("target_id"))
+                    .values(updated_at=func.greatest(func.coalesce(Chat.updated_at, bindparam("at")), bindparam("at")))
+                    .execution_options(synchronize_session=False),
+                    [{"target_id": chat_id, "at": at} for chat_id, at in touches.items()]
+                )
+            if feedback:
+                await conn.execute(
+                    update(ChatMessage)
+                    .where(ChatMessage.id == bindparam("message_id"))
+                    .values(feedback=bindparam("feedback"), feedback_comment=bindparam("comment"))
+                    .execution_options(synchronize_session=False),
+                    list(feedback.values())
+                )
+
+    async def _apply_each(self, parsed: List[tuple]) -> List[str]:
+        """
+        Применяет операции пачки по одной (в порядке очереди)
+
+        Returns:
+            Записи для chat:persist:dead по операциям с ошибкой в данных
+        """
+        dead = []
+        for item, op in parsed:
+            try:
+                await self._apply([op])
+            except Exception as e:
+                if not _is_data_error(e):
+                    raise  # БД недоступна: пачка останется в очереди, записанное повторится идемпотентно
+                dead.append(_dead_letter(item, e))
+        return dead
+
+    async def flush(self) -> int:
+        """
+        Переносит очередь в БД пачками по batch_size
+
+        Returns:
+            Число обработанных операций
+        """
+        if async_engine is None or async_engine.dialect.name != "postgresql":
+            return 0
+        backend = await redis_manager.async_backend()
+        if backend is redis_manager.async_memory:
+            return 0
+
+        token = uuid.uuid4().hex
+        if not await backend.set(LOCK_KEY, token, nx=True, ex=LOCK_TTL_SECONDS):
+            return 0  # Очередь обрабатывает другой процесс
+
+        processed = 0
+        deadline = time.monotonic() + LOCK_TTL_SECONDS / 2
+        try:
+            while time.monotonic() < deadline:
+                items = await backend.lrange(QUEUE_KEY, 0, self.batch_size - 1)
+                if not items:
+                    break
+                parsed, dead = [], []
+                for item in items:
+                    try:
+                        parsed.append((item, json.loads(item)))
+                    except (TypeError, ValueError) as e:
+                        dead.append(_dead_letter(item, e))
+                ops = [op for _, op in parsed]
+                try:
+                    await self._apply(ops)
+                except Exception as e:
+                    if not _is_data_error(e):
+                        raise
+                    dead.extend(await self._apply_each(parsed))
+
+                pipe = backend.pipeline(transaction=True)
+                pipe.ltrim(QUEUE_KEY, len(items), -1)
+                pipe.incrby(FLUSHED_KEY, len(items))
+                if dead:
+                    pipe.rpush(DEAD_LETTER_KEY, *dead)
+                pending = [_pending_key(op["id"]) for op in ops if isinstance(op, dict) and op.get("op") == "message"]
+                if pending:
+                    pipe.delete(*pending)
+                await pipe.execute()
+                if dead:
+                    print(f"⚠️ {len(dead)} операций очереди сообщений чата не записаны в БД, перенесены в {DEAD_LETTER_KEY}")
+                processed += len(items)
+        finally:
+            await backend.eval(_RELEASE_LOCK_SCRIPT, 1, LOCK_KEY, token)
+        return processed
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except CONNECTION_ERRORS as e:
+                redis_manager.mark_down(e)
+            except Exception as e:
+                # Пачка осталась в очереди и будет повторена в следующем цикле
+                print(f"⚠️ Ошибка записи очереди сообщений чата в БД: {e}")
+
+    def start(self):
+        """Запускает фоновый обработчик очереди (в event loop приложения)"""
+        if self._task is None and settings.chat_write_behind_enabled:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает обработчик и переносит остаток очереди в БД"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            processed = await self.flush()
+            if processed:
+                print(f"💾 Перед остановкой записано {processed} операций очереди сообщений чата")
+        except Exception as e:
+            print(f"⚠️ Очередь сообщений чата не записана перед остановкой (останется в Redis): {e}")
+
+
+chat_write_behind = ChatWriteBehindService()
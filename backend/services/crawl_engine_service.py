@@ -0,0 +1,447 @@
+"""
+Асинхронный обход сайта для парсеров автомобилей (AIParser, AAAMotorsParser)
+
+Вместо последовательных запросов с фиксированной паузой:
+- страницы загружаются параллельно через общий пул httpx.AsyncClient
+  с ограничением числа одновременных запросов;
+- вежливость к сайту - token bucket на каждый хост (запросов в секунду и
+  размер "пачки" без ожидания);
+- таймауты, 429 и 5xx повторяются с экспоненциальной задержкой и случайным
+  разбросом (Retry-After учитывается);
+- для страниц автомобилей, уже сохраненных в parsed_cars, отправляются условные
+  запросы (If-None-Match / If-Modified-Since): ответ 304 пропускается без
+  разбора и сохранения;
+- очередь URL (crawl_frontier) хранится в БД: прерванный или остановленный
+  обход продолжается с оставшихся страниц.
+
+Разбор HTML и запись в БД выполняются в одном отдельном потоке: сессия БД
+парсера не используется из нескольких потоков, а цикл событий не блокируется.
+"""
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+import httpx
+from sqlalchemy import and_, delete, exists, insert, select, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from models.database import CrawlFrontierEntry, ParsedCar
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Ответы, после которых запрос повторяется
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Ограничение частоты запросов: rate токенов в секунду, не больше capacity про запас"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = max(rate, 0.001)
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Сервер попросил подождать (Retry-After): следующий токен появится не раньше"""
+        self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+
+@dataclass
+class FetchResult:
+    """Результат загрузки URL"""
+    url: str
+    status_code: Optional[int] = None
+    content: bytes = b""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.status_code is not None and 200 <= self.status_code < 300
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status_code == 304
+
+
+@dataclass
+class CrawlItem:
+    """URL из очереди обхода с валидаторами предыдущей загрузки"""
+    url: str
+    kind: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+
+class AsyncCrawler:
+    """Параллельная загрузка страниц с ограничением частоты по хостам и повторами"""
+
+    def __init__(self, headers: Optional[Dict[str, str]] = None, concurrency: Optional[int] = None,
+                 host_rate: Optional[float] = None, host_burst: Optional[int] = None,
+                 max_retries: Optional[int] = None, timeout: Optional[float] = None,
+                 max_bytes: Optional[int] = None):
+        """
+        Args:
+            max_bytes: Предел размера ответа; больший ответ не дочитывается (None - без предела)
+        """
+        self.headers = headers or {}
+        self.concurrency = max(1, concurrency or settings.crawler_concurrency)
+        self.host_rate = host_rate or settings.crawler_host_rate_per_second
+        self.host_burst = host_burst or settings.crawler_host_burst
+        self.max_retries = settings.crawler_max_retries if max_retries is None else max_retries
+        self.timeout = timeout or settings.crawler_timeout_seconds
+        self.max_bytes = max_bytes
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def client(self) -> httpx.AsyncClient:
+        """Пул соединений на все время обхода (keep-alive к сайту)"""
+        return httpx.AsyncClient(
+            timeout=self.timeout,
+            headers=self.headers,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+        )
+
+    def _bucket(self, url: str) -> TokenBucket:
+        host = urlparse(url).netloc.lower()
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = TokenBucket(self.host_rate, self.host_burst)
+        return bucket
+
+    def _backoff(self, attempt: int) -> float:
+        return settings.crawler_retry_backoff_seconds * (2 ** attempt) * (0.5 + random.random())
+
+    async def fetch(self, client: httpx.AsyncClient, url: str, etag: Optional[str] = None,
+                    last_modified: Optional[str] = None) -> FetchResult:
+        """Загружает URL (условно, если переданы валидаторы) с повторами"""
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        bucket = self._bucket(url)
+        error = None
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire()
+            try:
+                async with client.stream("GET", url, headers=headers) as response:
+                    if response.status_code not in RETRY_STATUS_CODES:
+                        return await self._read(url, response)
+                    error = f"HTTP {response.status_code}"
+                    retry_after = response.headers.get("retry-after")
+                    if retry_after and retry_after.isdigit():
+                        bucket.pause(float(retry_after))
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                error = f"{type(e).__name__}: {e}"
+            if attempt < self.max_retries:
+                await asyncio.sleep(self._backoff(attempt))
+        return FetchResult(url=url, error=error)
+
+    async def _read(self, url: str, response: httpx.Response) -> FetchResult:
+        """Читает тело ответа; при max_bytes - по Content-Length и по мере чтения"""
+        result = FetchResult(
+            url=url,
+            status_code=response.status_code,
+            etag=response.headers.get("etag"),
+            last_modified=response.headers.get("last-modified"),
+        )
+        too_large = f"Ответ больше {self.max_bytes} байт"
+        length = response.headers.get("content-length")
+        if self.max_bytes is not None and length and length.isdigit() and int(length) > self.max_bytes:
+            result.error = too_large
+            return result
+
+        chunks: List[bytes] = []
+        size = 0
+        async for chunk in response.aiter_bytes():
+            size += len(chunk)
+            if self.max_bytes is not None and size > self.max_bytes:
+                # Content-Length не было или он неверный: дальше не читаем
+                result.error = too_large
+                return result
+            chunks.append(chunk)
+        result.content = b"".join(chunks)
+        return result
+
+    async def crawl(self, client: httpx.AsyncClient, items: Iterable[CrawlItem],
+                    handle: Callable[[CrawlItem, FetchResult], Awaitable[None]],
+                    should_stop: Callable[[], bool] = lambda: False) -> None:
+        """
+        Загружает items не больше concurrency одновременно и передает результаты в handle
+
+        После should_stop() новые загрузки не начинаются; уже начатые завершаются.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in items:
+            queue.put_nowait(item)
+
+        async def worker():
+            while not should_stop():
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                result = await self.fetch(client, item.url, item.etag, item.last_modified)
+                try:
+                    await handle(item, result)
+                except Exception as e:
+                    logger.error(f"Ошибка обработки {item.url}: {e}", exc_info=True)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, queue.qsize()) or 1)))
+
+
+class CrawlFrontier:
+    """
+    Очередь обхода сайта в таблице crawl_frontier
+
+    Обход отмечается записью kind="run": pending с start() до finish(). Прерванным
+    считается только обход с такой записью - автомобили, не загруженные из-за
+    max_cars, остаются pending, но следующий запуск начинается с каталога.
+    """
+
+    def __init__(self, db: Session, crawl_key: str):
+        self.db = db
+        self.crawl_key = crawl_key.rstrip("/")
+        self.table = CrawlFrontierEntry.__table__
+
+    def _scope(self, *conditions):
+        return and_(self.table.c.crawl_key == self.crawl_key, *conditions)
+
+    @property
+    def _run_url(self) -> str:
+        return f"{self.crawl_key}#run"
+
+    def has_unfinished(self) -> bool:
+        """Был ли прерван предыдущий обход (начат start() и не завершен finish())"""
+        return bool(self.db.execute(
+            select(exists().where(self._scope(self.table.c.kind == "run", self.table.c.status == "pending")))
+        ).scalar())
+
+    def start(self, catalog_urls: List[str]) -> None:
+        """Новый обход: страницы каталога заново, автомобили - по мере обнаружения (валидаторы сохраняются)"""
+        self.db.execute(delete(self.table).where(self._scope(self.table.c.kind.in_(["catalog", "run"]))))
+        self.db.execute(update(self.table).where(self._scope()).values(status="idle"))
+        self.db.commit()
+        self.add(catalog_urls, "catalog")
+        self.add([self._run_url], "run")
+
+    def finish(self) -> None:
+        """Обход завершен (в том числе с ограничением max_cars): следующий начнется с каталога"""
+        self.db.execute(
+            update(self.table)
+            .where(self._scope(self.table.c.kind == "run"))
+            .values(status="done", fetched_at=datetime.now(timezone.utc))
+        )
+        self.db.commit()
+
+    def catalog_complete(self) -> bool:
+        """Все страницы каталога загружены (список объявлений текущего обхода полный)"""
+        return not self.db.execute(
+            select(exists().where(self._scope(self.table.c.kind == "catalog",
+                                              self.table.c.status.in_(["pending", "failed"]))))
+        ).scalar()
+
+    def reset(self) -> None:
+        """Забывает очередь и валидаторы (после очистки parsed_cars)"""
+        self.db.execute(delete(self.table).where(self._scope()))
+        self.db.commit()
+
+    def add(self, urls: Iterable[str], kind: str) -> int:
+        """Ставит URL в очередь; уже известные URL переводятся в pending. Возвращает число новых"""
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return 0
+        known = set()
+        for start in range(0, len(urls), 500):
+            chunk = urls[start:start + 500]
+            known.update(self.db.execute(
+                select(self.table.c.url).where(self._scope(self.table.c.url.in_(chunk)))
+            ).scalars())
+            self.db.execute(
+                update(self.table)
+                .where(self._scope(self.table.c.url.in_(chunk), self.table.c.status != "pending"))
+                .values(status="pending", attempts=0, error=None)
+            )
+        new_urls = [url for url in urls if url not in known]
+        if new_urls:
+            self.db.execute(insert(self.table), [
+                {"crawl_key": self.crawl_key, "url": url, "kind": kind, "status": "pending", "attempts": 0}
+                for url in new_urls
+            ])
+        self.db.commit()
+        return len(new_urls)
+
+    def pending(self, kind: str, limit: Optional[int] = None) -> List[CrawlItem]:
+        """
+        URL к загрузке в порядке обнаружения
+
+        Валидаторы отдаются только для автомобилей, которые есть в parsed_cars:
+        иначе 304 пропустил бы страницу, данные которой были удалены.
+        """
+        saved = exists().where(and_(ParsedCar.source_url == self.table.c.url, ParsedCar.is_active == True))
+        query = (
+            select(self.table.c.url, self.table.c.etag, self.table.c.last_modified, saved.label("saved"))
+            .where(self._scope(self.table.c.kind == kind, self.table.c.status == "pending"))
+            .order_by(self.table.c.id)
+        )
+        if limit:
+            query = query.limit(limit)
+        return [
+            CrawlItem(
+                url=row.url,
+                kind=kind,
+                etag=row.etag if row.saved else None,
+                last_modified=row.last_modified if row.saved else None,
+            )
+            for row in self.db.execute(query)
+        ]
+
+    def mark_done(self, result: FetchResult) -> None:
+        values = {"status": "done", "http_status": result.status_code, "error": None,
+                  "fetched_at": datetime.now(timezone.utc)}
+        if not result.not_modified:
+            values.update(etag=result.etag, last_modified=result.last_modified)
+        self._mark(result.url, values)
+
+    def mark_failed(self, url: str, error: str, status_code: Optional[int] = None) -> None:
+        self._mark(url, {"status": "failed", "http_status": status_code, "error": error[:1000],
+                         "etag": None, "last_modified": None, "fetched_at": datetime.now(timezone.utc)})
+
+    def _mark(self, url: str, values: Dict[str, Any]) -> None:
+        self.db.execute(
+            update(self.table)
+            .where(self._scope(self.table.c.url == url))
+            .values(attempts=self.table.c.attempts + 1, **values)
+        )
+        self.db.commit()
+
+
+class ParserCrawlRunner:
+    """
+    Обход каталога для парсера: страницы каталога -> ссылки -> страницы автомобилей
+
+    Парсер предоставляет:
+        _extract_car_links(page_url, content) -> List[str]
+        _process_car_page(url, content, index, total) -> bool (сохранен ли автомобиль)
+        db, base_url, stats, is_running
+    """
+
+    def __init__(self, parser: Any, delay: float = 0.0, headers: Optional[Dict[str, str]] = None):
+        self.parser = parser
+        self.frontier = CrawlFrontier(parser.db, parser.base_url)
+        concurrency = settings.crawler_concurrency
+        host_rate = settings.crawler_host_rate_per_second
+        if delay and delay > 0:
+            # delay - пауза между запросами одного "потока": не чаще concurrency / delay в секунду
+            host_rate = min(host_rate, concurrency / delay)
+        self.crawler = AsyncCrawler(headers=headers, concurrency=concurrency, host_rate=host_rate)
+        self._db_executor: Optional[ThreadPoolExecutor] = None
+
+    def has_unfinished(self) -> bool:
+        return self.frontier.has_unfinished()
+
+    def start(self, catalog_urls: List[str]) -> None:
+        self.frontier.start(catalog_urls)
+
+    def catalog_complete(self) -> bool:
+        return self.frontier.catalog_complete()
+
+    def run(self, max_cars: Optional[int] = None) -> None:
+        """Обходит оставшиеся URL очереди; блокирует вызывающий поток до завершения"""
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="crawl-db")
+        try:
+            asyncio.run(self._run(max_cars))
+        finally:
+            self._db_executor.shutdown(wait=True)
+            self._db_executor = None
+
+    async def _in_db_thread(self, func: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._db_executor, func, *args)
+
+    def _should_stop(self) -> bool:
+        return not self.parser.is_running
+
+    async def _run(self, max_cars: Optional[int]) -> None:
+        stats = self.parser.stats
+        stats.setdefault("unchanged_skipped", 0)
+        started = time.monotonic()
+        async with self.crawler.client() as client:
+            # 1. Страницы каталога -> ссылки на автомобили в очередь
+            catalog = await self._in_db_thread(self.frontier.pending, "catalog")
+            logger.info(f"🌐 Обход каталога: {len(catalog)} страниц, до {self.crawler.concurrency} запросов параллельно")
+
+            async def handle_catalog(item: CrawlItem, result: FetchResult):
+                stats["current_page"] += 1
+                if not result.ok:
+                    logger.warning(f"Страница каталога не загружена {item.url}: {result.error or result.status_code}")
+                    await self._in_db_thread(self.frontier.mark_failed, item.url,
+                                             result.error or f"HTTP {result.status_code}", result.status_code)
+                    return
+                links = await self._in_db_thread(self.parser._extract_car_links, item.url, result.content)
+                added = await self._in_db_thread(self.frontier.add, links, "car")
+                await self._in_db_thread(self.frontier.mark_done, result)
+                logger.info(f"Страница каталога {stats['current_page']}: {item.url} - ссылок {len(links)}, новых {added}")
+
+            await self.crawler.crawl(client, catalog, handle_catalog, self._should_stop)
+            if self._should_stop():
+                return
+
+            # 2. Страницы автомобилей (условные запросы для уже сохраненных)
+            cars = await self._in_db_thread(self.frontier.pending, "car", max_cars)
+            total = len(cars)
+            logger.info(f"Найдено {total} автомобилей к загрузке")
+            counter = {"index": 0}
+
+            async def handle_car(item: CrawlItem, result: FetchResult):
+                counter["index"] += 1
+                index = counter["index"]
+                if result.not_modified:
+                    stats["unchanged_skipped"] += 1
+                    await self._in_db_thread(self.frontier.mark_done, result)
+                    return
+                if not result.ok:
+                    stats["total_errors"] += 1
+                    error = result.error or f"HTTP {result.status_code}"
+                    logger.warning(f"⚠️ [{index}/{total}] Страница не загружена {item.url}: {error}")
+                    await self._in_db_thread(self.frontier.mark_failed, item.url, error, result.status_code)
+                    return
+                saved = await self._in_db_thread(self.parser._process_car_page, item.url, result.content, index, total)
+                if saved:
+                    await self._in_db_thread(self.frontier.mark_done, result)
+                else:
+                    await self._in_db_thread(self.frontier.mark_failed, item.url, "Данные не извлечены или не сохранены",
+                                             result.status_code)
+
+            await self.crawler.crawl(client, cars, handle_car, self._should_stop)
+            if self._should_stop():
+                return
+            await self._in_db_thread(self.frontier.finish)
+
+        logger.info(
+            f"✅ Обход завершен за {time.monotonic() - started:.1f} сек: сохранено {stats['total_parsed']}, "
+            f"без изменений {stats['unchanged_skipped']}, ошибок {stats['total_errors']}"
+        )
@@ -6,15 +6,73 @@ from models.database import (
     Car, UsedCar, CarPicture, UsedCarPicture, CarOption, CarOptionsGroup
 )
 from models.schemas import ArticleCreate, ArticleUpdate, CategoryCreate, TagCreate, UserCreate
+from services.pagination_service import cached_count, paginate
+from services.facet_service import facet_store
 import json
 
 
+def car_filter_conditions(model_cls, search: Optional[str] = None,
+                          mark: Optional[str] = None, model: Optional[str] = None,
+                          city: Optional[str] = None, fuel_type: Optional[str] = None,
+                          body_type: Optional[str] = None, min_price: Optional[float] = None,
+                          max_price: Optional[float] = None, min_year: Optional[int] = None,
+                          max_year: Optional[int] = None, min_mileage: Optional[int] = None,
+                          max_mileage: Optional[int] = None) -> List[Any]:
+    """
+    Условия фильтрации каталога для Car/UsedCar
+    
+    Общие для синхронного DatabaseService и AsyncDatabaseService.
+    """
+    conditions = []
+    
+    if search:
+        conditions.append(or_(
+            model_cls.mark.ilike(f"%{search}%"),
+            model_cls.model.ilike(f"%{search}%"),
+            model_cls.vin.ilike(f"%{search}%"),
+            model_cls.city.ilike(f"%{search}%")
+        ))
+    
+    if mark:
+        conditions.append(model_cls.mark.ilike(f"%{mark}%"))
+    if model:
+        conditions.append(model_cls.model.ilike(f"%{model}%"))
+    if city:
+        conditions.append(model_cls.city.ilike(f"%{city}%"))
+    if fuel_type:
+        conditions.append(model_cls.fuel_type == fuel_type)
+    if body_type:
+        conditions.append(model_cls.body_type == body_type)
+    
+    if min_year:
+        conditions.append(model_cls.manufacture_year >= min_year)
+    if max_year:
+        conditions.append(model_cls.manufacture_year <= max_year)
+    if min_mileage and hasattr(model_cls, "mileage"):
+        conditions.append(model_cls.mileage >= min_mileage)
+    if max_mileage and hasattr(model_cls, "mileage"):
+        conditions.append(model_cls.mileage <= max_mileage)
+    # Цена хранится как строка – аккуратно кастуем в FLOAT для фильтрации
+    if min_price is not None:
+        conditions.append(cast(model_cls.price, Float) >= float(min_price))
+    if max_price is not None:
+        conditions.append(cast(model_cls.price, Float) <= float(max_price))
+    
+    return conditions
+
+
 class DatabaseService:
     def __init__(self, db: Session):
         self.db = db
     
     # Статьи
     def get_articles(self, skip: int = 0, limit: int = 100, search: Optional[str] = None) -> Tuple[List[Article], int]:
+        articles, total, _ = self.get_articles_page(skip=skip, limit=limit, search=search)
+        return articles, total
+    
+    def get_articles_page(self, skip: int = 0, limit: int = 100, search: Optional[str] = None,
+                          cursor: Optional[str] = None) -> Tuple[List[Article], int, Optional[str]]:
+        """Страница статей (по id) с курсором следующей страницы и кэшированным total"""
         query = self.db.query(Article)
         
         if search:
@@ -24,9 +82,9 @@ class DatabaseService:
             )
             query = query.filter(search_filter)
         
-        total = query.count()
-        articles = query.offset(skip).limit(limit).all()
-        return articles, total
+        total = cached_count(query, Article.__tablename__, {"search": search})
+        articles, next_cursor = paginate(query, None, Article.id, limit, skip=skip, cursor=cursor, descending=False)
+        return articles, total, next_cursor
     
     def get_article(self, article_id: int) -> Optional[Article]:
         return self.db.query(Article).filter(Article.id == article_id).first()
@@ -246,6 +304,9 @@ class DatabaseService:
         self.db.commit()
         return True
     
+    def chat_message_exists(self, message_id: int) -> bool:
+        return self.db.query(ChatMessage.id).filter(ChatMessage.id == message_id).first() is not None
+
     def update_feedback(self, message_id: int, feedback: int, comment: Optional[str] = None) -> bool:
         chat_message = self.db.query(ChatMessage).filter(ChatMessage.id == message_id).first()
         if not chat_message:
@@ -287,41 +348,24 @@ class DatabaseService:
                   max_price: Optional[float] = None, min_year: Optional[int] = None,
                   max_year: Optional[int] = None) -> Tuple[List[Car], int]:
         """Получает список новых автомобилей с фильтрацией"""
-        query = self.db.query(Car)
-        
-        if search:
-            search_filter = or_(
-                Car.mark.ilike(f"%{search}%"),
-                Car.model.ilike(f"%{search}%"),
-                Car.vin.ilike(f"%{search}%"),
-                Car.city.ilike(f"%{search}%")
-            )
-            query = query.filter(search_filter)
-        
-        if mark:
-            query = query.filter(Car.mark.ilike(f"%{mark}%"))
-        if model:
-            query = query.filter(Car.model.ilike(f"%{model}%"))
-        if city:
-            query = query.filter(Car.city.ilike(f"%{city}%"))
-        if fuel_type:
-            query = query.filter(Car.fuel_type == fuel_type)
-        if body_type:
-            query = query.filter(Car.body_type == body_type)
+        cars, total, _ = self.get_cars_page(
+            skip=skip, limit=limit, search=search, mark=mark, model=model, city=city,
+            fuel_type=fuel_type, body_type=body_type, min_price=min_price, max_price=max_price,
+            min_year=min_year, max_year=max_year
+        )
+        return cars, total
+    
+    def get_cars_page(self, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                      **filters) -> Tuple[List[Car], int, Optional[str]]:
+        """
+        Страница новых автомобилей (created_at DESC, id DESC)
         
-        if min_year:
-            query = query.filter(Car.manufacture_year >= min_year)
-        if max_year:
-            query = query.filter(Car.manufacture_year <= max_year)
-        # Цена хранится как строка – аккуратно кастуем в FLOAT для фильтрации
-        if min_price is not None:
-            query = query.filter(cast(Car.price, Float) >= float(min_price))
-        if max_price is not None:
-            query = query.filter(cast(Car.price, Float) <= float(max_price))
+        С курсором используется keyset-пагинация (skip игнорируется); total берется из кэша.
         
-        total = query.count()
-        cars = query.order_by(Car.created_at.desc()).offset(skip).limit(limit).all()
-        return cars, total
+        Returns:
+            (автомобили, total, курсор следующей страницы или None)
+        """
+        return self._get_catalog_page(Car, skip, limit, cursor, filters)
     
     def get_car(self, car_id: int) -> Optional[Car]:
         return self.db.query(Car).filter(Car.id == car_id).first()
@@ -345,88 +389,31 @@ class DatabaseService:
                       max_price: Optional[float] = None, min_mileage: Optional[int] = None,
                       max_mileage: Optional[int] = None) -> Tuple[List[UsedCar], int]:
         """Получает список подержанных автомобилей с фильтрацией"""
-        query = self.db.query(UsedCar)
-        
-        if search:
-            search_filter = or_(
-                UsedCar.mark.ilike(f"%{search}%"),
-                UsedCar.model.ilike(f"%{search}%"),
-                UsedCar.vin.ilike(f"%{search}%"),
-                UsedCar.city.ilike(f"%{search}%")
-            )
-            query = query.filter(search_filter)
-        
-        if mark:
-            query = query.filter(UsedCar.mark.ilike(f"%{mark}%"))
-        if model:
-            query = query.filter(UsedCar.model.ilike(f"%{model}%"))
-        if city:
-            query = query.filter(UsedCar.city.ilike(f"%{city}%"))
-        if fuel_type:
-            query = query.filter(UsedCar.fuel_type == fuel_type)
-        if body_type:
-            query = query.filter(UsedCar.body_type == body_type)
-        
-        if min_mileage:
-            query = query.filter(UsedCar.mileage >= min_mileage)
-        if max_mileage:
-            query = query.filter(UsedCar.mileage <= max_mileage)
-        # Фильтрация по цене
-        if min_price is not None:
-            query = query.filter(cast(UsedCar.price, Float) >= float(min_price))
-        if max_price is not None:
-            query = query.filter(cast(UsedCar.price, Float) <= float(max_price))
-        
-        total = query.count()
-        cars = query.order_by(UsedCar.created_at.desc()).offset(skip).limit(limit).all()
+        cars, total, _ = self.get_used_cars_page(
+            skip=skip, limit=limit, search=search, mark=mark, model=model, city=city,
+            fuel_type=fuel_type, body_type=body_type, min_price=min_price, max_price=max_price,
+            min_mileage=min_mileage, max_mileage=max_mileage
+        )
         return cars, total
     
+    def get_used_cars_page(self, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                           **filters) -> Tuple[List[UsedCar], int, Optional[str]]:
+        """Страница подержанных автомобилей (см. get_cars_page)"""
+        return self._get_catalog_page(UsedCar, skip, limit, cursor, filters)
+    
+    def _get_catalog_page(self, model_cls, skip: int, limit: int, cursor: Optional[str],
+                          filters: Dict[str, Any]) -> Tuple[List[Any], int, Optional[str]]:
+        query = self.db.query(model_cls).filter(*car_filter_conditions(model_cls, **filters))
+        total = cached_count(query, model_cls.__tablename__, filters)
+        cars, next_cursor = paginate(query, model_cls.created_at, model_cls.id, limit, skip=skip, cursor=cursor)
+        return cars, total, next_cursor
+    
     def get_used_car(self, used_car_id: int) -> Optional[UsedCar]:
         return self.db.query(UsedCar).filter(UsedCar.id == used_car_id).first()
     
     def get_cars_statistics(self) -> Dict[str, Any]:
-        """Получает статистику по автомобилям: уникальные марки, модели, количество"""
-        from sqlalchemy import func, distinct
-        
-        # Количество новых автомобилей
-        new_cars_count = self.db.query(func.count(Car.id)).scalar() or 0
-        
-        # Количество подержанных автомобилей
-        used_cars_count = self.db.query(func.count(UsedCar.id)).scalar() or 0
-        
-        # Уникальные марки (новые)
-        new_marks = self.db.query(distinct(Car.mark)).filter(Car.mark.isnot(None), Car.mark != '').all()
-        new_marks_list = sorted([m[0] for m in new_marks if m[0]])
-        
-        # Уникальные марки (подержанные)
-        used_marks = self.db.query(distinct(UsedCar.mark)).filter(UsedCar.mark.isnot(None), UsedCar.mark != '').all()
-        used_marks_list = sorted([m[0] for m in used_marks if m[0]])
-        
-        # Объединенный список уникальных марок (все)
-        all_marks = sorted(list(set(new_marks_list + used_marks_list)))
-        
-        # Уникальные модели (новые)
-        new_models = self.db.query(distinct(Car.model)).filter(Car.model.isnot(None), Car.model != '').all()
-        new_models_list = sorted([m[0] for m in new_models if m[0]])
-        
-        # Уникальные модели (подержанные)
-        used_models = self.db.query(distinct(UsedCar.model)).filter(UsedCar.model.isnot(None), UsedCar.model != '').all()
-        used_models_list = sorted([m[0] for m in used_models if m[0]])
-        
-        # Объединенный список уникальных моделей (все)
-        all_models = sorted(list(set(new_models_list + used_models_list)))
-        
-        return {
-            "new_cars_count": new_cars_count,
-            "used_cars_count": used_cars_count,
-            "total_cars_count": new_cars_count + used_cars_count,
-            "unique_marks": all_marks,
-            "unique_models": all_models,
-            "new_marks": new_marks_list,
-            "used_marks": used_marks_list,
-            "new_models": new_models_list,
-            "used_models": used_models_list,
-        }
+        """Получает статистику по автомобилям: уникальные марки, модели, количество (из снимка фасетов)"""
+        return facet_store.cars_statistics()
 
     # Точный поиск по VIN
     def get_car_by_vin(self, vin: str) -> Optional[Car]:
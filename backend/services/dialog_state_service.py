@@ -1,173 +1,280 @@
-"""Сервис для управления состоянием диалога пользователя"""
-from typing import Dict, Any, Optional, List
+"""
+Сервис для управления состоянием диалога пользователя
+
+Состояние хранится в Redis по полям, а не одним JSON:
+- dialog:session:{user} - хеш полей состояния (mode, current_question, last_shown_cars);
+- dialog:criteria:{user} - хеш критериев поиска, по полю на критерий: update_criteria
+  пишет только переданные критерии одним HSET, без чтения и перезаписи всего
+  состояния, поэтому параллельные запросы не затирают изменения друг друга;
+- dialog:found:{user} - ID найденных автомобилей; карточки загружаются из БД
+  только при чтении результатов (get_search_results).
+
+Изменения за ход объединяются в batch(): одна транзакция MULTI/EXEC за один
+сетевой обмен. Изменения "прочитать - изменить - записать" (modify_criteria)
+выполняются с оптимистической блокировкой WATCH и повтором при конфликте.
+Ключи живут STATE_TTL_SECONDS с последнего изменения.
+"""
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Callable, Iterable
 import json
-import redis
-from app.core.config import settings
-
-
-class _MemoryStorage:
-    """In-memory хранилище для fallback когда Redis недоступен"""
-    def __init__(self):
-        self._data: Dict[str, str] = {}
-        self._lists: Dict[str, List[str]] = {}
-    
-    def get(self, key: str) -> Optional[str]:
-        return self._data.get(key)
-    
-    def set(self, key: str, value: str, ex: Optional[int] = None):
-        self._data[key] = value
-        return True
-    
-    def delete(self, key: str):
-        deleted = 0
-        if key in self._data:
-            del self._data[key]
-            deleted += 1
-        if key in self._lists:
-            del self._lists[key]
-            deleted += 1
-        return deleted
-    
-    def rpush(self, key: str, value: str):
-        """Добавляет элемент в конец списка"""
-        if key not in self._lists:
-            self._lists[key] = []
-        self._lists[key].append(value)
-        return len(self._lists[key])
-    
-    def lrange(self, key: str, start: int, end: int) -> List[str]:
-        """Получает элементы списка"""
-        if key not in self._lists:
-            return []
-        lst = self._lists[key]
-        # Redis lrange: end=-1 означает конец списка
-        if end == -1:
-            end = len(lst) - 1
-        return lst[start:end+1] if end >= start else []
-    
-    def llen(self, key: str) -> int:
-        """Возвращает длину списка"""
-        return len(self._lists.get(key, []))
-    
-    def ltrim(self, key: str, start: int, end: int):
-        """Обрезает список"""
-        if key not in self._lists:
-            return True
-        lst = self._lists[key]
-        if end == -1:
-            end = len(lst) - 1
-        self._lists[key] = lst[start:end+1] if end >= start else []
-        return True
-    
-    def keys(self, pattern: str) -> List[str]:
-        """Возвращает ключи, соответствующие паттерну"""
-        import fnmatch
-        all_keys = list(self._data.keys()) + list(self._lists.keys())
-        return [k for k in all_keys if fnmatch.fnmatch(k, pattern)]
-
-
-def _init_redis_client():
-    """Инициализация Redis клиента с fallback"""
+from redis.exceptions import WatchError
+from sqlalchemy.orm import Session
+from app.core.redis_client import redis_client
+
+STATE_TTL_SECONDS = 3600  # 1 час
+MAX_LAST_SHOWN_CARS = 10
+MODIFY_MAX_RETRIES = 5  # Повторов modify_criteria при конкурентном изменении
+
+
+def _loads(raw: Optional[str], default: Any = None) -> Any:
+    if raw is None:
+        return default
     try:
-        client = redis.Redis(
-            host=settings.redis_host,
-            port=settings.redis_port,
-            db=settings.redis_db,
-            decode_responses=True
-        )
-        client.ping()
-        return client
-    except Exception:
-        return _MemoryStorage()
+        return json.loads(raw)
+    except (TypeError, ValueError):
+        return default
 
 
-_redis_client = _init_redis_client()
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False)
 
 
 class DialogStateService:
     """Управляет состоянием диалога пользователя (критерии поиска, текущие результаты и т.д.)"""
-    
+
     def __init__(self, user_id: str):
         self.user_id = user_id
-        self.state_key = f"dialog:state:{user_id}"
-        self.results_key = f"dialog:results:{user_id}"
-        self.last_question_key = f"dialog:last_question:{user_id}"
-    
-    def get_state(self) -> Dict[str, Any]:
-        """Получает текущее состояние диалога"""
-        try:
-            data = _redis_client.get(self.state_key)
-            if data:
-                return json.loads(data)
-        except Exception:
-            pass
+        self.session_key = f"dialog:session:{user_id}"
+        self.criteria_key = f"dialog:criteria:{user_id}"
+        self.results_key = f"dialog:found:{user_id}"
+        self._batch = None  # Pipeline текущего batch()
+        self._batch_keys: set = set()
+
+    @staticmethod
+    def _default_state() -> Dict[str, Any]:
         return {
             "criteria": {},
             "mode": "search",  # search, compare, details
             "last_shown_cars": [],
             "current_question": None,
         }
-    
-    def save_state(self, state: Dict[str, Any]):
-        """Сохраняет состояние диалога"""
+
+    def _write(self, apply: Callable[[Any], None], keys: Iterable[str]):
+        """Выполняет запись одной транзакцией или добавляет ее в текущий batch()"""
+        if self._batch is not None:
+            apply(self._batch)
+            self._batch_keys.update(keys)
+            return
         try:
-            _redis_client.set(self.state_key, json.dumps(state), ex=3600)  # TTL 1 час
+            pipe = redis_client.pipeline(transaction=True)
+            apply(pipe)
+            for key in keys:
+                pipe.expire(key, STATE_TTL_SECONDS)
+            pipe.execute()
         except Exception:
             pass
-    
+
+    @contextmanager
+    def batch(self):
+        """
+        Объединяет изменения состояния в одну транзакцию (один сетевой обмен)
+
+        Чтения внутри блока видят состояние до него. Пример:
+            with dialog_state.batch():
+                dialog_state.set_last_shown_cars(cars)
+                dialog_state.save_search_results(results)
+        """
+        if self._batch is not None:
+            # Вложенный batch() - часть внешнего
+            yield self
+            return
+        pipe = redis_client.pipeline(transaction=True)
+        self._batch, self._batch_keys = pipe, set()
+        try:
+            yield self
+            for key in self._batch_keys:
+                pipe.expire(key, STATE_TTL_SECONDS)
+            try:
+                pipe.execute()
+            except Exception:
+                pass
+        finally:
+            self._batch, self._batch_keys = None, set()
+            pipe.reset()
+
+    def get_state(self) -> Dict[str, Any]:
+        """Получает текущее состояние диалога (оба хеша за один сетевой обмен)"""
+        state = self._default_state()
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.hgetall(self.session_key)
+            pipe.hgetall(self.criteria_key)
+            fields, criteria = pipe.execute()
+        except Exception:
+            return state
+        state["criteria"] = self._decode_criteria(criteria)
+        state["mode"] = fields.get("mode") or state["mode"]
+        state["last_shown_cars"] = _loads(fields.get("last_shown_cars"), [])
+        state["current_question"] = fields.get("current_question")
+        return state
+
+    def save_state(self, state: Dict[str, Any]):
+        """Сохраняет состояние диалога целиком (заменяет все поля)"""
+        def apply(pipe):
+            pipe.delete(self.session_key, self.criteria_key)
+            fields = {
+                "mode": state.get("mode") or "search",
+                "last_shown_cars": _dumps(state.get("last_shown_cars") or []),
+            }
+            if state.get("current_question") is not None:
+                fields["current_question"] = str(state["current_question"])
+            pipe.hset(self.session_key, mapping=fields)
+            criteria = state.get("criteria") or {}
+            if criteria:
+                pipe.hset(self.criteria_key, mapping={name: _dumps(value) for name, value in criteria.items()})
+        self._write(apply, (self.session_key, self.criteria_key))
+
+    @staticmethod
+    def _decode_criteria(raw: Dict[str, str]) -> Dict[str, Any]:
+        return {name: _loads(value) for name, value in (raw or {}).items()}
+
     def update_criteria(self, criteria: Dict[str, Any]):
-        """Обновляет критерии поиска"""
-        state = self.get_state()
-        state["criteria"].update(criteria)
-        self.save_state(state)
-    
+        """Обновляет критерии поиска (только переданные поля, без чтения остальных)"""
+        if not criteria:
+            return
+        mapping = {name: _dumps(value) for name, value in criteria.items()}
+        self._write(lambda pipe: pipe.hset(self.criteria_key, mapping=mapping), (self.criteria_key,))
+
+    def modify_criteria(self, modify: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Заменяет критерии результатом modify(текущие критерии)
+
+        Оптимистическая блокировка: если критерии изменил параллельный запрос
+        между чтением и записью, чтение и modify повторяются. Выполняется сразу,
+        даже внутри batch().
+
+        Returns:
+            Сохраненные критерии
+        """
+        for _ in range(MODIFY_MAX_RETRIES):
+            try:
+                with redis_client.pipeline(transaction=True) as pipe:
+                    pipe.watch(self.criteria_key)
+                    updated = modify(self._decode_criteria(pipe.hgetall(self.criteria_key)))
+                    pipe.multi()
+                    pipe.delete(self.criteria_key)
+                    if updated:
+                        pipe.hset(self.criteria_key, mapping={name: _dumps(value) for name, value in updated.items()})
+                        pipe.expire(self.criteria_key, STATE_TTL_SECONDS)
+                    pipe.execute()
+                    return updated or {}
+            except WatchError:
+                continue
+            except Exception:
+                break
+        return self.get_criteria()
+
     def clear_criteria(self):
         """Очищает все критерии (сброс поиска)"""
-        state = self.get_state()
-        state["criteria"] = {}
-        state["last_shown_cars"] = []
-        state["current_question"] = None
-        self.save_state(state)
-    
+        def apply(pipe):
+            pipe.delete(self.criteria_key)
+            pipe.hdel(self.session_key, "last_shown_cars", "current_question")
+        self._write(apply, (self.session_key,))
+
     def get_criteria(self) -> Dict[str, Any]:
         """Получает текущие критерии"""
-        return self.get_state().get("criteria", {})
-    
+        try:
+            return self._decode_criteria(redis_client.hgetall(self.criteria_key))
+        except Exception:
+            return {}
+
     def set_last_shown_cars(self, cars: List[Dict[str, Any]]):
         """Сохраняет последние показанные автомобили"""
-        state = self.get_state()
-        state["last_shown_cars"] = cars[:10]  # Сохраняем до 10 последних
-        self.save_state(state)
-    
+        value = _dumps(cars[:MAX_LAST_SHOWN_CARS])
+        self._write(lambda pipe: pipe.hset(self.session_key, "last_shown_cars", value), (self.session_key,))
+
     def get_last_shown_cars(self) -> List[Dict[str, Any]]:
         """Получает последние показанные автомобили"""
-        return self.get_state().get("last_shown_cars", [])
-    
-    def set_current_question(self, question: str):
+        try:
+            return _loads(redis_client.hget(self.session_key, "last_shown_cars"), [])
+        except Exception:
+            return []
+
+    def set_current_question(self, question: Optional[str]):
         """Устанавливает текущий вопрос, на который ждем ответ"""
-        state = self.get_state()
-        state["current_question"] = question
-        self.save_state(state)
-    
+        if question is None:
+            self._write(lambda pipe: pipe.hdel(self.session_key, "current_question"), (self.session_key,))
+        else:
+            self._write(lambda pipe: pipe.hset(self.session_key, "current_question", str(question)), (self.session_key,))
+
     def get_current_question(self) -> Optional[str]:
         """Получает текущий вопрос"""
-        return self.get_state().get("current_question")
-    
+        try:
+            return redis_client.hget(self.session_key, "current_question")
+        except Exception:
+            return None
+
     def save_search_results(self, results: Dict[str, Any]):
-        """Сохраняет результаты поиска"""
+        """
+        Сохраняет результаты поиска
+
+        Хранятся только ID автомобилей ({"cars": [...], "used_cars": [...]}, элементы -
+        словари с id или сами id); карточки загружаются в get_search_results.
+        """
+        mapping = {
+            group: _dumps([
+                item.get("id") if isinstance(item, dict) else item
+                for item in results.get(group) or []
+            ])
+            for group in ("cars", "used_cars")
+        }
+
+        def apply(pipe):
+            pipe.delete(self.results_key)
+            pipe.hset(self.results_key, mapping=mapping)
+        self._write(apply, (self.results_key,))
+
+    def get_search_result_ids(self) -> Optional[Dict[str, List[int]]]:
+        """ID сохраненных результатов поиска: {"cars": [...], "used_cars": [...]}"""
         try:
-            _redis_client.set(self.results_key, json.dumps(results), ex=3600)
+            data = redis_client.hgetall(self.results_key)
         except Exception:
-            pass
-    
-    def get_search_results(self) -> Optional[Dict[str, Any]]:
-        """Получает сохраненные результаты поиска"""
+            return None
+        if not data:
+            return None
+        return {
+            group: [int(car_id) for car_id in _loads(data.get(group), []) if car_id]
+            for group in ("cars", "used_cars")
+        }
+
+    def get_search_results(self, db: Optional[Session] = None) -> Optional[Dict[str, Any]]:
+        """
+        Получает сохраненные результаты поиска с карточками автомобилей
+
+        Карточки загружаются из БД одним запросом на тип (порядок сохраняется);
+        без db используется отдельная сессия.
+        """
+        ids = self.get_search_result_ids()
+        if ids is None:
+            return None
+        from models import SessionLocal
+        from services.car_hydration_service import CarHydrator, car_to_dict
+
+        session = db or SessionLocal()
         try:
-            data = _redis_client.get(self.results_key)
-            if data:
-                return json.loads(data)
+            hydrator = CarHydrator(session, with_relations=False)
+            cars, used_cars = hydrator.hydrate(
+                [("car", car_id) for car_id in ids["cars"]] + [("used_car", car_id) for car_id in ids["used_cars"]]
+            )
         except Exception:
-            pass
-        return None
+            return None
+        finally:
+            if db is None:
+                session.close()
 
+        def card(car) -> Dict[str, Any]:
+            summary = car_to_dict(car)
+            summary["year"] = summary.get("manufacture_year")
+            return summary
 
+        return {"cars": [card(car) for car in cars], "used_cars": [card(car) for car in used_cars]}
@@ -7,7 +7,7 @@ import json
 import time
 # Отключено: определение темы через LLM
 # from services.ai_model_orchestrator_service import AIModelOrchestratorService, TaskType
-from services.dialog_state_service import _init_redis_client
+from app.core.redis_client import redis_client
 
 
 class DialogueHistoryService:
@@ -15,7 +15,7 @@ class DialogueHistoryService:
     
     def __init__(self, user_id: str, session_id: Optional[int] = None):
         self.user_id = user_id
-        self.redis_client = _init_redis_client()
+        self.redis_client = redis_client
         # Отключено: определение темы через LLM
         # self.orchestrator = AIModelOrchestratorService()
         
@@ -0,0 +1,394 @@
+"""
+Очередь фоновой обработки документов
+
+Задачи хранятся в таблице document_jobs (Postgres), поэтому переживают перезапуск.
+Пул потоков-обработчиков забирает задачи через SELECT ... FOR UPDATE SKIP LOCKED,
+выполняет этапы extract -> metadata -> chunks (конвейером: извлечение страниц идет
+параллельно с чанкингом) и сохраняет прогресс после каждого этапа и каждого чанка.
+При повторе обработка продолжается с последнего сохраненного чанка.
+
+Пока задача выполняется, отдельный поток обновляет heartbeat_at (долгие извлечение
+и генерация метаданных не коммитят прогресс), а обработчики периодически возвращают
+в очередь задачи без heartbeat - в том числе задачи процессов, упавших после старта.
+"""
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from models import SessionLocal, engine
+from models.database import Document, DocumentJob
+from services.document_service import DocumentService
+
+ACTIVE_STATUSES = ("queued", "running")
+
+# Доля общего прогресса на момент начала этапа
+STAGE_PROGRESS = {
+    "extract": 0.0,
+    "metadata": 0.1,
+    "chunks": 0.2,
+    "done": 1.0,
+}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class DocumentJobService:
+    """Постановка задач в очередь и получение их статуса"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def enqueue(self, document_id: int, max_attempts: Optional[int] = None) -> DocumentJob:
+        """
+        Ставит документ в очередь на обработку
+
+        Если для документа уже есть активная задача, возвращает ее (повторная постановка идемпотентна).
+        """
+        active_job = self.db.query(DocumentJob).filter(
+            DocumentJob.document_id == document_id,
+            DocumentJob.status.in_(ACTIVE_STATUSES)
+        ).order_by(DocumentJob.id.desc()).first()
+        if active_job:
+            return active_job
+
+        job = DocumentJob(
+            document_id=document_id,
+            status="queued",
+            stage="extract",
+            progress=0.0,
+            chunks_done=0,
+            attempts=0,
+            max_attempts=max_attempts or settings.document_job_max_attempts,
+            run_after=_now(),
+        )
+        self.db.add(job)
+
+        document = self.db.query(Document).filter(Document.id == document_id).first()
+        if document:
+            document.processing_status = "pending"
+            document.error_message = None
+
+        self.db.commit()
+        self.db.refresh(job)
+
+        document_job_worker.notify()
+        return job
+
+    def get_job(self, job_id: int) -> Optional[DocumentJob]:
+        return self.db.query(DocumentJob).filter(DocumentJob.id == job_id).first()
+
+    def get_latest_job(self, document_id: int) -> Optional[DocumentJob]:
+        return self.db.query(DocumentJob).filter(
+            DocumentJob.document_id == document_id
+        ).order_by(DocumentJob.id.desc()).first()
+
+    def list_jobs(self, status: Optional[str] = None, limit: int = 100) -> List[DocumentJob]:
+        query = self.db.query(DocumentJob)
+        if status:
+            query = query.filter(DocumentJob.status == status)
+        return query.order_by(DocumentJob.id.desc()).limit(limit).all()
+
+    @staticmethod
+    def job_to_dict(job: DocumentJob) -> Dict[str, Any]:
+        return {
+            "job_id": job.id,
+            "document_id": job.document_id,
+            "status": job.status,
+            "stage": job.stage,
+            "progress": round(job.progress or 0.0, 4),
+            "chunks_done": job.chunks_done,
+            "chunks_total": job.chunks_total,
+            "attempts": job.attempts,
+            "max_attempts": job.max_attempts,
+            "error_message": job.error_message,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "started_at": job.started_at.isoformat() if job.started_at else None,
+            "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        }
+
+
+class DocumentJobWorker:
+    """Пул потоков, обрабатывающих очередь document_jobs с ограничениями на каждый этап"""
+
+    def __init__(
+        self,
+        workers: int = 2,
+        extract_concurrency: int = 2,
+        metadata_concurrency: int = 2,
+        embed_concurrency: int = 4,
+        metadata_workers: int = 4,
+        poll_interval: float = 5.0,
+        stale_after: int = 600,
+        requeue_interval: float = 60.0,
+    ):
+        self.workers = max(1, workers)
+        self.metadata_workers = max(1, metadata_workers)
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.requeue_interval = requeue_interval
+        # Heartbeat обновляется в несколько раз чаще, чем задача считается зависшей
+        self.heartbeat_interval = max(1.0, stale_after / 4)
+        self._requeue_lock = threading.Lock()
+        self._next_requeue_at = 0.0
+        self.extract_semaphore = threading.BoundedSemaphore(max(1, extract_concurrency))
+        self.metadata_semaphore = threading.BoundedSemaphore(max(1, metadata_concurrency))
+        self.embed_semaphore = threading.BoundedSemaphore(max(1, embed_concurrency))
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+    def start(self):
+        """Запускает обработчики (вызывается при старте приложения)"""
+        if self._threads:
+            return
+        self._stop.clear()
+        self._maybe_requeue_stale_jobs()
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._run,
+                args=(f"{self._worker_prefix}:{index}",),
+                name=f"document-job-worker-{index}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+        print(f"✅ Запущено {self.workers} обработчиков очереди документов")
+
+    def stop(self):
+        """Останавливает обработчики после завершения текущих этапов"""
+        self._stop.set()
+        self._wake.set()
+        self._threads = []
+
+    def notify(self):
+        """Будит обработчики после постановки новой задачи"""
+        self._wake.set()
+
+    def _run(self, worker_id: str):
+        while not self._stop.is_set():
+            self._maybe_requeue_stale_jobs()
+            try:
+                job_id = self._claim_job(worker_id)
+            except Exception as e:
+                print(f"⚠️ Ошибка получения задачи из очереди документов: {e}")
+                job_id = None
+
+            if job_id is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+
+            self._process_job(job_id, worker_id)
+
+    def _claim_job(self, worker_id: str) -> Optional[int]:
+        """Атомарно забирает следующую готовую задачу"""
+        db = SessionLocal()
+        try:
+            query = db.query(DocumentJob).filter(
+                DocumentJob.status == "queued",
+                DocumentJob.run_after <= _now()
+            ).order_by(DocumentJob.id)
+            if engine.dialect.name == "postgresql":
+                query = query.with_for_update(skip_locked=True)
+
+            job = query.first()
+            if not job:
+                db.rollback()
+                return None
+
+            job.status = "running"
+            job.worker_id = worker_id
+            job.attempts = (job.attempts or 0) + 1
+            job.heartbeat_at = _now()
+            if not job.started_at:
+                job.started_at = _now()
+            db.commit()
+            return job.id
+        finally:
+            db.close()
+
+    def _maybe_requeue_stale_jobs(self):
+        """Проверка зависших задач не чаще раза в requeue_interval на весь пул"""
+        with self._requeue_lock:
+            now = time.monotonic()
+            if now < self._next_requeue_at:
+                return
+            self._next_requeue_at = now + self.requeue_interval
+        self._requeue_stale_jobs()
+
+    def _requeue_stale_jobs(self):
+        """
+        Возвращает в очередь задачи, обработчик которых умер (нет heartbeat)
+
+        Задача, исчерпавшая попытки, завершается ошибкой: иначе файл, на котором
+        обработчик каждый раз падает (например, по памяти), повторялся бы бесконечно.
+        """
+        db = SessionLocal()
+        try:
+            stale_before = _now() - timedelta(seconds=self.stale_after)
+            query = db.query(DocumentJob).filter(
+                DocumentJob.status == "running",
+                DocumentJob.heartbeat_at < stale_before
+            )
+            if engine.dialect.name == "postgresql":
+                query = query.with_for_update(skip_locked=True)
+
+            requeued = failed = 0
+            for job in query.all():
+                job.worker_id = None
+                if (job.attempts or 0) < job.max_attempts:
+                    job.status = "queued"
+                    requeued += 1
+                    continue
+
+                error = "Обработчик задачи прервался, попытки исчерпаны"
+                job.status = "failed"
+                job.error_message = error
+                job.finished_at = _now()
+                document = db.query(Document).filter(Document.id == job.document_id).first()
+                if document:
+                    document.processing_status = "failed"
+                    document.error_message = error
+                failed += 1
+            db.commit()
+            if requeued:
+                print(f"🔄 Возвращено в очередь {requeued} прерванных задач обработки документов")
+            if failed:
+                print(f"❌ {failed} прерванных задач обработки документов исчерпали попытки")
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ Ошибка восстановления задач обработки документов: {e}")
+        finally:
+            db.close()
+
+    def _heartbeat(self, job_id: int, worker_id: str, done: threading.Event):
+        """Обновляет heartbeat_at задачи, пока ее обрабатывает этот обработчик"""
+        while not done.wait(self.heartbeat_interval):
+            db = SessionLocal()
+            try:
+                db.query(DocumentJob).filter(
+                    DocumentJob.id == job_id,
+                    DocumentJob.worker_id == worker_id,
+                    DocumentJob.status == "running"
+                ).update({DocumentJob.heartbeat_at: _now()}, synchronize_session=False)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                print(f"⚠️ Ошибка обновления heartbeat задачи {job_id}: {e}")
+            finally:
+                db.close()
+
+    def _advance(self, db: Session, job: DocumentJob, stage: str):
+        job.stage = stage
+        job.progress = STAGE_PROGRESS[stage]
+        job.heartbeat_at = _now()
+        db.commit()
+
+    def _process_job(self, job_id: int, worker_id: str):
+        db = SessionLocal()
+        job = None
+        heartbeat_done = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat,
+            args=(job_id, worker_id, heartbeat_done),
+            name=f"document-job-heartbeat-{job_id}",
+            daemon=True,
+        )
+        heartbeat.start()
+        try:
+            job = db.query(DocumentJob).filter(DocumentJob.id == job_id).first()
+            doc_service = DocumentService(db)
+            document = doc_service.get_document(job.document_id)
+            if not document:
+                job.status = "failed"
+                job.error_message = "Документ не найден"
+                job.finished_at = _now()
+                db.commit()
+                return
+
+            document.processing_status = "processing"
+            db.commit()
+
+            if job.stage != "done":
+                def on_stage(stage: str):
+                    self._advance(db, job, stage)
+
+                def on_progress(done: int, fraction: float):
+                    job.chunks_done = done
+                    job.progress = STAGE_PROGRESS["chunks"] + (1.0 - STAGE_PROGRESS["chunks"]) * fraction
+                    job.heartbeat_at = _now()
+
+                # Извлечение, метаданные и чанки идут конвейером: чанки считаются, пока извлекаются страницы
+                job.chunks_total = doc_service.process_document_streaming(
+                    document,
+                    start_index=job.chunks_done or 0,
+                    generate_metadata=job.stage in ("extract", "metadata"),
+                    metadata_workers=self.metadata_workers,
+                    on_stage=on_stage,
+                    on_progress=on_progress,
+                    extract_semaphore=self.extract_semaphore,
+                    metadata_semaphore=self.metadata_semaphore,
+                    embed_semaphore=self.embed_semaphore
+                )
+                self._advance(db, job, "done")
+
+            doc_service.mark_document_completed(document)
+            job.status = "completed"
+            job.progress = 1.0
+            job.error_message = None
+            job.finished_at = _now()
+            db.commit()
+            print(f"✅ Документ {document.id} обработан (задача {job.id})")
+
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ Ошибка обработки документа (задача {job_id}): {e}")
+            self._handle_failure(db, job_id, str(e))
+        finally:
+            heartbeat_done.set()
+            heartbeat.join()
+            db.close()
+
+    def _handle_failure(self, db: Session, job_id: int, error: str):
+        """Повтор с экспоненциальной задержкой или окончательная ошибка"""
+        try:
+            job = db.query(DocumentJob).filter(DocumentJob.id == job_id).first()
+            if not job:
+                return
+            job.error_message = error
+            job.worker_id = None
+            document = db.query(Document).filter(Document.id == job.document_id).first()
+
+            if job.attempts < job.max_attempts:
+                job.status = "queued"
+                job.run_after = _now() + timedelta(seconds=10 * (2 ** job.attempts))
+                if document:
+                    document.processing_status = "pending"
+            else:
+                job.status = "failed"
+                job.finished_at = _now()
+                if document:
+                    document.processing_status = "failed"
+                    document.error_message = error
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"❌ Не удалось сохранить ошибку задачи {job_id}: {e}")
+
+
+document_job_worker = DocumentJobWorker(
+    workers=settings.document_job_workers,
+    extract_concurrency=settings.document_extract_concurrency,
+    metadata_concurrency=settings.document_metadata_concurrency,
+    embed_concurrency=settings.document_embed_concurrency,
+    metadata_workers=settings.document_metadata_workers,
+)
@@ -1,8 +1,13 @@
+import io
 import os
 import uuid
-import hashlib
+import codecs
 import mimetypes
-from typing import List, Optional, Tuple, BinaryIO
+import queue
+import threading
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, BinaryIO, Union
 from sqlalchemy.orm import Session
 from sqlalchemy import and_, or_, func
 from models.database import Document, Category, Tag, DocumentChunk
@@ -10,14 +15,38 @@ from models.schemas import DocumentCreate, DocumentUpdate
 import requests
 import time
 from app.core.config import settings
+from services.blob_storage_service import document_blob_storage
+from services.embedding_provider_service import current_embedding_model, embed_texts
+from services.pagination_service import cached_count, paginate
+from services.text_chunker_service import TextChunk, chunk_hash, chunk_texts_parallel, default_chunker
+
+# Сколько символов начала документа нужно для генерации метаданных (тема/теги берут text[:2000])
+METADATA_PREFIX_CHARS = 2000
+# Абзацев DOCX в одном блоке потоковой выдачи
+DOC_PARAGRAPHS_PER_BLOCK = 50
+# Размер блока при чтении TXT
+TXT_BLOCK_SIZE = 64 * 1024
+# Сколько извлеченных страниц может ждать чанкинга
+EXTRACT_QUEUE_SIZE = 8
 
 
 class DocumentService:
     def __init__(self, db: Session):
         self.db = db
     
-    def create_document(self, document_data: DocumentCreate, file_content: bytes) -> Document:
-        """Создает новый документ в базе данных"""
+    def create_document(
+        self,
+        document_data: DocumentCreate,
+        file_content: Optional[bytes] = None,
+        content_hash: Optional[str] = None,
+        file_size: Optional[int] = None
+    ) -> Document:
+        """
+        Создает новый документ в базе данных
+        
+        Файл хранится в BlobStorage: передайте либо file_content, либо уже сохраненный
+        content_hash с file_size. В строке документа остается только хеш.
+        """
         # Проверяем, не существует ли уже документ с таким же именем файла
         existing_document = self.db.query(Document).filter(
             Document.original_filename == document_data.original_filename
@@ -26,17 +55,20 @@ class DocumentService:
         if existing_document:
             raise ValueError(f"Документ с именем '{document_data.original_filename}' уже существует")
         
+        if content_hash is None:
+            content_hash = document_blob_storage.put_bytes(file_content)
+            file_size = len(file_content)
+        
         # Генерируем уникальное имя файла
-        file_hash = hashlib.md5(file_content).hexdigest()
-        filename = f"{file_hash}_{uuid.uuid4().hex[:8]}.{document_data.file_type}"
+        filename = f"{content_hash[:32]}_{uuid.uuid4().hex[:8]}.{document_data.file_type}"
         
         # Создаем документ
         document = Document(
             filename=filename,
             original_filename=document_data.original_filename,
             file_type=document_data.file_type,
-            file_size=len(file_content),
-            file_content=file_content,
+            file_size=file_size,
+            content_hash=content_hash,
             language=document_data.language,
             path=document_data.path,
             processing_status="pending"
@@ -66,6 +98,12 @@ class DocumentService:
     
     def get_documents(self, skip: int = 0, limit: int = 100, search: Optional[str] = None) -> Tuple[List[Document], int]:
         """Получает список документов с пагинацией и поиском"""
+        documents, total, _ = self.get_documents_page(skip=skip, limit=limit, search=search)
+        return documents, total
+    
+    def get_documents_page(self, skip: int = 0, limit: int = 100, search: Optional[str] = None,
+                           cursor: Optional[str] = None) -> Tuple[List[Document], int, Optional[str]]:
+        """Страница документов (по id) с курсором следующей страницы и кэшированным total"""
         query = self.db.query(Document)
         
         if search:
@@ -77,14 +115,34 @@ class DocumentService:
             )
             query = query.filter(search_filter)
         
-        total = query.count()
-        documents = query.offset(skip).limit(limit).all()
-        return documents, total
+        total = cached_count(query, Document.__tablename__, {"search": search})
+        documents, next_cursor = paginate(query, None, Document.id, limit, skip=skip, cursor=cursor, descending=False)
+        return documents, total, next_cursor
     
     def get_document(self, document_id: int) -> Optional[Document]:
         """Получает документ по ID"""
         return self.db.query(Document).filter(Document.id == document_id).first()
     
+    def get_document_by_hash(self, content_hash: str) -> Optional[Document]:
+        """Находит уже загруженный документ с тем же содержимым"""
+        return self.db.query(Document).filter(
+            Document.content_hash == content_hash
+        ).order_by(Document.id).first()
+    
+    def get_document_content(self, document: Document) -> Optional[bytes]:
+        """Возвращает байты файла документа (из BlobStorage или из устаревшей колонки file_content)"""
+        if document.content_hash and document_blob_storage.exists(document.content_hash):
+            return document_blob_storage.read_bytes(document.content_hash)
+        return document.file_content
+    
+    def get_document_source(self, document: Document) -> Optional[Union[Path, BinaryIO]]:
+        """Путь к файлу в BlobStorage (читается с диска по страницам) или поток из устаревшей колонки"""
+        if document.content_hash and document_blob_storage.exists(document.content_hash):
+            return document_blob_storage.path_for(document.content_hash)
+        if document.file_content is not None:
+            return io.BytesIO(document.file_content)
+        return None
+    
     def update_document(self, document_id: int, document_data: DocumentUpdate) -> Optional[Document]:
         """Обновляет документ"""
         document = self.get_document(document_id)
@@ -128,12 +186,22 @@ class DocumentService:
         if not document:
             return False
         
+        content_hash = document.content_hash
         self.db.delete(document)
         self.db.commit()
+        
+        # Удаляем файл, если на него больше не ссылается ни один документ
+        if content_hash and not self.get_document_by_hash(content_hash):
+            document_blob_storage.delete(content_hash)
         return True
     
     def process_document(self, document_id: int) -> bool:
-        """Обрабатывает документ: извлекает текст, генерирует тему и теги"""
+        """
+        Обрабатывает документ: извлекает текст, генерирует тему и теги
+        
+        Синхронная обработка в текущем потоке. Для фоновой обработки с прогрессом
+        и повторами используйте DocumentJobService.enqueue.
+        """
         document = self.get_document(document_id)
         if not document:
             return False
@@ -143,60 +211,9 @@ class DocumentService:
             document.processing_status = "processing"
             self.db.commit()
             
-            # Извлекаем текст из файла
-            extracted_text = self._extract_text_from_file(document.file_content, document.file_type)
-            if not extracted_text:
-                raise Exception("Не удалось извлечь текст из файла")
-            
-            document.extracted_text = extracted_text
-            
-            # Генерируем тему документа
-            topic = self._generate_topic(extracted_text)
-            document.topic = topic
-            
-            # Генерируем заголовок
-            title = self._generate_title(extracted_text, document.original_filename)
-            document.title = title
-            
-            # Генерируем категории
-            categories = self._generate_categories(extracted_text, title)
-            if categories:
-                # Очищаем старые категории и добавляем новые
-                document.categories.clear()
-                for category_name in categories:
-                    category = self.db.query(Category).filter(Category.name == category_name).first()
-                    if not category:
-                        category = Category(name=category_name)
-                        self.db.add(category)
-                        self.db.flush()
-                    document.categories.append(category)
-            
-            # Генерируем теги
-            tags = self._generate_tags(extracted_text, title)
-            if tags:
-                # Очищаем старые теги и добавляем новые
-                document.tags.clear()
-                for tag_name in tags:
-                    tag = self.db.query(Tag).filter(Tag.name == tag_name).first()
-                    if not tag:
-                        tag = Tag(name=tag_name)
-                        self.db.add(tag)
-                        self.db.flush()
-                    document.tags.append(tag)
-            
-            # Генерируем краткое содержание
-            summary = self._generate_summary(extracted_text)
-            document.summary = summary
-            
-            # Создаем чанки текста с эмбеддингами
-            chunks = self.create_document_chunks(document.id)
+            self.process_document_streaming(document)
             
-            # Обновляем статус и время обработки
-            document.processing_status = "completed"
-            document.processed_at = func.now()
-            document.error_message = None
-            
-            self.db.commit()
+            self.mark_document_completed(document)
             return True
             
         except Exception as e:
@@ -205,17 +222,215 @@ class DocumentService:
             self.db.commit()
             return False
     
+    # Этапы обработки документа (используются также фоновыми задачами DocumentJobService)
+    
+    def process_document_streaming(
+        self,
+        document: Document,
+        start_index: int = 0,
+        generate_metadata: bool = True,
+        metadata_workers: int = 1,
+        on_stage: Optional[Callable[[str], None]] = None,
+        on_progress: Optional[Callable[[int, float], None]] = None,
+        extract_semaphore=None,
+        metadata_semaphore=None,
+        embed_semaphore=None
+    ) -> int:
+        """
+        Потоковая обработка: извлечение по страницам -> метаданные -> чанки с эмбеддингами
+        
+        Текст извлекается в отдельном потоке прямо из файла на диске и через ограниченную
+        очередь передается в TextChunker, поэтому эмбеддинги первых чанков считаются, пока
+        извлекаются следующие страницы, а в памяти не держится весь файл. Метаданные
+        генерируются по первым METADATA_PREFIX_CHARS символам, как только они извлечены.
+        
+        Args:
+            document: Документ
+            start_index: С какого чанка продолжить (чанки с меньшим индексом уже сохранены)
+            generate_metadata: Генерировать ли метаданные (False при продолжении с этапа чанков)
+            metadata_workers: Сколько LLM-запросов метаданных выполнять параллельно
+            on_stage: Callback при переходе к этапу "metadata" / "chunks"
+            on_progress: Callback (сохранено чанков, доля извлеченного файла) перед коммитом каждого чанка
+            extract_semaphore: Семафор, ограничивающий параллельные извлечения текста
+            metadata_semaphore: Семафор, ограничивающий параллельную генерацию метаданных
+            embed_semaphore: Семафор, ограничивающий параллельные запросы эмбеддингов
+        
+        Returns:
+            Общее количество чанков документа
+        """
+        stats: Dict[str, int] = {}
+        blocks = self._iter_in_background(
+            lambda: self.iter_document_text(document, stats),
+            semaphore=extract_semaphore
+        )
+        
+        # Начало документа нужно до чанков: метаданные входят в контекст эмбеддингов
+        parts: List[str] = []
+        prefix_length = 0
+        for block in blocks:
+            parts.append(block)
+            prefix_length += len(block)
+            if prefix_length >= METADATA_PREFIX_CHARS:
+                break
+        
+        prefix_text = "".join(parts).strip()
+        if not prefix_text:
+            blocks.close()
+            raise Exception("Не удалось извлечь текст из файла")
+        
+        if generate_metadata:
+            if on_stage is not None:
+                on_stage("metadata")
+            with metadata_semaphore if metadata_semaphore is not None else nullcontext():
+                self.generate_document_metadata(document, max_workers=metadata_workers, text=prefix_text)
+        if on_stage is not None:
+            on_stage("chunks")
+        
+        blocks_done = [len(parts)]
+        
+        def all_blocks() -> Iterator[str]:
+            yield from list(parts)
+            for block in blocks:
+                parts.append(block)
+                blocks_done[0] += 1
+                yield block
+        
+        # Удаляем существующие чанки (при продолжении - только недописанные),
+        # запомнив их эмбеддинги: неизменившиеся чанки не отправляются в API повторно
+        reusable = self._pop_reusable_embeddings(document.id, start_index)
+        
+        context = self._build_chunk_context(document)
+        total_chunks = 0
+        
+        try:
+            for i, chunk in enumerate(default_chunker.iter_chunks(all_blocks())):
+                total_chunks = i + 1
+                if i < start_index:
+                    continue
+                
+                self.db.add(self._build_chunk(document.id, i, chunk, context, reusable, embed_semaphore))
+                
+                if on_progress is not None:
+                    blocks_total = stats.get("blocks_total")
+                    fraction = min(blocks_done[0] / blocks_total, 1.0) if blocks_total else 0.0
+                    on_progress(i + 1, fraction)
+                # Коммитим каждый чанк (вместе с прогрессом), чтобы повтор продолжил с последнего сохраненного
+                self.db.commit()
+        finally:
+            blocks.close()
+        
+        # Полный текст нужен для поиска по документам; собирается один раз из страниц
+        document.extracted_text = "".join(parts).strip()
+        self.db.commit()
+        return total_chunks
+    
+    def generate_document_metadata(self, document: Document, max_workers: int = 1, text: Optional[str] = None):
+        """
+        Генерирует тему, заголовок, категории, теги и краткое содержание
+        
+        Args:
+            document: Документ с извлеченным текстом
+            max_workers: Сколько LLM-запросов выполнять параллельно (1 - последовательно)
+            text: Текст для анализа (по умолчанию document.extracted_text; достаточно начала документа)
+        """
+        extracted_text = text if text is not None else document.extracted_text
+        
+        # Генерируем заголовок
+        title = self._generate_title(extracted_text, document.original_filename)
+        
+        # Тема, категории, теги и краткое содержание независимы друг от друга
+        if max_workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                topic_future = executor.submit(self._generate_topic, extracted_text)
+                categories_future = executor.submit(self._generate_categories, extracted_text, title)
+                tags_future = executor.submit(self._generate_tags, extracted_text, title)
+                summary_future = executor.submit(self._generate_summary, extracted_text)
+                topic = topic_future.result()
+                categories = categories_future.result()
+                tags = tags_future.result()
+                summary = summary_future.result()
+        else:
+            topic = self._generate_topic(extracted_text)
+            categories = self._generate_categories(extracted_text, title)
+            tags = self._generate_tags(extracted_text, title)
+            summary = self._generate_summary(extracted_text)
+        
+        document.topic = topic
+        document.title = title
+        
+        if categories:
+            # Очищаем старые категории и добавляем новые
+            document.categories.clear()
+            for category_name in categories:
+                category = self.db.query(Category).filter(Category.name == category_name).first()
+                if not category:
+                    category = Category(name=category_name)
+                    self.db.add(category)
+                    self.db.flush()
+                document.categories.append(category)
+        
+        if tags:
+            # Очищаем старые теги и добавляем новые
+            document.tags.clear()
+            for tag_name in tags:
+                tag = self.db.query(Tag).filter(Tag.name == tag_name).first()
+                if not tag:
+                    tag = Tag(name=tag_name)
+                    self.db.add(tag)
+                    self.db.flush()
+                document.tags.append(tag)
+        
+        document.summary = summary
+        self.db.commit()
+    
+    def mark_document_completed(self, document: Document):
+        """Обновляет статус и время обработки"""
+        document.processing_status = "completed"
+        document.processed_at = func.now()
+        document.error_message = None
+        self.db.commit()
+    
     def _extract_text_from_file(self, file_content: bytes, file_type: str) -> str:
         """Извлекает текст из файла в зависимости от типа"""
+        return "".join(self._iter_text_blocks(io.BytesIO(file_content), file_type)).strip()
+    
+    def _extract_text_from_pdf(self, file_content: bytes) -> str:
+        """Извлекает текст из PDF файла"""
+        return "".join(self._iter_pdf_pages(io.BytesIO(file_content))).strip()
+    
+    def _extract_text_from_doc(self, file_content: bytes) -> str:
+        """Извлекает текст из DOC/DOCX файла"""
+        return "".join(self._iter_doc_blocks(io.BytesIO(file_content))).strip()
+    
+    def iter_document_text(self, document: Document, stats: Optional[Dict[str, int]] = None) -> Iterator[str]:
+        """
+        Извлекает текст документа по страницам (PDF) или блокам абзацев (DOCX, TXT)
+        
+        Конкатенация блоков дает полный текст. В stats["blocks_total"] записывается
+        ожидаемое число блоков, как только оно известно (для оценки прогресса).
+        """
+        source = self.get_document_source(document)
+        if source is None:
+            raise Exception("Файл документа не найден")
+        return self._iter_text_blocks(source, document.file_type, stats)
+    
+    def _iter_text_blocks(
+        self,
+        source: Union[Path, BinaryIO],
+        file_type: str,
+        stats: Optional[Dict[str, int]] = None
+    ) -> Iterator[str]:
+        file_type = file_type.lower()
         try:
-            if file_type.lower() == 'txt':
-                return file_content.decode('utf-8', errors='ignore')
+            if file_type == 'txt':
+                yield from self._iter_txt_blocks(source, stats)
             
-            elif file_type.lower() == 'pdf':
-                return self._extract_text_from_pdf(file_content)
+            elif file_type == 'pdf':
+                yield from self._iter_pdf_pages(source, stats)
             
-            elif file_type.lower() in ['doc', 'docx']:
-                return self._extract_text_from_doc(file_content)
+            elif file_type in ['doc', 'docx']:
+                yield from self._iter_doc_blocks(source, stats)
             
             else:
                 raise Exception(f"Неподдерживаемый тип файла: {file_type}")
@@ -223,39 +438,137 @@ class DocumentService:
         except Exception as e:
             raise Exception(f"Ошибка извлечения текста: {str(e)}")
     
-    def _extract_text_from_pdf(self, file_content: bytes) -> str:
-        """Извлекает текст из PDF файла"""
+    def _iter_txt_blocks(self, source: Union[Path, BinaryIO], stats: Optional[Dict[str, int]] = None) -> Iterator[str]:
+        """Читает TXT блоками, декодируя UTF-8 инкрементально (многобайтные символы на границах не теряются)"""
+        stream = open(source, "rb") if isinstance(source, Path) else source
+        try:
+            if stats is not None and isinstance(source, Path):
+                stats["blocks_total"] = max(1, -(-source.stat().st_size // TXT_BLOCK_SIZE))
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+            while True:
+                data = stream.read(TXT_BLOCK_SIZE)
+                if not data:
+                    break
+                text = decoder.decode(data)
+                if text:
+                    yield text
+            tail = decoder.decode(b"", final=True)
+            if tail:
+                yield tail
+        finally:
+            if stream is not source:
+                stream.close()
+    
+    def _iter_pdf_pages(self, source: Union[Path, BinaryIO], stats: Optional[Dict[str, int]] = None) -> Iterator[str]:
+        """
+        Извлекает текст PDF постранично
+        
+        Если установлен PyMuPDF (fitz), используется он - он в разы быстрее PyPDF2
+        на больших файлах. Бэкенд выбирается настройкой document_pdf_backend.
+        """
+        backend = settings.document_pdf_backend
+        if backend in ("auto", "pymupdf"):
+            try:
+                import fitz
+            except ImportError:
+                if backend == "pymupdf":
+                    raise Exception("PyMuPDF не установлен. Установите: pip install PyMuPDF")
+            else:
+                yield from self._iter_pdf_pages_pymupdf(fitz, source, stats)
+                return
+        
         try:
             import PyPDF2
-            import io
-            
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            return text.strip()
         except ImportError:
-            # Fallback: используем внешний сервис или возвращаем ошибку
             raise Exception("PyPDF2 не установлен. Установите: pip install PyPDF2")
+        
+        try:
+            # PdfReader читает страницы из файла по мере обращения к ним
+            pdf_reader = PyPDF2.PdfReader(str(source) if isinstance(source, Path) else source)
+            if stats is not None:
+                stats["blocks_total"] = len(pdf_reader.pages)
+            for page in pdf_reader.pages:
+                yield (page.extract_text() or "") + "\n"
         except Exception as e:
             raise Exception(f"Ошибка чтения PDF: {str(e)}")
     
-    def _extract_text_from_doc(self, file_content: bytes) -> str:
-        """Извлекает текст из DOC/DOCX файла"""
+    def _iter_pdf_pages_pymupdf(self, fitz, source: Union[Path, BinaryIO], stats: Optional[Dict[str, int]] = None) -> Iterator[str]:
+        try:
+            if isinstance(source, Path):
+                pdf = fitz.open(str(source))
+            else:
+                pdf = fitz.open(stream=source.read(), filetype="pdf")
+            with pdf:
+                if stats is not None:
+                    stats["blocks_total"] = pdf.page_count
+                for page in pdf:
+                    yield page.get_text() + "\n"
+        except Exception as e:
+            raise Exception(f"Ошибка чтения PDF: {str(e)}")
+    
+    def _iter_doc_blocks(self, source: Union[Path, BinaryIO], stats: Optional[Dict[str, int]] = None) -> Iterator[str]:
+        """Извлекает текст DOC/DOCX блоками по DOC_PARAGRAPHS_PER_BLOCK абзацев"""
         try:
             import docx
-            import io
-            
-            doc = docx.Document(io.BytesIO(file_content))
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            return text.strip()
         except ImportError:
             raise Exception("python-docx не установлен. Установите: pip install python-docx")
+        
+        try:
+            doc = docx.Document(str(source) if isinstance(source, Path) else source)
+            paragraphs = doc.paragraphs
+            if stats is not None:
+                stats["blocks_total"] = max(1, -(-len(paragraphs) // DOC_PARAGRAPHS_PER_BLOCK))
+            for start in range(0, len(paragraphs), DOC_PARAGRAPHS_PER_BLOCK):
+                batch = paragraphs[start:start + DOC_PARAGRAPHS_PER_BLOCK]
+                yield "".join(paragraph.text + "\n" for paragraph in batch)
         except Exception as e:
             raise Exception(f"Ошибка чтения DOC/DOCX: {str(e)}")
     
+    def _iter_in_background(self, factory: Callable[[], Iterable[str]], semaphore=None,
+                            maxsize: int = EXTRACT_QUEUE_SIZE) -> Iterator[str]:
+        """
+        Выполняет итератор в отдельном потоке, передавая элементы через ограниченную очередь
+        
+        Производитель блокируется, когда потребитель отстает, поэтому в памяти
+        не больше maxsize блоков. При закрытии генератора поток останавливается.
+        """
+        buffer: "queue.Queue" = queue.Queue(maxsize=maxsize)
+        stop = threading.Event()
+        finished = object()
+        
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    buffer.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        
+        def produce():
+            try:
+                with semaphore if semaphore is not None else nullcontext():
+                    for item in factory():
+                        if not put(item):
+                            return
+            except Exception as e:
+                put(e)
+            finally:
+                put(finished)
+        
+        thread = threading.Thread(target=produce, name="document-extract", daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = buffer.get()
+                if item is finished:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+    
     def _generate_topic(self, text: str) -> str:
         """Генерирует тему документа с помощью Mistral AI"""
         try:
@@ -494,33 +807,6 @@ class DocumentService:
             and_(search_filter, Document.processing_status == "completed")
         ).limit(limit).all()
     
-    def _split_text_into_chunks(self, text: str, chunk_size: int = 500) -> List[str]:
-        """Разбивает текст на чанки заданного размера"""
-        if not text:
-            return []
-        
-        chunks = []
-        start = 0
-        
-        while start < len(text):
-            end = start + chunk_size
-            
-            # Если это не последний чанк, ищем ближайший пробел или перенос строки
-            if end < len(text):
-                # Ищем последний пробел или перенос строки в пределах чанка
-                for i in range(end, start + chunk_size // 2, -1):
-                    if text[i] in [' ', '\n', '\t', '.', '!', '?']:
-                        end = i + 1
-                        break
-            
-            chunk = text[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
-            
-            start = end
-        
-        return chunks
-    
     def _build_embedding_context(self, text: str, context: dict = None) -> str:
         """Строит контекстный текст для эмбеддинга"""
         if not context:
@@ -556,68 +842,57 @@ class DocumentService:
         return " | ".join(context_parts)
     
     def _generate_embedding(self, text: str, context: dict = None) -> Optional[str]:
-        """Генерирует эмбеддинг для текста с контекстной информацией"""
+        """Генерирует эмбеддинг для текста с контекстной информацией (текущим провайдером, через общий кэш)"""
         try:
             # Формируем контекстный текст для эмбеддинга
             context_text = self._build_embedding_context(text, context)
+            # Чанки уже укладываются в бюджет токенов; обрезка - только страховка от лимита модели
+            embedding_input = default_chunker.truncate(context_text, settings.embedding_max_input_tokens)
             
-            url = f"{settings.mistral_base_url}/v1/embeddings"
-            headers = {
-                "Authorization": f"Bearer {settings.mistral_api_key}",
-                "Content-Type": "application/json",
-            }
-            payload = {
-                "model": "mistral-embed",  # Используем модель для эмбеддингов
-                "input": context_text[:1000],  # Ограничиваем размер текста
-            }
-            
-            for attempt in range(3):
-                try:
-                    resp = requests.post(url, headers=headers, json=payload, timeout=30)
-                    if resp.status_code == 429:
-                        time.sleep(1 * (2 ** attempt))
-                        continue
-                    resp.raise_for_status()
-                    data = resp.json()
-                    if "data" in data and len(data["data"]) > 0:
-                        embedding = data["data"][0]["embedding"]
-                        return str(embedding)  # Сохраняем как JSON строку
-                    return None
-                except Exception:
-                    if attempt == 2:
-                        return None
-                    time.sleep(1)
-            
+            embedding = embed_texts([embedding_input])[0]
+            return str(embedding) if embedding else None  # Сохраняем как JSON строку
         except Exception:
             return None
     
-    def create_document_chunks(self, document_id: int, show_progress: bool = False) -> List[DocumentChunk]:
-        """Создает чанки для документа"""
+    def create_document_chunks(
+        self,
+        document_id: int,
+        show_progress: bool = False,
+        start_index: int = 0,
+        on_chunk_saved: Optional[Callable[[int, int], None]] = None,
+        embed_semaphore=None
+    ) -> List[DocumentChunk]:
+        """
+        Создает чанки для документа
+        
+        Args:
+            document_id: ID документа
+            show_progress: Печатать прогресс-бар в консоль
+            start_index: С какого чанка продолжить (чанки с меньшим индексом уже сохранены)
+            on_chunk_saved: Callback (сохранено, всего) перед коммитом каждого чанка (в той же транзакции)
+            embed_semaphore: Семафор, ограничивающий параллельные запросы эмбеддингов
+        """
         document = self.get_document(document_id)
         if not document or not document.extracted_text:
             return []
         
-        # Удаляем существующие чанки
-        self.db.query(DocumentChunk).filter(DocumentChunk.document_id == document_id).delete()
+        # Удаляем существующие чанки (при продолжении - только недописанные)
+        reusable = self._pop_reusable_embeddings(document_id, start_index)
         
         # Разбиваем текст на чанки
-        chunks = self._split_text_into_chunks(document.extracted_text)
+        chunks = default_chunker.split(document.extracted_text)
         created_chunks = []
         
-        # Собираем контекстную информацию для эмбеддингов
-        context = {
-            'filename': document.original_filename,
-            'path': document.path,
-            'topic': document.topic,
-            'categories': [cat.name for cat in document.categories],
-            'tags': [tag.name for tag in document.tags]
-        }
+        context = self._build_chunk_context(document)
         
         total_chunks = len(chunks)
         if show_progress:
             print(f"      📊 Создание {total_chunks} чанков с эмбеддингами...")
         
-        for i, chunk_text in enumerate(chunks):
+        for i, text_chunk in enumerate(chunks):
+            if i < start_index:
+                continue
+            
             if show_progress:
                 # Показываем прогресс для эмбеддингов
                 percent = (i + 1) / total_chunks * 100
@@ -626,19 +901,16 @@ class DocumentService:
                 bar = '█' * filled + '░' * (bar_length - filled)
                 print(f'\r      🔄 Эмбеддинги |{bar}| {percent:.1f}% ({i+1}/{total_chunks})', end='', flush=True)
             
-            # Генерируем эмбеддинг для чанка с контекстом
-            embedding = self._generate_embedding(chunk_text, context)
-            
-            # Создаем чанк
-            chunk = DocumentChunk(
-                document_id=document_id,
-                chunk_index=i,
-                text=chunk_text,
-                embedding=embedding
-            )
+            # Создаем чанк с эмбеддингом (с учетом контекста документа)
+            chunk = self._build_chunk(document_id, i, text_chunk, context, reusable, embed_semaphore)
             
             self.db.add(chunk)
             created_chunks.append(chunk)
+            
+            if on_chunk_saved is not None:
+                # Коммитим каждый чанк вместе с прогрессом, чтобы повтор продолжил с последнего сохраненного
+                on_chunk_saved(i + 1, total_chunks)
+                self.db.commit()
         
         if show_progress:
             print()  # Новая строка после прогресс-бара
@@ -651,6 +923,85 @@ class DocumentService:
         
         return created_chunks
     
+    def _build_chunk_context(self, document: Document) -> dict:
+        """Собирает контекстную информацию для эмбеддингов чанков"""
+        return {
+            'filename': document.original_filename,
+            'path': document.path,
+            'topic': document.topic,
+            'categories': [cat.name for cat in document.categories],
+            'tags': [tag.name for tag in document.tags]
+        }
+    
+    def _pop_reusable_embeddings(self, document_id: int, start_index: int = 0) -> Dict[str, str]:
+        """
+        Удаляет чанки начиная с start_index и возвращает их эмбеддинги по content_hash
+        
+        Переиспользуются только эмбеддинги текущей модели: векторы разных моделей несовместимы.
+        """
+        rows = self.db.query(DocumentChunk.content_hash, DocumentChunk.embedding).filter(
+            DocumentChunk.document_id == document_id,
+            DocumentChunk.chunk_index >= start_index,
+            DocumentChunk.content_hash.isnot(None),
+            DocumentChunk.embedding.isnot(None),
+            DocumentChunk.embedding_model == current_embedding_model()
+        ).all()
+        self.db.query(DocumentChunk).filter(
+            DocumentChunk.document_id == document_id,
+            DocumentChunk.chunk_index >= start_index
+        ).delete()
+        return {content_hash: embedding for content_hash, embedding in rows}
+    
+    def _build_chunk(self, document_id: int, index: int, chunk: TextChunk, context: dict,
+                     reusable: Dict[str, str], embed_semaphore=None) -> DocumentChunk:
+        """
+        Создает DocumentChunk с эмбеддингом
+        
+        content_hash считается от текста, который уходит в эмбеддинг (чанк + контекст документа),
+        поэтому совпадение хеша гарантирует, что эмбеддинг можно взять из прежней версии.
+        """
+        content_hash = chunk_hash(self._build_embedding_context(chunk.text, context))
+        embedding = reusable.get(content_hash)
+        if embedding is None:
+            with embed_semaphore if embed_semaphore is not None else nullcontext():
+                embedding = self._generate_embedding(chunk.text, context)
+        
+        return DocumentChunk(
+            document_id=document_id,
+            chunk_index=index,
+            text=chunk.text,
+            token_count=chunk.token_count,
+            content_hash=content_hash,
+            embedding=embedding,
+            embedding_model=current_embedding_model() if embedding else None
+        )
+    
+    def rechunk_documents(self, document_ids: List[int], max_workers: Optional[int] = None) -> Dict[int, int]:
+        """
+        Пересоздает чанки нескольких документов
+        
+        Разбиение выполняется параллельно в пуле процессов, эмбеддинги неизменившихся
+        чанков берутся из прежних версий.
+        
+        Returns:
+            {document_id: количество чанков}
+        """
+        documents = [
+            document for document in self.db.query(Document).filter(Document.id.in_(document_ids)).all()
+            if document.extracted_text
+        ]
+        chunked = chunk_texts_parallel([document.extracted_text for document in documents], max_workers=max_workers)
+        
+        results = {}
+        for document, chunks in zip(documents, chunked):
+            reusable = self._pop_reusable_embeddings(document.id)
+            context = self._build_chunk_context(document)
+            for i, chunk in enumerate(chunks):
+                self.db.add(self._build_chunk(document.id, i, chunk, context, reusable))
+            self.db.commit()
+            results[document.id] = len(chunks)
+        return results
+    
     def get_document_chunks(self, document_id: int) -> List[DocumentChunk]:
         """Получает чанки документа"""
         return self.db.query(DocumentChunk).filter(
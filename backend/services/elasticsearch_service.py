@@ -907,6 +907,15 @@ class ElasticsearchService:
     def get_aggregations(self, field: str, size: int = 20) -> Dict[str, Any]:
         """Получает агрегации по полю"""
         
+        # Материализованные фасеты каталога отвечают без запроса к Elasticsearch
+        try:
+            from services.facet_service import facet_store
+            materialized = facet_store.terms(field, size)
+            if materialized is not None:
+                return materialized
+        except Exception as e:
+            print(f"⚠️ Фасеты каталога недоступны, агрегация через Elasticsearch: {e}")
+        
         if not self.is_available():
             return {"buckets": [], "error": "Elasticsearch недоступен"}
         
@@ -943,6 +952,13 @@ class ElasticsearchService:
     def get_price_stats(self) -> Dict[str, Any]:
         """Получает статистику по ценам"""
         
+        try:
+            from services.facet_service import facet_store
+            price_stats = facet_store.price_stats()
+            return {"stats": price_stats["stats"], "histogram": price_stats["histogram"]}
+        except Exception as e:
+            print(f"⚠️ Фасеты каталога недоступны, статистика через Elasticsearch: {e}")
+        
         if not self.is_available():
             return {"error": "Elasticsearch недоступен"}
         
@@ -0,0 +1,195 @@
+"""
+Кэш эмбеддингов, общий для документов, памяти пользователей и запросов
+
+Ключ - (модель, SHA-256 нормализованного текста). Перед постоянной таблицей
+embedding_cache стоит LRU в памяти процесса. Внутри батча одинаковые тексты
+отправляются в API один раз; неудачные эмбеддинги (None) не кэшируются.
+"""
+import asyncio
+import hashlib
+import json
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+Vector = List[float]
+EmbedFn = Callable[[List[str]], List[Optional[Vector]]]
+AsyncEmbedFn = Callable[[List[str]], Awaitable[List[Optional[Vector]]]]
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация перед хешированием и отправкой в модель: NFC и схлопывание пробелов"""
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Двухуровневый кэш эмбеддингов: LRU в памяти + таблица embedding_cache"""
+
+    def __init__(self, max_memory_entries: int = 10000, persistent: bool = True):
+        self.max_memory_entries = max(0, max_memory_entries)
+        self.persistent = persistent
+        self._memory: "OrderedDict[Tuple[str, str], Vector]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0,  # Запрошено текстов
+            "batch_duplicates": 0,  # Повторы внутри одного батча
+            "memory_hits": 0,
+            "db_hits": 0,
+            "misses": 0,  # Отправлено в модель
+            "failures": 0,  # Модель не вернула эмбеддинг
+            "db_errors": 0,
+        }
+
+    # Публичный API
+
+    def embed(self, model: str, texts: List[str], embed_fn: EmbedFn) -> List[Optional[Vector]]:
+        """
+        Возвращает эмбеддинги texts (в том же порядке), вызывая embed_fn только для промахов
+
+        embed_fn получает список уникальных нормализованных текстов и возвращает
+        список векторов той же длины (None для неудачных).
+        """
+        keys, unique = self._prepare(texts)
+        found = self._lookup_memory(model, unique)
+        missing = [h for h in unique if h not in found]
+        if missing:
+            found.update(self._lookup_db(model, missing))
+            missing = [h for h in unique if h not in found]
+        if missing:
+            vectors = embed_fn([unique[h] for h in missing])
+            found.update(self._store(model, missing, vectors))
+        return [found.get(h) for h in keys]
+
+    async def aembed(self, model: str, texts: List[str], embed_fn: AsyncEmbedFn) -> List[Optional[Vector]]:
+        """Асинхронный вариант embed: обращения к таблице выполняются в пуле потоков"""
+        keys, unique = self._prepare(texts)
+        found = self._lookup_memory(model, unique)
+        missing = [h for h in unique if h not in found]
+        if missing and self.persistent:
+            found.update(await asyncio.to_thread(self._lookup_db, model, missing))
+            missing = [h for h in unique if h not in found]
+        if missing:
+            vectors = await embed_fn([unique[h] for h in missing])
+            found.update(await asyncio.to_thread(self._store, model, missing, vectors))
+        return [found.get(h) for h in keys]
+
+    def get_stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["db_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["db_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+
+    # Внутреннее
+
+    def _prepare(self, texts: List[str]) -> Tuple[List[str], Dict[str, str]]:
+        """Хеши в порядке texts и словарь уникальных {хеш: нормализованный текст}"""
+        keys = []
+        unique: Dict[str, str] = {}
+        for text in texts:
+            normalized = normalize_text(text)
+            h = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+            keys.append(h)
+            unique.setdefault(h, normalized)
+        with self._lock:
+            self._stats["requests"] += len(keys)
+            self._stats["batch_duplicates"] += len(keys) - len(unique)
+        return keys, unique
+
+    def _lookup_memory(self, model: str, unique: Dict[str, str]) -> Dict[str, Vector]:
+        found = {}
+        with self._lock:
+            for h in unique:
+                vector = self._memory.get((model, h))
+                if vector is not None:
+                    self._memory.move_to_end((model, h))
+                    found[h] = vector
+            self._stats["memory_hits"] += len(found)
+        return found
+
+    def _remember(self, model: str, items: Dict[str, Vector]):
+        if not self.max_memory_entries:
+            return
+        with self._lock:
+            for h, vector in items.items():
+                self._memory[(model, h)] = vector
+                self._memory.move_to_end((model, h))
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def _lookup_db(self, model: str, hashes: List[str]) -> Dict[str, Vector]:
+        if not self.persistent or not hashes:
+            return {}
+        from models import SessionLocal
+        from models.database import EmbeddingCacheEntry
+
+        db = SessionLocal()
+        try:
+            rows = db.query(EmbeddingCacheEntry.text_hash, EmbeddingCacheEntry.embedding).filter(
+                EmbeddingCacheEntry.model == model,
+                EmbeddingCacheEntry.text_hash.in_(hashes)
+            ).all()
+            found = {h: json.loads(embedding) for h, embedding in rows}
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ Ошибка чтения кэша эмбеддингов: {e}")
+            with self._lock:
+                self._stats["db_errors"] += 1
+            return {}
+        finally:
+            db.close()
+
+        self._remember(model, found)
+        with self._lock:
+            self._stats["db_hits"] += len(found)
+        return found
+
+    def _store(self, model: str, hashes: List[str], vectors: List[Optional[Vector]]) -> Dict[str, Vector]:
+        items = {h: list(v) for h, v in zip(hashes, vectors or []) if v}
+        with self._lock:
+            self._stats["misses"] += len(hashes)
+            self._stats["failures"] += len(hashes) - len(items)
+        self._remember(model, items)
+        if self.persistent and items:
+            self._save_db(model, items)
+        return items
+
+    def _save_db(self, model: str, items: Dict[str, Vector]):
+        from models import SessionLocal, engine
+        from models.database import EmbeddingCacheEntry
+
+        rows = [
+            {"model": model, "text_hash": h, "dimensions": len(v), "embedding": json.dumps(v)}
+            for h, v in items.items()
+        ]
+        db = SessionLocal()
+        try:
+            if engine.dialect.name == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert as pg_insert
+                db.execute(pg_insert(EmbeddingCacheEntry).values(rows).on_conflict_do_nothing())
+            else:
+                for row in rows:
+                    db.merge(EmbeddingCacheEntry(**row))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ Ошибка записи в кэш эмбеддингов: {e}")
+            with self._lock:
+                self._stats["db_errors"] += 1
+        finally:
+            db.close()
+
+
+embedding_cache = EmbeddingCache(max_memory_entries=settings.embedding_cache_memory_entries)
@@ -0,0 +1,281 @@
+"""
+Провайдеры эмбеддингов: Mistral API или локальная модель на CPU
+
+Провайдер выбирается полем embedding_model в ai_settings.json в формате "provider:model":
+    ""                          - Mistral (settings.mistral_embed_model), как раньше
+    "mistral:mistral-embed"     - Mistral API
+    "local:BAAI/bge-m3"         - sentence-transformers на CPU, без сети
+
+Все провайдеры выдают векторы размерности EMBEDDING_DIMENSION (колонки Vector(1024)).
+Векторы разных моделей несовместимы между собой: после смены модели переиндексируйте
+данные скриптом migrate_reembed.py.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import requests
+
+from app.core.config import settings
+from services.embedding_cache_service import embedding_cache
+
+EMBEDDING_DIMENSION = 1024
+
+Vector = List[float]
+
+_AI_SETTINGS_PATHS = [
+    "ai_settings.json",
+    "backend/ai_settings.json",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "ai_settings.json"),
+]
+
+
+class EmbeddingProvider(ABC):
+    """Базовый провайдер: embed/aembed возвращают список векторов (None для неудачных)"""
+
+    name: str = ""
+    dimension: int = EMBEDDING_DIMENSION
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> List[Optional[Vector]]:
+        """Векторы текстов в том же порядке"""
+
+    async def aembed(self, texts: List[str]) -> List[Optional[Vector]]:
+        return await asyncio.to_thread(self.embed, texts)
+
+    def close(self):
+        pass
+
+
+class MistralEmbeddingProvider(EmbeddingProvider):
+    """Эмбеддинги через Mistral API (батч одним запросом, повтор при 429)"""
+
+    def __init__(self, model: Optional[str] = None):
+        self.model = model or settings.mistral_embed_model
+        self.name = self.model
+
+    def _request(self) -> tuple:
+        url = f"{settings.mistral_base_url}/v1/embeddings"
+        headers = {
+            "Authorization": f"Bearer {settings.mistral_api_key}",
+            "Content-Type": "application/json",
+        }
+        return url, headers
+
+    def _parse(self, data: dict, count: int) -> List[Optional[Vector]]:
+        vectors: List[Optional[Vector]] = []
+        for item in (data or {}).get("data") or []:
+            embedding = item.get("embedding") or []
+            vectors.append(embedding if len(embedding) == self.dimension else None)
+        return vectors + [None] * (count - len(vectors))
+
+    def embed(self, texts: List[str]) -> List[Optional[Vector]]:
+        url, headers = self._request()
+        payload = {"model": self.model, "input": texts}
+
+        for attempt in range(3):
+            try:
+                resp = requests.post(url, headers=headers, json=payload, timeout=120)
+                if resp.status_code == 429:
+                    time.sleep(1 * (2 ** attempt))
+                    continue
+                resp.raise_for_status()
+                return self._parse(resp.json(), len(texts))
+            except Exception as e:
+                if attempt == 2:
+                    print(f"⚠️ Ошибка получения эмбеддингов через Mistral API: {e}")
+                    break
+                time.sleep(1)
+        return [None] * len(texts)
+
+    async def aembed(self, texts: List[str]) -> List[Optional[Vector]]:
+        import httpx
+
+        url, headers = self._request()
+        payload = {"model": self.model, "input": texts}
+        try:
+            async with httpx.AsyncClient(timeout=60.0) as client:
+                for attempt in range(3):
+                    response = await client.post(url, headers=headers, json=payload)
+                    if response.status_code == 429 and attempt < 2:
+                        await asyncio.sleep(1 * (2 ** attempt))
+                        continue
+                    response.raise_for_status()
+                    return self._parse(response.json(), len(texts))
+        except Exception as e:
+            print(f"⚠️ Ошибка получения эмбеддинга через Mistral API: {e}")
+        return [None] * len(texts)
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """
+    Локальная модель sentence-transformers на CPU
+
+    Модель загружается один раз при первом запросе; батчи кодируются в пуле потоков
+    (torch и onnxruntime отпускают GIL). Если модель выдает меньше EMBEDDING_DIMENSION
+    измерений, вектор дополняется нулями - косинусное расстояние от этого не меняется.
+    """
+
+    def __init__(self, model_name: str, max_workers: int = 2, batch_size: int = 32, backend: str = "torch"):
+        self.model_name = model_name
+        self.name = f"local:{model_name}"
+        self.batch_size = max(1, batch_size)
+        self.backend = backend
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="local-embed")
+
+    def _get_model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    try:
+                        from sentence_transformers import SentenceTransformer
+                    except ImportError:
+                        raise Exception("sentence-transformers не установлен. Установите: pip install sentence-transformers")
+
+                    kwargs = {"device": "cpu"}
+                    if self.backend != "torch":
+                        kwargs["backend"] = self.backend  # "onnx" / "openvino" (sentence-transformers >= 3.2)
+                    model = SentenceTransformer(self.model_name, **kwargs)
+                    dimension = model.get_sentence_embedding_dimension()
+                    if dimension and dimension > self.dimension:
+                        raise Exception(
+                            f"Модель {self.model_name} выдает {dimension} измерений, "
+                            f"а колонки рассчитаны на {self.dimension}"
+                        )
+                    print(f"✅ Загружена локальная модель эмбеддингов {self.model_name} ({dimension} измерений)")
+                    self._model = model
+        return self._model
+
+    def _encode(self, texts: List[str]) -> List[Vector]:
+        vectors = self._get_model().encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        result = []
+        for vector in vectors:
+            values = vector.tolist()
+            if len(values) < self.dimension:
+                values += [0.0] * (self.dimension - len(values))
+            result.append(values)
+        return result
+
+    def _batches(self, texts: List[str]) -> List[List[str]]:
+        return [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+    def embed(self, texts: List[str]) -> List[Optional[Vector]]:
+        if not texts:
+            return []
+        try:
+            results: List[Optional[Vector]] = []
+            for vectors in self._executor.map(self._encode, self._batches(texts)):
+                results.extend(vectors)
+            return results
+        except Exception as e:
+            print(f"⚠️ Ошибка локальной модели эмбеддингов: {e}")
+            return [None] * len(texts)
+
+    async def aembed(self, texts: List[str]) -> List[Optional[Vector]]:
+        """Те же батчи и тот же пул потоков, что и embed, без блокировки event loop"""
+        if not texts:
+            return []
+        loop = asyncio.get_running_loop()
+        try:
+            parts = await asyncio.gather(*(
+                loop.run_in_executor(self._executor, self._encode, batch) for batch in self._batches(texts)
+            ))
+            return [vector for vectors in parts for vector in vectors]
+        except Exception as e:
+            print(f"⚠️ Ошибка локальной модели эмбеддингов: {e}")
+            return [None] * len(texts)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+_setting_cache: dict = {}
+
+
+def _load_embedding_model_setting() -> str:
+    """embedding_model из ai_settings.json (файл перечитывается только при изменении)"""
+    for path in _AI_SETTINGS_PATHS:
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            continue
+        if _setting_cache.get("key") != (path, mtime):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    value = (json.load(f).get("embedding_model") or "").strip()
+            except Exception as e:
+                print(f"⚠️ Ошибка загрузки ai_settings.json: {e}")
+                value = ""
+            _setting_cache["key"] = (path, mtime)
+            _setting_cache["value"] = value
+        return _setting_cache["value"]
+    return ""
+
+
+def create_embedding_provider(model_setting: str) -> EmbeddingProvider:
+    """Создает провайдер по строке "provider:model" из ai_settings.json (ValueError для неизвестного провайдера)"""
+    provider, _, model = model_setting.partition(":")
+    provider = provider.lower()
+    if provider == "local":
+        return LocalEmbeddingProvider(
+            model or settings.local_embedding_model,
+            max_workers=settings.local_embedding_workers,
+            batch_size=settings.local_embedding_batch_size,
+            backend=settings.local_embedding_backend,
+        )
+    if provider in ("", "mistral"):
+        return MistralEmbeddingProvider(model or None)
+    # Молча подставлять Mistral нельзя: векторы легли бы рядом с векторами другой модели
+    raise ValueError(
+        f"Неизвестный провайдер эмбеддингов '{model_setting}' (ожидается 'mistral:<модель>' или 'local:<модель>')"
+    )
+
+
+_provider: Optional[EmbeddingProvider] = None
+_provider_setting: Optional[str] = None
+_provider_lock = threading.Lock()
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """Текущий провайдер (пересоздается, если embedding_model в ai_settings.json изменился)"""
+    global _provider, _provider_setting
+    model_setting = _load_embedding_model_setting()
+    with _provider_lock:
+        if _provider is None or model_setting != _provider_setting:
+            # Сначала создаем новый: при ошибке в настройке старый провайдер не закрывается
+            provider = create_embedding_provider(model_setting)
+            if _provider is not None:
+                _provider.close()
+            _provider = provider
+            _provider_setting = model_setting
+        return _provider
+
+
+def current_embedding_model() -> str:
+    """Имя текущего провайдера/модели (записывается рядом с сохраненными векторами)"""
+    return get_embedding_provider().name
+
+
+def embed_texts(texts: List[str]) -> List[Optional[Vector]]:
+    """Эмбеддинги текущим провайдером через общий кэш"""
+    provider = get_embedding_provider()
+    return embedding_cache.embed(provider.name, texts, provider.embed)
+
+
+async def aembed_texts(texts: List[str]) -> List[Optional[Vector]]:
+    """Асинхронный вариант embed_texts"""
+    provider = await asyncio.to_thread(get_embedding_provider)
+    return await embedding_cache.aembed(provider.name, texts, provider.aembed)
@@ -0,0 +1,411 @@
+"""
+Материализованные фасеты каталога автомобилей
+
+Марки, модели, города, типы кузова/топлива/КПП, гистограммы цен и годов выпуска
+считаются одним проходом по каждой таблице (cars, used_cars, активные parsed_cars)
+и сохраняются в inventory_facet_snapshots. Процесс держит снимок в памяти и
+перечитывает таблицу не чаще раза в facet_snapshot_ttl_seconds - так пересчет,
+выполненный другим процессом (импорт, миграция, парсер), виден всем воркерам.
+
+Пересчет запускается:
+    - явно: facet_store.rebuild() в конце импорта, миграции и парсинга;
+    - автоматически: коммит ORM-сессии, изменивший каталог, планирует отложенный
+      пересчет (несколько коммитов подряд схлопываются в один);
+    - при первом запуске (таблица снимков пуста) - в фоне; пока он идет,
+      читатели получают пустые фасеты, а не ждут полного прохода по каталогу.
+"""
+import json
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.core.config import settings
+from models import SessionLocal
+from models.database import Car, InventoryFacetSnapshot, ParsedCar, UsedCar
+from services.car_hydration_service import parse_price
+from services.pagination_service import register_commit_listener
+
+# Типы автомобилей каталога (car_type=None объединяет их) и спарсенные объявления
+CATALOG_TYPES = ("car", "used_car")
+CAR_TYPES = CATALOG_TYPES + ("parsed_car",)
+
+_MODELS = {"car": Car, "used_car": UsedCar, "parsed_car": ParsedCar}
+_TABLE_TYPES = {model_cls.__tablename__: car_type for car_type, model_cls in _MODELS.items()}
+
+# Фасеты-счетчики: имя фасета -> колонка
+TERM_FACETS = {
+    "brands": "mark",
+    "cities": "city",
+    "body_types": "body_type",
+    "fuel_types": "fuel_type",
+    "gear_box_types": "gear_box_type",
+}
+# Колонка (как в индексе Elasticsearch) -> имя фасета
+FIELD_FACETS = {column: facet for facet, column in TERM_FACETS.items()}
+
+
+def _clean(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _stats(values_count: int, total: float, minimum: Optional[float], maximum: Optional[float]) -> Dict[str, Any]:
+    """Статистика в формате агрегации stats Elasticsearch"""
+    return {
+        "count": values_count,
+        "min": minimum,
+        "max": maximum,
+        "avg": total / values_count if values_count else None,
+        "sum": total,
+    }
+
+
+def _histogram(counter: Counter) -> List[Dict[str, Any]]:
+    return [{"key": key, "doc_count": count} for key, count in sorted(counter.items())]
+
+
+def _top(counter: Dict[str, int]) -> Dict[str, int]:
+    """Счетчики по убыванию (при равенстве - по алфавиту), чтобы JSON был стабильным"""
+    return dict(sorted(counter.items(), key=lambda item: (-item[1], item[0])))
+
+
+def build_facets(rows: Iterable[tuple], price_interval: float) -> Dict[str, Any]:
+    """
+    Фасеты по строкам (mark, model, city, body_type, fuel_type, gear_box_type, manufacture_year, price)
+
+    Returns:
+        {"count", "brands", "models": {марка: {модель: n}}, "cities", "body_types",
+         "fuel_types", "gear_box_types", "price": {"interval", "stats", "histogram"},
+         "years": {"stats", "histogram"}}
+    """
+    count = 0
+    terms = {facet: Counter() for facet in TERM_FACETS}
+    models: Dict[str, Counter] = {}
+    price_buckets: Counter = Counter()
+    year_buckets: Counter = Counter()
+    price_sum, price_min, price_max = 0.0, None, None
+    year_sum = 0
+
+    for mark, model, city, body_type, fuel_type, gear_box_type, year, price in rows:
+        count += 1
+        mark, model = _clean(mark), _clean(model)
+        for facet, value in (("brands", mark), ("cities", city), ("body_types", body_type),
+                             ("fuel_types", fuel_type), ("gear_box_types", gear_box_type)):
+            value = _clean(value)
+            if value:
+                terms[facet][value] += 1
+        if model:
+            models.setdefault(mark or "", Counter())[model] += 1
+        if year:
+            year_buckets[int(year)] += 1
+            year_sum += int(year)
+        price = parse_price(price)
+        if price:
+            price_buckets[float(int(price // price_interval) * price_interval)] += 1
+            price_sum += price
+            price_min = price if price_min is None else min(price_min, price)
+            price_max = price if price_max is None else max(price_max, price)
+
+    years = sorted(year_buckets)
+    return {
+        "count": count,
+        **{facet: _top(counter) for facet, counter in terms.items()},
+        "models": {mark: _top(counter) for mark, counter in sorted(models.items())},
+        "price": {
+            "interval": price_interval,
+            "stats": _stats(sum(price_buckets.values()), price_sum, price_min, price_max),
+            "histogram": _histogram(price_buckets),
+        },
+        "years": {
+            "stats": _stats(sum(year_buckets.values()), float(year_sum),
+                            years[0] if years else None, years[-1] if years else None),
+            "histogram": _histogram(year_buckets),
+        },
+    }
+
+
+def merge_facets(snapshots: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Объединяет фасеты нескольких типов автомобилей"""
+    snapshots = [snapshot for snapshot in snapshots if snapshot]
+    merged: Dict[str, Any] = {"count": sum(snapshot.get("count", 0) for snapshot in snapshots)}
+
+    for facet in TERM_FACETS:
+        counter: Counter = Counter()
+        for snapshot in snapshots:
+            counter.update(snapshot.get(facet) or {})
+        merged[facet] = _top(counter)
+
+    models: Dict[str, Counter] = {}
+    for snapshot in snapshots:
+        for mark, mark_models in (snapshot.get("models") or {}).items():
+            models.setdefault(mark, Counter()).update(mark_models)
+    merged["models"] = {mark: _top(counter) for mark, counter in sorted(models.items())}
+
+    for facet in ("price", "years"):
+        parts = [snapshot[facet] for snapshot in snapshots if snapshot.get(facet)]
+        buckets: Counter = Counter()
+        for part in parts:
+            buckets.update({bucket["key"]: bucket["doc_count"] for bucket in part["histogram"]})
+        stats = [part["stats"] for part in parts if part["stats"]["count"]]
+        minimums = [item["min"] for item in stats]
+        maximums = [item["max"] for item in stats]
+        merged[facet] = {
+            "stats": _stats(sum(item["count"] for item in stats), sum(item["sum"] for item in stats),
+                            min(minimums) if minimums else None, max(maximums) if maximums else None),
+            "histogram": _histogram(buckets),
+        }
+        if facet == "price":
+            merged[facet]["interval"] = parts[0]["interval"] if parts else settings.facet_price_interval
+    return merged
+
+
+class FacetStore:
+    """Снимок фасетов в памяти поверх таблицы inventory_facet_snapshots"""
+
+    def __init__(self, ttl_seconds: float, rebuild_delay_seconds: float):
+        """
+        Args:
+            ttl_seconds: Как часто перечитывать таблицу (пересчеты других процессов)
+            rebuild_delay_seconds: Задержка автоматического пересчета после коммита
+        """
+        self.ttl_seconds = ttl_seconds
+        self.rebuild_delay_seconds = rebuild_delay_seconds
+        self._snapshots: Dict[str, Dict[str, Any]] = {}
+        self._merged: Dict[str, Any] = {}
+        self._built_at: Optional[datetime] = None
+        self._loaded_at = 0.0
+        self._lock = threading.RLock()
+        self._rebuild_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    # ------------------------------------------------------------------
+    # Пересчет
+    # ------------------------------------------------------------------
+
+    def rebuild(self, db=None, car_types: Iterable[str] = CAR_TYPES) -> Dict[str, Any]:
+        """
+        Пересчитывает фасеты и сохраняет их в таблицу
+
+        Args:
+            db: SQLAlchemy сессия (None - отдельная сессия)
+            car_types: Какие типы пересчитать
+
+        Returns:
+            Обновленные фасеты по типам {car_type: facets}
+        """
+        self._cancel_scheduled()
+        own_session = db is None
+        db = db or SessionLocal()
+        started = time.perf_counter()
+        try:
+            with self._rebuild_lock:
+                InventoryFacetSnapshot.__table__.create(bind=db.get_bind(), checkfirst=True)
+                built = {car_type: self._compute(db, car_type) for car_type in car_types}
+                built_at = datetime.now(timezone.utc)
+                for car_type, facets in built.items():
+                    db.merge(InventoryFacetSnapshot(
+                        car_type=car_type,
+                        car_count=facets["count"],
+                        facets=json.dumps(facets, ensure_ascii=False),
+                        built_at=built_at,
+                    ))
+                db.commit()
+            with self._lock:
+                self._snapshots.update(built)
+                self._merged = {}
+                self._built_at = built_at
+                self._loaded_at = time.monotonic()
+            print(f"📊 Фасеты каталога пересчитаны за {int((time.perf_counter() - started) * 1000)}мс: "
+                  + ", ".join(f"{car_type} {facets['count']}" for car_type, facets in built.items()))
+            return built
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            if own_session:
+                db.close()
+
+    def _compute(self, db, car_type: str) -> Dict[str, Any]:
+        model_cls = _MODELS[car_type]
+        query = db.query(
+            model_cls.mark, model_cls.model, model_cls.city, model_cls.body_type,
+            model_cls.fuel_type, model_cls.gear_box_type, model_cls.manufacture_year, model_cls.price,
+        )
+        if model_cls is ParsedCar:
+            query = query.filter(ParsedCar.is_active == True)
+        # Потоковое чтение: в памяти только счетчики, а не весь каталог
+        return build_facets(query.yield_per(1000), settings.facet_price_interval)
+
+    def schedule_rebuild(self, delay: Optional[float] = None):
+        """
+        Планирует пересчет в фоне
+
+        Если пересчет уже запланирован, новый не создается: серия коммитов
+        (импорт, парсинг) дает один пересчет не позже чем через delay секунд.
+        """
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(
+                self.rebuild_delay_seconds if delay is None else delay,
+                self._run_scheduled
+            )
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _run_scheduled(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.rebuild()
+        except Exception as e:
+            print(f"⚠️ Ошибка пересчета фасетов каталога: {e}")
+
+    def _cancel_scheduled(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def on_commit(self, tables: set):
+        """Обработчик коммита: изменение каталога планирует пересчет"""
+        if any(table in _TABLE_TYPES for table in tables):
+            self.schedule_rebuild()
+
+    # ------------------------------------------------------------------
+    # Снимок
+    # ------------------------------------------------------------------
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._loaded_at and time.monotonic() - self._loaded_at < self.ttl_seconds:
+                return
+        try:
+            self._load()
+        except Exception as e:
+            print(f"⚠️ Не удалось прочитать фасеты каталога: {e}")
+            with self._lock:
+                # Не повторяем неудачное чтение на каждом запросе
+                self._loaded_at = time.monotonic()
+
+    def _load(self):
+        db = SessionLocal()
+        try:
+            InventoryFacetSnapshot.__table__.create(bind=db.get_bind(), checkfirst=True)
+            rows = db.query(InventoryFacetSnapshot).all()
+        finally:
+            db.close()
+
+        if {row.car_type for row in rows} != set(CAR_TYPES) and not self._rebuild_lock.locked():
+            # Первый запуск: таблица еще не заполнена. Пересчет идет в фоне,
+            # до его окончания отдаем то, что есть (пустые фасеты)
+            self.schedule_rebuild(delay=0)
+        with self._lock:
+            for row in rows:
+                self._snapshots[row.car_type] = json.loads(row.facets)
+            self._merged = {}
+            built_dates = [row.built_at for row in rows if row.built_at]
+            if built_dates:
+                self._built_at = max(built_dates)
+            self._loaded_at = time.monotonic()
+
+    def get(self, car_type: Optional[str] = None) -> Dict[str, Any]:
+        """Фасеты типа автомобиля (None - новые и подержанные вместе)"""
+        self._ensure_loaded()
+        with self._lock:
+            if car_type is not None:
+                return self._snapshots.get(car_type) or merge_facets([])
+            if not self._merged:
+                self._merged = merge_facets(self._snapshots.get(name) for name in CATALOG_TYPES)
+            return self._merged
+
+    @property
+    def built_at(self) -> Optional[datetime]:
+        self._ensure_loaded()
+        return self._built_at
+
+    # ------------------------------------------------------------------
+    # Чтение
+    # ------------------------------------------------------------------
+
+    def values(self, facet: str, car_type: Optional[str] = None, limit: Optional[int] = None,
+               by_count: bool = True) -> List[str]:
+        """
+        Значения фасета-счетчика (brands, cities, body_types, fuel_types, gear_box_types)
+
+        Args:
+            by_count: По убыванию количества автомобилей (False - по алфавиту)
+        """
+        counter = self.get(car_type).get(facet) or {}
+        names = list(counter) if by_count else sorted(counter)
+        return names[:limit] if limit else names
+
+    def brands(self, car_type: Optional[str] = None, limit: Optional[int] = None, by_count: bool = True) -> List[str]:
+        return self.values("brands", car_type, limit, by_count)
+
+    def body_types(self, car_type: Optional[str] = None, limit: Optional[int] = None, by_count: bool = True) -> List[str]:
+        return self.values("body_types", car_type, limit, by_count)
+
+    def models(self, car_type: Optional[str] = None, mark: Optional[str] = None) -> List[str]:
+        """Модели (по алфавиту), опционально только одной марки"""
+        by_mark = self.get(car_type).get("models") or {}
+        if mark:
+            by_mark = {key: value for key, value in by_mark.items() if key.lower() == mark.strip().lower()}
+        return sorted({model for mark_models in by_mark.values() for model in mark_models})
+
+    def terms(self, field: str, size: int = 20, car_type: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Агрегация terms в формате Elasticsearch: {"buckets": [{"key", "doc_count"}]}
+
+        Returns:
+            None, если по полю фасет не материализуется
+        """
+        if field in FIELD_FACETS:
+            counter = self.get(car_type).get(FIELD_FACETS[field]) or {}
+        elif field == "model":
+            counter = Counter()
+            for mark_models in (self.get(car_type).get("models") or {}).values():
+                counter.update(mark_models)
+            counter = _top(counter)
+        elif field == "manufacture_year":
+            buckets = self.get(car_type)["years"]["histogram"]
+            counter = _top({bucket["key"]: bucket["doc_count"] for bucket in buckets})
+        else:
+            return None
+        return {"buckets": [{"key": key, "doc_count": count} for key, count in list(counter.items())[:size]]}
+
+    def price_stats(self, car_type: Optional[str] = None) -> Dict[str, Any]:
+        """Статистика и гистограмма цен в формате агрегаций Elasticsearch"""
+        price = self.get(car_type)["price"]
+        return {"stats": price["stats"], "histogram": price["histogram"], "interval": price["interval"]}
+
+    def cars_statistics(self) -> Dict[str, Any]:
+        """Количество автомобилей и уникальные марки/модели (формат DatabaseService.get_cars_statistics)"""
+        new_facets = self.get("car")
+        used_facets = self.get("used_car")
+        new_marks = sorted(new_facets.get("brands") or {})
+        used_marks = sorted(used_facets.get("brands") or {})
+        new_models = self.models("car")
+        used_models = self.models("used_car")
+        return {
+            "new_cars_count": new_facets.get("count", 0),
+            "used_cars_count": used_facets.get("count", 0),
+            "total_cars_count": new_facets.get("count", 0) + used_facets.get("count", 0),
+            "unique_marks": sorted(set(new_marks) | set(used_marks)),
+            "unique_models": sorted(set(new_models) | set(used_models)),
+            "new_marks": new_marks,
+            "used_marks": used_marks,
+            "new_models": new_models,
+            "used_models": used_models,
+        }
+
+
+facet_store = FacetStore(
+    ttl_seconds=settings.facet_snapshot_ttl_seconds,
+    rebuild_delay_seconds=settings.facet_rebuild_delay_seconds,
+)
+register_commit_listener(facet_store.on_commit)
@@ -0,0 +1,365 @@
+"""
+Сопоставление полей файлов импорта с полями таблиц и профили сопоставлений
+
+Нечеткое сопоставление идет через индекс триграмм: сначала SequenceMatcher
+оценивает несколько лучших по общим триграммам полей (коэффициент Дайса), и их
+оценка становится порогом для остальных - те отсекаются по верхним границам
+real_quick_ratio/quick_ratio (как в difflib.get_close_matches), и полный ratio
+считается только для прошедших. Результат совпадает с полным перебором. Короткие
+имена (аббревиатуры вроде km, yr) почти не делят триграмм с целевыми полями,
+поэтому для них и при малом числе кандидатов из индекса выполняется полный
+перебор. Результат для имени поля кэшируется - набор целевых полей не меняется
+во время работы.
+
+Подтвержденное сопоставление (сохраненный импорт) записывается в профиль по
+отпечатку набора полей файла; повторные загрузки того же фида берут маппинг
+из профиля.
+"""
+import hashlib
+import json
+from collections import defaultdict
+from datetime import datetime, timezone
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from models.database import ImportMappingProfile
+
+# Поля, которые НЕ нужно импортировать в car_data (но могут использоваться для других целей)
+EXCLUDED_SOURCE_FIELDS = {
+    'picture_path', 'picture_path.path',
+    'pictures_real', 'pictures_real.pic',
+    'Images', 'Images.Image', 'Images.Images', 'Images.Images.url', 'Images.Image.url',
+    'Kilometrage'  # Это поле маппится на mileage, но само не импортируется
+}
+
+# Специальные сопоставления для XML форматов
+XML_FIELD_MAPPING = {
+    # Для новых автомобилей (CarOrder)
+    "Mark": "mark",
+    "Model": "model",
+    "Price": "price",
+    "City": "city",
+    "ManufactureYear": "manufacture_year",
+    "FuelType": "fuel_type",
+    "Power": "power",
+    "BodyType": "body_type",
+    "GearBoxType": "gear_box_type",
+    "DrivingGearType": "driving_gear_type",
+    "EngineVol": "engine_vol",
+    "Color": "color",
+    "VIN": "vin",
+    "CodeCompl": "code_compl",
+    "StockQty": "stock_qty",
+    "DocNum": "doc_num",
+    "Title": "title",
+    "InteriorColor": "interior_color",
+    "Engine": "engine",
+    "DoorQty": "door_qty",
+    "PTSColour": "pts_colour",
+    "ModelYear": "model_year",
+    "FuelConsumption": "fuel_consumption",
+    "MaxTorque": "max_torque",
+    "Acceleration": "acceleration",
+    "MaxSpeed": "max_speed",
+    "EcoClass": "eco_class",
+    "Dimensions": "dimensions",
+    "Weight": "weight",
+    "CargoVolume": "cargo_volume",
+    "ComplLevel": "compl_level",
+    "interior-code": "interior_code",
+    "color-code": "color_code",
+    "CarOrderIntStatus": "car_order_int_status",
+    "SalePrice": "sale_price",
+    "MaxAdditionalDiscount": "max_additional_discount",
+    "MaxDiscountTradeIn": "max_discount_trade_in",
+    "MaxDiscountCredit": "max_discount_credit",
+    "MaxDiscountCasko": "max_discount_casko",
+    "MaxDiscountExtraGear": "max_discount_extra_gear",
+    "MaxDiscountLifeInsurance": "max_discount_life_insurance",
+    # Для подержанных автомобилей (Ads/Ad)
+    "Make": "mark",
+    "Year": "manufacture_year",
+    "Kilometrage": "mileage",
+    "Transmission": "gear_box_type",
+    "DriveType": "driving_gear_type",
+    "EngineSize": "engine_vol",
+    "DateBegin": "date_begin",
+    "DateEnd": "date_end",
+    "AdStatus": "ad_status",
+    "AllowEmail": "allow_email",
+    "CompanyName": "company_name",
+    "ManagerName": "manager_name",
+    "ContactPhone": "contact_phone",
+    "Category": "category",
+    "Region": "region",
+    "CarType": "car_type",
+    "CertificationNumber": "certification_number",
+    "AllowAvtokodReportLink": "allow_avtokod_report_link",
+    "Doors": "doors",
+    "WheelType": "wheel_type",
+    "Owners": "owners",
+    "Street": "street",
+    "Sticker": "sticker",
+    "GenerationId": "generation_id",
+    "ModificationId": "modification_id",
+    "AAA_MaxAdditionalDiscount": "aaa_max_additional_discount",
+    "AAA_MaxDiscountTradeIn": "aaa_max_discount_trade_in",
+    "AAA_MaxDiscountCredit": "aaa_max_discount_credit",
+    "AAA_MaxDiscountCasko": "aaa_max_discount_casko",
+    "AAA_MaxDiscountExtraGear": "aaa_max_discount_extra_gear",
+    "AAA_MaxDiscountLifeInsurance": "aaa_max_discount_life_insurance",
+    "DealerCenter": "dealer_center",
+}
+
+# Поля для новых автомобилей
+CAR_FIELDS = [
+    "title", "doc_num", "stock_qty", "mark", "model", "code_compl", "vin",
+    "color", "price", "city", "manufacture_year", "fuel_type", "power",
+    "body_type", "gear_box_type", "driving_gear_type", "engine_vol",
+    "dealer_center", "interior_color", "engine", "door_qty", "pts_colour",
+    "model_year", "fuel_consumption", "max_torque", "acceleration",
+    "max_speed", "eco_class", "dimensions", "weight", "cargo_volume",
+    "compl_level", "interior_code", "color_code", "car_order_int_status",
+    "sale_price", "max_additional_discount", "max_discount_trade_in",
+    "max_discount_credit", "max_discount_casko", "max_discount_extra_gear",
+    "max_discount_life_insurance"
+]
+
+# Поля для подержанных автомобилей
+USED_CAR_FIELDS = [
+    "title", "doc_num", "mark", "model", "vin", "color", "price", "city",
+    "manufacture_year", "mileage", "body_type", "gear_box_type",
+    "driving_gear_type", "engine_vol", "power", "fuel_type", "dealer_center",
+    "date_begin", "date_end", "ad_status", "allow_email", "company_name",
+    "manager_name", "contact_phone", "category", "region", "car_type",
+    "accident", "certification_number", "allow_avtokod_report_link",
+    "doors", "wheel_type", "owners", "street", "sticker", "generation_id",
+    "modification_id", "aaa_max_additional_discount", "aaa_max_discount_trade_in",
+    "aaa_max_discount_credit", "aaa_max_discount_casko",
+    "aaa_max_discount_extra_gear", "aaa_max_discount_life_insurance"
+]
+
+# Поля для подсказок в интерфейсе сопоставления
+SUGGESTION_FIELDS = [
+    "title", "doc_num", "stock_qty", "mark", "model", "code_compl", "vin",
+    "color", "price", "city", "manufacture_year", "fuel_type", "power",
+    "body_type", "gear_box_type", "driving_gear_type", "engine_vol",
+    "mileage", "dealer_center"
+]
+
+AUTO_MAP_MIN_SCORE = 0.5  # Минимальная схожесть для автоматического сопоставления
+SUGGEST_MIN_SCORE = 0.3  # Минимальная схожесть для подсказки
+NGRAM_SIZE = 3
+NGRAM_CANDIDATES = 8  # Сколько кандидатов из индекса оценивать первыми (задают порог для остальных)
+SHORT_NAME_CHARS = 4  # Имена короче сопоставляются полным перебором
+
+
+def similarity(a: str, b: str) -> float:
+    """Вычисляет похожесть двух строк"""
+    return SequenceMatcher(None, a.lower(), b.lower()).ratio()
+
+
+def normalize_field_name(field_name: str) -> str:
+    """Последняя часть пути поля в нижнем регистре без '_' и '-'"""
+    return field_name.split(".")[-1].lower().replace("_", "").replace("-", "")
+
+
+def _ngrams(value: str) -> set:
+    padded = f"^{value}$"
+    if len(padded) <= NGRAM_SIZE:
+        return {padded}
+    return {padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)}
+
+
+def field_set_fingerprint(fields: Iterable[str]) -> str:
+    """Отпечаток набора полей файла (не зависит от порядка полей)"""
+    return hashlib.sha256("\n".join(sorted(set(fields))).encode("utf-8")).hexdigest()
+
+
+class NgramIndex:
+    """Инвертированный индекс триграмм по именам целевых полей"""
+
+    def __init__(self, targets: Iterable[str]):
+        # Порядок целевых полей сохраняется: при равной схожести побеждает более раннее
+        self.targets = list(dict.fromkeys(targets))
+        self._normalized = [normalize_field_name(target) for target in self.targets]
+        self._grams: List[set] = []
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        for position, normalized in enumerate(self._normalized):
+            grams = _ngrams(normalized)
+            self._grams.append(grams)
+            for gram in grams:
+                self._postings[gram].append(position)
+
+    def _candidate_positions(self, normalized: str, limit: int) -> List[int]:
+        grams = _ngrams(normalized)
+        shared: Dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for position in self._postings.get(gram, ()):
+                shared[position] += 1
+        ranked = sorted(
+            shared.items(),
+            key=lambda item: (-2.0 * item[1] / (len(grams) + len(self._grams[item[0]])), item[0]),
+        )
+        return [position for position, _ in ranked[:limit]]
+
+    def candidates(self, value: str, limit: int = NGRAM_CANDIDATES) -> List[str]:
+        """
+        Целевые поля с общими триграммами, лучшие по коэффициенту Дайса
+
+        Оцениваются только поля из списков вхождений триграмм value.
+        """
+        return [self.targets[position] for position in self._candidate_positions(normalize_field_name(value), limit)]
+
+    def search(self, value: str, min_score: float, limit: Optional[int] = None) -> List[Tuple[str, float]]:
+        """
+        Целевые поля со схожестью выше min_score, лучшие первыми
+
+        Совпадает с полным перебором similarity по всем полям (при равной
+        схожести - в порядке целевых полей).
+        """
+        normalized = normalize_field_name(value)
+        seeds = [] if len(normalized) < SHORT_NAME_CHARS else self._candidate_positions(normalized, NGRAM_CANDIDATES)
+        if len(seeds) < NGRAM_CANDIDATES:
+            seeds = range(len(self.targets))  # Полный перебор
+
+        matcher = SequenceMatcher(None, normalized)
+        scored: Dict[int, float] = {}
+        for position in seeds:
+            matcher.set_seq2(self._normalized[position])
+            scored[position] = matcher.ratio()
+
+        # Порог для остальных полей: худшая из оценок, попадающих в результат
+        best = sorted(scored.values(), reverse=True)
+        floor = min_score
+        if limit and len(best) >= limit:
+            floor = max(floor, best[limit - 1])
+        for position in range(len(self.targets)):
+            if position in scored:
+                continue
+            matcher.set_seq2(self._normalized[position])
+            # Верхние границы ratio: поле не может обойти порог - ratio не считаем
+            if matcher.real_quick_ratio() >= floor and matcher.quick_ratio() >= floor:
+                scored[position] = matcher.ratio()
+
+        results = sorted(
+            ((position, score) for position, score in scored.items() if score > min_score),
+            key=lambda item: (-item[1], item[0]),
+        )
+        if limit:
+            results = results[:limit]
+        return [(self.targets[position], score) for position, score in results]
+
+
+class FieldMapper:
+    """Сопоставление полей файла с полями таблиц импорта"""
+
+    def __init__(self):
+        self._exact = {key.lower(): target for key, target in XML_FIELD_MAPPING.items()}
+        self._auto_index = NgramIndex(CAR_FIELDS + USED_CAR_FIELDS)
+        self._suggest_index = NgramIndex(SUGGESTION_FIELDS)
+        self.map_field = lru_cache(maxsize=4096)(self._map_field)
+        self.suggest = lru_cache(maxsize=4096)(self._suggest)
+
+    def auto_map(self, source_fields: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Автоматически сопоставляет поля из файла с полями таблицы"""
+        return {source_field: self.map_field(source_field) for source_field in source_fields}
+
+    def _map_field(self, source_field: str) -> Optional[str]:
+        # Исключенные поля не маппятся на car_data
+        if source_field in EXCLUDED_SOURCE_FIELDS:
+            return None
+
+        # Точное совпадение в XML маппинге (с учетом регистра, затем без)
+        field_name = source_field.split(".")[-1]
+        if field_name in XML_FIELD_MAPPING:
+            return XML_FIELD_MAPPING[field_name]
+        exact_match = self._exact.get(field_name.lower())
+        if exact_match:
+            return exact_match
+
+        # Нечеткое сопоставление по индексу триграмм
+        matches = self._auto_index.search(source_field, AUTO_MAP_MIN_SCORE, limit=1)
+        return matches[0][0] if matches else None
+
+    def _suggest(self, source_field: str) -> List[str]:
+        """Предлагает возможные сопоставления для поля (топ-5)"""
+        return [field for field, score in self._suggest_index.search(source_field, SUGGEST_MIN_SCORE, limit=5)]
+
+
+class MappingProfileService:
+    """Профили сопоставления полей по отпечатку набора полей фида"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def find(self, fingerprint: str) -> Optional[ImportMappingProfile]:
+        return self.db.query(ImportMappingProfile).filter(ImportMappingProfile.fingerprint == fingerprint).first()
+
+    def list_profiles(self) -> List[ImportMappingProfile]:
+        return self.db.query(ImportMappingProfile).order_by(ImportMappingProfile.updated_at.desc().nullslast(),
+                                                             ImportMappingProfile.id.desc()).all()
+
+    def get_mapping(self, profile: ImportMappingProfile) -> Dict[str, Optional[str]]:
+        try:
+            return json.loads(profile.field_mapping)
+        except (TypeError, ValueError):
+            return {}
+
+    @staticmethod
+    def describe(profile: ImportMappingProfile) -> Dict[str, Any]:
+        """Краткое описание профиля для ответов API"""
+        return {
+            "id": profile.id,
+            "name": profile.name,
+            "file_type": profile.file_type,
+            "car_type": profile.car_type,
+            "field_count": profile.field_count,
+            "use_count": profile.use_count,
+            "last_used_at": profile.last_used_at,
+        }
+
+    def mark_used(self, profile: ImportMappingProfile) -> None:
+        profile.use_count = (profile.use_count or 0) + 1
+        profile.last_used_at = datetime.now(timezone.utc)
+        self.db.commit()
+
+    def save(self, field_mapping: Dict[str, Optional[str]], fingerprint: Optional[str] = None,
+             name: Optional[str] = None, file_type: Optional[str] = None,
+             car_type: Optional[str] = None) -> ImportMappingProfile:
+        """
+        Сохраняет подтвержденное сопоставление (создает или обновляет профиль)
+
+        Без fingerprint отпечаток считается по полям маппинга - интерфейс
+        присылает маппинг для всех полей файла, поэтому он совпадает с анализом.
+        """
+        fingerprint = fingerprint or field_set_fingerprint(field_mapping.keys())
+        profile = self.find(fingerprint)
+        if profile is None:
+            profile = ImportMappingProfile(fingerprint=fingerprint, use_count=0)
+            self.db.add(profile)
+        profile.name = name or profile.name or f"{(file_type or 'feed').upper()}: {len(field_mapping)} полей"
+        profile.file_type = file_type or profile.file_type
+        profile.car_type = car_type or profile.car_type
+        profile.field_count = len(field_mapping)
+        profile.field_mapping = json.dumps(field_mapping, ensure_ascii=False, sort_keys=True)
+        profile.use_count = (profile.use_count or 0) + 1
+        profile.last_used_at = datetime.now(timezone.utc)
+        self.db.commit()
+        self.db.refresh(profile)
+        return profile
+
+    def delete(self, profile_id: int) -> bool:
+        profile = self.db.query(ImportMappingProfile).filter(ImportMappingProfile.id == profile_id).first()
+        if profile is None:
+            return False
+        self.db.delete(profile)
+        self.db.commit()
+        return True
+
+
+# Глобальный экземпляр: индексы триграмм и кэш сопоставлений общие для всех запросов
+field_mapper = FieldMapper()
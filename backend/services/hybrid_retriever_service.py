@@ -0,0 +1,324 @@
+"""
+HybridRetriever - гибридный поиск автомобилей по нескольким источникам
+
+Источники опрашиваются параллельно, у каждого свой бюджет времени:
+    elasticsearch - полнотекстовый BM25
+    vector        - семантический поиск pgvector (VectorSearchService)
+    sql           - структурные фильтры по каталогу Postgres
+
+Источник, не уложившийся в бюджет, отбрасывается - ответ собирается из остальных.
+Результаты объединяются reciprocal rank fusion (RRF): score = sum(1 / (k + rank)),
+дубликаты схлопываются по (type, id). Полные карточки Elasticsearch (весь набор
+полей краткой карточки в _source) и SQL (строки каталога) используются как есть;
+остальные результаты (метаданные вектора, неполный _source) догружаются из
+каталога через CarHydrator.summaries_from_hits - один запрос IN на тип.
+Автомобили, которых уже нет в каталоге, отбрасываются. Догружаются только первые
+limit результатов и со своим бюджетом времени: если каталог не ответил вовремя,
+результаты отдаются с данными источников.
+"""
+import asyncio
+import time
+from itertools import zip_longest
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from models import AsyncSessionLocal, SessionLocal
+from models.database import Car, UsedCar
+from services.car_hydration_service import CarHydrator, car_summary_from_source, car_to_dict
+from services.database_service import car_filter_conditions
+
+SOURCE_ELASTICSEARCH = "elasticsearch"
+SOURCE_VECTOR = "vector"
+SOURCE_SQL = "sql"
+
+# Источники, чьи полные карточки не нужно перепроверять по каталогу
+# (метаданные вектора могут отличаться регистром и типами и устареть)
+CARD_SOURCES = (SOURCE_ELASTICSEARCH, SOURCE_SQL)
+
+# Ключ результата: (type, id)
+ResultKey = Tuple[str, int]
+
+
+def _first(value: Any) -> Any:
+    """Первое значение фильтра, если передан список"""
+    if isinstance(value, (list, tuple)):
+        return value[0] if value else None
+    return value
+
+
+def _car_types(criteria: Dict[str, Any]) -> List[str]:
+    car_type = criteria.get("car_type")
+    if car_type in ("car", "used_car"):
+        return [car_type]
+    return ["car", "used_car"]
+
+
+def _catalog_filters(criteria: Dict[str, Any]) -> Dict[str, Any]:
+    """Критерии поиска -> аргументы car_filter_conditions"""
+    filters = {
+        "mark": _first(criteria.get("brands") or criteria.get("mark")),
+        "model": _first(criteria.get("models") or criteria.get("model")),
+        "city": _first(criteria.get("cities") or criteria.get("city")),
+        "fuel_type": _first(criteria.get("fuel_types") or criteria.get("fuel_type")),
+        "body_type": _first(criteria.get("body_types") or criteria.get("body_type")),
+        "min_price": criteria.get("min_price"),
+        "max_price": criteria.get("max_price"),
+        "min_year": criteria.get("min_year"),
+        "max_year": criteria.get("max_year"),
+        "min_mileage": criteria.get("min_mileage"),
+        "max_mileage": criteria.get("max_mileage"),
+    }
+    return {key: value for key, value in filters.items() if value is not None}
+
+
+class HybridRetriever:
+    """Параллельный опрос источников с дедлайнами и слиянием через RRF"""
+
+    def __init__(
+        self,
+        elasticsearch_service=None,
+        vector_search_service=None,
+        use_sql: bool = True,
+        rrf_k: Optional[int] = None,
+        timeouts: Optional[Dict[str, float]] = None,
+        hydrate_timeout: Optional[float] = None,
+    ):
+        """
+        Args:
+            elasticsearch_service: ElasticsearchService (None - источник отключен)
+            vector_search_service: VectorSearchService (None - источник отключен)
+            use_sql: Использовать ли структурный поиск по каталогу
+            rrf_k: Константа RRF (чем больше, тем меньше вес первых позиций)
+            timeouts: Бюджет времени источников в секундах {source: seconds}
+            hydrate_timeout: Бюджет загрузки карточек из каталога в секундах
+        """
+        self.es = elasticsearch_service
+        self.vector = vector_search_service
+        self.use_sql = use_sql
+        self.rrf_k = rrf_k or settings.hybrid_search_rrf_k
+        self.timeouts = {
+            SOURCE_ELASTICSEARCH: settings.hybrid_search_es_timeout,
+            SOURCE_VECTOR: settings.hybrid_search_vector_timeout,
+            SOURCE_SQL: settings.hybrid_search_sql_timeout,
+        }
+        self.timeouts.update(timeouts or {})
+        self.hydrate_timeout = hydrate_timeout if hydrate_timeout is not None else settings.hybrid_search_hydrate_timeout
+
+    async def retrieve(
+        self,
+        query: str,
+        criteria: Optional[Dict[str, Any]] = None,
+        limit: int = 20,
+        semantic_query: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Ищет автомобили во всех доступных источниках
+
+        Args:
+            query: Текст запроса (для ES и SQL)
+            criteria: Структурные критерии (brands, min_price, max_year, car_type, ...)
+            limit: Сколько результатов вернуть после слияния
+            semantic_query: Текст для векторного поиска (по умолчанию query)
+
+        Returns:
+            {"results": [...], "sources": {source: отчет}} - результаты отсортированы по RRF,
+            у каждого есть id, type, score (RRF), combined_score (0..1), sources, ranks, data
+        """
+        criteria = criteria or {}
+        per_source = settings.hybrid_search_source_limit
+
+        searches: Dict[str, Callable[[], Awaitable[List[Tuple[ResultKey, Dict[str, Any]]]]]] = {}
+        if self.es is not None and self.es.is_available():
+            searches[SOURCE_ELASTICSEARCH] = lambda: self._search_elasticsearch(query, criteria, per_source)
+        if self.vector is not None:
+            searches[SOURCE_VECTOR] = lambda: self._search_vector(semantic_query or query, criteria, per_source)
+        if self.use_sql and _catalog_filters(criteria):
+            searches[SOURCE_SQL] = lambda: self._search_sql(criteria, per_source)
+
+        names = list(searches)
+        outcomes = await asyncio.gather(*(self._run_source(name, searches[name]) for name in names))
+        ranked = {name: hits for name, (hits, _) in zip(names, outcomes)}
+        reports = {name: report for name, (_, report) in zip(names, outcomes)}
+
+        fused = self._fuse(ranked, limit)
+        try:
+            results = await asyncio.wait_for(asyncio.to_thread(self._hydrate, fused), timeout=self.hydrate_timeout)
+        except asyncio.TimeoutError:
+            results = self._source_cards(fused)
+            print(f"⚠️ Каталог не ответил за {self.hydrate_timeout}с, карточки взяты из источников")
+        except Exception as e:
+            results = self._source_cards(fused)
+            print(f"⚠️ Ошибка загрузки карточек из каталога: {e}")
+        for name, report in reports.items():
+            report["contributed"] = sum(1 for result in results if name in result["sources"])
+
+        print("🔀 Гибридный поиск: " + ", ".join(
+            f"{name} {report['status']} {report['latency_ms']}мс ({report['returned']}→{report['contributed']})"
+            for name, report in reports.items()
+        ))
+        return {"results": results, "sources": reports}
+
+    async def _run_source(self, name: str, search: Callable[[], Awaitable[list]]):
+        """Запускает источник с его дедлайном; ошибка или таймаут -> пустой результат"""
+        started = time.perf_counter()
+        report = {"status": "ok", "latency_ms": 0, "returned": 0, "contributed": 0}
+        hits: List[Tuple[ResultKey, Dict[str, Any]]] = []
+        try:
+            hits = await asyncio.wait_for(search(), timeout=self.timeouts[name])
+        except asyncio.TimeoutError:
+            report["status"] = "timeout"
+        except Exception as e:
+            report["status"] = "error"
+            report["error"] = str(e)
+            print(f"⚠️ Ошибка источника {name}: {e}")
+        report["latency_ms"] = int((time.perf_counter() - started) * 1000)
+        report["returned"] = len(hits)
+        return hits, report
+
+    def _fuse(self, ranked: Dict[str, List[Tuple[ResultKey, Dict[str, Any]]]], limit: int) -> List[Dict[str, Any]]:
+        """Reciprocal rank fusion с дедупликацией по (type, id)"""
+        fused: Dict[ResultKey, Dict[str, Any]] = {}
+        for name, hits in ranked.items():
+            seen = set()
+            for key, data in hits:
+                if key in seen:
+                    continue
+                seen.add(key)
+                rank = len(seen)
+                entry = fused.setdefault(key, {
+                    "id": key[1],
+                    "type": key[0],
+                    "score": 0.0,
+                    "sources": [],
+                    "ranks": {},
+                    "data": data,
+                    "card": None,
+                })
+                if entry["card"] is None and name in CARD_SOURCES:
+                    entry["card"] = car_summary_from_source(data)
+                entry["score"] += 1.0 / (self.rrf_k + rank)
+                entry["sources"].append(name)
+                entry["ranks"][name] = rank
+
+        # Нормируем на максимум: первое место во всех опрошенных источниках = 1.0
+        best_possible = len(ranked) / (self.rrf_k + 1) if ranked else 1.0
+        results = sorted(fused.values(), key=lambda entry: entry["score"], reverse=True)[:limit]
+        for entry in results:
+            entry["combined_score"] = entry["score"] / best_possible
+        return results
+
+    @staticmethod
+    def _source_cards(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Данные источников вместо каталога (полная карточка ES/SQL, если есть)"""
+        return [
+            {**{key: value for key, value in result.items() if key != "card"},
+             "data": result.get("card") or result["data"]}
+            for result in results
+        ]
+
+    @staticmethod
+    def _hydrate(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Заменяет data результатов краткими карточками (порядок RRF сохраняется)
+
+        Полные карточки ES/SQL берутся как есть, остальные загружаются из каталога.
+        """
+        if not results:
+            return results
+        hits = [
+            {"_source": result.get("card") or {"id": result["id"], "type": result["type"]}}
+            for result in results
+        ]
+        db = SessionLocal()
+        try:
+            summaries = CarHydrator(db, with_relations=False).summaries_from_hits(hits)
+        finally:
+            db.close()
+
+        # Новые словари: после таймаута поток может доработать, не трогая отданные результаты
+        return [
+            {**{key: value for key, value in result.items() if key != "card"}, "data": summary}
+            for result, summary in zip(results, summaries) if summary is not None
+        ]
+
+    # ------------------------------------------------------------------
+    # Источники
+    # ------------------------------------------------------------------
+
+    async def _search_elasticsearch(self, query: str, criteria: Dict[str, Any], limit: int):
+        es_params = {
+            "query": query,
+            "car_type": criteria.get("car_type") if criteria.get("car_type") in ("car", "used_car") else None,
+            "limit": limit,
+            **_catalog_filters(criteria),
+        }
+        es_params = {key: value for key, value in es_params.items() if value is not None}
+
+        # ElasticsearchService.search_cars синхронный - не блокируем event loop
+        if asyncio.iscoroutinefunction(self.es.search_cars):
+            result = await self.es.search_cars(**es_params)
+        else:
+            result = await asyncio.to_thread(self.es.search_cars, **es_params)
+
+        hits = []
+        for hit in result.get("hits", []) or []:
+            source = hit.get("_source") or {}
+            car_id = source.get("id")
+            if car_id:
+                # Полный _source сразу служит карточкой, без обращения к Postgres
+                hits.append(((source.get("type") or "car", int(car_id)), car_summary_from_source(source) or source))
+        return hits
+
+    async def _search_vector(self, query: str, criteria: Dict[str, Any], limit: int):
+        vector_results = await self.vector.similarity_search(query, k=limit, filters=criteria)
+        hits = []
+        for doc, score in vector_results:
+            metadata = getattr(doc, "metadata", None) or {}
+            car_id = metadata.get("car_id") or metadata.get("id")
+            if car_id:
+                hits.append(((metadata.get("type") or "car", int(car_id)), dict(metadata)))
+        return hits
+
+    async def _search_sql(self, criteria: Dict[str, Any], limit: int):
+        filters = _catalog_filters(criteria)
+        model_classes = [Car if car_type == "car" else UsedCar for car_type in _car_types(criteria)]
+
+        if AsyncSessionLocal is not None:
+            from services.async_database_service import AsyncDatabaseService
+
+            async with AsyncSessionLocal() as session:
+                db_service = AsyncDatabaseService(session)
+                pages = []
+                for model_cls in model_classes:
+                    if model_cls is Car:
+                        page, _ = await db_service.get_cars(limit=limit, **filters)
+                    else:
+                        page, _ = await db_service.get_used_cars(limit=limit, **filters)
+                    pages.append(page)
+        else:
+            pages = await asyncio.to_thread(self._search_sql_sync, model_classes, filters, limit)
+
+        # Чередуем новые и подержанные, чтобы ранги не отдавали все верхние места одному типу
+        hits = []
+        for row in zip_longest(*pages):
+            for car in row:
+                if car is not None:
+                    data = car_to_dict(car)
+                    hits.append(((data["type"], car.id), data))
+        return hits[:limit]
+
+    @staticmethod
+    def _search_sql_sync(model_classes: list, filters: Dict[str, Any], limit: int) -> list:
+        # Отдельная сессия: при таймауте поток доработает сам, не мешая сессии запроса
+        db = SessionLocal()
+        try:
+            return [
+                db.query(model_cls)
+                .filter(*car_filter_conditions(model_cls, **filters))
+                .order_by(model_cls.created_at.desc())
+                .limit(limit)
+                .all()
+                for model_cls in model_classes
+            ]
+        finally:
+            db.close()
@@ -0,0 +1,428 @@
+"""
+Кэш фотографий автомобилей: загрузка, дедупликация и миниатюры
+
+Фото каталога (car_pictures, used_car_pictures, parsed_car_pictures) хранятся
+ссылками на сайты дилеров. Сервис:
+- загружает фото параллельно через AsyncCrawler (ограничение одновременных
+  запросов, token bucket на хост, повторы при 429/5xx);
+- сохраняет оригинал по SHA-256 содержимого (BlobStorage): одно фото с разных
+  URL хранится и уменьшается один раз, таблица car_images связывает URL с хешем;
+- строит миниатюры THUMBNAIL_SIZES в пуле процессов (Pillow), не блокируя event loop;
+- отдает миниатюры через GET /api/images/{sha256}/{size}: содержимое по адресу
+  никогда не меняется, поэтому ответ кэшируется без срока (immutable, ETag, 304).
+
+Одновременные запросы одного URL (или одного содержимого) внутри процесса
+объединяются: загрузка и уменьшение выполняются один раз. URL обрабатываются
+пачками по image_cache_batch_size, результаты каждой пачки фиксируются в
+car_images отдельной транзакцией: после перезапуска загруженное не повторяется.
+Запросы к БД выполняются в потоках (asyncio.to_thread) со своей сессией.
+"""
+import asyncio
+import importlib.util
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from sqlalchemy import and_, bindparam, exists, or_, select, union, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from models import SessionLocal
+from models.database import CarImage, CarPicture, ParsedCarPicture, UsedCarPicture
+from services.blob_storage_service import BlobStorage
+from services.crawl_engine_service import AsyncCrawler, CrawlItem, FetchResult
+
+logger = logging.getLogger(__name__)
+
+# Миниатюры: имя размера -> наибольшая сторона, px (меньшие фото не увеличиваются)
+THUMBNAIL_SIZES = {"sm": 320, "md": 640, "lg": 1280}
+THUMBNAIL_MEDIA_TYPE = "image/jpeg"
+
+IMAGE_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+                  "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "image/avif,image/webp,image/jpeg,image/png,image/*;q=0.8",
+}
+
+
+# ---------------------------------------------------------------------------
+# Код, выполняемый в рабочих процессах пула
+# ---------------------------------------------------------------------------
+
+def _render_thumbnails(source: str, targets: Dict[str, Tuple[int, str]], quality: int) -> Tuple[int, int, str]:
+    """
+    Строит миниатюры оригинала
+
+    Returns:
+        (ширина, высота, MIME-тип оригинала)
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        width, height = image.size
+        content_type = Image.MIME.get(image.format or "", "application/octet-stream")
+        # JPEG декодируется сразу в уменьшенном масштабе (не меньше самой большой миниатюры)
+        largest = max(max_side for max_side, _ in targets.values())
+        image.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+
+        for max_side, target in targets.values():
+            thumbnail = image.copy()
+            thumbnail.thumbnail((max_side, max_side), Image.LANCZOS)
+            path = Path(target)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".thumb-")
+            try:
+                with os.fdopen(fd, "wb") as tmp_file:
+                    thumbnail.save(tmp_file, "JPEG", quality=quality, optimize=True, progressive=True)
+                os.replace(tmp_path, path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+    return width, height, content_type
+
+
+def _probe_image(source: str) -> Tuple[int, int, str]:
+    """Размеры и тип оригинала (читается только заголовок файла)"""
+    from PIL import Image
+
+    with Image.open(source) as image:
+        return image.size[0], image.size[1], Image.MIME.get(image.format or "", "application/octet-stream")
+
+
+# ---------------------------------------------------------------------------
+# Сервис
+# ---------------------------------------------------------------------------
+
+class ImageCacheService:
+    """Загрузка фото автомобилей в локальный кэш и построение миниатюр"""
+
+    def __init__(
+        self,
+        root: Union[str, Path],
+        concurrency: int = 8,
+        workers: int = 2,
+        quality: int = 82,
+        max_bytes: int = 15 * 1024 * 1024,
+        max_attempts: int = 3,
+        batch_size: int = 100,
+    ):
+        self.root = Path(root)
+        self.originals = BlobStorage(self.root / "originals")
+        self.thumbnails_root = self.root / "thumbnails"
+        self.concurrency = max(1, concurrency)
+        self.workers = max(1, workers)
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.max_attempts = max(1, max_attempts)
+        self.batch_size = max(1, batch_size)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._inflight_urls: Dict[str, asyncio.Future] = {}
+        self._inflight_hashes: Dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def is_available() -> bool:
+        """Установлен ли Pillow"""
+        return importlib.util.find_spec("PIL") is not None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: не копируем потоки и соединения uvicorn в дочерние процессы
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def thumbnail_path(self, content_hash: str, size: str) -> Path:
+        return self.thumbnails_root / size / content_hash[:2] / content_hash[2:4] / f"{content_hash}.jpg"
+
+    def has_thumbnails(self, content_hash: str) -> bool:
+        return all(self.thumbnail_path(content_hash, size).is_file() for size in THUMBNAIL_SIZES)
+
+    @staticmethod
+    def thumbnail_urls(content_hash: str) -> Dict[str, str]:
+        """Адреса миниатюр в API по размерам"""
+        return {size: f"/api/images/{content_hash}/{size}" for size in THUMBNAIL_SIZES}
+
+    def get_thumbnails(self, db: Session, urls: Iterable[str]) -> Dict[str, Dict[str, str]]:
+        """Миниатюры уже загруженных фото: {внешний URL: {размер: адрес в API}}"""
+        urls = list({url for url in urls if url})
+        if not urls:
+            return {}
+        rows = db.execute(
+            select(CarImage.source_url, CarImage.content_hash)
+            .where(CarImage.source_url.in_(urls), CarImage.status == "ready")
+        ).all()
+        return {row.source_url: self.thumbnail_urls(row.content_hash) for row in rows}
+
+    async def cache_urls(self, urls: Iterable[str]) -> Dict[str, Optional[str]]:
+        """
+        Загружает фото в кэш (уже загруженные и исчерпавшие попытки пропускаются)
+
+        Каждая пачка из batch_size URL сохраняется в БД сразу после загрузки.
+
+        Returns:
+            {URL: SHA-256 содержимого или None, если фото недоступно}
+        """
+        urls = list(dict.fromkeys(url for url in urls if url and url.startswith(("http://", "https://"))))
+        if not urls:
+            return {}
+        if not self.is_available():
+            logger.warning("Pillow не установлен, фото не кэшируются. Установите: pip install Pillow")
+            return {}
+
+        results: Dict[str, Optional[str]] = {}
+        for start in range(0, len(urls), self.batch_size):
+            results.update(await self._cache_batch(urls[start:start + self.batch_size]))
+        return results
+
+    async def _cache_batch(self, urls: List[str]) -> Dict[str, Optional[str]]:
+        known = await asyncio.to_thread(self._load_known, urls)
+
+        results: Dict[str, Optional[str]] = {}
+        rerender: List[str] = []
+        to_fetch: List[str] = []
+        for url in urls:
+            status, content_hash, attempts = known.get(url, (None, None, 0))
+            if status == "ready" and content_hash:
+                results[url] = content_hash
+                if not self.has_thumbnails(content_hash):
+                    if self.originals.exists(content_hash):
+                        rerender.append(content_hash)
+                    else:
+                        to_fetch.append(url)
+            elif status is not None and attempts >= self.max_attempts:
+                results[url] = None
+            else:
+                to_fetch.append(url)
+
+        for content_hash in set(rerender):
+            await self._ensure_thumbnails(content_hash)
+
+        loop = asyncio.get_running_loop()
+        owned: List[str] = []
+        waiting: Dict[str, asyncio.Future] = {}
+        for url in to_fetch:
+            future = self._inflight_urls.get(url)
+            if future is None:
+                self._inflight_urls[url] = loop.create_future()
+                owned.append(url)
+            else:
+                waiting[url] = future
+
+        outcomes: Dict[str, Dict[str, Any]] = {}
+        try:
+            if owned:
+                outcomes = await self._fetch_all(owned)
+                await asyncio.to_thread(self._save, outcomes)
+        finally:
+            for url in owned:
+                outcome = outcomes.get(url) or {"error": "Загрузка прервана"}
+                self._inflight_urls.pop(url).set_result(outcome)
+
+        for url in owned:
+            results[url] = outcomes[url].get("content_hash")
+        for url, future in waiting.items():
+            results[url] = (await future).get("content_hash")
+        return results
+
+    @staticmethod
+    def _load_known(urls: List[str]) -> Dict[str, Tuple[Optional[str], Optional[str], int]]:
+        """Состояние URL в car_images: {URL: (status, content_hash, attempts)}"""
+        db = SessionLocal()
+        try:
+            rows = db.execute(
+                select(CarImage.source_url, CarImage.status, CarImage.content_hash, CarImage.attempts)
+                .where(CarImage.source_url.in_(urls))
+            ).all()
+            return {row.source_url: (row.status, row.content_hash, row.attempts or 0) for row in rows}
+        finally:
+            db.close()
+
+    async def _fetch_all(self, urls: List[str]) -> Dict[str, Dict[str, Any]]:
+        crawler = AsyncCrawler(
+            headers=IMAGE_HEADERS,
+            concurrency=self.concurrency,
+            host_rate=settings.image_host_rate_per_second,
+            host_burst=self.concurrency,
+            max_bytes=self.max_bytes,
+        )
+        outcomes: Dict[str, Dict[str, Any]] = {}
+
+        async def handle(item: CrawlItem, result: FetchResult) -> None:
+            outcomes[item.url] = await self._store(result)
+
+        async with crawler.client() as client:
+            await crawler.crawl(client, [CrawlItem(url=url, kind="image") for url in urls], handle)
+        for url in urls:
+            outcomes.setdefault(url, {"error": "Ошибка обработки"})
+        return outcomes
+
+    async def _store(self, result: FetchResult) -> Dict[str, Any]:
+        """Сохраняет загруженное фото и строит миниатюры"""
+        if not result.ok:
+            return {"error": result.error or f"HTTP {result.status_code}"}
+        if not result.content:
+            return {"error": "Пустой ответ"}
+
+        content_hash = await asyncio.to_thread(self.originals.put_bytes, result.content)
+        meta = await self._ensure_thumbnails(content_hash)
+        if meta.get("error"):
+            # Не изображение или поврежденный файл: оригинал не храним
+            self.originals.delete(content_hash)
+            return meta
+        return {"content_hash": content_hash, "size_bytes": len(result.content), **meta}
+
+    async def _ensure_thumbnails(self, content_hash: str) -> Dict[str, Any]:
+        """
+        Миниатюры содержимого (строятся один раз на хеш)
+
+        Returns:
+            {"width", "height", "content_type"} или {"error"}
+        """
+        future = self._inflight_hashes.get(content_hash)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        loop = asyncio.get_running_loop()
+        future = self._inflight_hashes[content_hash] = loop.create_future()
+        source = str(self.originals.path_for(content_hash))
+        meta: Dict[str, Any] = {"error": "Построение миниатюр прервано"}
+        try:
+            if self.has_thumbnails(content_hash):
+                width, height, content_type = await asyncio.to_thread(_probe_image, source)
+            else:
+                targets = {
+                    size: (max_side, str(self.thumbnail_path(content_hash, size)))
+                    for size, max_side in THUMBNAIL_SIZES.items()
+                }
+                width, height, content_type = await loop.run_in_executor(
+                    self._get_executor(), _render_thumbnails, source, targets, self.quality
+                )
+            meta = {"width": width, "height": height, "content_type": content_type}
+        except Exception as e:
+            logger.warning(f"Не удалось построить миниатюры {content_hash}: {e}")
+            meta = {"error": f"{type(e).__name__}: {e}"}
+        finally:
+            self._inflight_hashes.pop(content_hash, None)
+            future.set_result(meta)
+        return meta
+
+    def _save(self, outcomes: Dict[str, Dict[str, Any]]) -> None:
+        """Записывает результаты пачки в car_images и local_path фото парсера (одна транзакция)"""
+        db = SessionLocal()
+        try:
+            for attempt in range(2):
+                try:
+                    self._write_outcomes(db, outcomes)
+                    db.commit()
+                    return
+                except IntegrityError:
+                    # Тот же URL одновременно сохранил другой процесс: перечитываем и обновляем его запись
+                    db.rollback()
+            logger.warning("Не удалось сохранить результаты пачки фото: конфликт с другим процессом")
+        finally:
+            db.close()
+
+    def _write_outcomes(self, db: Session, outcomes: Dict[str, Dict[str, Any]]) -> None:
+        known = {row.source_url: row for row in db.execute(
+            select(CarImage).where(CarImage.source_url.in_(list(outcomes)))
+        ).scalars()}
+        local_paths = []
+        for url, outcome in outcomes.items():
+            row = known.get(url)
+            if row is None:
+                row = CarImage(source_url=url, attempts=0)
+                db.add(row)
+            if outcome.get("error"):
+                row.status = "failed"
+                row.error = outcome["error"][:1000]
+                row.attempts = (row.attempts or 0) + 1
+                continue
+            row.status = "ready"
+            row.error = None
+            row.attempts = 0
+            row.content_hash = outcome["content_hash"]
+            row.content_type = outcome.get("content_type")
+            row.width = outcome.get("width")
+            row.height = outcome.get("height")
+            row.size_bytes = outcome.get("size_bytes")
+            local_paths.append({"url_": url, "path_": str(self.originals.path_for(outcome["content_hash"]))})
+
+        if local_paths:
+            pictures = ParsedCarPicture.__table__
+            db.execute(
+                update(pictures).where(pictures.c.image_url == bindparam("url_")).values(local_path=bindparam("path_")),
+                local_paths,
+            )
+
+    def missing_urls(self, limit: int) -> List[str]:
+        """URL фото каталога, которых еще нет в кэше (и попытки загрузки не исчерпаны)"""
+        db = SessionLocal()
+        try:
+            return self._missing_urls(db, limit)
+        finally:
+            db.close()
+
+    def _missing_urls(self, db: Session, limit: int) -> List[str]:
+        sources = union(
+            select(CarPicture.url.label("url")).where(CarPicture.url.isnot(None)),
+            select(UsedCarPicture.url.label("url")).where(UsedCarPicture.url.isnot(None)),
+            select(ParsedCarPicture.image_url.label("url")),
+        ).subquery()
+        cached = exists().where(and_(
+            CarImage.source_url == sources.c.url,
+            or_(CarImage.status == "ready", CarImage.attempts >= self.max_attempts),
+        ))
+        return list(db.execute(select(sources.c.url).where(~cached).limit(limit)).scalars())
+
+    async def cache_in_background(self, urls: List[str]) -> None:
+        """Для BackgroundTasks: сессия запроса к этому моменту закрыта, БД - в потоках"""
+        try:
+            await self.cache_urls(urls)
+        except Exception as e:
+            logger.error(f"Ошибка кэширования фото: {e}", exc_info=True)
+
+    async def prefetch(self, limit: int = 1000) -> Dict[str, int]:
+        """
+        Загружает в кэш фото каталога, которых там еще нет
+
+        Пачки фиксируются по мере загрузки: прерванный prefetch при повторном
+        запуске продолжает с еще не загруженных фото.
+        """
+        urls = await asyncio.to_thread(self.missing_urls, limit)
+        results = await self.cache_urls(urls)
+        cached = sum(1 for content_hash in results.values() if content_hash)
+        logger.info(f"🖼️ Кэширование фото: {cached} из {len(urls)} загружено")
+        return {"requested": len(urls), "cached": cached, "failed": len(results) - cached}
+
+    def shutdown(self):
+        """Останавливает пул процессов"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+image_cache_service = ImageCacheService(
+    settings.image_storage_dir,
+    concurrency=settings.image_fetch_concurrency,
+    workers=settings.image_thumbnail_workers,
+    quality=settings.image_thumbnail_quality,
+    max_bytes=settings.image_max_bytes,
+    max_attempts=settings.image_max_attempts,
+    batch_size=settings.image_cache_batch_size,
+)
@@ -1,26 +1,26 @@
 """
 Сервис для импорта автомобилей из JSON/XML файлов
 """
+import io
 import json
+import time
 import xml.etree.ElementTree as ET
-from typing import Dict, List, Any, Optional, Tuple
+from typing import BinaryIO, Callable, Dict, Iterable, List, Any, Optional, Tuple
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
+from app.core.config import settings
 from models.database import (
     ImportCar, ImportUsedCar, ImportCarPicture, ImportUsedCarPicture,
     ImportCarOption, ImportCarOptionsGroup, Car, UsedCar, CarPicture,
     UsedCarPicture, CarOption, CarOptionsGroup
 )
+from services.field_mapping_service import MappingProfileService, field_mapper, field_set_fingerprint
+from services.import_stream_service import ImportRecordStream, xml_element_to_dict
 import logging
-from difflib import SequenceMatcher
 
 logger = logging.getLogger(__name__)
 
 
-def similarity(a: str, b: str) -> float:
-    """Вычисляет похожесть двух строк"""
-    return SequenceMatcher(None, a.lower(), b.lower()).ratio()
-
-
 class ImportService:
     """Сервис для импорта автомобилей"""
     
@@ -197,97 +197,51 @@ class ImportService:
     
     def _xml_element_to_dict(self, element: ET.Element) -> Dict[str, Any]:
         """Конвертирует XML элемент в словарь"""
-        result = {}
-        
-        # Добавляем атрибуты
-        for key, value in element.attrib.items():
-            result[key] = value
-        
-        # Добавляем дочерние элементы
-        for child in element:
-            if len(child) == 0:  # Нет дочерних элементов
-                # Обработка специальных элементов
-                if child.tag == 'Image' and 'url' in child.attrib:
-                    # Для изображений
-                    if 'Images' not in result:
-                        result['Images'] = []
-                    result['Images'].append({'url': child.attrib['url']})
-                elif child.tag == 'Images':
-                    # Контейнер для изображений
-                    if 'Images' not in result:
-                        result['Images'] = []
-                    # Ищем все Image элементы внутри Images
-                    for img in child.findall('Image'):
-                        if 'url' in img.attrib:
-                            result['Images'].append({'url': img.attrib['url']})
-                    # Также проверяем, есть ли Image как дочерний элемент напрямую
-                    for img_child in child:
-                        if img_child.tag == 'Image' and 'url' in img_child.attrib:
-                            result['Images'].append({'url': img_child.attrib['url']})
-                else:
-                    # Обычные элементы - берем текст содержимого
-                    text_value = child.text.strip() if child.text and child.text.strip() else ""
-                    # Если текст пустой, но есть атрибуты, берем атрибут 'value' или первый атрибут
-                    if not text_value and child.attrib:
-                        # Пробуем взять значение из атрибута value, если есть
-                        text_value = child.attrib.get('value') or child.attrib.get('Value') or ""
-                        # Если все еще пусто, берем первый атрибут (кроме Title, Code)
-                        if not text_value:
-                            for key, val in child.attrib.items():
-                                if key.lower() not in ['title', 'code', 'name']:
-                                    text_value = val
-                                    break
-                    
-                    # Если несколько элементов с одним тегом - создаем список
-                    if child.tag in result:
-                        if not isinstance(result[child.tag], list):
-                            result[child.tag] = [result[child.tag]]
-                        result[child.tag].append(text_value)
-                    else:
-                        result[child.tag] = text_value
-            else:
-                # Есть дочерние элементы - рекурсивно обрабатываем
-                child_dict = self._xml_element_to_dict(child)
-                if child.tag in result:
-                    if not isinstance(result[child.tag], list):
-                        result[child.tag] = [result[child.tag]]
-                    result[child.tag].append(child_dict)
-                else:
-                    result[child.tag] = child_dict
-        
-        # Добавляем текст элемента, если он есть и нет дочерних элементов
-        if element.text and element.text.strip():
-            text_value = element.text.strip()
-            if not result:
-                return text_value
-            result["_text"] = text_value
-        
-        return result
+        return xml_element_to_dict(element)
     
     def analyze_file(self, file_content: bytes, file_type: str) -> Dict[str, Any]:
         """
         Анализирует файл и возвращает информацию о структуре
         """
-        if file_type.lower() == "json":
-            root_key, records = self.parse_json_file(file_content)
-        elif file_type.lower() == "xml":
+        try:
+            return self.analyze_stream(io.BytesIO(file_content), file_type)
+        except ET.ParseError as e:
+            # Поврежденный XML: разбираем целиком с очисткой содержимого
+            logger.warning(f"Потоковый разбор XML не удался ({e}), разбираем файл целиком")
             root_key, records = self.parse_xml_file(file_content)
-        else:
-            raise ValueError(f"Неподдерживаемый тип файла: {file_type}")
-        
-        if not records:
-            raise ValueError("Файл не содержит записей")
-        
-        # Получаем все уникальные поля из всех записей
+            return self._analyze_records(records, file_type)
+    
+    def analyze_stream(self, file_obj: BinaryIO, file_type: str) -> Dict[str, Any]:
+        """
+        Анализирует файл потоково: в памяти только список полей и первые 5 записей
+        """
+        return self._analyze_records(ImportRecordStream(file_obj, file_type), file_type)
+    
+    def _analyze_records(self, records: Iterable[Any], file_type: str) -> Dict[str, Any]:
+        total_records = 0
         all_fields = set()
+        sample_records = []
         for record in records:
+            total_records += 1
+            # Получаем все уникальные поля из всех записей
             self._extract_fields(record, all_fields, "")
+            # Примеры записей (первые 5)
+            if len(sample_records) < 5:
+                sample_records.append(record)
         
-        # Получаем примеры записей (первые 5)
-        sample_records = records[:5]
+        if not total_records:
+            raise ValueError("Файл не содержит записей")
         
-        # Автоматическое сопоставление полей
-        auto_mapping = self._auto_map_fields(list(all_fields))
+        # Подтвержденный профиль того же набора полей - без автоматического сопоставления
+        fingerprint = field_set_fingerprint(all_fields)
+        profiles = MappingProfileService(self.db)
+        profile = profiles.find(fingerprint)
+        if profile is not None:
+            saved_mapping = profiles.get_mapping(profile)
+            auto_mapping = {field: saved_mapping.get(field) for field in all_fields}
+            profiles.mark_used(profile)
+        else:
+            auto_mapping = self._auto_map_fields(list(all_fields))
         
         # Предложения для каждого поля
         suggestions = {}
@@ -296,11 +250,13 @@ class ImportService:
         
         return {
             "file_type": file_type,
-            "total_records": len(records),
+            "total_records": total_records,
             "sample_records": sample_records,
             "available_fields": sorted(list(all_fields)),
             "auto_mapping": auto_mapping,
-            "suggestions": suggestions
+            "suggestions": suggestions,
+            "fields_fingerprint": fingerprint,
+            "mapping_profile": profiles.describe(profile) if profile is not None else None
         }
     
     def _extract_fields(self, obj: Any, fields: set, prefix: str = ""):
@@ -318,189 +274,11 @@ class ImportService:
     
     def _auto_map_fields(self, source_fields: List[str]) -> Dict[str, Optional[str]]:
         """Автоматически сопоставляет поля из файла с полями таблицы"""
-        # Поля, которые НЕ нужно импортировать в car_data (но могут использоваться для других целей)
-        excluded_fields = {
-            'picture_path', 'picture_path.path',
-            'pictures_real', 'pictures_real.pic',
-            'Images', 'Images.Image', 'Images.Images', 'Images.Images.url', 'Images.Image.url',
-            'Kilometrage'  # Это поле маппится на mileage, но само не импортируется
-        }
-        
-        # Специальные сопоставления для XML форматов
-        xml_field_mapping = {
-            # Для новых автомобилей (CarOrder)
-            "Mark": "mark",
-            "Model": "model",
-            "Price": "price",
-            "City": "city",
-            "ManufactureYear": "manufacture_year",
-            "FuelType": "fuel_type",
-            "Power": "power",
-            "BodyType": "body_type",
-            "GearBoxType": "gear_box_type",
-            "DrivingGearType": "driving_gear_type",
-            "EngineVol": "engine_vol",
-            "Color": "color",
-            "VIN": "vin",
-            "CodeCompl": "code_compl",
-            "StockQty": "stock_qty",
-            "DocNum": "doc_num",
-            "Title": "title",
-            "InteriorColor": "interior_color",
-            "Engine": "engine",
-            "DoorQty": "door_qty",
-            "PTSColour": "pts_colour",
-            "ModelYear": "model_year",
-            "FuelConsumption": "fuel_consumption",
-            "MaxTorque": "max_torque",
-            "Acceleration": "acceleration",
-            "MaxSpeed": "max_speed",
-            "EcoClass": "eco_class",
-            "Dimensions": "dimensions",
-            "Weight": "weight",
-            "CargoVolume": "cargo_volume",
-            "ComplLevel": "compl_level",
-            "interior-code": "interior_code",
-            "color-code": "color_code",
-            "CarOrderIntStatus": "car_order_int_status",
-            "SalePrice": "sale_price",
-            "MaxAdditionalDiscount": "max_additional_discount",
-            "MaxDiscountTradeIn": "max_discount_trade_in",
-            "MaxDiscountCredit": "max_discount_credit",
-            "MaxDiscountCasko": "max_discount_casko",
-            "MaxDiscountExtraGear": "max_discount_extra_gear",
-            "MaxDiscountLifeInsurance": "max_discount_life_insurance",
-            # Для подержанных автомобилей (Ads/Ad)
-            "Make": "mark",
-            "Year": "manufacture_year",
-            "Kilometrage": "mileage",
-            "Transmission": "gear_box_type",
-            "DriveType": "driving_gear_type",
-            "EngineSize": "engine_vol",
-            "DateBegin": "date_begin",
-            "DateEnd": "date_end",
-            "AdStatus": "ad_status",
-            "AllowEmail": "allow_email",
-            "CompanyName": "company_name",
-            "ManagerName": "manager_name",
-            "ContactPhone": "contact_phone",
-            "Category": "category",
-            "Region": "region",
-            "CarType": "car_type",
-            "CertificationNumber": "certification_number",
-            "AllowAvtokodReportLink": "allow_avtokod_report_link",
-            "Doors": "doors",
-            "WheelType": "wheel_type",
-            "Owners": "owners",
-            "Street": "street",
-            "Sticker": "sticker",
-            "GenerationId": "generation_id",
-            "ModificationId": "modification_id",
-            "AAA_MaxAdditionalDiscount": "aaa_max_additional_discount",
-            "AAA_MaxDiscountTradeIn": "aaa_max_discount_trade_in",
-            "AAA_MaxDiscountCredit": "aaa_max_discount_credit",
-            "AAA_MaxDiscountCasko": "aaa_max_discount_casko",
-            "AAA_MaxDiscountExtraGear": "aaa_max_discount_extra_gear",
-            "AAA_MaxDiscountLifeInsurance": "aaa_max_discount_life_insurance",
-            "DealerCenter": "dealer_center",
-        }
-        
-        # Поля для новых автомобилей
-        car_fields = [
-            "title", "doc_num", "stock_qty", "mark", "model", "code_compl", "vin",
-            "color", "price", "city", "manufacture_year", "fuel_type", "power",
-            "body_type", "gear_box_type", "driving_gear_type", "engine_vol",
-            "dealer_center", "interior_color", "engine", "door_qty", "pts_colour",
-            "model_year", "fuel_consumption", "max_torque", "acceleration",
-            "max_speed", "eco_class", "dimensions", "weight", "cargo_volume",
-            "compl_level", "interior_code", "color_code", "car_order_int_status",
-            "sale_price", "max_additional_discount", "max_discount_trade_in",
-            "max_discount_credit", "max_discount_casko", "max_discount_extra_gear",
-            "max_discount_life_insurance"
-        ]
-        
-        # Поля для подержанных автомобилей
-        used_car_fields = [
-            "title", "doc_num", "mark", "model", "vin", "color", "price", "city",
-            "manufacture_year", "mileage", "body_type", "gear_box_type",
-            "driving_gear_type", "engine_vol", "power", "fuel_type", "dealer_center",
-            "date_begin", "date_end", "ad_status", "allow_email", "company_name",
-            "manager_name", "contact_phone", "category", "region", "car_type",
-            "accident", "certification_number", "allow_avtokod_report_link",
-            "doors", "wheel_type", "owners", "street", "sticker", "generation_id",
-            "modification_id", "aaa_max_additional_discount", "aaa_max_discount_trade_in",
-            "aaa_max_discount_credit", "aaa_max_discount_casko",
-            "aaa_max_discount_extra_gear", "aaa_max_discount_life_insurance"
-        ]
-        
-        # Объединяем все поля
-        all_target_fields = set(car_fields + used_car_fields)
-        
-        mapping = {}
-        for source_field in source_fields:
-            # Пропускаем исключенные поля (они не должны маппиться на car_data)
-            if source_field in excluded_fields:
-                mapping[source_field] = None
-                continue
-            
-            # Сначала проверяем точное соответствие в XML маппинге
-            field_name = source_field.split(".")[-1]  # Берем последнюю часть пути
-            
-            # Проверяем точное совпадение (с учетом регистра)
-            if field_name in xml_field_mapping:
-                mapping[source_field] = xml_field_mapping[field_name]
-                continue
-            
-            # Проверяем нечувствительное к регистру совпадение
-            field_name_lower = field_name.lower()
-            exact_match = None
-            for xml_key, db_field in xml_field_mapping.items():
-                if xml_key.lower() == field_name_lower:
-                    exact_match = db_field
-                    break
-            
-            if exact_match:
-                mapping[source_field] = exact_match
-                continue
-            
-            # Если точного совпадения нет, используем алгоритм похожести
-            normalized_source = field_name.lower().replace("_", "").replace("-", "")
-            
-            best_match = None
-            best_score = 0.5  # Минимальный порог похожести
-            
-            for target_field in all_target_fields:
-                normalized_target = target_field.lower().replace("_", "")
-                score = similarity(normalized_source, normalized_target)
-                
-                if score > best_score:
-                    best_score = score
-                    best_match = target_field
-            
-            mapping[source_field] = best_match if best_match else None
-        
-        return mapping
+        return field_mapper.auto_map(source_fields)
     
     def _suggest_mappings(self, source_field: str) -> List[str]:
         """Предлагает возможные сопоставления для поля"""
-        # Похожая логика, но возвращает топ-5 вариантов
-        all_fields = [
-            "title", "doc_num", "stock_qty", "mark", "model", "code_compl", "vin",
-            "color", "price", "city", "manufacture_year", "fuel_type", "power",
-            "body_type", "gear_box_type", "driving_gear_type", "engine_vol",
-            "mileage", "dealer_center"
-        ]
-        
-        normalized_source = source_field.split(".")[-1].lower().replace("_", "").replace("-", "")
-        
-        scores = []
-        for field in all_fields:
-            normalized_target = field.lower().replace("_", "")
-            score = similarity(normalized_source, normalized_target)
-            scores.append((field, score))
-        
-        scores.sort(key=lambda x: x[1], reverse=True)
-        return [field for field, score in scores[:5] if score > 0.3]
+        return list(field_mapper.suggest(source_field))
     
     def _get_nested_value(self, obj: Dict, field_path: str) -> Any:
         """Получает значение из вложенного словаря по пути"""
@@ -538,228 +316,343 @@ class ImportService:
         
         return value
     
+    # Поля фотографий и опций, которые не применяются через сопоставление полей
+    EXCLUDED_FROM_MAPPING = {'Images', 'Images.Image', 'Images.Images', 'Images.Images.url',
+                             'Images.Image.url', 'picture_path', 'pictures_real', 'ComplLevel',
+                             'Options', 'Equipment', 'Features', 'Kilometrage'}
+    
+    INTEGER_FIELDS = {'manufacture_year', 'engine_vol', 'mileage', 'owners', 'stock_qty'}
+    
     def save_import(self, file_content: bytes, file_type: str, 
                    field_mapping: Dict[str, Optional[str]], 
                    car_type: str = "new") -> Dict[str, Any]:
         """
         Сохраняет импортированные данные в таблицы импорта
         """
-        # Парсим файл
-        if file_type.lower() == "json":
-            root_key, records = self.parse_json_file(file_content)
-        elif file_type.lower() == "xml":
+        try:
+            return self.save_import_stream(io.BytesIO(file_content), file_type, field_mapping, car_type)
+        except ET.ParseError as e:
+            # Поврежденный XML (ничего еще не записано): разбираем целиком с очисткой содержимого
+            logger.warning(f"Потоковый разбор XML не удался ({e}), разбираем файл целиком")
             root_key, records = self.parse_xml_file(file_content)
-        else:
-            raise ValueError(f"Неподдерживаемый тип файла: {file_type}")
+            return self._save_records(records, field_mapping, car_type)
+    
+    def save_import_stream(self, file_obj: BinaryIO, file_type: str,
+                           field_mapping: Dict[str, Optional[str]],
+                           car_type: str = "new",
+                           batch_size: Optional[int] = None,
+                           progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        Потоково сохраняет записи файла в таблицы импорта
         
-        imported_cars = 0
-        imported_used_cars = 0
-        imported_pictures = 0
-        imported_options = 0
-        errors = []
+        Записи читаются по одной (iterparse для XML, инкрементальный разбор JSON)
+        и вставляются пачками по batch_size: автомобили, фотографии и опции пачки -
+        многострочными INSERT в одной транзакции. Память не зависит от размера файла.
         
-        for idx, record in enumerate(records):
-            try:
-                # Создаем словарь для сохранения
-                car_data = {}
-                
-                # Для XML формата DealerCenter, извлекаем Name как dealer_center
-                if isinstance(record, dict) and 'Name' in record:
-                    car_data['dealer_center'] = record['Name']
-                
-                # Извлекаем фотографии и опции ДО применения сопоставления полей
-                images_urls = []
-                options_list = []
-                
-                # Извлекаем фотографии из Images
-                images_data = self._get_nested_value(record, 'Images')
-                if images_data:
-                    if isinstance(images_data, list):
-                        for img_item in images_data:
-                            if isinstance(img_item, dict):
-                                url = img_item.get('url') or img_item.get('link') or img_item.get('src')
-                                if url:
-                                    images_urls.append(url)
-                            elif isinstance(img_item, str):
-                                images_urls.append(img_item)
-                    elif isinstance(images_data, dict):
-                        # Если Images это словарь, ищем Image внутри
-                        if 'Image' in images_data:
-                            img_list = images_data['Image'] if isinstance(images_data['Image'], list) else [images_data['Image']]
-                            for img in img_list:
-                                if isinstance(img, dict):
-                                    url = img.get('url') or img.get('link') or img.get('src')
-                                    if url:
-                                        images_urls.append(url)
-                
-                # Извлекаем опции из ComplLevel, Options, Equipment и т.д.
-                for opt_field in ['ComplLevel', 'Options', 'Equipment', 'Features', 'Option']:
-                    opt_value = self._get_nested_value(record, opt_field)
-                    if opt_value:
-                        if isinstance(opt_value, str) and opt_value.strip():
-                            # Если это строка, разбиваем по разделителям
-                            options_list.extend([opt.strip() for opt in opt_value.split(',') if opt.strip()])
-                        elif isinstance(opt_value, list):
-                            for opt in opt_value:
-                                if isinstance(opt, str):
-                                    options_list.append(opt.strip())
-                                elif isinstance(opt, dict):
-                                    desc = opt.get('description') or opt.get('name') or opt.get('text')
-                                    if desc:
-                                        options_list.append(str(desc).strip())
-                
-                # Применяем сопоставление полей (исключая поля для фотографий и опций)
-                excluded_from_mapping = {'Images', 'Images.Image', 'Images.Images', 'Images.Images.url', 
-                                        'Images.Image.url', 'picture_path', 'pictures_real', 'ComplLevel', 
-                                        'Options', 'Equipment', 'Features', 'Kilometrage'}
-                
-                for source_field, target_field in field_mapping.items():
-                    # Пропускаем исключенные поля и поля без маппинга
-                    if source_field in excluded_from_mapping or target_field is None:
-                        continue
-                    
-                    # Для новых автомобилей не добавляем поле mileage
-                    if car_type == "new" and target_field == "mileage":
-                        continue
-                    
-                    value = self._get_nested_value(record, source_field)
-                    
-                    # Если значение не найдено по полному пути, пробуем найти только по имени поля
-                    if value is None and '.' in source_field:
-                        field_name = source_field.split('.')[-1]
-                        value = self._get_nested_value(record, field_name)
-                    
-                    # Если все еще не найдено, пробуем найти по имени поля без учета регистра
-                    if value is None or value == "":
-                        field_name = source_field.split('.')[-1]
-                        # Ищем в record по имени поля без учета регистра
-                        if isinstance(record, dict):
-                            for key, val in record.items():
-                                if key.lower() == field_name.lower():
-                                    value = val
-                                    break
-                    
-                    if value is not None and value != "":
-                        # Преобразуем списки в строки
-                        if isinstance(value, list):
-                            if value:  # Проверяем, что список не пустой
-                                value = ", ".join(str(v) for v in value if v)
-                            else:
-                                continue  # Пропускаем пустые списки
-                        
-                        # Преобразуем числовые значения
-                        if target_field in ['manufacture_year', 'engine_vol', 'mileage', 'owners', 'stock_qty']:
-                            try:
-                                # Убираем пробелы и запятые, заменяем запятую на точку
-                                if isinstance(value, str):
-                                    value_clean = value.replace(' ', '').replace(',', '.')
-                                    if '.' in value_clean:
-                                        value = int(float(value_clean))
-                                    else:
-                                        value = int(value_clean)
-                            except (ValueError, TypeError):
-                                pass  # Оставляем как есть, если не удалось преобразовать
-                        
-                        car_data[target_field] = str(value) if not isinstance(value, (int, float)) else value
-                
-                # Обрабатываем Kilometrage -> mileage (специальная обработка только для подержанных)
-                # Для новых автомобилей mileage не используется
-                if car_type == "used":
-                    kilometrage_value = self._get_nested_value(record, 'Kilometrage')
-                    if kilometrage_value is not None and 'mileage' not in car_data:
-                        try:
-                            if isinstance(kilometrage_value, str):
-                                kilometrage_clean = kilometrage_value.replace(' ', '').replace(',', '.')
-                                car_data['mileage'] = int(float(kilometrage_clean)) if '.' in kilometrage_clean else int(kilometrage_clean)
-                            else:
-                                car_data['mileage'] = int(kilometrage_value)
-                        except (ValueError, TypeError):
-                            pass
-                
-                # Определяем, новый или подержанный автомобиль
-                if car_type == "new":
-                    # Удаляем поле mileage из car_data, так как оно не существует в ImportCar
-                    car_data.pop('mileage', None)
-                    # Создаем ImportCar
-                    import_car = ImportCar(
-                        **car_data,
-                        import_status="imported",
-                        import_source=f"file_{idx}"
-                    )
-                    self.db.add(import_car)
-                    self.db.flush()
-                    imported_cars += 1
-                    
-                    # Обрабатываем фотографии из извлеченных URLs
-                    if images_urls:
-                        for pic_idx, url in enumerate(images_urls):
-                            if url and url.strip():
-                                import_pic = ImportCarPicture(
-                                    car_id=import_car.id,
-                                    url=url.strip(),
-                                    seqno=pic_idx,
-                                    type=None
-                                )
-                                self.db.add(import_pic)
-                                imported_pictures += 1
-                    
-                    # Обрабатываем опции из извлеченного списка
-                    if options_list:
-                        for opt_desc in options_list:
-                            if opt_desc and opt_desc.strip():
-                                import_option = ImportCarOption(
-                                    car_id=import_car.id,
-                                    code=None,
-                                    description=opt_desc.strip()
-                                )
-                                self.db.add(import_option)
-                                imported_options += 1
-                
-                elif car_type == "used":
-                    # Создаем ImportUsedCar
-                    import_used_car = ImportUsedCar(
-                        **car_data,
-                        import_status="imported",
-                        import_source=f"file_{idx}"
-                    )
-                    self.db.add(import_used_car)
-                    self.db.flush()
-                    imported_used_cars += 1
-                    
-                    # Обрабатываем фотографии из извлеченных URLs
-                    if images_urls:
-                        for pic_idx, url in enumerate(images_urls):
-                            if url and url.strip():
-                                import_pic = ImportUsedCarPicture(
-                                    used_car_id=import_used_car.id,
-                                    url=url.strip(),
-                                    seqno=pic_idx,
-                                    type=None
-                                )
-                                self.db.add(import_pic)
-                                imported_pictures += 1
-                    
-                    # Обрабатываем опции из извлеченного списка
-                    # Примечание: ImportCarOption использует ForeignKey на import_cars.id
-                    # Для подержанных автомобилей опции можно сохранить, но нужно будет
-                    # создать отдельную таблицу или использовать существующую структуру
-                    # Пока сохраняем опции только для новых автомобилей
-                    # TODO: Добавить поддержку опций для подержанных автомобилей
-                    if options_list:
-                        logger.warning(f"Опции для подержанных автомобилей не поддерживаются в текущей структуре БД. Найдено опций: {len(options_list)}")
-                
-            except Exception as e:
-                error_msg = f"Ошибка при импорте записи {idx + 1}: {str(e)}"
-                logger.error(error_msg)
-                errors.append(error_msg)
+        Args:
+            file_obj: Бинарный файловый объект
+            file_type: "xml" или "json"
+            field_mapping: Сопоставление полей {source_field: target_field}
+            car_type: "new" или "used"
+            batch_size: Записей в пачке (по умолчанию settings.import_batch_size)
+            progress_callback: Вызывается после каждой пачки со статистикой импорта
         
-        self.db.commit()
+        Raises:
+            ET.ParseError: XML поврежден до первой записанной пачки
+        """
+        stream = ImportRecordStream(file_obj, file_type)
+        return self._save_records(stream, field_mapping, car_type, batch_size, progress_callback, stream=stream)
+    
+    def _save_records(self, records: Iterable[Any],
+                      field_mapping: Dict[str, Optional[str]],
+                      car_type: str = "new",
+                      batch_size: Optional[int] = None,
+                      progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                      stream: Optional[ImportRecordStream] = None) -> Dict[str, Any]:
+        batch_size = batch_size or settings.import_batch_size
+        compiled_mapping = self._compile_field_mapping(field_mapping, car_type)
+        stats = {
+            "processed_records": 0,
+            "imported_cars": 0,
+            "imported_used_cars": 0,
+            "imported_pictures": 0,
+            "imported_options": 0,
+            "errors_count": 0,
+        }
+        errors: List[str] = []
+        started = time.perf_counter()
+        
+        def add_error(message: str):
+            logger.error(message)
+            stats["errors_count"] += 1
+            if len(errors) < settings.import_max_reported_errors:
+                errors.append(message)
+        
+        def flush(batch: list):
+            self._flush_import_batch(batch, car_type, stats, add_error)
+            batch.clear()
+            progress = {**stats, "elapsed_seconds": round(time.perf_counter() - started, 1)}
+            if stream is not None:
+                progress["bytes_read"] = stream.bytes_read
+            logger.info(
+                f"Импорт: обработано {stats['processed_records']} записей, "
+                f"сохранено {stats['imported_cars'] + stats['imported_used_cars']}, ошибок {stats['errors_count']}"
+            )
+            if progress_callback:
+                progress_callback(progress)
+        
+        batch = []
+        idx = -1
+        try:
+            for idx, record in enumerate(records):
+                stats["processed_records"] += 1
+                try:
+                    batch.append((idx, *self._prepare_import_record(record, idx, compiled_mapping, car_type)))
+                except Exception as e:
+                    add_error(f"Ошибка при импорте записи {idx + 1}: {str(e)}")
+                if len(batch) >= batch_size:
+                    flush(batch)
+        except ET.ParseError as e:
+            if not stats["imported_cars"] and not stats["imported_used_cars"] and not batch:
+                raise
+            # Сохраняем то, что успели прочитать до повреждения файла
+            add_error(f"Файл поврежден после записи {idx + 1}: {str(e)}")
+        
+        if batch:
+            flush(batch)
+        
+        if stats["errors_count"] > len(errors):
+            errors.append(f"... и еще {stats['errors_count'] - len(errors)} ошибок")
         
         return {
             "success": True,
-            "imported_cars": imported_cars,
-            "imported_used_cars": imported_used_cars,
-            "imported_pictures": imported_pictures,
-            "imported_options": imported_options,
+            "imported_cars": stats["imported_cars"],
+            "imported_used_cars": stats["imported_used_cars"],
+            "imported_pictures": stats["imported_pictures"],
+            "imported_options": stats["imported_options"],
             "errors": errors
         }
+    
+    def _compile_field_mapping(self, field_mapping: Dict[str, Optional[str]],
+                               car_type: str) -> List[Tuple[str, str, str]]:
+        """
+        Сопоставление полей, подготовленное один раз на файл: [(source_field, имя поля, target_field)]
+        """
+        compiled = []
+        for source_field, target_field in field_mapping.items():
+            # Пропускаем исключенные поля и поля без маппинга
+            if source_field in self.EXCLUDED_FROM_MAPPING or target_field is None:
+                continue
+            # Для новых автомобилей не добавляем поле mileage
+            if car_type == "new" and target_field == "mileage":
+                continue
+            compiled.append((source_field, source_field.split('.')[-1], target_field))
+        return compiled
+    
+    def _prepare_import_record(self, record: Any, idx: int,
+                               compiled_mapping: List[Tuple[str, str, str]],
+                               car_type: str) -> Tuple[Dict[str, Any], List[str], List[str]]:
+        """
+        Готовит запись к вставке
+        
+        Returns:
+            (поля автомобиля, URL фотографий, описания опций)
+        """
+        # Создаем словарь для сохранения
+        car_data = {}
+        
+        # Для XML формата DealerCenter, извлекаем Name как dealer_center
+        if isinstance(record, dict) and 'Name' in record:
+            car_data['dealer_center'] = record['Name']
+        
+        # Ключи верхнего уровня без учета регистра (первое совпадение, как при переборе record)
+        lower_keys = {}
+        if isinstance(record, dict):
+            for key, val in record.items():
+                lower_keys.setdefault(key.lower(), val)
+        
+        # Извлекаем фотографии и опции ДО применения сопоставления полей
+        images_urls = []
+        options_list = []
+        
+        # Извлекаем фотографии из Images
+        images_data = self._get_nested_value(record, 'Images')
+        if images_data:
+            if isinstance(images_data, list):
+                for img_item in images_data:
+                    if isinstance(img_item, dict):
+                        url = img_item.get('url') or img_item.get('link') or img_item.get('src')
+                        if url:
+                            images_urls.append(url)
+                    elif isinstance(img_item, str):
+                        images_urls.append(img_item)
+            elif isinstance(images_data, dict):
+                # Если Images это словарь, ищем Image внутри
+                if 'Image' in images_data:
+                    img_list = images_data['Image'] if isinstance(images_data['Image'], list) else [images_data['Image']]
+                    for img in img_list:
+                        if isinstance(img, dict):
+                            url = img.get('url') or img.get('link') or img.get('src')
+                            if url:
+                                images_urls.append(url)
+        
+        # Извлекаем опции из ComplLevel, Options, Equipment и т.д.
+        for opt_field in ['ComplLevel', 'Options', 'Equipment', 'Features', 'Option']:
+            opt_value = self._get_nested_value(record, opt_field)
+            if opt_value:
+                if isinstance(opt_value, str) and opt_value.strip():
+                    # Если это строка, разбиваем по разделителям
+                    options_list.extend([opt.strip() for opt in opt_value.split(',') if opt.strip()])
+                elif isinstance(opt_value, list):
+                    for opt in opt_value:
+                        if isinstance(opt, str):
+                            options_list.append(opt.strip())
+                        elif isinstance(opt, dict):
+                            desc = opt.get('description') or opt.get('name') or opt.get('text')
+                            if desc:
+                                options_list.append(str(desc).strip())
+        
+        # Применяем сопоставление полей (исключая поля для фотографий и опций)
+        for source_field, field_name, target_field in compiled_mapping:
+            value = self._get_nested_value(record, source_field)
+            
+            # Если значение не найдено по полному пути, пробуем найти только по имени поля
+            if value is None and field_name != source_field:
+                value = self._get_nested_value(record, field_name)
+            
+            # Если все еще не найдено, пробуем найти по имени поля без учета регистра
+            if (value is None or value == "") and field_name.lower() in lower_keys:
+                value = lower_keys[field_name.lower()]
+            
+            if value is not None and value != "":
+                # Преобразуем списки в строки
+                if isinstance(value, list):
+                    if value:  # Проверяем, что список не пустой
+                        value = ", ".join(str(v) for v in value if v)
+                    else:
+                        continue  # Пропускаем пустые списки
+                
+                # Преобразуем числовые значения
+                if target_field in self.INTEGER_FIELDS:
+                    try:
+                        # Убираем пробелы и запятые, заменяем запятую на точку
+                        if isinstance(value, str):
+                            value_clean = value.replace(' ', '').replace(',', '.')
+                            if '.' in value_clean:
+                                value = int(float(value_clean))
+                            else:
+                                value = int(value_clean)
+                    except (ValueError, TypeError):
+                        pass  # Оставляем как есть, если не удалось преобразовать
+                
+                car_data[target_field] = str(value) if not isinstance(value, (int, float)) else value
+        
+        # Обрабатываем Kilometrage -> mileage (специальная обработка только для подержанных)
+        # Для новых автомобилей mileage не используется
+        if car_type == "used":
+            kilometrage_value = self._get_nested_value(record, 'Kilometrage')
+            if kilometrage_value is not None and 'mileage' not in car_data:
+                try:
+                    if isinstance(kilometrage_value, str):
+                        kilometrage_clean = kilometrage_value.replace(' ', '').replace(',', '.')
+                        car_data['mileage'] = int(float(kilometrage_clean)) if '.' in kilometrage_clean else int(kilometrage_clean)
+                    else:
+                        car_data['mileage'] = int(kilometrage_value)
+                except (ValueError, TypeError):
+                    pass
+        
+        if car_type == "new":
+            # Удаляем поле mileage из car_data, так как оно не существует в ImportCar
+            car_data.pop('mileage', None)
+        elif car_type != "used":
+            raise ValueError(f"Неизвестный тип автомобиля: {car_type}")
+        
+        # Поля, которых нет в таблице импорта, раньше давали ошибку конструктора ORM-модели
+        model_cls = ImportCar if car_type == "new" else ImportUsedCar
+        unknown_fields = set(car_data) - set(model_cls.__table__.columns.keys())
+        if unknown_fields:
+            raise TypeError(f"{', '.join(sorted(unknown_fields))} - недопустимые поля для {model_cls.__name__}")
+        
+        car_data["import_status"] = "imported"
+        car_data["import_source"] = f"file_{idx}"
+        return car_data, images_urls, options_list
+    
+    def _flush_import_batch(self, batch: List[tuple], car_type: str,
+                            stats: Dict[str, int], add_error: Callable[[str], None]):
+        """
+        Вставляет пачку записей одной транзакцией
+        
+        Если пачка не прошла (например, значение не подходит по типу колонки),
+        записи вставляются по одной, чтобы отбросить только ошибочные.
+        """
+        try:
+            counts = self._insert_import_rows(batch, car_type)
+            self.db.commit()
+            self._add_batch_counts(stats, car_type, counts)
+            return
+        except Exception as e:
+            self.db.rollback()
+            logger.warning(f"Пачка импорта из {len(batch)} записей не сохранена ({e}), сохраняем по одной")
+        
+        for item in batch:
+            try:
+                counts = self._insert_import_rows([item], car_type)
+                self.db.commit()
+                self._add_batch_counts(stats, car_type, counts)
+            except Exception as e:
+                self.db.rollback()
+                add_error(f"Ошибка при импорте записи {item[0] + 1}: {str(e)}")
+    
+    @staticmethod
+    def _add_batch_counts(stats: Dict[str, int], car_type: str, counts: Tuple[int, int, int]):
+        cars, pictures, options = counts
+        stats["imported_cars" if car_type == "new" else "imported_used_cars"] += cars
+        stats["imported_pictures"] += pictures
+        stats["imported_options"] += options
+    
+    def _insert_import_rows(self, batch: List[tuple], car_type: str) -> Tuple[int, int, int]:
+        """Многострочные INSERT автомобилей, фотографий и опций пачки (без коммита)"""
+        if car_type == "new":
+            model_cls, picture_cls, picture_fk = ImportCar, ImportCarPicture, "car_id"
+        else:
+            model_cls, picture_cls, picture_fk = ImportUsedCar, ImportUsedCarPicture, "used_car_id"
+        
+        # Единый набор колонок: отсутствующие в записи поля - NULL, как у ORM-объекта
+        columns = set()
+        for _, car_data, _, _ in batch:
+            columns.update(car_data)
+        rows = [{**dict.fromkeys(columns), **car_data} for _, car_data, _, _ in batch]
+        
+        ids = self.db.execute(
+            insert(model_cls).returning(model_cls.id, sort_by_parameter_order=True),
+            rows
+        ).scalars().all()
+        
+        pictures = []
+        options = []
+        options_skipped = 0
+        for car_id, (_, _, images_urls, options_list) in zip(ids, batch):
+            # Обрабатываем фотографии из извлеченных URLs
+            for pic_idx, url in enumerate(images_urls):
+                if url and url.strip():
+                    pictures.append({picture_fk: car_id, "url": url.strip(), "seqno": pic_idx, "type": None})
+            
+            # Обрабатываем опции из извлеченного списка
+            # Примечание: ImportCarOption использует ForeignKey на import_cars.id,
+            # поэтому опции сохраняются только для новых автомобилей
+            # TODO: Добавить поддержку опций для подержанных автомобилей
+            if car_type == "new":
+                for opt_desc in options_list:
+                    if opt_desc and opt_desc.strip():
+                        options.append({"car_id": car_id, "code": None, "description": opt_desc.strip()})
+            else:
+                options_skipped += len(options_list)
+        
+        if pictures:
+            self.db.execute(insert(picture_cls), pictures)
+        if options:
+            self.db.execute(insert(ImportCarOption), options)
+        if options_skipped:
+            logger.warning(f"Опции для подержанных автомобилей не поддерживаются в текущей структуре БД. Найдено опций: {options_skipped}")
+        
+        return len(ids), len(pictures), len(options)
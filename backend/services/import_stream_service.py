@@ -0,0 +1,326 @@
+"""
+Потоковое чтение записей из файлов импорта (XML DealerCenter/Ads, JSON)
+
+Файл не загружается в память целиком: XML разбирается через iterparse, и каждая
+запись (CarOrder, Ad или дочерний элемент корня) удаляется из дерева сразу после
+преобразования в словарь. JSON читается кусками, элементы массива декодируются
+по одному. В памяти одновременно находится только текущая запись и буфер чтения.
+"""
+import codecs
+import json
+import xml.etree.ElementTree as ET
+from typing import Any, BinaryIO, Dict, Iterator, Optional
+
+from app.core.config import settings
+
+# Корень XML -> тег записи
+XML_RECORD_TAGS = {
+    "Ads": "Ad",  # Подержанные автомобили
+    "DealerCenter": "CarOrder",  # Новые автомобили
+}
+
+# Символы, которыми может продолжаться число JSON
+_NUMBER_CHARS = frozenset("0123456789.eE+-")
+
+# Служебные элементы DealerCenter, которые не являются записями
+_DEALER_CENTER_SERVICE_TAGS = {"picture_path", "pictures_real"}
+
+
+def xml_element_to_dict(element: ET.Element) -> Dict[str, Any]:
+    """Конвертирует XML элемент в словарь"""
+    result = {}
+
+    # Добавляем атрибуты
+    for key, value in element.attrib.items():
+        result[key] = value
+
+    # Добавляем дочерние элементы
+    for child in element:
+        if len(child) == 0:  # Нет дочерних элементов
+            # Обработка специальных элементов
+            if child.tag == 'Image' and 'url' in child.attrib:
+                # Для изображений
+                if 'Images' not in result:
+                    result['Images'] = []
+                result['Images'].append({'url': child.attrib['url']})
+            elif child.tag == 'Images':
+                # Контейнер для изображений
+                if 'Images' not in result:
+                    result['Images'] = []
+                # Ищем все Image элементы внутри Images
+                for img in child.findall('Image'):
+                    if 'url' in img.attrib:
+                        result['Images'].append({'url': img.attrib['url']})
+                # Также проверяем, есть ли Image как дочерний элемент напрямую
+                for img_child in child:
+                    if img_child.tag == 'Image' and 'url' in img_child.attrib:
+                        result['Images'].append({'url': img_child.attrib['url']})
+            else:
+                # Обычные элементы - берем текст содержимого
+                text_value = child.text.strip() if child.text and child.text.strip() else ""
+                # Если текст пустой, но есть атрибуты, берем атрибут 'value' или первый атрибут
+                if not text_value and child.attrib:
+                    # Пробуем взять значение из атрибута value, если есть
+                    text_value = child.attrib.get('value') or child.attrib.get('Value') or ""
+                    # Если все еще пусто, берем первый атрибут (кроме Title, Code)
+                    if not text_value:
+                        for key, val in child.attrib.items():
+                            if key.lower() not in ['title', 'code', 'name']:
+                                text_value = val
+                                break
+
+                # Если несколько элементов с одним тегом - создаем список
+                if child.tag in result:
+                    if not isinstance(result[child.tag], list):
+                        result[child.tag] = [result[child.tag]]
+                    result[child.tag].append(text_value)
+                else:
+                    result[child.tag] = text_value
+        else:
+            # Есть дочерние элементы - рекурсивно обрабатываем
+            child_dict = xml_element_to_dict(child)
+            if child.tag in result:
+                if not isinstance(result[child.tag], list):
+                    result[child.tag] = [result[child.tag]]
+                result[child.tag].append(child_dict)
+            else:
+                result[child.tag] = child_dict
+
+    # Добавляем текст элемента, если он есть и нет дочерних элементов
+    if element.text and element.text.strip():
+        text_value = element.text.strip()
+        if not result:
+            return text_value
+        result["_text"] = text_value
+
+    return result
+
+
+class ImportRecordStream:
+    """
+    Итератор записей файла импорта
+
+    root_key заполняется по мере чтения (тег записи XML или путь к массиву JSON),
+    bytes_read - сколько байт файла прочитано (для отчета о прогрессе).
+    """
+
+    def __init__(self, file_obj: BinaryIO, file_type: str, chunk_size: Optional[int] = None):
+        """
+        Args:
+            file_obj: Бинарный файловый объект (UploadFile.file, open(..., 'rb'), BytesIO)
+            file_type: "xml" или "json"
+            chunk_size: Размер блока чтения в байтах
+        """
+        file_type = file_type.lower()
+        if file_type not in ("xml", "json"):
+            raise ValueError(f"Неподдерживаемый тип файла: {file_type}")
+        self.file_obj = file_obj
+        self.file_type = file_type
+        self.chunk_size = chunk_size or settings.import_stream_chunk_bytes
+        self.root_key = ""
+        self.bytes_read = 0
+
+    def __iter__(self) -> Iterator[Any]:
+        if self.file_type == "xml":
+            return self._iter_xml()
+        return self._iter_json()
+
+    def _read(self, size: int = -1) -> bytes:
+        data = self.file_obj.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    # ------------------------------------------------------------------
+    # XML
+    # ------------------------------------------------------------------
+
+    def _iter_xml(self) -> Iterator[Any]:
+        """
+        Записи XML через iterparse
+
+        Ads -> элементы Ad, DealerCenter -> элементы CarOrder на любой глубине,
+        другие корни -> дочерние элементы корня (каждый - отдельная запись).
+        """
+        stack = []
+        record_tag = None
+        record_depth = None  # Глубина текущей записи в стеке
+        yielded = 0
+
+        for event, elem in ET.iterparse(_CountingReader(self), events=("start", "end")):
+            if event == "start":
+                if not stack:
+                    record_tag = XML_RECORD_TAGS.get(elem.tag)
+                    self.root_key = record_tag or elem.tag
+                stack.append(elem)
+                if record_depth is None and (elem.tag == record_tag if record_tag else len(stack) == 2):
+                    record_depth = len(stack)
+                continue
+
+            depth = len(stack)
+            stack.pop()
+            if depth == record_depth:
+                record_depth = None
+                if not record_tag and not yielded:
+                    self.root_key = elem.tag
+                yield xml_element_to_dict(elem)
+                yielded += 1
+                # Освобождаем память: запись больше не нужна дереву
+                elem.clear()
+                if stack:
+                    stack[-1].remove(elem)
+            elif not stack and not yielded:
+                # Конец документа без записей - поведение parse_xml_file
+                yield from self._xml_fallback_records(elem)
+
+    def _xml_fallback_records(self, root: ET.Element) -> Iterator[Any]:
+        if root.tag == "Ads":
+            # Объявлений нет - записей нет
+            return
+        if root.tag == "DealerCenter":
+            self.root_key = root.tag
+            children = [child for child in root if child.tag not in _DEALER_CENTER_SERVICE_TAGS]
+            for child in children:
+                yield xml_element_to_dict(child)
+            if children:
+                return
+        yield xml_element_to_dict(root)
+
+    # ------------------------------------------------------------------
+    # JSON
+    # ------------------------------------------------------------------
+
+    def _iter_json(self) -> Iterator[Any]:
+        """
+        Записи JSON: элементы массива верхнего уровня или первого массива
+        в объекте (как parse_json_file); иначе весь объект - одна запись
+        """
+        reader = _JsonReader(self._read, self.chunk_size)
+        first = reader.peek()
+        if first == "[":
+            yield from reader.iter_array()
+            return
+        if first != "{":
+            yield reader.decode_value()
+            return
+
+        # Объект: ищем первый массив на первом или втором уровне
+        scanned: Dict[str, Any] = {}
+        for key in reader.iter_object_keys():
+            value_start = reader.peek()
+            if value_start == "[":
+                self.root_key = key
+                yield from reader.iter_array()
+                return
+            if value_start == "{":
+                nested: Dict[str, Any] = {}
+                for sub_key in reader.iter_object_keys():
+                    if reader.peek() == "[":
+                        self.root_key = f"{key}.{sub_key}"
+                        yield from reader.iter_array()
+                        return
+                    nested[sub_key] = reader.decode_value()
+                scanned[key] = nested
+            else:
+                scanned[key] = reader.decode_value()
+
+        # Массива нет - весь объект как одна запись
+        yield scanned
+
+
+class _CountingReader:
+    """Файловый объект для iterparse, считающий прочитанные байты"""
+
+    def __init__(self, stream: ImportRecordStream):
+        self.stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        return self.stream._read(size if size and size > 0 else self.stream.chunk_size)
+
+
+class _JsonReader:
+    """Инкрементальный разбор JSON поверх блочного чтения"""
+
+    def __init__(self, read, chunk_size: int):
+        self._read = read
+        self.chunk_size = chunk_size
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._json = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        """Дочитывает блок в буфер; False - файл закончился"""
+        if self.eof:
+            return False
+        chunk = self._read(self.chunk_size)
+        if not chunk:
+            self.buffer += self._decoder.decode(b"", final=True)
+            self.eof = True
+            return False
+        # Отбрасываем уже разобранную часть, чтобы буфер не рос
+        self.buffer = self.buffer[self.pos:] + self._decoder.decode(chunk)
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Следующий значимый символ (пустая строка - конец файла)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Ошибка парсинга JSON: ожидался один из символов {chars!r}, получено {char!r}")
+        self.pos += 1
+        return char
+
+    def decode_value(self) -> Any:
+        """Декодирует одно значение, дочитывая файл, пока значение не будет полным"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self.buffer, self.pos)
+                # Число на границе блока могло оборваться - проверяем на следующем блоке
+                if self.eof or not self._may_continue_number(value, end):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            if not self._fill():
+                value, self.pos = self._json.raw_decode(self.buffer, self.pos)
+                return value
+
+    def _may_continue_number(self, value: Any, end: int) -> bool:
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return False
+        return all(char in _NUMBER_CHARS for char in self.buffer[end:])
+
+    def iter_array(self) -> Iterator[Any]:
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.decode_value()
+            if self.expect(",]") == "]":
+                return
+
+    def iter_object_keys(self) -> Iterator[str]:
+        """Ключи объекта; значение каждого ключа должен прочитать вызывающий код"""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.decode_value()
+            self.expect(":")
+            yield key
+            if self.expect(",}") == "}":
+                return
@@ -0,0 +1,194 @@
+"""
+Общий пул NLP-моделей процесса (spaCy NER и анализ тональности transformers)
+
+Раньше каждый AIParser загружал spaCy в конструкторе, а DistilBERT - в отдельном
+потоке при первом анализе, и оба обрабатывали тексты по одному. Пул:
+- загружает каждую модель один раз на процесс, при первом использовании;
+  запуски парсера и запросы API используют одни и те же модели;
+- в spaCy оставляет только NER (и tok2vec, от которого он зависит) - тэггер,
+  парсер зависимостей, лемматизатор и т.д. для извлечения сущностей не нужны;
+- прогоняет тексты пачками через nlp.pipe и пачечный инференс transformers;
+- кэширует сущности по тексту: текст страницы и кандидаты цены разбираются
+  повторно (кандидаты - сначала одной пачкой, затем по одному из кэша).
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+
+try:
+    import spacy
+    SPACY_AVAILABLE = True
+except ImportError:
+    spacy = None
+    SPACY_AVAILABLE = False
+
+try:
+    import transformers  # noqa: F401
+    TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    TRANSFORMERS_AVAILABLE = False
+
+# Модели spaCy в порядке предпочтения
+SPACY_MODEL_NAMES = ["ru_core_news_md", "ru_core_news_sm", "xx_ent_wiki_sm"]
+# Компоненты, нужные для NER; остальные отключаются
+SPACY_NER_COMPONENTS = ("tok2vec", "ner")
+SENTIMENT_MODEL_NAME = "distilbert/distilbert-base-uncased-finetuned-sst-2-english"
+SENTIMENT_MAX_CHARS = 512
+
+# Сущность: (метка, текст)
+Entity = Tuple[str, str]
+
+
+class NlpModelPool:
+    """Модели загружаются лениво и один раз; методы потокобезопасны"""
+
+    def __init__(self, batch_size: int = 32, cache_size: int = 2048):
+        self.batch_size = max(1, batch_size)
+        self.cache_size = max(0, cache_size)
+
+        self._nlp = None
+        self._nlp_loaded = False
+        self._nlp_lock = threading.Lock()
+
+        self._sentiment = None
+        self._sentiment_loading = False
+        self._sentiment_failed = False
+        self._sentiment_lock = threading.Lock()
+
+        self._entity_cache: "OrderedDict[str, List[Entity]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    # ---------- spaCy ----------
+
+    def get_nlp(self):
+        """spaCy-пайплайн только с NER или None, если spaCy/модели нет"""
+        if not self._nlp_loaded:
+            with self._nlp_lock:
+                if not self._nlp_loaded:
+                    self._nlp = self._load_nlp()
+                    self._nlp_loaded = True
+        return self._nlp
+
+    def _load_nlp(self):
+        if not SPACY_AVAILABLE:
+            print("⚠️ spaCy не установлен. NLP функции будут ограничены.")
+            return None
+        for model_name in SPACY_MODEL_NAMES:
+            try:
+                nlp = spacy.load(model_name)
+            except OSError:
+                continue
+            disabled = [name for name in nlp.pipe_names if name not in SPACY_NER_COMPONENTS]
+            if disabled:
+                nlp.select_pipes(disable=disabled)
+            print(f"✅ Загружена NLP модель: {model_name} (компоненты: {', '.join(nlp.pipe_names)})")
+            return nlp
+        print("⚠️ Не удалось загрузить NLP модель. Используется базовое извлечение.")
+        return None
+
+    def extract_entities(self, texts: Sequence[str]) -> List[List[Entity]]:
+        """Сущности для каждого текста; некэшированные тексты идут одной пачкой через nlp.pipe"""
+        results: List[Optional[List[Entity]]] = [None] * len(texts)
+        nlp = self.get_nlp()
+        if nlp is None:
+            return [[] for _ in texts]
+
+        missing: Dict[str, List[int]] = {}
+        with self._cache_lock:
+            for i, text in enumerate(texts):
+                if not text:
+                    results[i] = []
+                elif text in self._entity_cache:
+                    self._entity_cache.move_to_end(text)
+                    results[i] = self._entity_cache[text]
+                else:
+                    missing.setdefault(text, []).append(i)
+
+        if missing:
+            pending = list(missing)
+            for text, doc in zip(pending, nlp.pipe(pending, batch_size=self.batch_size)):
+                entities = [(ent.label_.upper(), ent.text.strip()) for ent in doc.ents]
+                for i in missing[text]:
+                    results[i] = entities
+                self._remember(text, entities)
+        return results
+
+    def _remember(self, text: str, entities: List[Entity]) -> None:
+        if not self.cache_size:
+            return
+        with self._cache_lock:
+            self._entity_cache[text] = entities
+            self._entity_cache.move_to_end(text)
+            while len(self._entity_cache) > self.cache_size:
+                self._entity_cache.popitem(last=False)
+
+    # ---------- Тональность ----------
+
+    def get_sentiment_analyzer(self, wait: bool = False):
+        """
+        Пайплайн тональности или None
+
+        Без wait первая загрузка идет в фоне, а вызывающий получает None, пока модель
+        не загрузится: анализ тональности для парсинга не обязателен.
+        """
+        if self._sentiment is not None or self._sentiment_failed or not TRANSFORMERS_AVAILABLE:
+            return self._sentiment
+        with self._sentiment_lock:
+            if self._sentiment is None and not self._sentiment_loading and not self._sentiment_failed:
+                self._sentiment_loading = True
+                if wait:
+                    self._load_sentiment()
+                else:
+                    threading.Thread(target=self._load_sentiment, daemon=True).start()
+        return self._sentiment
+
+    def _load_sentiment(self) -> None:
+        try:
+            os.environ.setdefault('HF_HUB_DOWNLOAD_TIMEOUT', '60')
+            os.environ.setdefault('HF_HUB_CACHE', os.path.expanduser('~/.cache/huggingface'))
+            from transformers import pipeline
+
+            self._sentiment = pipeline("text-classification", model=SENTIMENT_MODEL_NAME, device=-1)
+            print("✅ Загружен анализатор тональности DistilBERT")
+        except Exception as e:
+            # Не критично - парсер работает с эвристикой
+            print(f"⚠️ Не удалось загрузить анализатор тональности: {e}")
+            self._sentiment_failed = True
+        finally:
+            self._sentiment_loading = False
+
+    def analyze_sentiment(self, texts: Sequence[str]) -> List[Optional[Dict[str, Any]]]:
+        """Метка и вероятность для каждого текста (None, если модель еще не готова)"""
+        analyzer = self.get_sentiment_analyzer()
+        if analyzer is None or not texts:
+            return [None] * len(texts)
+        prepared = [(text or "")[:SENTIMENT_MAX_CHARS] for text in texts]
+        results: List[Optional[Dict[str, Any]]] = []
+        try:
+            for i in range(0, len(prepared), self.batch_size):
+                batch = prepared[i:i + self.batch_size]
+                batch_result = analyzer(batch, batch_size=len(batch), truncation=True)
+                results.extend(
+                    {"label": item.get("label", "N/A"), "score": item.get("score", 0.0)} for item in batch_result
+                )
+            return results
+        except Exception as e:
+            print(f"⚠️ Ошибка ML анализа тональности: {e}")
+            return [None] * len(texts)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "spacy_loaded": self._nlp is not None,
+            "spacy_components": list(self._nlp.pipe_names) if self._nlp is not None else [],
+            "sentiment_loaded": self._sentiment is not None,
+            "entity_cache_size": len(self._entity_cache),
+        }
+
+
+nlp_model_pool = NlpModelPool(
+    batch_size=settings.parser_nlp_batch_size,
+    cache_size=settings.parser_nlp_cache_size,
+)
@@ -0,0 +1,353 @@
+"""
+Шаблоны извлечения данных по структуре страницы (для AIParser)
+
+Страницы автомобилей одного сайта построены на нескольких шаблонах. Полное
+извлечение (эвристики, NLP, Ollama) нужно только для новой разметки:
+
+1. Отпечаток страницы - хеш набора пар "родитель > элемент" (тег + стабильные
+   классы) без текста и повторов: страницы одного шаблона с разными данными
+   и разным числом фото/опций дают одинаковый отпечаток.
+2. После полного извлечения для каждого поля ищется элемент, текст которого
+   после нормализации (число, цена, первое слово заголовка и т.д.) совпадает с
+   извлеченным значением, и для него строится CSS-селектор.
+3. Правила проверяются на следующих страницах того же отпечатка: несовпавшие
+   отбрасываются. После parser_template_min_samples подтверждений шаблон
+   применяется напрямую - без эвристик и LLM.
+4. Если шаблон не дал поле, которое было на всех изученных страницах, это
+   промах: страница разбирается полностью, а после parser_template_max_misses
+   промахов подряд шаблон переучивается.
+
+Шаблоны хранятся в таблице page_layout_templates и переживают перезапуск.
+"""
+import hashlib
+import json
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+from bs4 import BeautifulSoup, Tag
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from models.database import PageLayoutTemplate
+
+# Поля, для которых изучаются селекторы
+TEMPLATE_FIELDS = [
+    "mark", "model", "city", "price", "manufacture_year", "body_type", "fuel_type",
+    "gear_box_type", "driving_gear_type", "engine_vol", "power", "color", "mileage",
+]
+
+# Элементы без видимой структуры данных
+SKIP_TAGS = {"script", "style", "noscript", "svg", "path", "meta", "link", "br", "template"}
+MAX_ELEMENT_TEXT = 300
+
+# Основы названий городов в адресах автосалонов (используются и AIParser)
+CITY_NAME_STEMS = ['москв', 'ростов', 'спб', 'питер', 'казан', 'нижн', 'новосиб', 'екатерин']
+
+_STABLE_NAME = re.compile(r'^[A-Za-z_][\w-]*$')
+_NUMBER_GROUP = re.compile(r'\d[\d\s]*')
+
+
+def _is_stable_class(name: str) -> bool:
+    """Классы с длинными числами (css-1a2b3c4, id записи) от страницы к странице меняются"""
+    return bool(_STABLE_NAME.match(name)) and not re.search(r'\d{3,}', name)
+
+
+def _signature(element: Tag) -> str:
+    classes = sorted(c for c in element.get("class", []) if _is_stable_class(c))
+    return element.name + "".join(f".{c}" for c in classes)
+
+
+def layout_fingerprint(soup: BeautifulSoup) -> str:
+    """Отпечаток структуры DOM страницы (без текста и повторяющихся элементов)"""
+    root = soup.body or soup
+    signatures = set()
+    for element in root.find_all(True):
+        if element.name in SKIP_TAGS:
+            continue
+        parent = element.parent
+        parent_signature = _signature(parent) if isinstance(parent, Tag) else ""
+        signatures.add(f"{parent_signature}>{_signature(element)}")
+    return hashlib.sha256("\n".join(sorted(signatures)).encode("utf-8")).hexdigest()
+
+
+def css_selector(element: Tag) -> str:
+    """CSS-путь к элементу: до стабильного id или до body, с :nth-of-type при одноименных соседях"""
+    parts = []
+    node = element
+    while isinstance(node, Tag) and node.name not in ("[document]", "html", "body"):
+        node_id = node.get("id")
+        if node_id and _STABLE_NAME.match(node_id) and not re.search(r'\d', node_id):
+            parts.append(f"{node.name}#{node_id}")
+            break
+        part = node.name + "".join(f".{c}" for c in node.get("class", []) if _is_stable_class(c))
+        parent = node.parent
+        if isinstance(parent, Tag):
+            siblings = parent.find_all(node.name, recursive=False)
+            if len(siblings) > 1:
+                part += f":nth-of-type({siblings.index(node) + 1})"
+        parts.append(part)
+        node = parent
+    else:
+        if isinstance(node, Tag) and node.name == "body":
+            parts.append("body")
+    return " > ".join(reversed(parts))
+
+
+# ---------- Нормализация текста элемента к значению поля ----------
+# Форматы совпадают с тем, что выдает полное извлечение AIParser
+
+def _text(element: Tag) -> Optional[str]:
+    value = re.sub(r'[,;]\s*$', '', element.get_text(strip=True)).strip()
+    return value or None
+
+
+def _text_spaced(element: Tag) -> Optional[str]:
+    value = re.sub(r'\s+', ' ', element.get_text(" ", strip=True)).strip()
+    return value or None
+
+
+def _int(element: Tag) -> Optional[int]:
+    numbers = re.findall(r'\d+', element.get_text(strip=True).replace(' ', ''))
+    return int(numbers[0]) if numbers else None
+
+
+def _number_text(element: Tag) -> Optional[str]:
+    number = _int(element)
+    return str(number) if number is not None else None
+
+
+def _price(element: Tag) -> Optional[str]:
+    match = _NUMBER_GROUP.search(element.get_text(" ", strip=True))
+    if not match:
+        return None
+    digits = re.sub(r'\D', '', match.group(0))
+    if not digits:
+        return None
+    value = int(digits)
+    return (f"{value:,}".replace(',', ' ') if value >= 1000 else str(value)) + ' р.'
+
+
+def _city(element: Tag) -> Optional[str]:
+    """Как в AIParser: слово с названием известного города, иначе весь адрес"""
+    text = element.get_text(strip=True)
+    for part in text.split():
+        if len(part) > 3 and not part[0].isdigit() and any(stem in part.lower() for stem in CITY_NAME_STEMS):
+            return re.sub(r'[,;]\s*$', '', part).strip() or None
+    return _text(element)
+
+
+def _title_words(element: Tag) -> List[str]:
+    return [word for word in _text_spaced(element).split() if len(word) > 1] if _text_spaced(element) else []
+
+
+def _first_word(element: Tag) -> Optional[str]:
+    words = _title_words(element)
+    return words[0] if words else None
+
+
+def _rest_words(element: Tag) -> Optional[str]:
+    words = _title_words(element)
+    return " ".join(words[1:4]) if len(words) >= 2 else None
+
+
+NORMALIZERS: Dict[str, Callable[[Tag], Any]] = {
+    "text": _text,
+    "text_spaced": _text_spaced,
+    "int": _int,
+    "number_text": _number_text,
+    "price": _price,
+    "city": _city,
+    "first_word": _first_word,
+    "rest_words": _rest_words,
+}
+
+FIELD_NORMALIZERS: Dict[str, List[str]] = {
+    "mark": ["text", "first_word"],
+    "model": ["text", "rest_words"],
+    "price": ["price"],
+    "city": ["city", "text_spaced"],
+    "manufacture_year": ["int"],
+    "mileage": ["int"],
+    "engine_vol": ["int"],
+    "power": ["number_text", "text"],
+}
+DEFAULT_NORMALIZERS = ["text", "text_spaced"]
+
+
+def _present(value: Any) -> bool:
+    return value is not None and value != "" and value != 0
+
+
+def apply_rule(soup: BeautifulSoup, rule: Dict[str, str]) -> Any:
+    """Значение поля по правилу или None"""
+    try:
+        element = soup.select_one(rule["selector"])
+    except Exception:
+        return None
+    if element is None:
+        return None
+    return NORMALIZERS[rule["normalizer"]](element)
+
+
+def learn_rules(soup: BeautifulSoup, values: Dict[str, Any]) -> Dict[str, Dict[str, str]]:
+    """Селекторы для полей, значения которых найдены в тексте отдельных элементов"""
+    root = soup.body or soup
+    elements = []
+    for element in root.find_all(True):
+        if element.name in SKIP_TAGS:
+            continue
+        text = element.get_text(strip=True)
+        if text and len(text) <= MAX_ELEMENT_TEXT:
+            elements.append((len(text), -len(list(element.parents)), element))
+    # Сначала самые "узкие" элементы: короче текст, глубже в дереве
+    elements.sort(key=lambda item: (item[0], item[1]))
+
+    rules = {}
+    for field in TEMPLATE_FIELDS:
+        value = values.get(field)
+        if not _present(value):
+            continue
+        for normalizer in FIELD_NORMALIZERS.get(field, DEFAULT_NORMALIZERS):
+            rule = _find_rule(soup, elements, NORMALIZERS[normalizer], normalizer, value)
+            if rule:
+                rules[field] = rule
+                break
+    return rules
+
+
+def _find_rule(soup: BeautifulSoup, elements: list, normalize: Callable, normalizer: str, value: Any) -> Optional[Dict[str, str]]:
+    for _, _, element in elements:
+        if normalize(element) != value:
+            continue
+        selector = css_selector(element)
+        try:
+            if soup.select_one(selector) is element:
+                return {"selector": selector, "normalizer": normalizer}
+        except Exception:
+            continue
+    return None
+
+
+class PageTemplateStore:
+    """Шаблоны извлечения одного сайта (кэш в памяти + таблица page_layout_templates)"""
+
+    def __init__(self, db: Session, site: str):
+        self.db = db
+        self.site = site.rstrip("/")
+        self._templates: Optional[Dict[str, PageLayoutTemplate]] = None
+
+    def _load(self) -> Dict[str, PageLayoutTemplate]:
+        if self._templates is None:
+            rows = self.db.query(PageLayoutTemplate).filter(PageLayoutTemplate.site == self.site).all()
+            self._templates = {row.fingerprint: row for row in rows}
+        return self._templates
+
+    @staticmethod
+    def fingerprint(soup: BeautifulSoup) -> str:
+        return layout_fingerprint(soup)
+
+    @staticmethod
+    def _rules(template: PageLayoutTemplate) -> Dict[str, Any]:
+        try:
+            return json.loads(template.rules or "{}")
+        except Exception:
+            return {}
+
+    def apply(self, fingerprint: str, soup: BeautifulSoup, baseline: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Данные страницы по готовому шаблону или None (шаблона нет или промах)
+
+        baseline - данные, которые парсер извлекает дешево без шаблона (характеристики,
+        фото); значения правил записываются поверх.
+        """
+        template = self._load().get(fingerprint)
+        if template is None or not template.is_ready:
+            return None
+
+        rules = self._rules(template)
+        car_data = dict(baseline)
+        for field, rule in rules.get("fields", {}).items():
+            value = apply_rule(soup, rule)
+            if not _present(value):
+                return self._miss(template, f"правило {field} не сработало")
+            car_data[field] = value
+
+        missing = [field for field in rules.get("expected", []) if not _present(car_data.get(field))]
+        if missing:
+            return self._miss(template, f"нет полей {', '.join(missing)}")
+
+        template.hits = (template.hits or 0) + 1
+        if template.misses:
+            template.misses = 0
+            self._commit()
+        return car_data
+
+    def _miss(self, template: PageLayoutTemplate, reason: str) -> None:
+        template.misses = (template.misses or 0) + 1
+        if template.misses >= settings.parser_template_max_misses:
+            print(f"⚠️ Шаблон разметки {template.fingerprint[:8]} устарел ({reason}), переобучение")
+            template.is_ready = False
+            template.samples = 0
+            template.misses = 0
+            template.rules = json.dumps({"fields": {}, "expected": []})
+        self._commit()
+        return None
+
+    def observe(self, fingerprint: str, soup: BeautifulSoup, car_data: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+        """Учится на результате полного извлечения страницы"""
+        values = {field: car_data.get(field) for field in TEMPLATE_FIELDS}
+        filled = [field for field in TEMPLATE_FIELDS if _present(values[field])]
+        if not filled:
+            return
+
+        templates = self._load()
+        template = templates.get(fingerprint)
+        if template is None:
+            if len(templates) >= settings.parser_template_max_count:
+                return
+            template = PageLayoutTemplate(site=self.site, fingerprint=fingerprint, samples=0, hits=0, misses=0,
+                                          is_ready=False, rules=json.dumps({"fields": {}, "expected": []}))
+            self.db.add(template)
+            templates[fingerprint] = template
+        if template.is_ready:
+            return
+
+        rules = self._rules(template)
+        if not template.samples:
+            fields = learn_rules(soup, values)
+            expected = filled
+        else:
+            # Оставляем только правила, подтвердившиеся на этой странице
+            fields = {
+                field: rule for field, rule in rules.get("fields", {}).items()
+                if apply_rule(soup, rule) == values.get(field)
+            }
+            expected = [field for field in rules.get("expected", []) if field in filled]
+
+        samples = (template.samples or 0) + 1
+        covered = all(field in fields or _present(baseline.get(field)) for field in expected)
+        if samples >= settings.parser_template_min_samples and not covered:
+            # Правила не покрывают данные шаблона - учимся заново с этой страницы
+            fields = learn_rules(soup, values)
+            expected = filled
+            samples = 1
+
+        template.rules = json.dumps({"fields": fields, "expected": expected}, ensure_ascii=False)
+        template.samples = samples
+        template.is_ready = samples >= settings.parser_template_min_samples and bool(fields)
+        if template.is_ready:
+            print(f"✅ Шаблон разметки {fingerprint[:8]} готов: {len(fields)} полей по селекторам")
+        self._commit()
+
+    def flush(self) -> None:
+        """Сохраняет накопленные счетчики попаданий"""
+        if self._templates:
+            self._commit()
+
+    def _commit(self) -> None:
+        try:
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            self._templates = None
+            print(f"⚠️ Ошибка сохранения шаблона разметки: {e}")
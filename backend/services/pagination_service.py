@@ -0,0 +1,267 @@
+"""
+Курсорная (keyset) пагинация и кэш общего количества записей для списков
+
+Вместо OFFSET страница продолжается с последней пары (ключ сортировки, id):
+    WHERE (created_at, id) < (:created_at, :id) ORDER BY created_at DESC, id DESC LIMIT n
+Такой запрос идет по составному индексу и не замедляется на дальних страницах.
+
+Общее количество (total) кэшируется по таблице и набору фильтров. Запись в таблицу
+через ORM-сессию сбрасывает ее кэш после коммита; записи из других процессов
+(импорт, парсер, миграции) ограничены TTL. Для больших таблиц без фильтров
+используется оценка из статистики Postgres (pg_class.reltuples).
+"""
+import base64
+import json
+import threading
+import time
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import event, func, select, text, tuple_
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+
+
+class CursorError(ValueError):
+    """Некорректный или устаревший курсор пагинации"""
+
+
+# ----------------------------------------------------------------------
+# Курсоры
+# ----------------------------------------------------------------------
+
+def encode_cursor(sort_value: Any, row_id: int) -> str:
+    """Курсор из значения ключа сортировки и id последней строки страницы"""
+    if isinstance(sort_value, (datetime, date)):
+        sort_value = sort_value.isoformat()
+    payload = json.dumps([sort_value, row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_column=None) -> Tuple[Any, int]:
+    """Разбирает курсор; значение ключа приводится к типу колонки сортировки"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        row_id = int(row_id)
+        if sort_column is not None and isinstance(sort_value, str):
+            python_type = sort_column.type.python_type
+            if python_type is datetime:
+                sort_value = datetime.fromisoformat(sort_value)
+            elif python_type is date:
+                sort_value = date.fromisoformat(sort_value)
+        return sort_value, row_id
+    except Exception:
+        raise CursorError("Некорректный курсор пагинации")
+
+
+def _keyset_clauses(sort_column, id_column, cursor: Optional[str], descending: bool):
+    """(условие продолжения или None, ORDER BY) для пары (ключ сортировки, id)"""
+    if sort_column is None:
+        order_by = [id_column.desc() if descending else id_column.asc()]
+    elif descending:
+        order_by = [sort_column.desc(), id_column.desc()]
+    else:
+        order_by = [sort_column.asc(), id_column.asc()]
+
+    condition = None
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor, sort_column)
+        if sort_column is None:
+            condition = id_column < row_id if descending else id_column > row_id
+        elif descending:
+            condition = tuple_(sort_column, id_column) < tuple_(sort_value, row_id)
+        else:
+            condition = tuple_(sort_column, id_column) > tuple_(sort_value, row_id)
+    return condition, order_by
+
+
+def _page_with_cursor(rows: list, limit: int, sort_attr: Optional[str]) -> Tuple[list, Optional[str]]:
+    """Отрезает лишнюю строку (limit + 1) и строит курсор следующей страницы"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, sort_attr) if sort_attr else last.id, last.id)
+
+
+def paginate(query, sort_column, id_column, limit: int, skip: int = 0,
+             cursor: Optional[str] = None, descending: bool = True) -> Tuple[list, Optional[str]]:
+    """
+    Страница синхронного Query: по курсору (keyset) или по skip для совместимости
+
+    Args:
+        query: Query с уже примененными фильтрами
+        sort_column: Колонка сортировки (None - только по id)
+        id_column: Первичный ключ (второй ключ сортировки)
+        limit: Размер страницы
+        skip: Смещение, если курсор не передан
+        cursor: Курсор из предыдущей страницы (skip игнорируется)
+        descending: Направление сортировки
+
+    Returns:
+        (строки, курсор следующей страницы или None)
+    """
+    condition, order_by = _keyset_clauses(sort_column, id_column, cursor, descending)
+    if condition is not None:
+        query = query.filter(condition)
+    elif skip:
+        query = query.offset(skip)
+    rows = query.order_by(*order_by).limit(limit + 1).all()
+    return _page_with_cursor(rows, limit, sort_column.key if sort_column is not None else None)
+
+
+async def apaginate(session, statement, sort_column, id_column, limit: int, skip: int = 0,
+                    cursor: Optional[str] = None, descending: bool = True) -> Tuple[list, Optional[str]]:
+    """Асинхронный вариант paginate для select() и AsyncSession"""
+    condition, order_by = _keyset_clauses(sort_column, id_column, cursor, descending)
+    if condition is not None:
+        statement = statement.where(condition)
+    elif skip:
+        statement = statement.offset(skip)
+    result = await session.execute(statement.order_by(*order_by).limit(limit + 1))
+    rows = list(result.scalars().all())
+    return _page_with_cursor(rows, limit, sort_column.key if sort_column is not None else None)
+
+
+# ----------------------------------------------------------------------
+# Кэш количества записей
+# ----------------------------------------------------------------------
+
+def _filters_key(filters: Optional[Dict[str, Any]]) -> tuple:
+    return tuple(sorted((key, repr(value)) for key, value in (filters or {}).items() if value not in (None, "")))
+
+
+def _estimate_table_rows(connection, table_name: str) -> Optional[int]:
+    """Оценка числа строк из статистики Postgres (None - таблица мала или не Postgres)"""
+    if connection.dialect.name != "postgresql":
+        return None
+    try:
+        estimate = connection.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE relname = :table"),
+            {"table": table_name}
+        ).scalar()
+    except Exception:
+        return None
+    if estimate is None or estimate < settings.count_estimate_min_rows:
+        return None
+    return int(estimate)
+
+
+class CountCache:
+    """Кэш total по (таблица, фильтры) с TTL и сбросом при записи в таблицу"""
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[Tuple[str, tuple], Tuple[float, int]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, table_name: str, key: tuple) -> Optional[int]:
+        with self._lock:
+            entry = self._entries.get((table_name, key))
+            if entry and time.monotonic() - entry[0] < self.ttl_seconds:
+                return entry[1]
+        return None
+
+    def set(self, table_name: str, key: tuple, value: int):
+        with self._lock:
+            self._entries[(table_name, key)] = (time.monotonic(), value)
+
+    def get_or_compute(self, table_name: str, key: tuple, compute: Callable[[], int]) -> int:
+        cached = self.get(table_name, key)
+        if cached is not None:
+            return cached
+        value = compute()
+        self.set(table_name, key, value)
+        return value
+
+    def invalidate(self, *table_names: str):
+        """Сбрасывает кэш таблиц (без аргументов - весь кэш)"""
+        with self._lock:
+            if not table_names:
+                self._entries.clear()
+                return
+            for entry_key in [k for k in self._entries if k[0] in table_names]:
+                del self._entries[entry_key]
+
+
+count_cache = CountCache(ttl_seconds=settings.count_cache_ttl_seconds)
+
+
+def cached_count(query, table_name: str, filters: Optional[Dict[str, Any]] = None) -> int:
+    """total для синхронного Query (без ORDER BY/LIMIT) с кэшем"""
+    key = _filters_key(filters)
+
+    def compute() -> int:
+        if not key:
+            estimate = _estimate_table_rows(query.session.connection(), table_name)
+            if estimate is not None:
+                return estimate
+        return query.order_by(None).count()
+
+    return count_cache.get_or_compute(table_name, key, compute)
+
+
+async def acached_count(session, model_cls, conditions: List[Any], filters: Optional[Dict[str, Any]] = None) -> int:
+    """total для AsyncSession с кэшем"""
+    table_name = model_cls.__tablename__
+    key = _filters_key(filters)
+    cached = count_cache.get(table_name, key)
+    if cached is not None:
+        return cached
+
+    value = None
+    if not key:
+        value = await session.run_sync(lambda sync_session: _estimate_table_rows(sync_session.connection(), table_name))
+    if value is None:
+        value = await session.scalar(select(func.count()).select_from(model_cls).where(*conditions)) or 0
+    count_cache.set(table_name, key, value)
+    return value
+
+
+# Сброс кэша после коммита сессии, изменившей таблицы (ORM-объекты и bulk insert/update/delete)
+_TOUCHED_TABLES = "count_cache_touched_tables"
+
+# Подписчики на коммит: callback(set имен измененных таблиц)
+_commit_listeners: List[Callable[[set], None]] = []
+
+
+def register_commit_listener(callback: Callable[[set], None]):
+    """Подписывает callback на коммиты сессий, изменивших таблицы (например, пересчет фасетов)"""
+    if callback not in _commit_listeners:
+        _commit_listeners.append(callback)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed_tables(session, flush_context):
+    touched = session.info.setdefault(_TOUCHED_TABLES, set())
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(instance, "__tablename__", None)
+        if table:
+            touched.add(table)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk_tables(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, "table", None)
+        if table is not None and getattr(table, "name", None):
+            orm_execute_state.session.info.setdefault(_TOUCHED_TABLES, set()).add(table.name)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_tables(session):
+    touched = session.info.pop(_TOUCHED_TABLES, None)
+    if touched:
+        count_cache.invalidate(*touched)
+        for callback in list(_commit_listeners):
+            try:
+                callback(touched)
+            except Exception as e:
+                print(f"⚠️ Ошибка обработчика коммита: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back_tables(session):
+    session.info.pop(_TOUCHED_TABLES, None)
@@ -0,0 +1,212 @@
+"""
+Инкрементальная синхронизация объявлений парсера (parsed_cars)
+
+Режим sync_mode="incremental" вместо очистки таблиц и повторной вставки всех
+объявлений:
+- для каждого разобранного автомобиля считается хеш содержимого (поля,
+  характеристики, фото); неизменившиеся объявления не перезаписываются;
+- новые и изменившиеся объявления пишутся пачками (parser_sync_batch_size)
+  с сопоставлением по source_url;
+- объявления, пропавшие из каталога, помечаются is_active = False (только после
+  полного обхода каталога, без ограничений max_pages/max_cars);
+- каждое изменение записывается в parsed_car_changes (created, updated,
+  reactivated, deactivated) с общим run_id: индексатор поиска и другие
+  потребители читают изменения по курсору id (GET /api/parser/changes).
+
+Каталог во время обхода остается полным - старые данные заменяются по мере
+поступления новых. Фасеты пересчитываются подписчиком на коммит (facet_service).
+"""
+import hashlib
+import json
+import uuid
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import String, and_, exists, insert, select, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from models.database import CrawlFrontierEntry, ParsedCar, ParsedCarChange, ParsedCarPicture
+
+# Поля parsed_cars, которые заполняет парсер
+SYNC_FIELDS = [
+    "mark", "model", "city", "price", "manufacture_year", "body_type", "fuel_type",
+    "gear_box_type", "driving_gear_type", "engine_vol", "power", "color", "mileage",
+]
+
+
+def _truncate(column, value: Any) -> Any:
+    """Строки обрезаются до длины колонки: одно длинное значение не должно ронять пачку"""
+    length = getattr(column.type, "length", None)
+    if isinstance(value, str) and isinstance(column.type, String) and length and len(value) > length:
+        return value[:length]
+    return value
+
+
+def build_row(car_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Значения колонок parsed_cars из данных парсера (как в _save_car: тип автомобиля в characteristics)"""
+    table = ParsedCar.__table__
+    row = {field: _truncate(table.c[field], car_data.get(field)) for field in SYNC_FIELDS}
+    characteristics = dict(car_data.get("characteristics") or {})
+    if car_data.get("car_type"):
+        characteristics["car_type"] = car_data["car_type"]
+    row["characteristics"] = json.dumps(characteristics, ensure_ascii=False) if characteristics else None
+    row["source_url"] = car_data["source_url"]
+    return row
+
+
+def content_hash(row: Dict[str, Any], pictures: List[Dict[str, Any]]) -> str:
+    """Хеш содержимого объявления: поля, характеристики и фото по порядку"""
+    payload = {
+        "fields": {field: row.get(field) for field in SYNC_FIELDS},
+        "characteristics": row.get("characteristics"),
+        "pictures": [picture["image_url"] for picture in sorted(pictures, key=lambda p: p.get("seqno", 0))],
+    }
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class ParsedCarSync:
+    """Буфер разобранных объявлений с пакетной записью изменений"""
+
+    def __init__(self, db: Session, crawl_key: str, batch_size: Optional[int] = None):
+        self.db = db
+        self.crawl_key = crawl_key.rstrip("/")
+        self.batch_size = max(1, batch_size or settings.parser_sync_batch_size)
+        self.run_id = str(uuid.uuid4())
+        self.stats = {"created": 0, "updated": 0, "reactivated": 0, "unchanged": 0, "deactivated": 0, "failed": 0}
+        self._pending: Dict[str, Dict[str, Any]] = {}
+
+    def add(self, car_data: Dict[str, Any]) -> None:
+        """Ставит объявление в очередь записи; пачка пишется при заполнении"""
+        if not car_data.get("source_url"):
+            return
+        self._pending[car_data["source_url"]] = car_data
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Записывает накопленную пачку одной транзакцией (при ошибке - по одному объявлению)"""
+        if not self._pending:
+            return
+        batch = list(self._pending.values())
+        self._pending = {}
+        try:
+            self._write(batch)
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            print(f"⚠️ Ошибка записи пачки объявлений ({len(batch)}), запись по одному: {e}")
+            for car_data in batch:
+                try:
+                    self._write([car_data])
+                    self.db.commit()
+                except Exception as row_error:
+                    self.db.rollback()
+                    self.stats["failed"] += 1
+                    print(f"❌ Объявление не сохранено {car_data.get('source_url')}: {row_error}")
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        table = ParsedCar.__table__
+        prepared = {}
+        for car_data in batch:
+            row = build_row(car_data)
+            pictures = car_data.get("pictures") or []
+            row["content_hash"] = content_hash(row, pictures)
+            prepared[row["source_url"]] = (row, pictures)
+
+        existing = {
+            item.source_url: item
+            for item in self.db.execute(
+                select(table.c.id, table.c.source_url, table.c.content_hash, table.c.is_active)
+                .where(table.c.source_url.in_(list(prepared)))
+            )
+        }
+
+        counts = {"created": 0, "updated": 0, "reactivated": 0, "unchanged": 0}
+        changes = []
+        replace_pictures = {}
+        new_rows = []
+        for url, (row, pictures) in prepared.items():
+            current = existing.get(url)
+            if current is None:
+                new_rows.append((row, pictures))
+                continue
+            if current.content_hash == row["content_hash"]:
+                if current.is_active:
+                    counts["unchanged"] += 1
+                    continue
+                self.db.execute(update(table).where(table.c.id == current.id).values(is_active=True))
+                counts["reactivated"] += 1
+                changes.append(self._change(current.id, url, "reactivated", row["content_hash"]))
+                continue
+            values = {key: value for key, value in row.items() if key != "source_url"}
+            self.db.execute(update(table).where(table.c.id == current.id).values(is_active=True, **values))
+            counts["updated"] += 1
+            changes.append(self._change(current.id, url, "updated", row["content_hash"]))
+            replace_pictures[current.id] = pictures
+
+        if new_rows:
+            ids = self.db.execute(
+                insert(table).returning(table.c.id, table.c.source_url, sort_by_parameter_order=True),
+                [dict(row, is_active=True) for row, _ in new_rows],
+            ).all()
+            for (car_id, url), (row, pictures) in zip(ids, new_rows):
+                counts["created"] += 1
+                changes.append(self._change(car_id, url, "created", row["content_hash"]))
+                replace_pictures[car_id] = pictures
+
+        if replace_pictures:
+            pictures_table = ParsedCarPicture.__table__
+            self.db.execute(pictures_table.delete().where(pictures_table.c.parsed_car_id.in_(list(replace_pictures))))
+            picture_rows = [
+                {"parsed_car_id": car_id, "image_url": picture["image_url"], "seqno": picture.get("seqno", 0)}
+                for car_id, pictures in replace_pictures.items()
+                for picture in pictures
+            ]
+            if picture_rows:
+                self.db.execute(insert(pictures_table), picture_rows)
+
+        if changes:
+            self.db.execute(insert(ParsedCarChange.__table__), changes)
+
+        for key, value in counts.items():
+            self.stats[key] += value
+
+    def _change(self, car_id: int, url: str, change_type: str, row_hash: Optional[str]) -> Dict[str, Any]:
+        return {"run_id": self.run_id, "parsed_car_id": car_id, "source_url": url,
+                "change_type": change_type, "content_hash": row_hash}
+
+    def deactivate_missing(self) -> int:
+        """
+        Помечает неактивными объявления, которых нет в текущем обходе
+
+        Ссылки текущего обхода - записи crawl_frontier этого сайта, найденные на страницах
+        каталога (после CrawlFrontier.start ранее известные URL получают статус idle).
+        Объявления других сайтов (source_url с другим префиксом) не затрагиваются.
+        """
+        self.flush()
+        table = ParsedCar.__table__
+        frontier = CrawlFrontierEntry.__table__
+        seen = exists().where(and_(
+            frontier.c.crawl_key == self.crawl_key,
+            frontier.c.kind == "car",
+            frontier.c.status != "idle",
+            frontier.c.url == table.c.source_url,
+        ))
+        missing = self.db.execute(
+            select(table.c.id, table.c.source_url, table.c.content_hash)
+            .where(table.c.is_active == True, table.c.source_url.startswith(self.crawl_key, autoescape=True), ~seen)
+        ).all()
+        if not missing:
+            return 0
+        ids = [item.id for item in missing]
+        for start in range(0, len(ids), 1000):
+            self.db.execute(update(table).where(table.c.id.in_(ids[start:start + 1000])).values(is_active=False))
+        self.db.execute(insert(ParsedCarChange.__table__), [
+            self._change(item.id, item.source_url, "deactivated", item.content_hash) for item in missing
+        ])
+        self.db.commit()
+        self.stats["deactivated"] += len(missing)
+        return len(missing)
+
+    def summary(self) -> Dict[str, Any]:
+        return {"run_id": self.run_id, **self.stats}
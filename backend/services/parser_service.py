@@ -3,7 +3,6 @@
 """
 import re
 import json
-import time
 import httpx
 from typing import Dict, List, Optional, Any
 from urllib.parse import urljoin, urlparse
@@ -11,6 +10,8 @@ from bs4 import BeautifulSoup
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from models.database import ParsedCar, ParsedCarPicture
+from services.crawl_engine_service import CrawlFrontier, ParserCrawlRunner
+from services.parsed_car_sync_service import ParsedCarSync
 import logging
 
 logger = logging.getLogger(__name__)
@@ -26,9 +27,11 @@ class AAAMotorsParser:
         self.stats = {
             "total_parsed": 0,
             "total_errors": 0,
-            "current_page": 0
+            "current_page": 0,
+            "unchanged_skipped": 0
         }
         self.is_running = False
+        self.sync: Optional[ParsedCarSync] = None  # Инкрементальная синхронизация текущего запуска
         
     def _create_session(self):
         """Создает HTTP сессию с правильными заголовками"""
@@ -66,13 +69,21 @@ class AAAMotorsParser:
         return price_clean.strip() if price_clean.strip() else None
     
     def _parse_car_page(self, url: str) -> Optional[Dict[str, Any]]:
-        """Парсит страницу автомобиля"""
+        """Загружает и парсит страницу автомобиля"""
         try:
             session = self._create_session()
             response = session.get(url)
             response.raise_for_status()
-            
-            soup = BeautifulSoup(response.content, 'html.parser')
+        except Exception as e:
+            logger.error(f"Ошибка загрузки страницы {url}: {e}")
+            self.stats["total_errors"] += 1
+            return None
+        return self._parse_car_html(url, response.content)
+    
+    def _parse_car_html(self, url: str, content: bytes) -> Optional[Dict[str, Any]]:
+        """Парсит загруженную страницу автомобиля"""
+        try:
+            soup = BeautifulSoup(content, 'html.parser')
             
             car_data = {
                 "source_url": url,
@@ -196,13 +207,20 @@ class AAAMotorsParser:
             return None
     
     def _find_car_links(self, page_url: str) -> List[str]:
-        """Находит все ссылки на автомобили на странице каталога"""
+        """Загружает страницу каталога и находит все ссылки на автомобили"""
         try:
             session = self._create_session()
             response = session.get(page_url)
             response.raise_for_status()
-            
-            soup = BeautifulSoup(response.content, 'html.parser')
+        except Exception as e:
+            logger.error(f"Ошибка загрузки страницы {page_url}: {e}")
+            return []
+        return self._extract_car_links(page_url, response.content)
+    
+    def _extract_car_links(self, page_url: str, content: bytes) -> List[str]:
+        """Находит все ссылки на автомобили в загруженной странице каталога"""
+        try:
+            soup = BeautifulSoup(content, 'html.parser')
             car_links = []
             
             # Ищем ссылки на автомобили (специфично для aaa-motors.ru)
@@ -379,6 +397,19 @@ class AAAMotorsParser:
             self.stats["total_errors"] += 1
             return False
     
+    def _process_car_page(self, url: str, content: bytes, index: int, total: int) -> bool:
+        """Разбирает загруженную страницу автомобиля и сохраняет его (вызывается обходчиком)"""
+        logger.info(f"Парсинг автомобиля {index}/{total}: {url}")
+        car_data = self._parse_car_html(url, content)
+        if not car_data:
+            return False
+        if self.sync is not None:
+            # Инкрементальный режим: запись пачками с проверкой хеша содержимого
+            self.sync.add(car_data)
+            self.stats["total_parsed"] += 1
+            return True
+        return self._save_car(car_data)
+    
     def clear_all_data(self) -> int:
         """
         Удаляет ВСЕ данные из таблиц парсинга (включая неактивные)
@@ -391,6 +422,9 @@ class AAAMotorsParser:
             
             logger.info(f"🗑️ Найдено данных для удаления: {cars_count} автомобилей, {pictures_count} фотографий")
             
+            # Очередь обхода и валидаторы (ETag/Last-Modified) без данных не нужны
+            CrawlFrontier(self.db, self.base_url).reset()
+            
             if cars_count == 0 and pictures_count == 0:
                 logger.info("✅ Данных для удаления нет, база уже пуста")
                 return 0
@@ -438,23 +472,33 @@ class AAAMotorsParser:
             logger.error(f"❌ Ошибка при очистке данных: {e}", exc_info=True)
             raise
     
-    def parse(self, max_pages: Optional[int] = None, max_cars: Optional[int] = None, delay: float = 1.0, clear_before: bool = True) -> Dict[str, Any]:
+    def parse(self, max_pages: Optional[int] = None, max_cars: Optional[int] = None, delay: float = 1.0, clear_before: bool = True, incremental: bool = False) -> Dict[str, Any]:
         """
         Запускает парсинг автомобилей
         
         Args:
             max_pages: Максимальное количество страниц каталога для парсинга
             max_cars: Максимальное количество автомобилей для парсинга
-            delay: Задержка между запросами (секунды)
+            delay: Задержка между запросами одного потока обхода (секунды), ограничивает частоту запросов к сайту
             clear_before: Очистить все данные перед парсингом (по умолчанию True)
+            incremental: Инкрементальная синхронизация вместо очистки: неизменившиеся объявления
+                не перезаписываются, пропавшие помечаются неактивными (clear_before игнорируется)
+        
+        Страницы загружаются параллельно (ParserCrawlRunner); очередь обхода хранится в БД,
+        поэтому остановленный парсинг без clear_before продолжается с оставшихся страниц.
         """
         self.is_running = True
         self.stats = {
             "total_parsed": 0,
             "total_errors": 0,
-            "current_page": 0
+            "current_page": 0,
+            "unchanged_skipped": 0
         }
         
+        self.sync = ParsedCarSync(self.db, self.base_url) if incremental else None
+        if incremental:
+            clear_before = False
+        
         try:
             # Очищаем все данные перед парсингом
             if clear_before:
@@ -462,62 +506,35 @@ class AAAMotorsParser:
                 deleted_count = self.clear_all_data()
                 logger.info(f"✅ Удалено {deleted_count} автомобилей перед началом парсинга")
             
-            # Находим страницы каталога
-            catalog_pages = self._find_catalog_pages()
-            if not catalog_pages:
-                logger.warning("Не найдено страниц каталога")
-                return {
-                    "status": "error",
-                    "message": "Не найдено страниц каталога",
-                    **self.stats
-                }
-            
-            # Ограничиваем количество страниц
-            if max_pages:
-                catalog_pages = catalog_pages[:max_pages]
-            
-            all_car_links = []
-            
-            # Собираем все ссылки на автомобили
-            for page_url in catalog_pages:
-                if not self.is_running:
-                    break
-                    
-                self.stats["current_page"] += 1
-                logger.info(f"Парсинг страницы {self.stats['current_page']}: {page_url}")
-                
-                car_links = self._find_car_links(page_url)
-                all_car_links.extend(car_links)
-                
-                # Задержка между запросами
-                if delay > 0:
-                    time.sleep(delay)
-            
-            # Убираем дубликаты
-            unique_car_links = list(set(all_car_links))
-            logger.info(f"Найдено {len(unique_car_links)} уникальных автомобилей")
-            
-            # Ограничиваем количество автомобилей
-            if max_cars:
-                unique_car_links = unique_car_links[:max_cars]
-            
-            # Парсим каждый автомобиль
-            for idx, car_url in enumerate(unique_car_links):
-                if not self.is_running:
-                    break
-                
-                if max_cars and self.stats["total_parsed"] >= max_cars:
-                    break
-                
-                logger.info(f"Парсинг автомобиля {idx + 1}/{len(unique_car_links)}: {car_url}")
-                
-                car_data = self._parse_car_page(car_url)
-                if car_data:
-                    self._save_car(car_data)
+            runner = ParserCrawlRunner(self, delay=delay, headers=dict(self._create_session().headers))
+            
+            # Прерванный обход продолжается с оставшихся URL, иначе - заново со страниц каталога
+            if runner.has_unfinished():
+                logger.info("🔄 Продолжение прерванного обхода")
+            else:
+                catalog_pages = self._find_catalog_pages()
+                if not catalog_pages:
+                    logger.warning("Не найдено страниц каталога")
+                    return {
+                        "status": "error",
+                        "message": "Не найдено страниц каталога",
+                        **self.stats
+                    }
                 
-                # Задержка между запросами
-                if delay > 0 and idx < len(unique_car_links) - 1:
-                    time.sleep(delay)
+                # Ограничиваем количество страниц
+                if max_pages:
+                    catalog_pages = catalog_pages[:max_pages]
+                runner.start(catalog_pages)
+            
+            runner.run(max_cars=max_cars)
+            
+            if self.sync is not None:
+                # Пропавшие объявления снимаются только после полного обхода каталога
+                self.sync.flush()
+                if self.is_running and not max_pages and not max_cars and runner.catalog_complete():
+                    self.sync.deactivate_missing()
+                self.stats["sync"] = self.sync.summary()
+                logger.info(f"🔁 Инкрементальная синхронизация: {self.stats['sync']}")
             
             return {
                 "status": "completed",
@@ -534,6 +551,8 @@ class AAAMotorsParser:
             }
         finally:
             self.is_running = False
+            if self.sync is not None:
+                self.sync.flush()
             if self.session:
                 self.session.close()
                 self.session = None
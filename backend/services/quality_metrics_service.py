@@ -5,14 +5,14 @@ from typing import Dict, Any, List, Optional
 import time
 from datetime import datetime
 import json
-from services.dialog_state_service import _init_redis_client
+from app.core.redis_client import redis_client
 
 
 class QualityMetricsService:
     """Сбор и анализ метрик качества работы системы"""
     
     def __init__(self):
-        self.redis_client = _init_redis_client()
+        self.redis_client = redis_client
         self.metrics_key = "quality:metrics"
         self.interactions_key = "quality:interactions"
     
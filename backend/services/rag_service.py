@@ -3,9 +3,11 @@ import time
 import os
 import re
 from app.core.config import settings
+from services.car_hydration_service import CarHydrator
 from services.database_service import DatabaseService
 from services.document_service import DocumentService
 from services.elasticsearch_service import ElasticsearchService
+from services.embedding_provider_service import embed_texts
 from models.database import Article, Car, UsedCar
 import json
 
@@ -951,18 +953,15 @@ class RAGService:
             try:
                 if getattr(self, 'es_service', None) and self.es_service.is_available():
                     es_result = self.es_service.search_cars(query=q, limit=100)
-                    for hit in es_result.get("hits", []) or []:
-                        src = hit.get('_source') or {}
-                        car_type = src.get('type')
-                        car_id = src.get('id')
-                        if car_type == 'car' and car_id is not None:
-                            car_obj = self.db_service.get_car(car_id)
-                            if car_obj:
-                                collected_cars.setdefault(car_obj.id, car_obj)
-                        elif car_type == 'used_car' and car_id is not None:
-                            used_obj = self.db_service.get_used_car(car_id)
-                            if used_obj:
-                                collected_used_cars.setdefault(used_obj.id, used_obj)
+                    es_hits = [
+                        hit for hit in es_result.get("hits", []) or []
+                        if (hit.get('_source') or {}).get('type') in ('car', 'used_car')
+                    ]
+                    es_cars, es_used_cars = CarHydrator(self.db_service.db).hydrate_hits(es_hits)
+                    for car_obj in es_cars:
+                        collected_cars.setdefault(car_obj.id, car_obj)
+                    for used_obj in es_used_cars:
+                        collected_used_cars.setdefault(used_obj.id, used_obj)
             except Exception as e:
                 print(f"⚠️ Ошибка поиска в Elasticsearch: {e}")
                 pass
@@ -1141,21 +1140,19 @@ class RAGService:
                     existing_car_ids = {car.id for car in context_cars}
                     existing_used_car_ids = {car.id for car in context_used_cars}
                     
+                    new_hits = []
                     for hit in es_results:
                         src = hit.get('_source', {})
                         car_id = src.get('id')
                         car_type = src.get('type')
-                        
                         if car_type == 'car' and car_id and car_id not in existing_car_ids:
-                            car = self.db_service.get_car(car_id)
-                            if car:
-                                context_cars.append(car)
-                                existing_car_ids.add(car_id)
+                            new_hits.append(hit)
                         elif car_type == 'used_car' and car_id and car_id not in existing_used_car_ids:
-                            used_car = self.db_service.get_used_car(car_id)
-                            if used_car:
-                                context_used_cars.append(used_car)
-                                existing_used_car_ids.add(car_id)
+                            new_hits.append(hit)
+                    
+                    es_cars, es_used_cars = CarHydrator(self.db_service.db).hydrate_hits(new_hits)
+                    context_cars.extend(es_cars)
+                    context_used_cars.extend(es_used_cars)
             except Exception as e:
                 print(f"⚠️ Ошибка получения автомобилей из ES: {e}")
         
@@ -1266,13 +1263,13 @@ class RAGService:
                     "year": car.manufacture_year,
                     "mileage": getattr(car, 'mileage', None),
                 })
-            dialog_state.set_last_shown_cars(shown_cars)
-            
-            # Сохраняем результаты поиска
-            dialog_state.save_search_results({
-                "cars": [{"id": c.id, "mark": c.mark, "model": c.model, "price": c.price} for c in relevant_cars],
-                "used_cars": [{"id": c.id, "mark": c.mark, "model": c.model, "price": c.price} for c in relevant_used_cars],
-            })
+            # Показанные автомобили и ID результатов поиска - одной транзакцией
+            with dialog_state.batch():
+                dialog_state.set_last_shown_cars(shown_cars)
+                dialog_state.save_search_results({
+                    "cars": [c.id for c in relevant_cars],
+                    "used_cars": [c.id for c in relevant_used_cars],
+                })
         except Exception as e:
             print(f"⚠️ Ошибка сохранения состояния диалога: {e}")
         
@@ -2243,7 +2240,7 @@ URL: {article.url or 'Не указан'}
     async def _handle_show_results_command(self, user_id: str, query: str, dialog_state) -> Dict[str, Any]:
         """Обрабатывает команду показа результатов"""
         # Получаем сохраненные результаты или выполняем поиск по текущим критериям
-        saved_results = dialog_state.get_search_results()
+        saved_results = dialog_state.get_search_results(self.db_service.db)
         
         if saved_results:
             # Показываем сохраненные результаты
@@ -2899,42 +2896,13 @@ URL: {article.url or 'Не указан'}
         return {"message": "Переиндексация завершена", "total_articles": total, "status": "success"}
 
     def _embed_mistral_batch(self, texts: List[str]) -> List[List[float]]:
-        """Получает эмбеддинги у Mistral для списка текстов"""
-        url = f"{settings.mistral_base_url}/v1/embeddings"
-        headers = {
-            "Authorization": f"Bearer {settings.mistral_api_key}",
-            "Content-Type": "application/json",
-        }
-        vectors: List[List[float]] = []
-        # Mistral API поддерживает батчи; отправим одним запросом, если возможно
-        try:
-            payload = {"model": settings.mistral_embed_model, "input": texts}
-            resp = requests.post(url, headers=headers, json=payload, timeout=120)
-            resp.raise_for_status()
-            data = resp.json() or {}
-            items = data.get("data") or []
-            for item in items:
-                emb = item.get("embedding", [])
-                if len(emb) == 1024:  # Проверяем правильную размерность
-                    vectors.append(emb)
-                else:
-                    vectors.append([0.0] * 1024)  # Fallback с правильной размерностью
-        except Exception:
-            # Фолбэк: попробуем по одному, чтобы вернуть хоть что-то
-            for t in texts:
-                try:
-                    payload = {"model": settings.mistral_embed_model, "input": t}
-                    r = requests.post(url, headers=headers, json=payload, timeout=60)
-                    r.raise_for_status()
-                    dd = r.json() or {}
-                    emb = ((dd.get("data") or [{}])[0]).get("embedding", [])
-                    if len(emb) == 1024:
-                        vectors.append(emb)
-                    else:
-                        vectors.append([0.0] * 1024)
-                except Exception:
-                    vectors.append([0.0] * 1024)  # Fallback с правильной размерностью
-        return vectors
+        """
+        Получает эмбеддинги для списка текстов провайдером из ai_settings.json
+        
+        Повторы и уже известные тексты берутся из кэша, остальные считаются одним батчем.
+        """
+        vectors = embed_texts(texts)
+        return [v if v else [0.0] * 1024 for v in vectors]  # Fallback с правильной размерностью
 
     def _search_semantic(self, query: str, k: int = 5) -> List[Article]:
         # ChromaDB отключена - используем только PostgreSQL
@@ -2943,49 +2911,37 @@ URL: {article.url or 'Не указан'}
     
     def _search_cars_semantic(self, query: str, k: int = 3) -> List[Car]:
         """Поиск новых автомобилей через PostgreSQL и Elasticsearch (ChromaDB отключена)"""
-        results: List[Car] = []
-        
-        # Поиск через PostgreSQL
-        for car in self.db_service.search_cars_for_rag(query, limit=k):
-            results.append(car)
-        
-        # Дополнительный поиск через Elasticsearch
-        if getattr(self, 'es_service', None) and self.es_service.is_available():
-            try:
-                es_result = self.es_service.search_cars(query=query, limit=k)
-                for hit in es_result.get("hits", []) or []:
-                    src = hit.get('_source') or {}
-                    if src.get('type') == 'car':
-                        car_id = src.get('id')
-                        if car_id:
-                            car = self.db_service.get_car(car_id)
-                            if car and car not in results:
-                                results.append(car)
-            except Exception:
-                pass
-        
-        return results[:k]
+        return self._search_catalog_semantic(query, k, "car")
     
     def _search_used_cars_semantic(self, query: str, k: int = 3) -> List[UsedCar]:
         """Поиск подержанных автомобилей через PostgreSQL и Elasticsearch (ChromaDB отключена)"""
-        results: List[UsedCar] = []
-        
-        # Поиск через PostgreSQL
-        for used_car in self.db_service.search_used_cars_for_rag(query, limit=k):
-            results.append(used_car)
+        return self._search_catalog_semantic(query, k, "used_car")
+    
+    def _search_catalog_semantic(self, query: str, k: int, car_type: str) -> List[Any]:
+        """PostgreSQL + Elasticsearch; хиты ES загружаются одним запросом, дубликаты отбрасываются по id"""
+        if car_type == "car":
+            results = list(self.db_service.search_cars_for_rag(query, limit=k))
+        else:
+            results = list(self.db_service.search_used_cars_for_rag(query, limit=k))
+        seen_ids = {car.id for car in results}
         
         # Дополнительный поиск через Elasticsearch
-        if getattr(self, 'es_service', None) and self.es_service.is_available():
+        if len(results) < k and getattr(self, 'es_service', None) and self.es_service.is_available():
             try:
-                es_result = self.es_service.search_cars(query=query, limit=k, car_type="used_car")
-                for hit in es_result.get("hits", []) or []:
-                    src = hit.get('_source') or {}
-                    if src.get('type') == 'used_car':
-                        car_id = src.get('id')
-                        if car_id:
-                            used_car = self.db_service.get_used_car(car_id)
-                            if used_car and used_car not in results:
-                                results.append(used_car)
+                es_params = {"query": query, "limit": k}
+                if car_type == "used_car":
+                    es_params["car_type"] = "used_car"
+                es_result = self.es_service.search_cars(**es_params)
+                hits = [
+                    hit for hit in es_result.get("hits", []) or []
+                    if (hit.get('_source') or {}).get('type') == car_type
+                    and (hit.get('_source') or {}).get('id') not in seen_ids
+                ]
+                cars, used_cars = CarHydrator(self.db_service.db, with_relations=False).hydrate_hits(hits)
+                for car in (cars if car_type == "car" else used_cars):
+                    if car.id not in seen_ids:
+                        seen_ids.add(car.id)
+                        results.append(car)
             except Exception:
                 pass
         
@@ -2517,6 +2517,27 @@ SQL запрос:"""
         
         return sql
     
+    async def _fetch_rows(self, sql_query: str) -> Tuple[List[str], List[Any]]:
+        """
+        Выполняет SELECT и возвращает (колонки, строки), не блокируя event loop
+        
+        Для основного движка приложения используется асинхронный движок (asyncpg),
+        для прочих (например, SQLite в тестах) - синхронный движок в пуле потоков.
+        """
+        from models import engine as app_engine, async_engine
+        
+        if async_engine is not None and self.engine is app_engine:
+            async with async_engine.connect() as connection:
+                result = await connection.execute(text(sql_query))
+                return list(result.keys()), result.fetchall()
+        
+        def _fetch_sync():
+            with self.engine.connect() as connection:
+                result = connection.execute(text(sql_query))
+                return list(result.keys()), result.fetchall()
+        
+        return await asyncio.to_thread(_fetch_sync)
+    
     async def execute_sql_query(self, sql_query: str, auto_fix: bool = True) -> Dict[str, Any]:
         """
         Безопасное выполнение SQL запроса с автоматическим исправлением UNION ошибок
@@ -2736,48 +2757,41 @@ SQL запрос:"""
                 print(f"🚀 Выполняю SQL запрос (первые 200 символов): {sql_query[:200]}")
                 
                 # Выполняем запрос
-                with self.engine.connect() as connection:
-                    result = connection.execute(text(sql_query))
-                    
-                    # Получаем колонки
-                    columns = list(result.keys())
-                    
-                    # Получаем данные
-                    rows = result.fetchall()
-                    
-                    print(f"✅ SQL запрос выполнен успешно. Найдено строк: {len(rows)}")
-                    
-                    # Преобразуем в список словарей
-                    data = []
-                    for row in rows:
-                        row_dict = {}
-                        for i, col in enumerate(columns):
-                            value = row[i]
-                            # Преобразуем специальные типы в строки
-                            if hasattr(value, 'isoformat'):  # datetime
-                                value = value.isoformat()
-                            row_dict[col] = value
-                        data.append(row_dict)
-                    
-                    # Ограничиваем данные до 5 записей для отправки в AI, но для источников отправляем все (до 500)
-                    limited_data = data[:5]  # Для AI-форматирования
-                    all_data = data[:500]  # Для источников (Search found/Results) - до 500 записей
-                    total_count = len(data)
-                    
-                    if total_count == 0:
-                        print(f"⚠️ SQL запрос вернул 0 результатов")
-                    else:
-                        print(f"✅ SQL запрос вернул {total_count} результатов (для AI: {len(limited_data)}, для источников: {len(all_data)})")
-                    
-                    return {
-                        "success": True,
-                        "data": all_data,  # Все данные для источников (до 500)
-                        "columns": columns,
-                        "row_count": total_count,  # Общее количество записей
-                        "limited_row_count": len(limited_data),  # Количество записей для AI (до 5)
-                        "sql": sql_query
-                    }
-                    
+                columns, rows = await self._fetch_rows(sql_query)
+                
+                print(f"✅ SQL запрос выполнен успешно. Найдено строк: {len(rows)}")
+                
+                # Преобразуем в список словарей
+                data = []
+                for row in rows:
+                    row_dict = {}
+                    for i, col in enumerate(columns):
+                        value = row[i]
+                        # Преобразуем специальные типы в строки
+                        if hasattr(value, 'isoformat'):  # datetime
+                            value = value.isoformat()
+                        row_dict[col] = value
+                    data.append(row_dict)
+                
+                # Ограничиваем данные до 5 записей для отправки в AI, но для источников отправляем все (до 500)
+                limited_data = data[:5]  # Для AI-форматирования
+                all_data = data[:500]  # Для источников (Search found/Results) - до 500 записей
+                total_count = len(data)
+                
+                if total_count == 0:
+                    print(f"⚠️ SQL запрос вернул 0 результатов")
+                else:
+                    print(f"✅ SQL запрос вернул {total_count} результатов (для AI: {len(limited_data)}, для источников: {len(all_data)})")
+                
+                return {
+                    "success": True,
+                    "data": all_data,  # Все данные для источников (до 500)
+                    "columns": columns,
+                    "row_count": total_count,  # Общее количество записей
+                    "limited_row_count": len(limited_data),  # Количество записей для AI (до 5)
+                    "sql": sql_query
+                }
+                
             except SQLAlchemyError as e:
                 error_str = str(e)
                 
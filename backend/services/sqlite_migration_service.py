@@ -0,0 +1,454 @@
+"""
+Потоковый перенос каталога из SQLite cars.db в PostgreSQL
+
+Вместо fetchall() и ORM-объекта на каждую строку:
+
+1. Строки читаются пачками (fetchmany) по возрастанию id; конвертеры колонок
+   строятся один раз на таблицу по типам SQLite и модели, а не вызываются
+   через convert_value с разбором типа на каждое значение.
+2. Пачка загружается через COPY во временную таблицу и INSERT ... SELECT
+   ON CONFLICT (id) DO UPDATE (как прежний db.merge); для других драйверов
+   и диалектов - многострочным INSERT ... ON CONFLICT.
+3. Каждая пачка коммитится вместе с чекпоинтом (catalog_migration_checkpoints),
+   поэтому прерванная миграция того же файла продолжается с последнего id.
+   Если пачка не загрузилась целиком, она повторяется построчно: плохая строка
+   пропускается и попадает в отчет, а не откатывает всю миграцию.
+4. Независимые таблицы (фото, группы опций) переносятся параллельно, каждая
+   в своем потоке со своими соединениями; опции ждут только группы опций.
+5. В конце последовательности id выставляются на MAX(id) таблиц.
+"""
+import csv
+import hashlib
+import io
+import os
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Integer, String, Table, delete, insert, select, text, update
+from sqlalchemy.engine import Connection, Engine
+
+from app.core.config import settings
+from models.database import (
+    Car, CarOption, CarOptionsGroup, CarPicture, CatalogMigrationCheckpoint,
+    UsedCar, UsedCarPicture,
+)
+
+# Колонки SQLite, которые не переносятся (created_at/updated_at заполняет PostgreSQL)
+_SKIP_COLUMNS = {"created_at", "updated_at"}
+
+# Колонки с типом FLOAT в SQLite: в каталоге это строки вида "2500000.0"
+_SQLITE_FLOAT_TYPES = ("REAL", "FLOA", "DOUB", "NUMERIC", "DECIMAL")
+
+
+@dataclass(frozen=True)
+class _TablePlan:
+    """Таблица SQLite -> таблица каталога"""
+    source: str
+    target: Table
+    depends_on: Tuple[str, ...] = ()
+
+
+TABLE_PLANS = (
+    _TablePlan("car", Car.__table__),
+    _TablePlan("used_car", UsedCar.__table__),
+    _TablePlan("picture", CarPicture.__table__, ("car",)),
+    _TablePlan("used_car_picture", UsedCarPicture.__table__, ("used_car",)),
+    _TablePlan("options_group", CarOptionsGroup.__table__, ("car",)),
+    _TablePlan("option", CarOption.__table__, ("car", "options_group")),
+)
+
+_PLANS_BY_SOURCE = {plan.source: plan for plan in TABLE_PLANS}
+
+
+# ----------------------------------------------------------------------
+# Конвертеры колонок
+# ----------------------------------------------------------------------
+
+def _to_int(value: Any) -> Optional[int]:
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        try:
+            return int(float(value))
+        except (ValueError, TypeError):
+            return None
+
+
+def _float_to_str(max_length: Optional[int]) -> Callable[[Any], Optional[str]]:
+    def convert(value: Any) -> Optional[str]:
+        if value is None or value == "":
+            return None
+        try:
+            result = str(float(value))
+        except (ValueError, TypeError):
+            result = str(value)
+        return result[:max_length] if max_length else result
+    return convert
+
+
+def _to_str(max_length: Optional[int]) -> Callable[[Any], Optional[str]]:
+    def convert(value: Any) -> Optional[str]:
+        if value is None:
+            return None
+        result = str(value).replace("\x00", "")  # PostgreSQL не принимает NUL в тексте
+        if not result:
+            return None
+        return result[:max_length] if max_length else result
+    return convert
+
+
+def _identity(value: Any) -> Any:
+    return value
+
+
+def build_converters(sqlite_types: Dict[str, str], target: Table, columns: Sequence[str]) -> List[Callable[[Any], Any]]:
+    """
+    Конвертеры для колонок по типу в SQLite и типу колонки каталога
+
+    Строки обрезаются до длины колонки каталога, FLOAT из SQLite в строковых
+    колонках каталога записывается как str(float) - как делал convert_value.
+    """
+    converters = []
+    for name in columns:
+        column_type = target.columns[name].type
+        declared = (sqlite_types.get(name) or "").upper()
+        if isinstance(column_type, Integer):
+            converters.append(_to_int)
+        elif isinstance(column_type, String):  # String и Text
+            max_length = getattr(column_type, "length", None)
+            if any(marker in declared for marker in _SQLITE_FLOAT_TYPES):
+                converters.append(_float_to_str(max_length))
+            else:
+                converters.append(_to_str(max_length))
+        else:
+            converters.append(_identity)
+    return converters
+
+
+def source_key(sqlite_path: str) -> str:
+    """Ключ чекпоинтов: тот же файл (путь, размер, mtime) продолжается, новый - начинается заново"""
+    stat = os.stat(sqlite_path)
+    raw = f"{os.path.abspath(sqlite_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SqliteCatalogMigrator:
+    """Перенос таблиц cars.db в каталог PostgreSQL пачками с чекпоинтами"""
+
+    def __init__(self, sqlite_path: str, engine: Engine, chunk_size: Optional[int] = None,
+                 workers: Optional[int] = None):
+        """
+        Args:
+            sqlite_path: Путь к cars.db
+            engine: Движок PostgreSQL (у скриптов миграции - свой, по переменным окружения)
+            chunk_size: Строк в одной пачке и транзакции
+            workers: Сколько таблиц переносить параллельно
+        """
+        self.sqlite_path = sqlite_path
+        self.engine = engine
+        self.chunk_size = chunk_size or settings.sqlite_migration_chunk_size
+        self.workers = max(1, workers or settings.sqlite_migration_workers)
+        self.source_key = source_key(sqlite_path)
+        self.checkpoints = CatalogMigrationCheckpoint.__table__
+
+    def run(self, tables: Optional[Iterable[str]] = None, reset: bool = False) -> Dict[str, Any]:
+        """
+        Переносит таблицы (по умолчанию все из TABLE_PLANS)
+
+        Args:
+            tables: Имена таблиц SQLite; зависимости вне списка считаются выполненными
+            reset: Игнорировать чекпоинты и перенести таблицы заново
+
+        Returns:
+            {"success", "tables": {таблица: статистика}, "duration_seconds"}
+        """
+        started = time.monotonic()
+        names = None if tables is None else set(tables)
+        unknown = (names or set()) - set(_PLANS_BY_SOURCE)
+        if unknown:
+            raise ValueError(f"Неизвестные таблицы SQLite: {', '.join(sorted(unknown))}")
+        selected = [plan for plan in TABLE_PLANS if names is None or plan.source in names]
+        selected_names = {plan.source for plan in selected}
+        self.checkpoints.create(bind=self.engine, checkfirst=True)
+        if reset:
+            self._clear_checkpoints()
+
+        results: Dict[str, Dict[str, Any]] = {}
+        pending = {plan.source: plan for plan in selected}
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sqlite-migrate") as executor:
+            while pending or running:
+                for name, plan in list(pending.items()):
+                    deps = [dep for dep in plan.depends_on if dep in selected_names]
+                    if any(results.get(dep, {}).get("status") in ("failed", "skipped") for dep in deps):
+                        print(f"⏭️ {name}: пропущена, не перенесена зависимость")
+                        results[name] = {"status": "skipped"}
+                        del pending[name]
+                    elif all(dep in results for dep in deps):
+                        running[executor.submit(self.migrate_table, plan)] = name
+                        del pending[name]
+                if not running:
+                    continue
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        print(f"❌ {name}: миграция прервана: {e} (повторный запуск продолжит с чекпоинта)")
+                        results[name] = {"status": "failed", "error": str(e)}
+
+        success = all(result.get("status") == "completed" for result in results.values())
+        if success:
+            self._fix_sequences(selected)
+            self._clear_checkpoints()
+        return {
+            "success": success,
+            "tables": results,
+            "duration_seconds": round(time.monotonic() - started, 2),
+        }
+
+    # ------------------------------------------------------------------
+    # Перенос одной таблицы
+    # ------------------------------------------------------------------
+
+    def migrate_table(self, plan: _TablePlan) -> Dict[str, Any]:
+        """Переносит одну таблицу SQLite пачками; каждая пачка - своя транзакция с чекпоинтом"""
+        sqlite_conn = sqlite3.connect(f"file:{self.sqlite_path}?mode=ro", uri=True)
+        try:
+            sqlite_types = {
+                row[1]: row[2] for row in sqlite_conn.execute(f'PRAGMA table_info("{plan.source}")')
+            }
+            if not sqlite_types:
+                print(f"⚠️ {plan.source}: таблицы нет в cars.db")
+                return {"status": "completed", "rows": 0, "failed": 0}
+            columns = [
+                name for name in sqlite_types
+                if name in plan.target.columns and name not in _SKIP_COLUMNS
+            ]
+            converters = build_converters(sqlite_types, plan.target, columns)
+            checkpoint = self._load_checkpoint(plan.source)
+            if checkpoint["completed"]:
+                print(f"⏭️ {plan.source}: уже перенесена (чекпоинт)")
+                return {"status": "completed", "rows": checkpoint["rows_done"],
+                        "failed": checkpoint["rows_failed"], "resumed": True}
+
+            total = sqlite_conn.execute(f'SELECT COUNT(*) FROM "{plan.source}"').fetchone()[0]
+            if checkpoint["last_id"]:
+                print(f"↪️ {plan.source}: продолжение с id > {checkpoint['last_id']} ({checkpoint['rows_done']}/{total})")
+            else:
+                print(f"📦 {plan.source} -> {plan.target.name}: {total} строк")
+
+            column_list = ", ".join(f'"{name}"' for name in columns)
+            cursor = sqlite_conn.execute(
+                f'SELECT {column_list} FROM "{plan.source}" WHERE id > ? ORDER BY id',
+                (checkpoint["last_id"],),
+            )
+            id_index = columns.index("id")
+            loader = _ChunkLoader(self.engine, plan.target, columns)
+            errors: List[str] = []
+            with self.engine.connect() as conn:
+                while True:
+                    raw_rows = cursor.fetchmany(self.chunk_size)
+                    if not raw_rows:
+                        break
+                    rows = [
+                        tuple(convert(value) for convert, value in zip(converters, raw_row))
+                        for raw_row in raw_rows
+                    ]
+                    last_id = raw_rows[-1][id_index]
+
+                    def save_checkpoint(tx_conn: Connection, loaded: int, failed: int) -> None:
+                        # В той же транзакции, что и строки пачки
+                        self._save_checkpoint(tx_conn, plan.source, {
+                            **checkpoint,
+                            "last_id": last_id,
+                            "rows_done": checkpoint["rows_done"] + loaded,
+                            "rows_failed": checkpoint["rows_failed"] + failed,
+                        })
+
+                    loaded, failed = loader.load(conn, rows, errors, save_checkpoint)
+                    checkpoint["last_id"] = last_id
+                    checkpoint["rows_done"] += loaded
+                    checkpoint["rows_failed"] += failed
+                    print(f"  {plan.source}: {checkpoint['rows_done']}/{total}"
+                          + (f", ошибок {checkpoint['rows_failed']}" if checkpoint["rows_failed"] else ""))
+
+                checkpoint["completed"] = True
+                with conn.begin():
+                    self._save_checkpoint(conn, plan.source, checkpoint)
+
+            for message in errors[:20]:
+                print(f"  ❌ {plan.source}: {message}")
+            print(f"✅ {plan.source}: перенесено {checkpoint['rows_done']}, ошибок {checkpoint['rows_failed']}")
+            return {
+                "status": "completed",
+                "rows": checkpoint["rows_done"],
+                "failed": checkpoint["rows_failed"],
+                "errors": errors,
+            }
+        finally:
+            sqlite_conn.close()
+
+    # ------------------------------------------------------------------
+    # Чекпоинты и последовательности
+    # ------------------------------------------------------------------
+
+    def _load_checkpoint(self, table_name: str) -> Dict[str, Any]:
+        with self.engine.begin() as conn:
+            row = conn.execute(
+                select(
+                    self.checkpoints.c.last_id, self.checkpoints.c.rows_done,
+                    self.checkpoints.c.rows_failed, self.checkpoints.c.completed,
+                ).where(
+                    self.checkpoints.c.source_key == self.source_key,
+                    self.checkpoints.c.table_name == table_name,
+                )
+            ).first()
+            if row is not None:
+                return dict(row._mapping)
+            conn.execute(insert(self.checkpoints).values(
+                source_key=self.source_key, table_name=table_name,
+                last_id=0, rows_done=0, rows_failed=0, completed=False,
+            ))
+        return {"last_id": 0, "rows_done": 0, "rows_failed": 0, "completed": False}
+
+    def _save_checkpoint(self, conn: Connection, table_name: str, checkpoint: Dict[str, Any]) -> None:
+        conn.execute(
+            update(self.checkpoints)
+            .where(
+                self.checkpoints.c.source_key == self.source_key,
+                self.checkpoints.c.table_name == table_name,
+            )
+            .values(**checkpoint)
+        )
+
+    def _clear_checkpoints(self) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.checkpoints).where(self.checkpoints.c.source_key == self.source_key))
+
+    def _fix_sequences(self, plans: Sequence[_TablePlan]) -> None:
+        """Строки перенесены с явными id - сдвигаем последовательности за MAX(id)"""
+        if self.engine.dialect.name != "postgresql":
+            return
+        with self.engine.begin() as conn:
+            for plan in plans:
+                table_name = plan.target.name
+                conn.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), "
+                    f"COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {table_name}"
+                ))
+        print("✅ Последовательности id обновлены")
+
+
+class _ChunkLoader:
+    """Загрузка пачки строк в таблицу каталога с заменой строк по id"""
+
+    def __init__(self, engine: Engine, target: Table, columns: Sequence[str]):
+        self.target = target
+        self.columns = list(columns)
+        self.dialect = engine.dialect.name
+        self.upsert = self._build_upsert()
+        self.max_errors = settings.import_max_reported_errors
+
+    def load(self, conn: Connection, rows: List[tuple], errors: List[str],
+             on_commit: Callable[[Connection, int, int], None]) -> Tuple[int, int]:
+        """
+        Загружает пачку целиком, при ошибке - построчно; возвращает (загружено, ошибок)
+
+        on_commit(conn, загружено, ошибок) выполняется в той же транзакции, что и
+        строки пачки (сохранение чекпоинта).
+        """
+        try:
+            with conn.begin():
+                if self._use_copy(conn):
+                    self._copy(conn, rows)
+                else:
+                    conn.execute(self.upsert, [dict(zip(self.columns, row)) for row in rows])
+                on_commit(conn, len(rows), 0)
+            return len(rows), 0
+        except Exception as e:
+            if len(rows) == 1:
+                with conn.begin():
+                    on_commit(conn, 0, 1)
+                self._add_error(errors, rows[0], e)
+                return 0, 1
+
+        loaded = failed = 0
+        row_errors: List[Tuple[tuple, Exception]] = []
+        with conn.begin():
+            for row in rows:
+                try:
+                    with conn.begin_nested():
+                        conn.execute(self.upsert, [dict(zip(self.columns, row))])
+                    loaded += 1
+                except Exception as e:
+                    failed += 1
+                    row_errors.append((row, e))
+            on_commit(conn, loaded, failed)
+        for row, error in row_errors:
+            self._add_error(errors, row, error)
+        return loaded, failed
+
+    def _add_error(self, errors: List[str], row: tuple, error: Exception) -> None:
+        if len(errors) < self.max_errors:
+            message = str(error).splitlines()[0] if str(error) else type(error).__name__
+            errors.append(f"id {row[self.columns.index('id')]}: {message}")
+
+    def _build_upsert(self):
+        update_columns = [name for name in self.columns if name != "id"]
+        if self.dialect in ("postgresql", "sqlite"):
+            if self.dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            stmt = dialect_insert(self.target)
+            if not update_columns:
+                return stmt.on_conflict_do_nothing(index_elements=["id"])
+            return stmt.on_conflict_do_update(
+                index_elements=["id"],
+                set_={name: stmt.excluded[name] for name in update_columns},
+            )
+        return insert(self.target)
+
+    def _use_copy(self, conn: Connection) -> bool:
+        return self.dialect == "postgresql" and conn.dialect.driver in ("psycopg2", "psycopg")
+
+    def _copy(self, conn: Connection, rows: List[tuple]) -> None:
+        """COPY во временную таблицу и INSERT ... SELECT ON CONFLICT в каталог"""
+        staging = f"_copy_{self.target.name}"
+        column_list = ", ".join(f'"{name}"' for name in self.columns)
+        # В той же транзакции: после отката пачки таблица создается заново
+        conn.exec_driver_sql(
+            f"CREATE TEMP TABLE IF NOT EXISTS {staging} "
+            f"(LIKE {self.target.name} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+        )
+
+        # CSV: пустое поле без кавычек - NULL (пустые строки конвертеры уже заменили на None)
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(rows)
+        buffer.seek(0)
+        copy_sql = f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv)"
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            if hasattr(cursor, "copy_expert"):  # psycopg2
+                cursor.copy_expert(copy_sql, buffer)
+            else:  # psycopg 3
+                with cursor.copy(copy_sql) as copy:
+                    copy.write(buffer.getvalue())
+        finally:
+            cursor.close()
+
+        update_columns = [name for name in self.columns if name != "id"]
+        on_conflict = "DO NOTHING"
+        if update_columns:
+            on_conflict = "DO UPDATE SET " + ", ".join(f'"{name}" = EXCLUDED."{name}"' for name in update_columns)
+        conn.exec_driver_sql(
+            f"INSERT INTO {self.target.name} ({column_list}) SELECT {column_list} FROM {staging} "
+            f"ON CONFLICT (id) {on_conflict}"
+        )
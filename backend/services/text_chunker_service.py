@@ -0,0 +1,289 @@
+"""
+Разбиение текста документов на чанки для эмбеддингов
+
+Чанк собирается из целых предложений в пределах бюджета токенов, соседние чанки
+перекрываются последними предложениями, а заголовок раздела начинает новый чанк
+и добавляется в начало каждого чанка раздела. Разбиение детерминировано: один и тот
+же текст (в том числе поданный разными блоками) всегда дает одни и те же чанки,
+поэтому их хеши стабильны между переобработками.
+"""
+import hashlib
+import multiprocessing
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional
+
+from app.core.config import settings
+
+# Приблизительные токены: слова и отдельные знаки препинания
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+# Конец предложения: . ! ? … (возможно с кавычкой/скобкой), затем пробел и заглавная буква/цифра/кавычка
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…])[\"»)\]]*\s+(?=[\"«(\[A-ZА-ЯЁ0-9—–-])")
+_HEADING_NUMBERED_RE = re.compile(r"^(?:\d+(?:\.\d+)*\.?|[IVXLC]+\.|(?:Глава|Раздел|Часть|Статья|Chapter|Section)\s+\S+)\s+\S")
+_MARKDOWN_HEADING_RE = re.compile(r"^#{1,6}\s+\S")
+
+MAX_HEADING_CHARS = 120
+# Абзац без пустых строк длиннее этого разбирается по предложениям, не дожидаясь конца
+MAX_PENDING_PARAGRAPH_CHARS = 20000
+
+
+def count_tokens(text: str) -> int:
+    """Приблизительное число токенов (слова + знаки препинания)"""
+    return len(_TOKEN_RE.findall(text))
+
+
+def chunk_hash(text: str) -> str:
+    """Стабильный хеш чанка: SHA-256 текста с нормализованными пробелами"""
+    normalized = " ".join(text.split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class TextChunk:
+    """Чанк текста документа"""
+    text: str
+    token_count: int
+    heading: Optional[str] = None
+
+
+class TextChunker:
+    """Разбиение по предложениям и заголовкам с бюджетом токенов и перекрытием"""
+
+    def __init__(self, max_tokens: int = 200, overlap_tokens: int = 30):
+        self.max_tokens = max(16, max_tokens)
+        self.overlap_tokens = max(0, min(overlap_tokens, self.max_tokens // 2))
+
+    def split(self, text: str) -> List[TextChunk]:
+        """Разбивает весь текст на чанки"""
+        return list(self.iter_chunks([text]))
+
+    def iter_chunks(self, blocks: Iterable[str]) -> Iterator[TextChunk]:
+        """
+        Разбивает поток блоков текста на чанки по мере поступления
+
+        Блоки обрабатываются по целым строкам, поэтому результат не зависит от того,
+        где проходят границы блоков.
+        """
+        builder = _ChunkBuilder(self.max_tokens, self.overlap_tokens)
+        paragraph: List[str] = []
+        paragraph_chars = 0
+        tail = ""
+
+        def flush_paragraph() -> Iterator[TextChunk]:
+            nonlocal paragraph, paragraph_chars
+            if paragraph:
+                for sentence in split_sentences(" ".join(paragraph)):
+                    yield from builder.add_sentence(sentence)
+            paragraph = []
+            paragraph_chars = 0
+
+        for block in blocks:
+            tail += block
+            if "\n" not in tail:
+                continue
+            complete, tail = tail.rsplit("\n", 1)
+            for line in complete.split("\n"):
+                stripped = line.strip()
+                if not stripped:
+                    yield from flush_paragraph()
+                elif is_heading(stripped):
+                    yield from flush_paragraph()
+                    yield from builder.start_section(stripped.lstrip("#").strip())
+                else:
+                    paragraph.append(stripped)
+                    paragraph_chars += len(stripped)
+                    if paragraph_chars > MAX_PENDING_PARAGRAPH_CHARS:
+                        # Длинный текст без пустых строк (типично для PDF): отдаем все предложения, кроме последнего
+                        sentences = split_sentences(" ".join(paragraph))
+                        for sentence in sentences[:-1]:
+                            yield from builder.add_sentence(sentence)
+                        paragraph = sentences[-1:]
+                        paragraph_chars = sum(len(s) for s in paragraph)
+
+        stripped = tail.strip()
+        if stripped:
+            if is_heading(stripped) and not paragraph:
+                yield from builder.start_section(stripped.lstrip("#").strip())
+            else:
+                paragraph.append(stripped)
+        yield from flush_paragraph()
+        yield from builder.finish()
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Обрезает текст до max_tokens токенов (по границе токена)"""
+        for count, match in enumerate(_TOKEN_RE.finditer(text)):
+            if count == max_tokens:
+                return text[:match.start()].rstrip()
+        return text
+
+
+class _ChunkBuilder:
+    """Накапливает предложения текущего раздела и выдает чанки по бюджету"""
+
+    def __init__(self, max_tokens: int, overlap_tokens: int):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.heading: Optional[str] = None
+        self.heading_tokens = 0
+        self.section_has_body = False
+        self.sentences: List[str] = []
+        self.sentence_tokens: List[int] = []
+        self.fresh = 0  # Предложений, еще не попавших ни в один чанк
+
+    def start_section(self, heading: str) -> Iterator[TextChunk]:
+        """
+        Начинает раздел: заголовок идет первым предложением и повторяется в начале
+        следующих чанков раздела. Подряд идущие заголовки без текста (оглавление,
+        нумерованный список) собираются в один чанк, а не дробятся.
+        """
+        if self.section_has_body:
+            yield from self.finish()
+        self.heading = heading[:MAX_HEADING_CHARS]
+        self.heading_tokens = count_tokens(self.heading)
+        self.section_has_body = False
+        yield from self._append(self.heading)
+
+    def add_sentence(self, sentence: str) -> Iterator[TextChunk]:
+        self.section_has_body = True
+        yield from self._append(sentence)
+
+    def finish(self) -> Iterator[TextChunk]:
+        if self.fresh:
+            yield self._emit()
+        # Перекрытие не переносится через границу раздела
+        self.sentences = []
+        self.sentence_tokens = []
+        self.fresh = 0
+
+    def _append(self, sentence: str) -> Iterator[TextChunk]:
+        budget = max(8, self.max_tokens - self.heading_tokens)
+        tokens = count_tokens(sentence)
+        if tokens > budget:
+            # Слишком длинное "предложение" (таблица, список без точек) режем по словам
+            for piece in _split_by_tokens(sentence, budget):
+                yield from self._append(piece)
+            return
+
+        if self.fresh and sum(self.sentence_tokens) + tokens > budget:
+            yield self._emit()
+            self._keep_overlap()
+            # Перекрытие не должно вытеснять новое предложение за бюджет
+            while self.sentences and sum(self.sentence_tokens) + tokens > budget:
+                self.sentences.pop(0)
+                self.sentence_tokens.pop(0)
+
+        self.sentences.append(sentence)
+        self.sentence_tokens.append(tokens)
+        self.fresh += 1
+
+    def _emit(self) -> TextChunk:
+        body = " ".join(self.sentences)
+        token_count = sum(self.sentence_tokens)
+        if self.heading and self.heading not in self.sentences:
+            body = f"{self.heading}\n{body}"
+            token_count += self.heading_tokens
+        self.fresh = 0
+        return TextChunk(text=body, token_count=token_count, heading=self.heading)
+
+    def _keep_overlap(self):
+        kept: List[str] = []
+        kept_tokens: List[int] = []
+        total = 0
+        for sentence, tokens in zip(reversed(self.sentences), reversed(self.sentence_tokens)):
+            if total + tokens > self.overlap_tokens:
+                break
+            kept.insert(0, sentence)
+            kept_tokens.insert(0, tokens)
+            total += tokens
+        self.sentences = kept
+        self.sentence_tokens = kept_tokens
+
+
+def split_sentences(text: str) -> List[str]:
+    """Делит абзац на предложения"""
+    return [sentence.strip() for sentence in _SENTENCE_END_RE.split(text) if sentence.strip()]
+
+
+def is_heading(line: str) -> bool:
+    """Эвристика заголовка: markdown, нумерация разделов или короткая строка заглавными буквами"""
+    if len(line) > MAX_HEADING_CHARS:
+        return False
+    if _MARKDOWN_HEADING_RE.match(line):
+        return True
+    if line[-1] in ".,;:!?":
+        return False
+    if _HEADING_NUMBERED_RE.match(line) and count_tokens(line) <= 15:
+        return True
+    letters = [ch for ch in line if ch.isalpha()]
+    return len(letters) >= 4 and all(ch.isupper() for ch in letters)
+
+
+def _split_by_tokens(text: str, max_tokens: int) -> List[str]:
+    pieces = []
+    matches = list(_TOKEN_RE.finditer(text))
+    for start in range(0, len(matches), max_tokens):
+        window = matches[start:start + max_tokens]
+        end = matches[start + max_tokens].start() if start + max_tokens < len(matches) else len(text)
+        pieces.append(text[window[0].start():end].strip())
+    return [piece for piece in pieces if piece]
+
+
+def _chunk_text(args) -> List[TextChunk]:
+    text, max_tokens, overlap_tokens = args
+    return TextChunker(max_tokens, overlap_tokens).split(text)
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+def _get_executor(workers: int) -> ProcessPoolExecutor:
+    """Общий пул процессов разбиения (создается при первом использовании)"""
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is not None and _executor_workers != workers:
+            _executor.shutdown(wait=True)
+            _executor = None
+        if _executor is None:
+            # spawn: не копируем потоки и соединения uvicorn в дочерние процессы
+            _executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _executor_workers = workers
+        return _executor
+
+
+def shutdown_chunk_pool():
+    """Останавливает пул процессов разбиения"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def chunk_texts_parallel(texts: List[str], max_workers: Optional[int] = None,
+                         max_tokens: Optional[int] = None, overlap_tokens: Optional[int] = None) -> List[List[TextChunk]]:
+    """
+    Разбивает несколько документов на чанки параллельно в пуле процессов
+
+    Разбиение - чистый Python, поэтому для пакетной переобработки оно выносится
+    в процессы, чтобы не упираться в GIL.
+    """
+    max_tokens = max_tokens or settings.document_chunk_max_tokens
+    overlap_tokens = settings.document_chunk_overlap_tokens if overlap_tokens is None else overlap_tokens
+    jobs = [(text or "", max_tokens, overlap_tokens) for text in texts]
+    workers = max_workers or settings.document_chunk_workers
+    if workers <= 1 or len(jobs) <= 1:
+        return [_chunk_text(job) for job in jobs]
+    return list(_get_executor(workers).map(_chunk_text, jobs))
+
+
+default_chunker = TextChunker(
+    max_tokens=settings.document_chunk_max_tokens,
+    overlap_tokens=settings.document_chunk_overlap_tokens,
+)
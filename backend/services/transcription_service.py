@@ -0,0 +1,259 @@
+"""
+Сервис транскрибации аудио с помощью Whisper
+
+Модели Whisper держатся в LRU-кэше внутри рабочих процессов (ключ - размер модели),
+задачи выполняются в ограниченном пуле процессов, поэтому распознавание
+не блокирует event loop. Аудио декодируется через ffmpeg из памяти (stdin),
+без промежуточного временного файла.
+"""
+import asyncio
+import importlib.util
+import logging
+import multiprocessing
+import os
+import subprocess
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+import numpy as np
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000  # Частота дискретизации, которую ожидает Whisper
+CHUNK_SECONDS = 30  # Размер окна Whisper
+
+
+class TranscriptionUnavailableError(Exception):
+    """Whisper или ffmpeg не установлены"""
+
+
+class TranscriptionQueueFullError(Exception):
+    """Превышен лимит задач в очереди транскрибации"""
+
+
+# ---------------------------------------------------------------------------
+# Код, выполняемый в рабочих процессах пула
+# ---------------------------------------------------------------------------
+
+_model_cache: "OrderedDict[str, Any]" = OrderedDict()
+_model_cache_size = 2
+
+
+def _init_worker(model_cache_size: int):
+    """Инициализация рабочего процесса"""
+    global _model_cache_size
+    _model_cache_size = max(1, model_cache_size)
+
+
+def _get_model(model_name: str):
+    """Возвращает модель Whisper из LRU-кэша процесса, загружая её при необходимости"""
+    model = _model_cache.get(model_name)
+    if model is not None:
+        _model_cache.move_to_end(model_name)
+        return model
+
+    import whisper
+
+    logger.info(f"Загрузка модели Whisper: {model_name} (pid {os.getpid()})")
+    model = whisper.load_model(model_name)
+    _model_cache[model_name] = model
+    while len(_model_cache) > _model_cache_size:
+        evicted, _ = _model_cache.popitem(last=False)
+        logger.info(f"Модель Whisper {evicted} выгружена из кэша")
+    return model
+
+
+def _run_ffmpeg(source: str, data: Optional[bytes]) -> bytes:
+    # -nostdin только при чтении из файла: иначе stdin используется как источник
+    cmd = ["ffmpeg"] + (["-nostdin"] if data is None else []) + [
+        "-threads", "0",
+        "-i", source,
+        "-f", "s16le",
+        "-ac", "1",
+        "-acodec", "pcm_s16le",
+        "-ar", str(SAMPLE_RATE),
+        "pipe:1",
+    ]
+    return subprocess.run(cmd, input=data, capture_output=True, check=True).stdout
+
+
+def _decode_audio(data: bytes, suffix: str = "webm") -> np.ndarray:
+    """
+    Декодирует аудио в моно float32 16 кГц через ffmpeg
+
+    Байты передаются в ffmpeg через stdin. Контейнеры, которые нельзя прочитать
+    из потока (например, mp4 с moov-атомом в конце), декодируются через временный файл.
+    """
+    try:
+        pcm = _run_ffmpeg("pipe:0", data)
+    except FileNotFoundError:
+        raise TranscriptionUnavailableError("ffmpeg не установлен")
+    except subprocess.CalledProcessError:
+        with tempfile.NamedTemporaryFile(suffix=f".{suffix}") as tmp_file:
+            tmp_file.write(data)
+            tmp_file.flush()
+            pcm = _run_ffmpeg(tmp_file.name, None)
+
+    return np.frombuffer(pcm, np.int16).flatten().astype(np.float32) / 32768.0
+
+
+def _transcribe_array(audio: np.ndarray, model_name: str, language: Optional[str]) -> Dict[str, Any]:
+    model = _get_model(model_name)
+    result = model.transcribe(audio, language=language or None, task="transcribe")
+    return {
+        "text": result.get("text", "").strip(),
+        "language": result.get("language", language or "unknown"),
+        "confidence": result.get("no_speech_prob", 0),
+    }
+
+
+def _transcribe_job(data: bytes, suffix: str, model_name: str, language: Optional[str]) -> Dict[str, Any]:
+    """Полная транскрибация одного аудио"""
+    return _transcribe_array(_decode_audio(data, suffix), model_name, language)
+
+
+def _decode_job(data: bytes, suffix: str) -> np.ndarray:
+    """Только декодирование (для потоковой транскрибации по частям)"""
+    return _decode_audio(data, suffix)
+
+
+# ---------------------------------------------------------------------------
+# Сервис, используемый в API
+# ---------------------------------------------------------------------------
+
+class TranscriptionService:
+    """Ограниченный пул процессов для транскрибации с очередью и контролем допуска"""
+
+    def __init__(
+        self,
+        max_workers: int = 1,
+        max_pending: int = 8,
+        model_cache_size: int = 2,
+    ):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(self.max_workers, max_pending)
+        self.model_cache_size = model_cache_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+
+    @staticmethod
+    def is_available() -> bool:
+        """Проверяет, установлен ли Whisper (без импорта torch в основном процессе)"""
+        return importlib.util.find_spec("whisper") is not None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: не копируем потоки и соединения uvicorn в дочерние процессы
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_cache_size,),
+            )
+        return self._executor
+
+    def _admit(self):
+        if not self.is_available():
+            raise TranscriptionUnavailableError(
+                "Whisper не установлен. Установите: pip install openai-whisper"
+            )
+        if self._pending >= self.max_pending:
+            raise TranscriptionQueueFullError(
+                f"Очередь транскрибации заполнена ({self._pending}/{self.max_pending})"
+            )
+        self._pending += 1
+
+    async def _submit(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), fn, *args)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Текущее состояние очереди"""
+        return {
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self._pending,
+        }
+
+    async def transcribe(
+        self,
+        data: bytes,
+        model: str = "base",
+        language: Optional[str] = None,
+        suffix: str = "webm",
+    ) -> Dict[str, Any]:
+        """
+        Транскрибирует аудио целиком
+
+        Returns:
+            Dict с полями text, language, confidence
+        """
+        self._admit()
+        try:
+            return await self._submit(_transcribe_job, data, suffix, model, language)
+        finally:
+            self._pending -= 1
+
+    async def transcribe_stream(
+        self,
+        data: bytes,
+        model: str = "base",
+        language: Optional[str] = None,
+        suffix: str = "webm",
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Транскрибирует аудио окнами по CHUNK_SECONDS и отдает частичные результаты
+
+        Язык, определенный на первом окне, фиксируется для последующих.
+        Если поток закрыт раньше времени (aclose, клиент отключился), еще
+        не начатые задачи окон снимаются с пула.
+        """
+        self._admit()
+        outstanding: Set[Future] = set()
+
+        async def run(fn, *args):
+            future = self._get_executor().submit(fn, *args)
+            outstanding.add(future)
+            result = await asyncio.wrap_future(future)
+            outstanding.discard(future)
+            return result
+
+        try:
+            audio = await run(_decode_job, data, suffix)
+            chunk_size = CHUNK_SECONDS * SAMPLE_RATE
+            total = max(1, -(-len(audio) // chunk_size))
+            texts = []
+            for index in range(total):
+                chunk = audio[index * chunk_size:(index + 1) * chunk_size]
+                result = await run(_transcribe_array, chunk, model, language)
+                language = language or result["language"]
+                if result["text"]:
+                    texts.append(result["text"])
+                yield {
+                    **result,
+                    "chunk": index,
+                    "total_chunks": total,
+                    "final": index == total - 1,
+                    "full_text": " ".join(texts),
+                }
+        finally:
+            for future in outstanding:
+                future.cancel()
+            self._pending -= 1
+
+    def shutdown(self):
+        """Останавливает пул процессов"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+transcription_service = TranscriptionService(
+    max_workers=settings.whisper_max_workers,
+    max_pending=settings.whisper_max_pending,
+    model_cache_size=settings.whisper_model_cache_size,
+)
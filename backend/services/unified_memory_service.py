@@ -2,13 +2,14 @@
 UnifiedMemoryService - единый сервис для работы с долговременной памятью пользователя
 Использует PostgreSQL + pgvector для хранения и семантического поиска предпочтений
 """
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import json
 import asyncio
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from models.database import UserMemory
 from app.core.config import settings
+from services.embedding_provider_service import aembed_texts, current_embedding_model
 
 
 class UnifiedMemoryService:
@@ -19,16 +20,23 @@ class UnifiedMemoryService:
     PostgreSQL + pgvector → прямое хранение и поиск
     """
     
-    def __init__(self, db_session: Session, embedding_service=None):
+    def __init__(self, db_session: Session, embedding_service=None, async_session_factory=None):
         """
         Инициализация сервиса
         
         Args:
             db_session: SQLAlchemy сессия
             embedding_service: Сервис для создания эмбеддингов (опционально)
+            async_session_factory: Фабрика AsyncSession (по умолчанию - основной асинхронный движок,
+                если db_session работает с основной БД приложения)
         """
         self.db = db_session
         self.embedding_service = embedding_service
+        if async_session_factory is None:
+            from models import engine, AsyncSessionLocal
+            if getattr(db_session, "bind", None) is engine:
+                async_session_factory = AsyncSessionLocal
+        self.async_session_factory = async_session_factory
     
     async def get_user_context(self, user_id: str, current_query: str) -> Dict[str, Any]:
         """
@@ -42,10 +50,16 @@ class UnifiedMemoryService:
             Словарь с контекстом: history, preferences, entities, inferred_criteria
         """
         # 1. История диалога (последние 10 сообщений)
-        history = await self._get_recent_history(user_id)
-        
         # 2. Долговременные предпочтения из pgvector
-        preferences = await self._get_user_preferences(user_id, current_query)
+        if self.async_session_factory is not None:
+            # Каждый запрос в своей AsyncSession - выполняем параллельно
+            history, preferences = await asyncio.gather(
+                self._get_recent_history(user_id),
+                self._get_user_preferences(user_id, current_query)
+            )
+        else:
+            history = await self._get_recent_history(user_id)
+            preferences = await self._get_user_preferences(user_id, current_query)
         
         # 3. Извлеченные сущности из текущего диалога
         entities = await self._extract_entities(history + [{"role": "user", "content": current_query}])
@@ -63,13 +77,21 @@ class UnifiedMemoryService:
             from models.database import ChatMessage
             from sqlalchemy import desc
             from sqlalchemy.exc import OperationalError, ProgrammingError
+            from services.chat_write_behind_service import chat_write_behind
             
+            # Последние ходы могут еще ждать в очереди отложенной записи
+            await chat_write_behind.wait_persisted()
             try:
-                messages = self.db.query(ChatMessage)\
-                    .filter(ChatMessage.user_id == user_id)\
-                    .order_by(desc(ChatMessage.created_at))\
-                    .limit(limit)\
-                    .all()
+                if self.async_session_factory is not None:
+                    from services.async_database_service import AsyncDatabaseService
+                    async with self.async_session_factory() as session:
+                        messages = await AsyncDatabaseService(session).get_recent_messages(user_id, limit)
+                else:
+                    messages = self.db.query(ChatMessage)\
+                        .filter(ChatMessage.user_id == user_id)\
+                        .order_by(desc(ChatMessage.created_at))\
+                        .limit(limit)\
+                        .all()
                 
                 history = []
                 for msg in reversed(messages):  # В хронологическом порядке
@@ -113,8 +135,8 @@ class UnifiedMemoryService:
         
         try:
             # Создаем эмбеддинг для запроса
-            query_embedding = await self._get_embedding(query)
-            if not query_embedding:
+            query_embedding, embedding_model = await self._get_embedding(query)
+            if not query_embedding or not embedding_model:
                 return await self._get_preferences_by_text(user_id, query, limit)
             
             # Семантический поиск в pgvector
@@ -122,28 +144,34 @@ class UnifiedMemoryService:
             embedding_str = '[' + ','.join(map(str, query_embedding)) + ']'
             
             # Используем оператор <=> для косинусного расстояния
-            results = self.db.execute(
-                text("""
-                    SELECT 
-                        id,
-                        memory_type,
-                        memory_text,
-                        memory_metadata,
-                        confidence,
-                        1 - (embedding <=> :embedding::vector) as similarity
-                    FROM user_memories 
-                    WHERE user_id = :user_id 
-                    AND embedding IS NOT NULL
-                    AND embedding <=> :embedding::vector < 0.3
-                    ORDER BY embedding <=> :embedding::vector
-                    LIMIT :limit
-                """),
-                {
-                    "user_id": user_id,
-                    "embedding": embedding_str,
-                    "limit": limit
-                }
-            )
+            # Сравниваем только с векторами той же модели: векторы разных моделей несовместимы
+            preferences_sql = text("""
+                SELECT 
+                    id,
+                    memory_type,
+                    memory_text,
+                    memory_metadata,
+                    confidence,
+                    1 - (embedding <=> :embedding::vector) as similarity
+                FROM user_memories 
+                WHERE user_id = :user_id 
+                AND embedding IS NOT NULL
+                AND embedding_model = :embedding_model
+                AND embedding <=> :embedding::vector < 0.3
+                ORDER BY embedding <=> :embedding::vector
+                LIMIT :limit
+            """)
+            params = {
+                "user_id": user_id,
+                "embedding": embedding_str,
+                "embedding_model": embedding_model,
+                "limit": limit
+            }
+            if self.async_session_factory is not None:
+                async with self.async_session_factory() as session:
+                    results = (await session.execute(preferences_sql, params)).fetchall()
+            else:
+                results = self.db.execute(preferences_sql, params)
             
             preferences = []
             for row in results:
@@ -171,12 +199,24 @@ class UnifiedMemoryService:
             
             try:
                 # Простой текстовый поиск
-                memories = self.db.query(UserMemory)\
-                    .filter(UserMemory.user_id == user_id)\
-                    .filter(UserMemory.memory_text.ilike(f"%{query}%"))\
-                    .order_by(UserMemory.confidence.desc(), UserMemory.created_at.desc())\
-                    .limit(limit)\
-                    .all()
+                if self.async_session_factory is not None:
+                    from sqlalchemy import select
+                    async with self.async_session_factory() as session:
+                        result = await session.execute(
+                            select(UserMemory)
+                            .where(UserMemory.user_id == user_id)
+                            .where(UserMemory.memory_text.ilike(f"%{query}%"))
+                            .order_by(UserMemory.confidence.desc(), UserMemory.created_at.desc())
+                            .limit(limit)
+                        )
+                        memories = result.scalars().all()
+                else:
+                    memories = self.db.query(UserMemory)\
+                        .filter(UserMemory.user_id == user_id)\
+                        .filter(UserMemory.memory_text.ilike(f"%{query}%"))\
+                        .order_by(UserMemory.confidence.desc(), UserMemory.created_at.desc())\
+                        .limit(limit)\
+                        .all()
                 
                 preferences = []
                 for mem in memories:
@@ -228,8 +268,9 @@ class UnifiedMemoryService:
             
             # Получаем или создаем эмбеддинг
             embedding = memory_data.get("embedding")
+            embedding_model = memory_data.get("embedding_model")
             if not embedding:
-                embedding = await self._get_embedding(memory_text)
+                embedding, embedding_model = await self._get_embedding(memory_text)
             
             # Преобразуем embedding в правильный формат для pgvector
             # Если это список, оставляем как есть (pgvector.sqlalchemy.Vector примет его)
@@ -241,6 +282,7 @@ class UnifiedMemoryService:
                 memory_type=memory_type,
                 memory_text=memory_text,
                 embedding=embedding,  # pgvector примет список напрямую
+                embedding_model=embedding_model,
                 memory_metadata=json.dumps(metadata, ensure_ascii=False),
                 confidence=confidence
             )
@@ -259,64 +301,43 @@ class UnifiedMemoryService:
             self.db.rollback()
             return None
     
-    async def _get_embedding(self, text: str) -> Optional[List[float]]:
-        """Получает эмбеддинг для текста"""
+    async def _get_embedding(self, text: str) -> Tuple[Optional[List[float]], Optional[str]]:
+        """Получает эмбеддинг для текста и имя модели, которая его посчитала"""
         if not self.embedding_service:
-            # Используем Mistral API напрямую
+            # Используем провайдер из ai_settings.json
             return await self._get_mistral_embedding(text)
         
+        service_model = getattr(self.embedding_service, "name", None) or type(self.embedding_service).__name__
         try:
             # Пробуем разные методы получения эмбеддинга
             if hasattr(self.embedding_service, 'embed_query'):
                 result = self.embedding_service.embed_query(text)
                 if asyncio.iscoroutine(result):
-                    return await result
-                return result
+                    result = await result
+                return result, service_model
             elif hasattr(self.embedding_service, 'encode'):
-                return self.embedding_service.encode(text).tolist()
+                return self.embedding_service.encode(text).tolist(), service_model
             elif callable(self.embedding_service):
                 result = self.embedding_service(text)
                 if asyncio.iscoroutine(result):
-                    return await result
-                return result
+                    result = await result
+                return result, service_model
             else:
                 return await self._get_mistral_embedding(text)
         except Exception as e:
             print(f"⚠️ Ошибка создания эмбеддинга через сервис: {e}")
             return await self._get_mistral_embedding(text)
     
-    async def _get_mistral_embedding(self, text: str) -> Optional[List[float]]:
-        """Получает эмбеддинг через Mistral API"""
-        try:
-            import httpx
-            from app.core.config import settings
-            
-            url = f"{settings.mistral_base_url}/v1/embeddings"
-            headers = {
-                "Authorization": f"Bearer {settings.mistral_api_key}",
-                "Content-Type": "application/json",
-            }
-            
-            payload = {
-                "model": settings.mistral_embed_model,
-                "input": text
-            }
-            
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(url, headers=headers, json=payload)
-                response.raise_for_status()
-                data = response.json()
-                
-                items = data.get("data", [])
-                if items:
-                    embedding = items[0].get("embedding", [])
-                    if len(embedding) == 1024:
-                        return embedding
-            
-            return None
-        except Exception as e:
-            print(f"⚠️ Ошибка получения эмбеддинга через Mistral API: {e}")
-            return None
+    async def _get_mistral_embedding(self, text: str) -> Tuple[Optional[List[float]], Optional[str]]:
+        """
+        Получает эмбеддинг провайдером из ai_settings.json (Mistral API или локальная модель)
+        
+        Через кэш: повторные запросы и воспоминания не тратят вызовы модели.
+        """
+        embeddings = await aembed_texts([text])
+        if not embeddings[0]:
+            return None, None
+        return embeddings[0], await asyncio.to_thread(current_embedding_model)
     
     async def _extract_entities(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
         """
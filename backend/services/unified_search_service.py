@@ -1,10 +1,9 @@
 """
 UnifiedSearchService - единый сервис для интеллектуального поиска
-Объединяет Elasticsearch (полнотекстовый) и pgvector (семантический) в гибридный поиск
+Объединяет Elasticsearch (полнотекстовый), pgvector (семантический) и структурный SQL в гибридный поиск
 """
 from typing import Dict, Any, List, Optional
-import asyncio
-from sqlalchemy.orm import Session
+from services.hybrid_retriever_service import HybridRetriever
 
 
 class UnifiedSearchService:
@@ -35,6 +34,11 @@ class UnifiedSearchService:
         self.es = elasticsearch_service
         self.vector = vector_search_service
         self.db = database_service
+        self.retriever = HybridRetriever(
+            elasticsearch_service=elasticsearch_service,
+            vector_search_service=vector_search_service,
+            use_sql=database_service is not None
+        )
     
     async def intelligent_search(
         self,
@@ -68,7 +72,9 @@ class UnifiedSearchService:
         
         # Параллельный поиск по всем источникам
         if intent_analysis.get("needs_car_search", True):
-            results["cars"] = await self._hybrid_car_search(query, filters or {}, user_context or {})
+            car_search = await self._hybrid_car_search(query, filters or {}, user_context or {})
+            results["cars"] = car_search["results"]
+            results["retrieval"] = car_search["sources"]
         
         if intent_analysis.get("needs_knowledge", False):
             results["knowledge"] = await self._knowledge_search(query, user_context or {})
@@ -137,147 +143,22 @@ class UnifiedSearchService:
         query: str,
         filters: Dict[str, Any],
         user_context: Dict[str, Any]
-    ) -> List[Dict[str, Any]]:
+    ) -> Dict[str, Any]:
         """
         Гибридный поиск автомобилей
         
-        Объединяет:
-        1. Точный поиск (Elasticsearch) - для точных совпадений
-        2. Семантический поиск (pgvector) - для семантических совпадений
-        """
-        # Параллельный поиск
-        es_future = self._exact_search(query, filters)
-        vector_future = self._semantic_search(query, filters, user_context)
+        Elasticsearch (BM25), pgvector и структурный SQL опрашиваются параллельно,
+        каждый в пределах своего бюджета времени; результаты сливаются через RRF.
         
-        es_results, vector_results = await asyncio.gather(
-            es_future,
-            vector_future,
-            return_exceptions=True
+        Returns:
+            {"results": [...], "sources": {источник: статус, задержка, вклад}}
+        """
+        return await self.retriever.retrieve(
+            query,
+            criteria=filters,
+            limit=20,
+            semantic_query=self._prepare_semantic_query(query, user_context)
         )
-        
-        # Обработка ошибок
-        if isinstance(es_results, Exception):
-            print(f"⚠️ Ошибка Elasticsearch поиска: {es_results}")
-            es_results = []
-        
-        if isinstance(vector_results, Exception):
-            print(f"⚠️ Ошибка векторного поиска: {vector_results}")
-            vector_results = []
-        
-        # Объединение и переранжирование
-        return await self._merge_search_results(es_results, vector_results, user_context)
-    
-    async def _exact_search(
-        self,
-        query: str,
-        criteria: Dict[str, Any]
-    ) -> List[Dict[str, Any]]:
-        """Поиск по точным совпадениям в Elasticsearch"""
-        if not self.es or not self.es.is_available():
-            return []
-        
-        try:
-            # Преобразуем критерии в параметры Elasticsearch
-            es_params = {
-                "query": query,
-                "mark": criteria.get("brands", [None])[0] if criteria.get("brands") else None,
-                "min_price": criteria.get("min_price"),
-                "max_price": criteria.get("max_price"),
-                "min_year": criteria.get("min_year"),
-                "max_year": criteria.get("max_year"),
-                "limit": 20
-            }
-            
-            # Удаляем None значения
-            es_params = {k: v for k, v in es_params.items() if v is not None}
-            
-            # ElasticsearchService.search_cars может быть синхронным
-            if asyncio.iscoroutinefunction(self.es.search_cars):
-                result = await self.es.search_cars(**es_params)
-            else:
-                result = self.es.search_cars(**es_params)
-            
-            # Преобразуем в единый формат
-            cars = []
-            for hit in result.get("hits", []):
-                source = hit.get("_source", {})
-                car_id = source.get("id")
-                car_type = source.get("type", "car")
-                
-                # Загружаем полный объект из БД, если доступен
-                car_obj = None
-                if car_id and self.db:
-                    if car_type == "used_car":
-                        car_obj = self.db.get_used_car(car_id)
-                    else:
-                        car_obj = self.db.get_car(car_id)
-                
-                cars.append({
-                    "id": car_id,
-                    "type": car_type,
-                    "score": hit.get("_score", 0.0),
-                    "sources": ["elasticsearch"],  # Список источников
-                    "data": car_obj if car_obj else source  # Возвращаем объект, если есть, иначе словарь
-                })
-            
-            return cars
-            
-        except Exception as e:
-            print(f"⚠️ Ошибка точного поиска: {e}")
-            return []
-    
-    async def _semantic_search(
-        self,
-        query: str,
-        criteria: Dict[str, Any],
-        user_context: Dict[str, Any]
-    ) -> List[Dict[str, Any]]:
-        """Семантический поиск с учетом контекста пользователя"""
-        if not self.vector:
-            return []
-        
-        try:
-            # Подготавливаем запрос для семантического поиска
-            semantic_query = self._prepare_semantic_query(query, user_context)
-            
-            # Векторный поиск
-            # Используем k вместо limit (параметр называется k в VectorSearchService)
-            vector_results = await self.vector.similarity_search(
-                semantic_query,
-                k=20,  # Исправлено: используем k вместо limit
-                filters=criteria
-            )
-            
-            # Преобразуем в единый формат
-            cars = []
-            for doc, score in vector_results:
-                metadata = getattr(doc, 'metadata', {}) if hasattr(doc, 'metadata') else {}
-                car_id = metadata.get("car_id") or metadata.get("id")
-                
-                if car_id and self.db:
-                    # Загружаем полные данные из БД
-                    car_type = metadata.get("type", "car")
-                    if car_type == "used_car":
-                        car_obj = self.db.get_used_car(car_id)
-                    else:
-                        car_obj = self.db.get_car(car_id)
-                    
-                    if car_obj:
-                        cars.append({
-                            "id": car_id,
-                            "type": car_type,
-                            "score": float(score),
-                            "sources": ["vector"],  # Список источников
-                            "data": self._car_to_dict(car_obj)
-                        })
-            
-            return cars
-            
-        except Exception as e:
-            # Не логируем как критичную ошибку, если это просто отсутствие pgvector
-            if "pgvector" not in str(e).lower() and "document" not in str(e).lower():
-                print(f"⚠️ Ошибка семантического поиска: {e}")
-            return []
     
     def _prepare_semantic_query(self, query: str, user_context: Dict[str, Any]) -> str:
         """Подготавливает запрос для семантического поиска"""
@@ -294,78 +175,6 @@ class UnifiedSearchService:
         
         return cleaned_query.strip()
     
-    async def _merge_search_results(
-        self,
-        es_results: List[Dict[str, Any]],
-        vector_results: List[Dict[str, Any]],
-        user_context: Dict[str, Any]
-    ) -> List[Dict[str, Any]]:
-        """Объединяет и переранжирует результаты из разных источников"""
-        # Собираем все результаты
-        all_results = {}
-        
-        # Добавляем результаты Elasticsearch (приоритет выше)
-        for result in es_results:
-            car_id = result.get("id")
-            if car_id:
-                result["combined_score"] = result.get("score", 0.0) * 1.2  # Бонус за точный поиск
-                if "sources" not in result:
-                    result["sources"] = []
-                all_results[car_id] = result
-        
-        # Добавляем результаты векторного поиска
-        for result in vector_results:
-            car_id = result.get("id")
-            if car_id:
-                if car_id in all_results:
-                    # Объединяем результаты
-                    all_results[car_id]["combined_score"] = max(
-                        all_results[car_id]["combined_score"],
-                        result.get("score", 0.0)
-                    )
-                    # Объединяем источники
-                    if "sources" not in all_results[car_id]:
-                        all_results[car_id]["sources"] = []
-                    if "vector" not in all_results[car_id]["sources"]:
-                        all_results[car_id]["sources"].append("vector")
-                else:
-                    result["combined_score"] = result.get("score", 0.0)
-                    if "sources" not in result:
-                        result["sources"] = []
-                    all_results[car_id] = result
-        
-        # Сортируем по combined_score
-        sorted_results = sorted(
-            all_results.values(),
-            key=lambda x: x.get("combined_score", 0.0),
-            reverse=True
-        )
-        
-        return sorted_results[:20]  # Возвращаем топ-20
-    
-    def _car_to_dict(self, car_obj) -> Dict[str, Any]:
-        """Преобразует объект Car/UsedCar в словарь"""
-        if not car_obj:
-            return {}
-        
-        result = {
-            "id": car_obj.id,
-            "mark": car_obj.mark,
-            "model": car_obj.model,
-            "price": car_obj.price,
-            "city": car_obj.city,
-            "manufacture_year": car_obj.manufacture_year,
-        }
-        
-        # Добавляем специфичные поля
-        if hasattr(car_obj, "mileage"):
-            result["mileage"] = car_obj.mileage
-            result["type"] = "used_car"
-        else:
-            result["type"] = "car"
-        
-        return result
-    
     async def _knowledge_search(
         self,
         query: str,
@@ -389,7 +198,8 @@ class UnifiedSearchService:
             "knowledge": knowledge,
             "total": len(cars),
             "search_type": intent_analysis.get("search_type", "hybrid"),
-            "confidence": self._calculate_confidence(cars, intent_analysis)
+            "confidence": self._calculate_confidence(cars, intent_analysis),
+            "retrieval": results.get("retrieval", {})
         }
     
     def _calculate_confidence(
@@ -0,0 +1,378 @@
+"""
+VectorSearchService - семантический поиск автомобилей на pgvector
+
+Эмбеддинги автомобилей из cars и used_cars хранятся в таблице car_embeddings с HNSW-индексом
+(косинусное расстояние). Структурные фильтры (цена, год, кузов, город, тип автомобиля и т.д.)
+применяются в том же SQL-запросе, что и поиск ближайших соседей, а не после него.
+"""
+import asyncio
+import hashlib
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, func, select, text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from models import SessionLocal, AsyncSessionLocal, engine
+from models.database import Car, CarEmbedding, UsedCar
+from services.car_hydration_service import parse_price
+from services.embedding_provider_service import aembed_texts, current_embedding_model, embed_texts
+
+CAR_TYPES = {
+    "car": Car,
+    "used_car": UsedCar,
+}
+
+# Синонимы типа автомобиля во входных фильтрах
+_CAR_TYPE_ALIASES = {
+    "car": "car", "new": "car", "new_car": "car", "новый": "car", "новые": "car",
+    "used_car": "used_car", "used": "used_car", "подержанный": "used_car", "подержанные": "used_car",
+}
+
+_pgvector_version: Optional[Tuple[int, ...]] = None
+
+
+@dataclass
+class CarVectorDocument:
+    """Найденный автомобиль (совместим по полям с langchain Document)"""
+    page_content: str
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
+def _norm(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip().lower()
+    return value or None
+
+
+def _as_list(*values: Any) -> List[str]:
+    """Собирает значения фильтра из строки/списка под разными ключами"""
+    result = []
+    for value in values:
+        if not value:
+            continue
+        for item in value if isinstance(value, (list, tuple, set)) else [value]:
+            normalized = _norm(item)
+            if normalized:
+                result.append(normalized)
+    return result
+
+
+class VectorSearchService:
+    """Индексация и семантический поиск автомобилей в car_embeddings"""
+
+    def __init__(self, db_session: Optional[Session] = None, ef_search: Optional[int] = None):
+        """
+        Args:
+            db_session: SQLAlchemy сессия (для синхронных операций, если не передана - создается своя)
+            ef_search: Размер списка кандидатов HNSW при поиске (больше - точнее, медленнее)
+        """
+        self.db = db_session
+        self.ef_search = ef_search or settings.vector_search_ef_search
+
+    # ------------------------------------------------------------------
+    # Схема
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def ensure_schema():
+        """Создает расширение vector, таблицу car_embeddings и HNSW-индекс, если их нет"""
+        with engine.begin() as connection:
+            if connection.dialect.name == "postgresql":
+                connection.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        CarEmbedding.__table__.create(bind=engine, checkfirst=True)
+
+    @staticmethod
+    def _get_pgvector_version(connection) -> Tuple[int, ...]:
+        global _pgvector_version
+        if _pgvector_version is None:
+            version = connection.execute(
+                text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+            ).scalar() or "0"
+            _pgvector_version = tuple(int(part) for part in re.findall(r"\d+", version)[:3])
+        return _pgvector_version
+
+    # ------------------------------------------------------------------
+    # Индексация
+    # ------------------------------------------------------------------
+
+    def build_car_document(self, car: Any) -> str:
+        """Текст автомобиля для эмбеддинга"""
+        parts = [" ".join(str(v) for v in (car.mark, car.model) if v)]
+        if car.manufacture_year:
+            parts.append(f"{car.manufacture_year} года")
+        for attr in ("body_type", "fuel_type", "gear_box_type", "driving_gear_type", "color"):
+            value = getattr(car, attr, None)
+            if value:
+                parts.append(str(value))
+        power = getattr(car, "power", None)
+        if power:
+            parts.append(f"мощность {power} л.с.")
+        mileage = getattr(car, "mileage", None)
+        if mileage is not None:
+            parts.append(f"пробег {mileage} км")
+        price = parse_price(car.price)
+        if price:
+            parts.append(f"цена {int(price)} руб.")
+        if car.city:
+            parts.append(f"город {car.city}")
+        return ", ".join(part for part in parts if part)
+
+    def _build_row(self, car_type: str, car: Any, document: str) -> Dict[str, Any]:
+        return {
+            "car_type": car_type,
+            "car_id": car.id,
+            "document": document,
+            "content_hash": hashlib.sha256(document.encode("utf-8")).hexdigest(),
+            "mark": _norm(car.mark),
+            "model": _norm(car.model),
+            "city": _norm(car.city),
+            "body_type": _norm(car.body_type),
+            "fuel_type": _norm(car.fuel_type),
+            "gear_box_type": _norm(car.gear_box_type),
+            "price": parse_price(car.price),
+            "manufacture_year": car.manufacture_year,
+            "mileage": getattr(car, "mileage", None),
+        }
+
+    def index_cars(self, batch_size: int = 100, car_types: Tuple[str, ...] = ("car", "used_car")) -> Dict[str, int]:
+        """
+        Индексирует автомобили батчами
+
+        Повторный запуск пересчитывает эмбеддинги только для новых и изменившихся автомобилей
+        (сравнивается хеш текста и модель), поэтому прерванную индексацию можно просто
+        запустить снова. Эмбеддинги удаленных из каталога автомобилей удаляются.
+
+        Returns:
+            {"indexed": пересчитано, "skipped": без изменений, "failed": без эмбеддинга, "deleted": удалено}
+        """
+        self.ensure_schema()
+        model_name = current_embedding_model()
+        stats = {"indexed": 0, "skipped": 0, "failed": 0, "deleted": 0}
+
+        db = SessionLocal()
+        try:
+            for car_type in car_types:
+                model_cls = CAR_TYPES[car_type]
+                last_id = 0
+                while True:
+                    cars = db.query(model_cls).filter(model_cls.id > last_id).order_by(model_cls.id).limit(batch_size).all()
+                    if not cars:
+                        break
+                    last_id = cars[-1].id
+
+                    rows = [self._build_row(car_type, car, self.build_car_document(car)) for car in cars]
+                    existing = dict(db.query(CarEmbedding.car_id, CarEmbedding.content_hash).filter(
+                        CarEmbedding.car_type == car_type,
+                        CarEmbedding.car_id.in_([row["car_id"] for row in rows]),
+                        CarEmbedding.embedding_model == model_name,
+                        CarEmbedding.embedding.isnot(None)
+                    ).all())
+                    changed = [row for row in rows if existing.get(row["car_id"]) != row["content_hash"]]
+                    stats["skipped"] += len(rows) - len(changed)
+                    if not changed:
+                        continue
+
+                    vectors = embed_texts([row["document"] for row in changed])
+                    ready = []
+                    for row, vector in zip(changed, vectors):
+                        if vector:
+                            row["embedding"] = vector
+                            row["embedding_model"] = model_name
+                            ready.append(row)
+                    stats["failed"] += len(changed) - len(ready)
+                    self._upsert(db, ready)
+                    db.commit()
+                    stats["indexed"] += len(ready)
+                    print(f"🔄 Векторный индекс ({car_type}): до id {last_id}, пересчитано {stats['indexed']}")
+
+                # Удаляем эмбеддинги автомобилей, которых больше нет в каталоге
+                deleted = db.query(CarEmbedding).filter(
+                    CarEmbedding.car_type == car_type,
+                    ~select(model_cls.id).where(model_cls.id == CarEmbedding.car_id).exists()
+                ).delete(synchronize_session=False)
+                db.commit()
+                stats["deleted"] += deleted
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        print(f"✅ Векторный индекс автомобилей обновлен: {stats}")
+        return stats
+
+    def _upsert(self, db: Session, rows: List[Dict[str, Any]]):
+        if not rows:
+            return
+        if engine.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+            statement = pg_insert(CarEmbedding).values(rows)
+            update_columns = {
+                column: getattr(statement.excluded, column)
+                for column in rows[0].keys() if column not in ("car_type", "car_id")
+            }
+            update_columns["updated_at"] = func.now()
+            db.execute(statement.on_conflict_do_update(
+                constraint="uq_car_embeddings_car",
+                set_=update_columns
+            ))
+        else:
+            for row in rows:
+                existing = db.query(CarEmbedding).filter(
+                    CarEmbedding.car_type == row["car_type"],
+                    CarEmbedding.car_id == row["car_id"]
+                ).first()
+                if existing:
+                    for column, value in row.items():
+                        setattr(existing, column, value)
+                else:
+                    db.add(CarEmbedding(**row))
+
+    def count_indexed(self) -> int:
+        db = self.db or SessionLocal()
+        try:
+            return db.query(func.count(CarEmbedding.id)).scalar() or 0
+        finally:
+            if db is not self.db:
+                db.close()
+
+    # ------------------------------------------------------------------
+    # Поиск
+    # ------------------------------------------------------------------
+
+    def _filter_conditions(self, filters: Optional[Dict[str, Any]]) -> List[Any]:
+        """
+        Переводит фильтры в условия SQL
+
+        Поддерживаются ключи критериев UnifiedSearchService и DatabaseService:
+        brands/mark, models/model, cities/city, body_types/body_type, fuel_types/fuel_type,
+        gear_box_types/gear_box_type, min_price/max_price, min_year/max_year,
+        min_mileage/max_mileage, car_type/type ('car'/'used_car'/'new'/'used').
+        """
+        f = filters or {}
+        conditions = []
+
+        for column, keys in (
+            (CarEmbedding.mark, ("brands", "mark")),
+            (CarEmbedding.model, ("models", "model")),
+            (CarEmbedding.city, ("cities", "city")),
+            (CarEmbedding.body_type, ("body_types", "body_type")),
+            (CarEmbedding.fuel_type, ("fuel_types", "fuel_type")),
+            (CarEmbedding.gear_box_type, ("gear_box_types", "gear_box_type")),
+        ):
+            values = _as_list(*(f.get(key) for key in keys))
+            if values:
+                conditions.append(column.in_(values))
+
+        for column, min_key, max_key in (
+            (CarEmbedding.price, "min_price", "max_price"),
+            (CarEmbedding.manufacture_year, "min_year", "max_year"),
+            (CarEmbedding.mileage, "min_mileage", "max_mileage"),
+        ):
+            if f.get(min_key) is not None:
+                conditions.append(column >= f[min_key])
+            if f.get(max_key) is not None:
+                conditions.append(column <= f[max_key])
+
+        car_types = {_CAR_TYPE_ALIASES.get(value) for value in _as_list(f.get("car_type"), f.get("type"))}
+        car_types.discard(None)
+        if car_types:
+            conditions.append(CarEmbedding.car_type.in_(sorted(car_types)))
+
+        return conditions
+
+    def _build_query(self, query_vector: List[float], k: int, filters: Optional[Dict[str, Any]]):
+        distance = CarEmbedding.embedding.cosine_distance(query_vector).label("distance")
+        return (
+            select(CarEmbedding, distance)
+            .where(and_(
+                CarEmbedding.embedding.isnot(None),
+                CarEmbedding.embedding_model == current_embedding_model(),
+                *self._filter_conditions(filters)
+            ))
+            .order_by(distance)
+            .limit(k)
+        )
+
+    def _session_settings(self, connection) -> List[str]:
+        """SET LOCAL для HNSW: ef_search и (pgvector >= 0.8) итеративный обход при фильтрах"""
+        statements = [f"SET LOCAL hnsw.ef_search = {int(max(self.ef_search, 1))}"]
+        if self._get_pgvector_version(connection) >= (0, 8):
+            statements.append("SET LOCAL hnsw.iterative_scan = relaxed_order")
+        return statements
+
+    @staticmethod
+    def _to_results(rows) -> List[Tuple[CarVectorDocument, float]]:
+        results = []
+        for entry, distance in rows:
+            document = CarVectorDocument(
+                page_content=entry.document or "",
+                metadata={
+                    "car_id": entry.car_id,
+                    "id": entry.car_id,
+                    "type": entry.car_type,
+                    "mark": entry.mark,
+                    "model": entry.model,
+                    "price": entry.price,
+                    "manufacture_year": entry.manufacture_year,
+                    "city": entry.city,
+                },
+            )
+            results.append((document, 1.0 - float(distance)))
+        return results
+
+    async def similarity_search(
+        self,
+        query: str,
+        k: int = 10,
+        filters: Optional[Dict[str, Any]] = None,
+        collection_name: Optional[str] = None,
+    ) -> List[Tuple[CarVectorDocument, float]]:
+        """
+        Ищет автомобили, близкие к запросу, с учетом структурных фильтров
+
+        Args:
+            query: Текст запроса
+            k: Сколько результатов вернуть
+            filters: Структурные фильтры (см. _filter_conditions)
+            collection_name: Не используется (оставлен для совместимости со старым PGVector API)
+
+        Returns:
+            Список (документ, сходство 0..1), отсортированный по убыванию сходства
+        """
+        if engine.dialect.name != "postgresql":
+            return []
+
+        query_vector = (await aembed_texts([query]))[0]
+        if not query_vector:
+            return []
+
+        statement = self._build_query(query_vector, k, filters)
+
+        if AsyncSessionLocal is not None:
+            async with AsyncSessionLocal() as session:
+                async with session.begin():
+                    connection = await session.connection()
+                    settings_sql = await connection.run_sync(self._session_settings)
+                    for sql in settings_sql:
+                        await session.execute(text(sql))
+                    rows = (await session.execute(statement)).all()
+            return self._to_results(rows)
+
+        return await asyncio.to_thread(self._similarity_search_sync, statement)
+
+    def _similarity_search_sync(self, statement) -> List[Tuple[CarVectorDocument, float]]:
+        db = SessionLocal()
+        try:
+            for sql in self._session_settings(db.connection()):
+                db.execute(text(sql))
+            rows = db.execute(statement).all()
+            db.rollback()  # Сбрасываем SET LOCAL
+            return self._to_results(rows)
+        finally:
+            db.close()
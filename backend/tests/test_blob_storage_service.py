@@ -0,0 +1,56 @@
+"""
+Хранилище файлов: запись потока с пределом размера и ответ 413 при загрузке документа
+"""
+import io
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import app.api.documents as documents_module
+from app.api.auth import require_admin
+from models import get_db
+from services.blob_storage_service import BlobStorage, BlobTooLargeError
+
+
+def _leftovers(root):
+    return [path for path in root.rglob("*") if path.is_file()]
+
+
+def test_put_stream_stores_by_hash(tmp_path):
+    storage = BlobStorage(tmp_path)
+
+    content_hash, size = storage.put_stream(io.BytesIO(b"hello"), max_bytes=5)
+
+    assert size == 5
+    assert storage.read_bytes(content_hash) == b"hello"
+
+
+def test_put_stream_over_limit_removes_temp_file(tmp_path, monkeypatch):
+    monkeypatch.setattr("services.blob_storage_service.READ_CHUNK_SIZE", 4)
+    stream = io.BytesIO(b"x" * 100)
+    storage = BlobStorage(tmp_path)
+
+    with pytest.raises(BlobTooLargeError):
+        storage.put_stream(stream, max_bytes=10)
+
+    # Чтение прервано на третьем куске, а не после всего потока
+    assert stream.tell() == 12
+    assert _leftovers(tmp_path) == []
+
+
+def test_upload_over_limit_returns_413(tmp_path, monkeypatch):
+    monkeypatch.setattr(documents_module, "document_blob_storage", BlobStorage(tmp_path))
+    monkeypatch.setattr(documents_module, "MAX_UPLOAD_SIZE", 10)
+    app = FastAPI()
+    app.include_router(documents_module.router)
+    app.dependency_overrides[require_admin] = lambda: object()
+    app.dependency_overrides[get_db] = lambda: None
+
+    response = TestClient(app).post(
+        f"{documents_module.router.prefix}/upload",
+        files={"file": ("big.txt", b"x" * 100, "text/plain")},
+    )
+
+    assert response.status_code == 413
+    assert _leftovers(tmp_path) == []
@@ -0,0 +1,63 @@
+"""
+Краткие карточки результатов поиска: _source Elasticsearch и догрузка из каталога
+"""
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from models import Base
+from models.database import Car, UsedCar
+from services.car_hydration_service import CarHydrator
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine, tables=[Car.__table__, UsedCar.__table__])
+    session = sessionmaker(bind=engine)()
+    session.add_all([
+        Car(id=1, mark="BMW", model="X5", price="5 000 000", city="Москва", manufacture_year=2023),
+        UsedCar(id=2, mark="Lada", model="Vesta", price="900 000", city="Казань", manufacture_year=2019, mileage=40000),
+    ])
+    session.commit()
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    session.statements = statements
+    yield session
+    session.close()
+
+
+def _source(**fields):
+    return {"_source": fields}
+
+
+def test_complete_source_skips_database(db):
+    hit = _source(id=7, type="used_car", mark="Kia", model="Rio", price="1", city="Омск",
+                  manufacture_year=2020, mileage=10)
+
+    summaries = CarHydrator(db).summaries_from_hits([hit])
+
+    assert summaries == [{"id": 7, "type": "used_car", "mark": "Kia", "model": "Rio", "price": "1",
+                          "city": "Омск", "manufacture_year": 2020, "mileage": 10}]
+    assert db.statements == []
+
+
+def test_partial_sources_are_loaded_in_hit_order(db):
+    hits = [_source(id=2, type="used_car"), _source(id=1, type="car", mark="BMW"), _source(id=99, type="car")]
+
+    summaries = CarHydrator(db).summaries_from_hits(hits)
+
+    assert [summary and (summary["type"], summary["id"]) for summary in summaries] == [
+        ("used_car", 2), ("car", 1), None
+    ]
+    assert summaries[0]["mileage"] == 40000
+
+
+def test_known_type_is_not_matched_in_other_table(db):
+    # car 2 и used_car 1 не существуют; с теми же id есть автомобили другого типа
+    hits = [_source(id=2, type="car"), _source(id=1, type="used_car"), _source(id=2)]
+
+    summaries = CarHydrator(db).summaries_from_hits(hits)
+
+    assert summaries[:2] == [None, None]
+    assert (summaries[2]["type"], summaries[2]["id"]) == ("used_car", 2)
@@ -0,0 +1,171 @@
+"""
+Set-based перенос импорта в каталог: режимы replace, append и upsert на SQLite
+"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base
+from models.database import (
+    Car, CarOption, CarOptionsGroup, CarPicture, ImportCar, ImportCarOption, ImportCarOptionsGroup,
+    ImportCarPicture, ImportUsedCar, ImportUsedCarPicture, UsedCar, UsedCarPicture,
+)
+from services.catalog_migration_service import CatalogMigrationService
+
+TABLES = [
+    Car, CarPicture, CarOptionsGroup, CarOption, UsedCar, UsedCarPicture,
+    ImportCar, ImportCarPicture, ImportCarOptionsGroup, ImportCarOption, ImportUsedCar, ImportUsedCarPicture,
+]
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'catalog.db'}")
+    Base.metadata.create_all(engine, tables=[model.__table__ for model in TABLES])
+    session = sessionmaker(bind=engine, autoflush=False)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _catalog_car(db, vin, mark="BMW", price="100", pictures=(), options=()):
+    car = Car(vin=vin, mark=mark, model="X", price=price)
+    db.add(car)
+    db.flush()
+    db.add_all(CarPicture(car_id=car.id, url=url, seqno=seqno) for seqno, url in enumerate(pictures))
+    db.add_all(CarOption(car_id=car.id, description=description) for description in options)
+    db.commit()
+    return car.id
+
+
+def _import_car(db, vin, mark="BMW", price="100", pictures=(), options=(), status="imported"):
+    car = ImportCar(vin=vin, mark=mark, model="X", price=price, import_status=status)
+    db.add(car)
+    db.flush()
+    db.add_all(ImportCarPicture(car_id=car.id, url=url, seqno=seqno) for seqno, url in enumerate(pictures))
+    db.add_all(ImportCarOption(car_id=car.id, description=description) for description in options)
+    db.commit()
+    return car.id
+
+
+def _cars(db):
+    return {car.vin: (car.mark, car.price) for car in db.query(Car).order_by(Car.id)}
+
+
+def _pictures(db, car_id):
+    return [p.url for p in db.query(CarPicture).filter(CarPicture.car_id == car_id).order_by(CarPicture.seqno)]
+
+
+def _options(db, car_id):
+    return sorted(o.description for o in db.query(CarOption).filter(CarOption.car_id == car_id))
+
+
+def test_replace_swaps_catalog(db):
+    _catalog_car(db, "OLD1", pictures=["old.jpg"], options=["old"])
+    _import_car(db, "NEW1", mark="Audi", pictures=["a.jpg", "b.jpg"], options=["ABS", "ESP"])
+    _import_car(db, "NEW2", mark="Kia")
+    _import_car(db, "SKIP", status="error")
+
+    stats = CatalogMigrationService(db).migrate(car_type="new", mode="replace")
+
+    assert stats["new"] == {"inserted": 2, "updated": 0, "unchanged": 0, "deleted_old": 1,
+                            "pictures": 2, "options": 2}
+    assert _cars(db) == {"NEW1": ("Audi", "100"), "NEW2": ("Kia", "100")}
+    audi_id = db.query(Car.id).filter(Car.vin == "NEW1").scalar()
+    assert _pictures(db, audi_id) == ["a.jpg", "b.jpg"]
+    assert _options(db, audi_id) == ["ABS", "ESP"]
+    assert db.query(CarPicture).count() == 2
+    statuses = dict(db.query(ImportCar.vin, ImportCar.import_status))
+    assert statuses == {"NEW1": "migrated", "NEW2": "migrated", "SKIP": "error"}
+
+
+def test_append_keeps_catalog_and_allocates_new_ids(db):
+    old_id = _catalog_car(db, "OLD1", pictures=["old.jpg"])
+    _import_car(db, "NEW1", pictures=["n.jpg"])
+
+    stats = CatalogMigrationService(db).migrate(car_type="new", mode="append")
+
+    assert stats["new"]["inserted"] == 1 and stats["new"]["deleted_old"] == 0
+    assert set(_cars(db)) == {"OLD1", "NEW1"}
+    new_id = db.query(Car.id).filter(Car.vin == "NEW1").scalar()
+    assert new_id > old_id
+    assert _pictures(db, old_id) == ["old.jpg"]
+    assert _pictures(db, new_id) == ["n.jpg"]
+
+    # Повторный запуск: перенесенные записи уже migrated
+    again = CatalogMigrationService(db).migrate(car_type="new", mode="append")
+    assert again["new"]["inserted"] == 0
+    assert db.query(Car).count() == 2
+
+
+def test_upsert_updates_only_changed_cars(db):
+    same_id = _catalog_car(db, "SAME", pictures=["s.jpg"], options=["ABS"])
+    price_id = _catalog_car(db, "PRICE", price="100", pictures=["p.jpg"])
+    photo_id = _catalog_car(db, "PHOTO", pictures=["old.jpg"])
+    keep_id = _catalog_car(db, "KEEP")
+
+    _import_car(db, "SAME", pictures=["s.jpg"], options=["ABS"])
+    _import_car(db, "price", price="200", pictures=["p.jpg"])  # VIN сравнивается без учета регистра
+    _import_car(db, "PHOTO", pictures=["new1.jpg", "new2.jpg"])
+    _import_car(db, "FRESH", mark="Kia")
+    _import_car(db, "DUP", price="1")
+    _import_car(db, "DUP", price="2")  # Из дубликатов VIN берется последняя запись
+
+    stats = CatalogMigrationService(db).migrate(car_type="new", mode="upsert")
+
+    # Фотографии изменившихся автомобилей перезаписываются целиком: PRICE (1) и PHOTO (2)
+    assert stats["new"] == {"inserted": 2, "updated": 2, "unchanged": 1, "deleted_old": 0,
+                            "pictures": 3, "options": 0}
+    cars = _cars(db)
+    assert cars["DUP"] == ("BMW", "2")
+    assert len(cars) == 6
+    # Существующие автомобили сохраняют id (поля, включая VIN, берутся из импорта),
+    # нетронутый - свои фотографии и опции
+    updated = db.get(Car, price_id)
+    assert (updated.vin, updated.price) == ("price", "200")
+    assert _pictures(db, same_id) == ["s.jpg"] and _options(db, same_id) == ["ABS"]
+    assert _pictures(db, price_id) == ["p.jpg"]
+    assert _pictures(db, photo_id) == ["new1.jpg", "new2.jpg"]
+    assert db.get(Car, keep_id) is not None
+    assert {status for (status,) in db.query(ImportCar.import_status)} == {"migrated"}
+
+
+def test_used_cars_are_migrated_separately(db):
+    db.add(UsedCar(vin="U-OLD", mark="Lada"))
+    used = ImportUsedCar(vin="U1", mark="Ford", mileage=1000, import_status="imported")
+    db.add(used)
+    db.flush()
+    db.add(ImportUsedCarPicture(used_car_id=used.id, url="u.jpg", seqno=0))
+    db.commit()
+    _catalog_car(db, "CAR")
+
+    stats = CatalogMigrationService(db).migrate(car_type="used", mode="replace")
+
+    assert list(stats) == ["used"]
+    assert stats["used"]["inserted"] == 1 and stats["used"]["pictures"] == 1
+    assert [(car.vin, car.mileage) for car in db.query(UsedCar)] == [("U1", 1000)]
+    assert set(_cars(db)) == {"CAR"}
+
+
+def test_failure_rolls_back_whole_migration(db, monkeypatch):
+    _catalog_car(db, "OLD1")
+    _import_car(db, "NEW1")
+    service = CatalogMigrationService(db)
+
+    def broken(*args):
+        raise RuntimeError("сбой")
+
+    monkeypatch.setattr(service, "_copy_children", broken)
+    with pytest.raises(RuntimeError):
+        service.migrate(car_type="new", mode="replace")
+
+    # Каталог не опустел посреди миграции, импорт не помечен
+    assert set(_cars(db)) == {"OLD1"}
+    assert db.query(ImportCar.import_status).scalar() == "imported"
+
+
+def test_unknown_mode_and_type_are_rejected(db):
+    with pytest.raises(ValueError):
+        CatalogMigrationService(db).migrate(mode="merge")
+    with pytest.raises(ValueError):
+        CatalogMigrationService(db).migrate(car_type="truck")
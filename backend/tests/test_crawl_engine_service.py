@@ -0,0 +1,87 @@
+"""
+Загрузчик: предел размера ответа по Content-Length и по мере чтения тела
+"""
+import asyncio
+
+import httpx
+
+from services.crawl_engine_service import AsyncCrawler
+
+
+def _fetch(crawler, handler, url="https://img.example/photo.jpg"):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await crawler.fetch(client, url)
+
+    return asyncio.run(run())
+
+
+def test_small_body_is_read():
+    crawler = AsyncCrawler(max_bytes=10, max_retries=0)
+    result = _fetch(crawler, lambda request: httpx.Response(200, content=b"12345"))
+
+    assert result.ok
+    assert result.content == b"12345"
+
+
+def test_content_length_over_limit_is_not_read():
+    streamed = []
+
+    async def body():
+        streamed.append(True)
+        yield b"x" * 100
+
+    def handler(request):
+        return httpx.Response(200, headers={"Content-Length": "100"}, content=body())
+
+    crawler = AsyncCrawler(max_bytes=10, max_retries=0)
+    result = _fetch(crawler, handler)
+
+    assert not result.ok
+    assert result.status_code == 200
+    assert result.content == b""
+    assert "10" in result.error
+    assert streamed == []
+
+
+def test_body_without_content_length_is_aborted_over_limit():
+    sent = []
+
+    async def body():
+        for _ in range(100):
+            sent.append(4)
+            yield b"xxxx"
+
+    crawler = AsyncCrawler(max_bytes=10, max_retries=0)
+    result = _fetch(crawler, lambda request: httpx.Response(200, content=body()))
+
+    assert not result.ok
+    assert result.content == b""
+    # Чтение прервано на третьем куске (12 > 10), остальное тело не загружалось
+    assert sum(sent) < 100 * 4
+
+
+def test_no_limit_reads_whole_body():
+    crawler = AsyncCrawler(max_retries=0)
+    result = _fetch(crawler, lambda request: httpx.Response(200, content=b"x" * 1000))
+
+    assert result.ok
+    assert len(result.content) == 1000
+
+
+def test_retry_status_is_retried():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            return httpx.Response(503)
+        return httpx.Response(200, content=b"ok")
+
+    crawler = AsyncCrawler(max_bytes=10, max_retries=1)
+    crawler._backoff = lambda attempt: 0
+    result = _fetch(crawler, handler)
+
+    assert result.ok
+    assert result.content == b"ok"
+    assert len(calls) == 2
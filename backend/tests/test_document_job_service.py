@@ -0,0 +1,137 @@
+"""
+Очередь обработки документов: heartbeat, возврат зависших задач, предел попыток
+"""
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import services.document_job_service as job_module
+from models import Base
+from models.database import Document, DocumentJob
+from services.document_job_service import DocumentJobWorker
+
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine, tables=[Document.__table__, DocumentJob.__table__])
+    factory = sessionmaker(bind=engine, autoflush=False)
+    monkeypatch.setattr(job_module, "SessionLocal", factory)
+    monkeypatch.setattr(job_module, "engine", engine)
+    yield factory
+    engine.dispose()
+
+
+def _add_job(factory, **fields) -> int:
+    db = factory()
+    try:
+        document = Document(filename="a.pdf", original_filename="a.pdf", file_type="pdf", file_size=1)
+        db.add(document)
+        db.flush()
+        values = dict(status="running", stage="extract", attempts=1, max_attempts=3, worker_id="dead:1:0",
+                      heartbeat_at=job_module._now() - timedelta(hours=1), run_after=job_module._now())
+        values.update(fields)
+        job = DocumentJob(document_id=document.id, **values)
+        db.add(job)
+        db.commit()
+        return job.id
+    finally:
+        db.close()
+
+
+def _load(factory, job_id: int):
+    db = factory()
+    try:
+        job = db.get(DocumentJob, job_id)
+        return job, db.get(Document, job.document_id)
+    finally:
+        db.close()
+
+
+def test_stale_job_is_requeued(session_factory):
+    job_id = _add_job(session_factory, attempts=1)
+
+    DocumentJobWorker(stale_after=60)._requeue_stale_jobs()
+
+    job, document = _load(session_factory, job_id)
+    assert job.status == "queued"
+    assert job.worker_id is None
+    assert document.processing_status != "failed"
+
+
+def test_stale_job_without_attempts_left_fails(session_factory):
+    job_id = _add_job(session_factory, attempts=3, max_attempts=3)
+
+    DocumentJobWorker(stale_after=60)._requeue_stale_jobs()
+
+    job, document = _load(session_factory, job_id)
+    assert job.status == "failed"
+    assert job.finished_at is not None
+    assert document.processing_status == "failed"
+    assert document.error_message == job.error_message
+
+
+def test_fresh_running_job_is_not_requeued(session_factory):
+    job_id = _add_job(session_factory, heartbeat_at=job_module._now())
+
+    DocumentJobWorker(stale_after=60)._requeue_stale_jobs()
+
+    assert _load(session_factory, job_id)[0].status == "running"
+
+
+def test_requeue_runs_at_most_once_per_interval(session_factory, monkeypatch):
+    worker = DocumentJobWorker(stale_after=60, requeue_interval=3600)
+    calls = []
+    monkeypatch.setattr(worker, "_requeue_stale_jobs", lambda: calls.append(1))
+
+    worker._maybe_requeue_stale_jobs()
+    worker._maybe_requeue_stale_jobs()
+
+    assert calls == [1]
+
+
+def test_heartbeat_keeps_long_job_alive(session_factory, monkeypatch):
+    release = threading.Event()
+
+    class SlowDocumentService:
+        def __init__(self, db):
+            self.db = db
+
+        def get_document(self, document_id):
+            return self.db.get(Document, document_id)
+
+        def process_document_streaming(self, document, **kwargs):
+            # Долгий этап без коммитов прогресса (извлечение текста, метаданные)
+            release.wait(10)
+            return 1
+
+        def mark_document_completed(self, document):
+            document.processing_status = "completed"
+
+    monkeypatch.setattr(job_module, "DocumentService", SlowDocumentService)
+    worker_id = "host:1:0"
+    job_id = _add_job(session_factory, worker_id=worker_id)
+    stale_heartbeat = _load(session_factory, job_id)[0].heartbeat_at
+
+    worker = DocumentJobWorker(stale_after=2)
+    thread = threading.Thread(target=worker._process_job, args=(job_id, worker_id))
+    thread.start()
+    try:
+        deadline = time.monotonic() + 5
+        while _load(session_factory, job_id)[0].heartbeat_at == stale_heartbeat:
+            assert time.monotonic() < deadline, "heartbeat не обновился"
+            time.sleep(0.1)
+
+        worker._requeue_stale_jobs()
+        assert _load(session_factory, job_id)[0].status == "running"
+    finally:
+        release.set()
+        thread.join()
+
+    job, document = _load(session_factory, job_id)
+    assert job.status == "completed"
+    assert document.processing_status == "completed"
@@ -0,0 +1,70 @@
+"""
+Провайдеры эмбеддингов: абстрактный базовый класс, батчи локальной модели в embed и aembed
+"""
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+from services.embedding_provider_service import (
+    EMBEDDING_DIMENSION,
+    EmbeddingProvider,
+    LocalEmbeddingProvider,
+    create_embedding_provider,
+)
+
+
+class FakeModel:
+    """Модель, кодирующая текст его длиной; запоминает размеры батчей и потоки"""
+
+    def __init__(self):
+        self.batches = []
+        self.threads = set()
+
+    def encode(self, texts, **kwargs):
+        self.batches.append(len(texts))
+        self.threads.add(threading.current_thread().name)
+        return np.array([[float(len(text)), 1.0] for text in texts])
+
+
+@pytest.fixture
+def provider():
+    provider = LocalEmbeddingProvider("fake", max_workers=2, batch_size=2)
+    provider._model = FakeModel()
+    yield provider
+    provider.close()
+
+
+TEXTS = ["a", "bb", "ccc", "dddd", "eeeee"]
+
+
+def test_base_provider_is_abstract():
+    with pytest.raises(TypeError):
+        EmbeddingProvider()
+
+
+def test_unknown_provider_is_rejected():
+    with pytest.raises(ValueError):
+        create_embedding_provider("openai:text-embedding-3")
+
+
+def test_embed_encodes_in_batches(provider):
+    vectors = provider.embed(TEXTS)
+
+    assert sorted(provider._model.batches) == [1, 2, 2]
+    assert [vector[0] for vector in vectors] == [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert all(len(vector) == EMBEDDING_DIMENSION for vector in vectors)
+
+
+def test_aembed_uses_same_batches_and_pool(provider):
+    vectors = asyncio.run(provider.aembed(TEXTS))
+
+    assert sorted(provider._model.batches) == [1, 2, 2]
+    assert all(name.startswith("local-embed") for name in provider._model.threads)
+    assert vectors == provider.embed(TEXTS)
+
+
+def test_aembed_empty(provider):
+    assert asyncio.run(provider.aembed([])) == []
+    assert provider._model.batches == []
@@ -0,0 +1,89 @@
+"""
+Фасеты каталога: пересчет в фоне при первом запуске и после коммита
+"""
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import services.facet_service as facet_module
+import services.pagination_service as pagination_module
+from models import Base
+from models.database import Car, InventoryFacetSnapshot, ParsedCar, UsedCar
+from services.facet_service import FacetStore
+
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'facets.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine, tables=[
+        Car.__table__, UsedCar.__table__, ParsedCar.__table__, InventoryFacetSnapshot.__table__,
+    ])
+    factory = sessionmaker(bind=engine, autoflush=False)
+    monkeypatch.setattr(facet_module, "SessionLocal", factory)
+    # Только подписчики теста: глобальный facet_store не должен пересчитывать тестовую БД
+    monkeypatch.setattr(pagination_module, "_commit_listeners", [])
+    yield factory
+    engine.dispose()
+
+
+def _add_car(factory, mark: str):
+    db = factory()
+    try:
+        db.add(Car(mark=mark, model="X", city="Москва", price="1000000", manufacture_year=2020))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_cold_start_rebuilds_in_background(session_factory, monkeypatch):
+    _add_car(session_factory, "BMW")
+    store = FacetStore(ttl_seconds=0, rebuild_delay_seconds=60)
+
+    compute = store._compute
+
+    def slow_compute(db, car_type):
+        time.sleep(0.3)
+        return compute(db, car_type)
+
+    monkeypatch.setattr(store, "_compute", slow_compute)
+
+    started = time.perf_counter()
+    assert store.brands("car") == []
+    # Полный пересчет (3 типа по 0.3с) не выполняется в запросе
+    assert time.perf_counter() - started < 0.3
+
+    assert _wait_for(lambda: store.brands("car") == ["BMW"])
+
+
+def test_commit_refreshes_snapshot(session_factory):
+    store = FacetStore(ttl_seconds=60, rebuild_delay_seconds=0.05)
+    store.rebuild()
+    pagination_module.register_commit_listener(store.on_commit)
+    assert store.brands("car") == []
+
+    _add_car(session_factory, "Audi")
+    _add_car(session_factory, "Audi")
+    _add_car(session_factory, "BMW")
+
+    assert _wait_for(lambda: store.brands("car") == ["Audi", "BMW"])
+    assert store.get("car")["count"] == 3
+    assert store.cars_statistics()["total_cars_count"] == 3
+
+
+def test_unrelated_commit_does_not_schedule_rebuild(session_factory):
+    store = FacetStore(ttl_seconds=60, rebuild_delay_seconds=0.05)
+
+    store.on_commit({"documents"})
+
+    assert store._timer is None
@@ -0,0 +1,63 @@
+"""
+Паритет нечеткого сопоставления полей импорта с полным перебором
+
+Эталон - прежний алгоритм import_service: similarity со всеми целевыми полями.
+"""
+from difflib import SequenceMatcher
+
+import pytest
+
+from services.field_mapping_service import (
+    CAR_FIELDS, SUGGESTION_FIELDS, USED_CAR_FIELDS, XML_FIELD_MAPPING, FieldMapper, normalize_field_name,
+)
+
+SOURCE_FIELDS = [
+    "Mdl", "mdl", "km", "yr", "town", "car_brand", "brand", "car_model", "model_name", "prc",
+    "price_rub", "cost", "vin_code", "VIN_number", "colour", "body", "kpp", "gearbox", "transmission_type",
+    "drive", "engine_volume", "engine_capacity", "hp", "horse_power", "fuel", "mileage_km", "run",
+    "dealer", "dealer_name", "city_name", "year_of_manufacture", "manufactureYear", "offer.title",
+    "offer.params.body-type", "stock", "qty", "discount_credit", "max_discount", "owners_count",
+    "phone", "contact", "generation", "modification", "ad_state", "region_name", "x", "id",
+]
+
+
+def _ratio(a: str, b: str) -> float:
+    return SequenceMatcher(None, a.lower(), b.lower()).ratio()
+
+
+def _reference_auto_score(source_field: str):
+    """Лучшая схожесть полного перебора (None - ниже порога 0.5)"""
+    normalized = normalize_field_name(source_field)
+    best = max(_ratio(normalized, target.lower().replace("_", "")) for target in set(CAR_FIELDS + USED_CAR_FIELDS))
+    return best if best > 0.5 else None
+
+
+def _reference_suggest(source_field: str):
+    normalized = normalize_field_name(source_field)
+    scores = [(field, _ratio(normalized, field.lower().replace("_", ""))) for field in SUGGESTION_FIELDS]
+    scores.sort(key=lambda item: item[1], reverse=True)
+    return [field for field, score in scores[:5] if score > 0.3]
+
+
+@pytest.fixture(scope="module")
+def mapper():
+    return FieldMapper()
+
+
+@pytest.mark.parametrize("source_field", SOURCE_FIELDS)
+def test_auto_map_matches_full_scan(mapper, source_field):
+    if source_field.split(".")[-1].lower() in {key.lower() for key in XML_FIELD_MAPPING}:
+        pytest.skip("точное совпадение из XML_FIELD_MAPPING")
+    expected = _reference_auto_score(source_field)
+    mapped = mapper.map_field(source_field)
+    if expected is None:
+        assert mapped is None
+    else:
+        # При равной схожести прежний перебор по set выбирал любое из полей - сравниваем оценку
+        assert mapped is not None
+        assert _ratio(normalize_field_name(source_field), normalize_field_name(mapped)) == expected
+
+
+@pytest.mark.parametrize("source_field", SOURCE_FIELDS)
+def test_suggestions_match_full_scan(mapper, source_field):
+    assert mapper.suggest(source_field) == _reference_suggest(source_field)
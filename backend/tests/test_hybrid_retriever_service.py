@@ -0,0 +1,139 @@
+"""
+Гибридный поиск: слияние RRF, отбрасывание источника по таймауту, бюджет загрузки карточек
+"""
+import asyncio
+import time
+
+import pytest
+
+import services.hybrid_retriever_service as retriever_module
+from services.hybrid_retriever_service import HybridRetriever
+
+
+def _card(car_id, car_type="car", mark="BMW"):
+    card = {"id": car_id, "type": car_type, "mark": mark, "model": "M", "price": "1",
+            "city": "Москва", "manufacture_year": 2020}
+    if car_type == "used_car":
+        card["mileage"] = 1000
+    return card
+
+
+class FakeElasticsearch:
+    def __init__(self, sources):
+        self.sources = sources
+
+    def is_available(self):
+        return True
+
+    async def search_cars(self, **params):
+        return {"hits": [{"_source": source} for source in self.sources]}
+
+
+class FakeDocument:
+    def __init__(self, metadata):
+        self.metadata = metadata
+
+
+class FakeVector:
+    def __init__(self, metadata, delay=0.0):
+        self.metadata = metadata
+        self.delay = delay
+
+    async def similarity_search(self, query, k=10, filters=None):
+        await asyncio.sleep(self.delay)
+        return [(FakeDocument(item), 0.9) for item in self.metadata]
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    """Каталог, из которого догружаются неполные карточки: {(type, id): карточка}"""
+    cards = {}
+
+    def summaries_from_hits(self, hits):
+        result = []
+        for hit in hits:
+            source = hit["_source"]
+            result.append(retriever_module.car_summary_from_source(source)
+                          or cards.get((source.get("type"), source["id"])))
+        return result
+
+    monkeypatch.setattr(retriever_module.CarHydrator, "summaries_from_hits", summaries_from_hits)
+    monkeypatch.setattr(retriever_module, "SessionLocal", lambda: type("S", (), {"close": lambda self: None})())
+    return cards
+
+
+def _retriever(es=None, vector=None, **kwargs):
+    kwargs.setdefault("timeouts", {"elasticsearch": 0.5, "vector": 0.5})
+    kwargs.setdefault("hydrate_timeout", 0.5)
+    return HybridRetriever(elasticsearch_service=es, vector_search_service=vector, use_sql=False, rrf_k=60, **kwargs)
+
+
+def test_rrf_orders_by_summed_reciprocal_ranks(catalog):
+    catalog[("car", 3)] = _card(3, mark="Audi")
+    # У 3 неполный _source - карточка догружается из каталога
+    es = FakeElasticsearch([_card(1), _card(2), {"id": 3, "type": "car"}])
+    vector = FakeVector([{"car_id": 3, "type": "car"}, {"car_id": 2, "type": "car"}])
+
+    result = asyncio.run(_retriever(es, vector).retrieve("bmw"))
+
+    # 3: 1/63 + 1/61 = 0.03227, 2: 1/62 + 1/62 = 0.03226, 1: 1/61
+    assert [item["id"] for item in result["results"]] == [3, 2, 1]
+    assert result["results"][0]["sources"] == ["elasticsearch", "vector"]
+    assert result["results"][0]["ranks"] == {"elasticsearch": 3, "vector": 1}
+    assert result["results"][0]["data"]["mark"] == "Audi"
+    assert result["sources"]["vector"]["contributed"] == 2
+
+
+def test_timed_out_source_is_dropped(catalog):
+    es = FakeElasticsearch([_card(1), _card(2)])
+    vector = FakeVector([{"car_id": 9, "type": "car"}], delay=2.0)
+    catalog[("car", 9)] = _card(9)
+
+    started = time.perf_counter()
+    result = asyncio.run(_retriever(es, vector, timeouts={"elasticsearch": 0.5, "vector": 0.1}).retrieve("bmw"))
+
+    assert time.perf_counter() - started < 1.0
+    assert result["sources"]["vector"]["status"] == "timeout"
+    assert result["sources"]["vector"]["contributed"] == 0
+    assert [item["id"] for item in result["results"]] == [1, 2]
+
+
+def test_results_are_limited_before_hydration(catalog, monkeypatch):
+    seen = []
+    original = HybridRetriever._hydrate
+
+    def hydrate(results):
+        seen.append(len(results))
+        return original(results)
+
+    monkeypatch.setattr(HybridRetriever, "_hydrate", staticmethod(hydrate))
+    es = FakeElasticsearch([_card(car_id) for car_id in range(1, 11)])
+
+    result = asyncio.run(_retriever(es).retrieve("bmw", limit=3))
+
+    assert seen == [3]
+    assert [item["id"] for item in result["results"]] == [1, 2, 3]
+
+
+def test_slow_catalog_falls_back_to_source_payloads(catalog, monkeypatch):
+    def slow_hydrate(results):
+        time.sleep(1.0)
+        return []
+
+    monkeypatch.setattr(HybridRetriever, "_hydrate", staticmethod(slow_hydrate))
+    es = FakeElasticsearch([_card(1)])
+    vector = FakeVector([{"car_id": 5, "type": "car", "mark": "bmw"}])
+
+    async def timed():
+        started = time.perf_counter()
+        result = await _retriever(es, vector, hydrate_timeout=0.1).retrieve("bmw")
+        return result, time.perf_counter() - started
+
+    # asyncio.run дожидается потока загрузки при закрытии loop, поэтому время меряем внутри
+    result, elapsed = asyncio.run(timed())
+
+    assert elapsed < 0.9
+    by_id = {item["id"]: item for item in result["results"]}
+    assert by_id[1]["data"] == _card(1)
+    assert by_id[5]["data"] == {"car_id": 5, "type": "car", "mark": "bmw"}
+    assert all("card" not in item for item in result["results"])
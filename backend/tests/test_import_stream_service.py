@@ -0,0 +1,95 @@
+"""
+Потоковое чтение файлов импорта: записи и root_key совпадают с разбором файла целиком
+"""
+import io
+import json
+
+import pytest
+
+from services.import_service import ImportService
+from services.import_stream_service import ImportRecordStream
+
+# Маленький блок чтения: значения, ключи и числа рвутся на границах блоков
+CHUNK_SIZES = [3, 7, 64 * 1024]
+
+JSON_FILES = {
+    "array": [{"mark": "BMW", "price": 1234567, "Images": [{"url": "a"}]}, {"mark": "Лада", "price": 1.5e6}],
+    "empty_array": [],
+    "object_with_array": {"meta": {"total": 2}, "cars": [{"id": 1}, {"id": 22222}], "after": [3]},
+    "nested_array": {"data": {"count": 10, "items": [{"vin": "X"}, {"vin": "Y", "ok": True, "v": None}]}},
+    "object_without_array": {"mark": "Audi", "options": {"a": 1}},
+    "escapes": [{"text": "кавычка \" и \\ и é", "k": -12.5e-3}],
+}
+
+XML_FILES = {
+    "ads": (
+        "<Ads><Ad><Id>1</Id><Make>BMW</Make><Images><Image url='a'/><Image url='b'/></Images></Ad>"
+        "<Ad><Id>2</Id><Make>Лада</Make><Kilometrage>1000</Kilometrage></Ad></Ads>"
+    ),
+    "dealer_center": (
+        "<DealerCenter><Name>ДЦ</Name><picture_path>/p</picture_path>"
+        "<Cars><CarOrder><mark_id>Audi</mark_id><ComplLevel>A, B</ComplLevel></CarOrder>"
+        "<CarOrder><mark_id>BMW</mark_id><Color Title='Цвет' value='черный'/></CarOrder></Cars>"
+        "</DealerCenter>"
+    ),
+    "dealer_center_without_car_orders": (
+        "<DealerCenter><picture_path>/p</picture_path><Car><mark>Kia</mark></Car>"
+        "<Car><mark>Haval</mark></Car></DealerCenter>"
+    ),
+    "generic_same_tags": "<Root><Item><a>1</a></Item><Item><a>2</a><a>3</a></Item></Root>",
+    "generic_no_children": "<Root>текст</Root>",
+    "ads_without_ads": "<Ads><Meta>1</Meta></Ads>",
+}
+
+
+def _stream(content: bytes, file_type: str, chunk_size: int):
+    stream = ImportRecordStream(io.BytesIO(content), file_type, chunk_size=chunk_size)
+    records = list(stream)
+    return stream.root_key, records
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize("name", sorted(JSON_FILES))
+def test_json_stream_matches_full_parse(name, chunk_size):
+    content = json.dumps(JSON_FILES[name], ensure_ascii=False, indent=1).encode("utf-8")
+
+    assert _stream(content, "json", chunk_size) == ImportService(None).parse_json_file(content)
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize("name", sorted(XML_FILES))
+def test_xml_stream_matches_full_parse(name, chunk_size):
+    content = ('<?xml version="1.0" encoding="utf-8"?>\n' + XML_FILES[name]).encode("utf-8")
+
+    assert _stream(content, "xml", chunk_size) == ImportService(None).parse_xml_file(content)
+
+
+def test_xml_generic_root_with_mixed_tags_yields_children():
+    # Единственное отличие от разбора целиком: тот делал из такого корня одну запись,
+    # а потоковое чтение не знает заранее, одинаковы ли теги дочерних элементов
+    content = b"<Root><Car><a>1</a></Car><Info>x</Info></Root>"
+
+    assert _stream(content, "xml", 7) == ("Car", [{"a": "1"}, "x"])
+
+
+def test_json_with_bom_is_read():
+    content = "﻿".encode("utf-8") + json.dumps([{"a": 1}]).encode("utf-8")
+
+    assert _stream(content, "json", 2) == ("", [{"a": 1}])
+
+
+def test_stream_reads_in_chunks():
+    content = json.dumps([{"id": i, "text": "x" * 100} for i in range(1000)]).encode("utf-8")
+    stream = ImportRecordStream(io.BytesIO(content), "json", chunk_size=1024)
+
+    iterator = iter(stream)
+    assert next(iterator) == {"id": 0, "text": "x" * 100}
+    # Первая запись получена без чтения всего файла
+    assert stream.bytes_read < len(content) // 10
+    assert sum(1 for _ in iterator) == 999
+    assert stream.bytes_read == len(content)
+
+
+def test_unsupported_type_is_rejected():
+    with pytest.raises(ValueError):
+        ImportRecordStream(io.BytesIO(b""), "csv")
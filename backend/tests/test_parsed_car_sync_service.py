@@ -0,0 +1,148 @@
+"""
+Инкрементальная синхронизация объявлений: хеш содержимого, журнал изменений и курсор по нему
+"""
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import services.pagination_service as pagination_module
+from app.api.parser_api import get_parsed_car_changes
+from models import Base
+from models.database import CrawlFrontierEntry, ParsedCar, ParsedCarChange, ParsedCarPicture
+from services.parsed_car_sync_service import ParsedCarSync
+
+SITE = "https://cars.example"
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'parsed.db'}")
+    Base.metadata.create_all(engine, tables=[
+        ParsedCar.__table__, ParsedCarPicture.__table__, ParsedCarChange.__table__, CrawlFrontierEntry.__table__,
+    ])
+    # Коммиты parsed_cars не должны планировать пересчет фасетов рабочей БД
+    monkeypatch.setattr(pagination_module, "_commit_listeners", [])
+    session = sessionmaker(bind=engine, autoflush=False)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _car(number, price="1000000", pictures=("a.jpg",), site=SITE):
+    return {
+        "source_url": f"{site}/car/{number}",
+        "mark": "BMW", "model": "X5", "city": "Москва", "price": price, "manufacture_year": 2020,
+        "characteristics": {"Привод": "полный"}, "car_type": "used",
+        "pictures": [{"image_url": url, "seqno": seqno} for seqno, url in enumerate(pictures)],
+    }
+
+
+def _sync(db, cars, batch_size=2):
+    sync = ParsedCarSync(db, SITE + "/", batch_size=batch_size)
+    for car in cars:
+        sync.add(car)
+    sync.flush()
+    return sync
+
+
+def _changes(db, after_id):
+    return asyncio.run(get_parsed_car_changes(after_id=after_id, limit=500, db=db))
+
+
+def _seen(db, *numbers):
+    """Ссылки объявлений, найденные на страницах каталога в текущем обходе"""
+    db.query(CrawlFrontierEntry).delete()
+    db.add_all(CrawlFrontierEntry(crawl_key=SITE, url=f"{SITE}/car/{number}", kind="car", status="done")
+               for number in numbers)
+    db.commit()
+
+
+def test_unchanged_cars_are_skipped_and_not_logged(db):
+    first = _sync(db, [_car(1), _car(2), _car(3)])
+    assert first.stats["created"] == 3
+    page = _changes(db, 0)
+    assert [change["change_type"] for change in page["changes"]] == ["created"] * 3
+    watermark = page["next_after_id"]
+
+    second = _sync(db, [_car(1), _car(2), _car(3)])
+
+    assert second.stats["unchanged"] == 3 and second.stats["created"] == 0
+    # Курсор журнала не сдвигается: потребителю нечего переиндексировать
+    assert _changes(db, watermark) == {"changes": [], "next_after_id": watermark}
+    assert db.query(ParsedCar).count() == 3
+
+
+def test_changed_car_is_updated_in_place(db):
+    _sync(db, [_car(1), _car(2)])
+    car_id = db.query(ParsedCar.id).filter(ParsedCar.source_url == f"{SITE}/car/1").scalar()
+    watermark = _changes(db, 0)["next_after_id"]
+
+    sync = _sync(db, [_car(1, price="900000", pictures=("b.jpg", "c.jpg")), _car(2)])
+
+    assert sync.stats["updated"] == 1 and sync.stats["unchanged"] == 1
+    car = db.get(ParsedCar, car_id)
+    db.refresh(car)
+    assert car.price == "900000"
+    pictures = db.query(ParsedCarPicture.image_url).filter(ParsedCarPicture.parsed_car_id == car_id)
+    assert sorted(url for (url,) in pictures) == ["b.jpg", "c.jpg"]
+    page = _changes(db, watermark)
+    assert [(c["parsed_car_id"], c["change_type"], c["run_id"]) for c in page["changes"]] == [
+        (car_id, "updated", sync.run_id)
+    ]
+    assert page["changes"][0]["content_hash"] == car.content_hash
+    assert page["next_after_id"] > watermark
+
+
+def test_missing_cars_are_deactivated_and_reactivated(db):
+    _sync(db, [_car(1), _car(2), _car(3, site="https://other.example")])
+    watermark = _changes(db, 0)["next_after_id"]
+
+    _seen(db, 1)
+    sync = _sync(db, [_car(1)])
+    deactivated = sync.deactivate_missing()
+
+    assert deactivated == 1
+    active = dict(db.query(ParsedCar.source_url, ParsedCar.is_active))
+    # Объявление другого сайта не затрагивается
+    assert active == {f"{SITE}/car/1": True, f"{SITE}/car/2": False, "https://other.example/car/3": True}
+    page = _changes(db, watermark)
+    assert [(c["source_url"], c["change_type"]) for c in page["changes"]] == [(f"{SITE}/car/2", "deactivated")]
+
+    _seen(db, 1, 2)
+    again = _sync(db, [_car(1), _car(2)])
+
+    assert again.stats["reactivated"] == 1 and again.stats["unchanged"] == 1
+    assert db.query(ParsedCar.is_active).filter(ParsedCar.source_url == f"{SITE}/car/2").scalar() is True
+    assert [c["change_type"] for c in _changes(db, page["next_after_id"])["changes"]] == ["reactivated"]
+
+
+def test_changes_are_paged_by_cursor(db):
+    _sync(db, [_car(number) for number in range(1, 6)], batch_size=10)
+
+    first = asyncio.run(get_parsed_car_changes(after_id=0, limit=2, db=db))
+    second = asyncio.run(get_parsed_car_changes(after_id=first["next_after_id"], limit=10, db=db))
+
+    assert len(first["changes"]) == 2 and len(second["changes"]) == 3
+    ids = [c["id"] for c in first["changes"] + second["changes"]]
+    assert ids == sorted(ids) and len(set(ids)) == 5
+
+
+def test_batch_error_falls_back_to_single_rows(db, monkeypatch):
+    sync = ParsedCarSync(db, SITE, batch_size=10)
+    write = sync._write
+
+    def failing_write(batch):
+        if any(car["source_url"].endswith("/bad") for car in batch):
+            raise RuntimeError("плохая строка")
+        return write(batch)
+
+    monkeypatch.setattr(sync, "_write", failing_write)
+    sync.add(_car(1))
+    sync.add({**_car(2), "source_url": f"{SITE}/car/bad"})
+    sync.add(_car(3))
+    sync.flush()
+
+    assert sync.stats["created"] == 2 and sync.stats["failed"] == 1
+    assert db.query(ParsedCar).count() == 2
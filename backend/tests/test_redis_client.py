@@ -0,0 +1,74 @@
+"""
+Pipeline async_redis_client: проверка доступности и переключение на память
+"""
+import asyncio
+
+import fakeredis.aioredis
+import redis
+
+from app.core.redis_client import AsyncRedisClient, RedisManager
+
+
+class _BrokenPipeline:
+    """Pipeline Redis, соединение которого обрывается на execute()"""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    async def execute(self):
+        raise redis.ConnectionError("Connection refused")
+
+
+class _BrokenRedis:
+    async def ping(self):
+        return True
+
+    def pipeline(self, transaction=True):
+        return _BrokenPipeline()
+
+
+def _manager(async_client) -> RedisManager:
+    manager = RedisManager()
+    manager._async_client = async_client
+    return manager
+
+
+def test_pipeline_falls_back_to_memory_on_connection_error():
+    manager = _manager(_BrokenRedis())
+    client = AsyncRedisClient(manager)
+
+    async def scenario():
+        pipe = client.pipeline(transaction=True)
+        pipe.set("chat:current:u", 1)
+        pipe.rpush("chat:sessions:u", 1)
+        result = await pipe.execute()
+
+        read = client.pipeline(transaction=False)
+        read.get("chat:current:u")
+        read.lrange("chat:sessions:u", 0, -1)
+        return result, await read.execute()
+
+    result, (current, sessions) = asyncio.run(scenario())
+
+    assert result == [True, 1]
+    assert current == "1"
+    assert sessions == ["1"]
+    assert manager.status()["backend"] == "memory"
+
+
+def test_pipeline_returns_to_redis_after_recheck():
+    server = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    manager = _manager(server)
+    manager.mark_down(redis.ConnectionError("down"))
+    manager._next_check = 0.0  # Повторная проверка уже наступила
+    client = AsyncRedisClient(manager)
+
+    async def scenario():
+        pipe = client.pipeline(transaction=True)
+        pipe.set("chat:current:u", 2)
+        await pipe.execute()
+        return await server.get("chat:current:u")
+
+    assert asyncio.run(scenario()) == "2"
+    assert manager.status()["backend"] == "redis"
+    assert manager.memory.get("chat:current:u") is None
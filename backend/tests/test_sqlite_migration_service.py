@@ -0,0 +1,158 @@
+"""
+Перенос cars.db пачками: продолжение с чекпоинта после сбоя, сброс, конвертеры колонок
+"""
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine, select
+
+import services.sqlite_migration_service as migration_module
+from models import Base
+from models.database import Car, CarPicture, CatalogMigrationCheckpoint
+from services.sqlite_migration_service import SqliteCatalogMigrator, build_converters
+
+ROWS = 10
+CHUNK = 3
+
+
+@pytest.fixture
+def cars_db(tmp_path):
+    path = tmp_path / "cars.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE car (id INTEGER PRIMARY KEY, mark TEXT, model TEXT, price REAL, "
+                 "manufacture_year TEXT, created_at TEXT)")
+    conn.execute("CREATE TABLE picture (id INTEGER PRIMARY KEY, car_id INTEGER, url TEXT, seqno INTEGER)")
+    conn.executemany(
+        "INSERT INTO car VALUES (?, ?, ?, ?, ?, ?)",
+        [(i, f"Mark{i}", "X", 1000000.0 + i, "2020", "2024-01-01") for i in range(1, ROWS + 1)],
+    )
+    conn.executemany("INSERT INTO picture VALUES (?, ?, ?, ?)", [(i, i, f"{i}.jpg", 0) for i in range(1, ROWS + 1)])
+    conn.commit()
+    conn.close()
+    return str(path)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'catalog.db'}")
+    Base.metadata.create_all(engine, tables=[Car.__table__, CarPicture.__table__])
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def chunk_calls(monkeypatch):
+    """Первые id загружаемых пачек; fail_on - номер вызова, на котором перенос "падает" """
+    calls = {"first_ids": [], "fail_on": None}
+    load = migration_module._ChunkLoader.load
+
+    def tracked(self, conn, rows, errors, on_commit):
+        calls["first_ids"].append((self.target.name, rows[0][self.columns.index("id")]))
+        if calls["fail_on"] == len(calls["first_ids"]):
+            raise RuntimeError("соединение потеряно")
+        return load(self, conn, rows, errors, on_commit)
+
+    monkeypatch.setattr(migration_module._ChunkLoader, "load", tracked)
+    return calls
+
+
+def _catalog(engine):
+    with engine.connect() as conn:
+        return conn.execute(select(Car.id, Car.mark, Car.price, Car.manufacture_year).order_by(Car.id)).all()
+
+
+def _checkpoints(engine):
+    with engine.connect() as conn:
+        return conn.execute(select(CatalogMigrationCheckpoint.table_name, CatalogMigrationCheckpoint.last_id,
+                                   CatalogMigrationCheckpoint.rows_done,
+                                   CatalogMigrationCheckpoint.completed)).all()
+
+
+def test_interrupted_migration_resumes_from_checkpoint(cars_db, engine, chunk_calls):
+    chunk_calls["fail_on"] = 3
+    first = SqliteCatalogMigrator(cars_db, engine, chunk_size=CHUNK, workers=1).run(tables=["car", "picture"])
+
+    assert not first["success"]
+    assert first["tables"]["car"]["status"] == "failed"
+    assert first["tables"]["picture"] == {"status": "skipped"}
+    # Две пачки закоммичены вместе с чекпоинтом, третья - нет
+    assert [row.id for row in _catalog(engine)] == list(range(1, 2 * CHUNK + 1))
+    assert _checkpoints(engine) == [("car", 2 * CHUNK, 2 * CHUNK, False)]
+
+    chunk_calls["fail_on"] = None
+    chunk_calls["first_ids"].clear()
+    second = SqliteCatalogMigrator(cars_db, engine, chunk_size=CHUNK, workers=1).run(tables=["car", "picture"])
+
+    assert second["success"]
+    # Автомобили продолжены с id > 6, а не перенесены заново
+    assert [first_id for table, first_id in chunk_calls["first_ids"] if table == "cars"] == [7, 10]
+    assert second["tables"]["car"]["rows"] == ROWS
+    assert [row.id for row in _catalog(engine)] == list(range(1, ROWS + 1))
+    with engine.connect() as conn:
+        assert conn.execute(select(CarPicture.url).order_by(CarPicture.id)).scalars().all() == [
+            f"{i}.jpg" for i in range(1, ROWS + 1)
+        ]
+    # После успешного завершения чекпоинты удаляются
+    assert _checkpoints(engine) == []
+
+
+def test_completed_table_is_not_migrated_again(cars_db, engine, chunk_calls):
+    chunk_calls["fail_on"] = 5  # car: 4 пачки, picture: падает на первой
+    first = SqliteCatalogMigrator(cars_db, engine, chunk_size=CHUNK, workers=1).run(tables=["car", "picture"])
+    assert first["tables"]["car"]["status"] == "completed"
+    assert first["tables"]["picture"]["status"] == "failed"
+
+    chunk_calls["fail_on"] = None
+    chunk_calls["first_ids"].clear()
+    second = SqliteCatalogMigrator(cars_db, engine, chunk_size=CHUNK, workers=1).run(tables=["car", "picture"])
+
+    assert second["success"]
+    assert second["tables"]["car"]["resumed"] is True
+    assert {table for table, _ in chunk_calls["first_ids"]} == {"car_pictures"}
+
+
+def test_reset_ignores_checkpoint(cars_db, engine, chunk_calls):
+    chunk_calls["fail_on"] = 2
+    SqliteCatalogMigrator(cars_db, engine, chunk_size=CHUNK, workers=1).run(tables=["car"])
+
+    chunk_calls["fail_on"] = None
+    chunk_calls["first_ids"].clear()
+    result = SqliteCatalogMigrator(cars_db, engine, chunk_size=CHUNK, workers=1).run(tables=["car"], reset=True)
+
+    assert result["success"]
+    assert chunk_calls["first_ids"][0] == ("cars", 1)
+    assert len(_catalog(engine)) == ROWS
+
+
+def test_rerun_replaces_rows_by_id(cars_db, engine):
+    SqliteCatalogMigrator(cars_db, engine, chunk_size=CHUNK, workers=1).run(tables=["car"])
+    conn = sqlite3.connect(cars_db)
+    conn.execute("UPDATE car SET mark = 'Renamed' WHERE id = 1")
+    conn.commit()
+    conn.close()
+
+    # Файл изменился - новый ключ чекпоинтов, строки заменяются по id
+    SqliteCatalogMigrator(cars_db, engine, chunk_size=CHUNK, workers=1).run(tables=["car"])
+
+    catalog = _catalog(engine)
+    assert len(catalog) == ROWS
+    assert catalog[0].mark == "Renamed"
+
+
+def test_converters_follow_sqlite_and_catalog_types():
+    columns = ["id", "price", "manufacture_year", "mark"]
+    converters = build_converters(
+        {"id": "INTEGER", "price": "REAL", "manufacture_year": "TEXT", "mark": "TEXT"},
+        Car.__table__, columns,
+    )
+    row = ("5", 2500000, "2020.0", "BMW\x00" + "x" * 500)
+
+    converted = [convert(value) for convert, value in zip(converters, row)]
+
+    assert converted[:3] == [5, "2500000.0", 2020]
+    assert converted[3].startswith("BMWx") and len(converted[3]) == Car.__table__.c.mark.type.length
+
+
+def test_unknown_table_is_rejected(cars_db, engine):
+    with pytest.raises(ValueError):
+        SqliteCatalogMigrator(cars_db, engine).run(tables=["trucks"])
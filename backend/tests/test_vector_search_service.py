@@ -0,0 +1,188 @@
+"""
+Векторный поиск: запрос ближайших соседей с фильтрами, настройки HNSW, инкрементальная индексация
+"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+
+import services.vector_search_service as vector_module
+from models import Base
+from models.database import Car, CarEmbedding, UsedCar
+from services.vector_search_service import VectorSearchService
+
+MODEL = "local:test-model"
+QUERY_VECTOR = [0.5] * 1024
+
+
+@pytest.fixture(autouse=True)
+def embedding_model(monkeypatch):
+    monkeypatch.setattr(vector_module, "current_embedding_model", lambda: MODEL)
+
+
+def _sql(statement) -> str:
+    return str(statement.compile(dialect=postgresql.dialect()))
+
+
+def _params(statement) -> dict:
+    return statement.compile(dialect=postgresql.dialect()).params
+
+
+def test_query_orders_by_cosine_distance_with_limit():
+    statement = VectorSearchService()._build_query(QUERY_VECTOR, 7, None)
+    sql = _sql(statement)
+
+    assert "car_embeddings.embedding <=> " in sql
+    assert "ORDER BY distance" in sql
+    assert "car_embeddings.embedding IS NOT NULL" in sql
+    params = _params(statement)
+    assert MODEL in params.values()
+    assert 7 in params.values()
+
+
+def test_filters_are_applied_in_the_same_query():
+    statement = VectorSearchService()._build_query(QUERY_VECTOR, 10, {
+        "brands": ["BMW", " Audi "],
+        "city": "Москва",
+        "body_types": [],
+        "min_price": 1000000,
+        "max_year": 2022,
+        "car_type": "used",
+    })
+    sql = _sql(statement).split("WHERE", 1)[1]
+    params = _params(statement)
+
+    assert "car_embeddings.mark IN" in sql
+    assert "car_embeddings.city IN" in sql
+    assert "car_embeddings.body_type" not in sql
+    assert "car_embeddings.price >=" in sql
+    assert "car_embeddings.manufacture_year <=" in sql
+    assert "car_embeddings.car_type IN" in sql
+    values = list(params.values())
+    # Значения фильтров приводятся к нижнему регистру, как колонки car_embeddings
+    assert ["bmw", "audi"] in values
+    assert ["москва"] in values
+    assert ["used_car"] in values
+    assert 1000000 in values and 2022 in values
+
+
+def test_filter_aliases_and_unknown_car_type():
+    service = VectorSearchService()
+
+    assert len(service._filter_conditions({"mark": "BMW", "brands": ["Audi"]})) == 1
+    assert service._filter_conditions({"car_type": "truck"}) == []
+    assert service._filter_conditions(None) == []
+
+
+class FakeConnection:
+    def __init__(self, version):
+        self.version = version
+
+    def execute(self, statement):
+        version = self.version
+
+        class Result:
+            def scalar(self):
+                return version
+
+        return Result()
+
+
+@pytest.mark.parametrize("version, iterative", [("0.7.4", False), ("0.8.0", True)])
+def test_session_settings_depend_on_pgvector_version(monkeypatch, version, iterative):
+    monkeypatch.setattr(vector_module, "_pgvector_version", None)
+
+    statements = VectorSearchService(ef_search=80)._session_settings(FakeConnection(version))
+
+    assert statements[0] == "SET LOCAL hnsw.ef_search = 80"
+    assert ("SET LOCAL hnsw.iterative_scan = relaxed_order" in statements) is iterative
+
+
+def test_results_carry_similarity_and_metadata():
+    entry = CarEmbedding(car_type="used_car", car_id=5, document="BMW X5", mark="bmw", price=2.0)
+
+    [(document, similarity)] = VectorSearchService._to_results([(entry, 0.25)])
+
+    assert similarity == 0.75
+    assert document.page_content == "BMW X5"
+    assert document.metadata["id"] == 5 and document.metadata["type"] == "used_car"
+
+
+# ----------------------------------------------------------------------
+# Индексация
+# ----------------------------------------------------------------------
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'vectors.db'}")
+    Base.metadata.create_all(engine, tables=[Car.__table__, UsedCar.__table__])
+    factory = sessionmaker(bind=engine, autoflush=False)
+    monkeypatch.setattr(vector_module, "engine", engine)
+    monkeypatch.setattr(vector_module, "SessionLocal", factory)
+    yield factory
+    engine.dispose()
+
+
+@pytest.fixture
+def embedded(monkeypatch):
+    calls = []
+
+    def fake_embed(texts):
+        calls.append(list(texts))
+        return [[float(len(text))] * 1024 for text in texts]
+
+    monkeypatch.setattr(vector_module, "embed_texts", fake_embed)
+    return calls
+
+
+def _add_cars(factory, *marks):
+    db = factory()
+    try:
+        cars = [Car(mark=mark, model="X", city="Москва", price="1 000 000", manufacture_year=2020) for mark in marks]
+        db.add_all(cars)
+        db.commit()
+        return [car.id for car in cars]
+    finally:
+        db.close()
+
+
+def test_index_cars_is_incremental(session_factory, embedded):
+    ids = _add_cars(session_factory, "BMW", "Audi")
+    service = VectorSearchService()
+
+    first = service.index_cars(car_types=("car",))
+    again = service.index_cars(car_types=("car",))
+
+    assert first == {"indexed": 2, "skipped": 0, "failed": 0, "deleted": 0}
+    assert again == {"indexed": 0, "skipped": 2, "failed": 0, "deleted": 0}
+    assert len(embedded) == 1
+
+    db = session_factory()
+    try:
+        db.get(Car, ids[0]).city = "Казань"
+        db.query(Car).filter(Car.id == ids[1]).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+    changed = service.index_cars(car_types=("car",))
+
+    assert changed == {"indexed": 1, "skipped": 0, "failed": 0, "deleted": 1}
+    assert "город Казань" in embedded[-1][0]
+    db = session_factory()
+    try:
+        [row] = db.query(CarEmbedding).all()
+        assert (row.car_id, row.mark, row.city, row.price) == (ids[0], "bmw", "казань", 1000000.0)
+    finally:
+        db.close()
+
+
+def test_index_cars_reembeds_after_model_change(session_factory, embedded, monkeypatch):
+    _add_cars(session_factory, "BMW")
+    service = VectorSearchService()
+    service.index_cars(car_types=("car",))
+
+    monkeypatch.setattr(vector_module, "current_embedding_model", lambda: "mistral-embed")
+    stats = service.index_cars(car_types=("car",))
+
+    assert stats["indexed"] == 1 and stats["skipped"] == 0